@@ -0,0 +1,142 @@
+"""
+Escritura de bloques en disco del nodo de almacenamiento con política de fsync.
+
+Cada bloque se escribe en un temporal y se renombra, así que un bloque a medio
+escribir nunca queda con su nombre definitivo. Cuándo se considera duradero (y
+por tanto cuándo se envía el STORE_BLOCK_ACK) depende de la política:
+
+  - 'block': fsync del archivo antes de renombrarlo y del directorio después.
+             Cada ACK implica que el bloque está en disco; es lo más lento.
+  - 'batch': el bloque se escribe y renombra sin fsync y queda pendiente. Un
+             hilo hace fsync de todos los pendientes (y de sus directorios) cada
+             `interval` segundos y solo entonces llama a los `on_durable` del
+             lote: un fsync por directorio por lote en vez de uno por bloque.
+  - 'none':  sin fsync; el ACK sale en cuanto el bloque está en la caché del SO.
+
+`close()` vacía el lote pendiente: los bloques ya recibidos se confirman antes
+de apagar el nodo.
+"""
+import os
+import threading
+import time
+
+FSYNC_POLICIES = ('block', 'batch', 'none')
+
+
+def _fsync_dir(path):
+    # En Windows no se puede abrir un directorio para fsync; el rename ya es atómico allí
+    if os.name == 'nt':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class BlockWriter:
+    def __init__(self, fsync='block', interval=0.05):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"política de fsync desconocida: {fsync!r} (usa {', '.join(FSYNC_POLICIES)})")
+        self.fsync = fsync
+        self.interval = max(0.001, float(interval))
+        self._pending = []              # (path, on_durable) escritos sin fsync
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self.writes = 0
+        self.fsyncs = 0
+        self.batches = 0
+        self.bytes = 0
+        self._syncer = None
+        if fsync == 'batch':
+            self._syncer = threading.Thread(target=self._sync_loop, name='fsync', daemon=True)
+            self._syncer.start()
+
+    def write(self, path, data, on_durable=None):
+        """Escribe `data` en `path`. `on_durable()` se llama cuando la política lo da por duradero."""
+        tmp = f"{path}.tmp{threading.get_ident()}"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            if self.fsync == 'block':
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+        if self.fsync == 'block':
+            _fsync_dir(os.path.dirname(path) or '.')
+        with self._lock:
+            self.writes += 1
+            self.bytes += len(data)
+            if self.fsync == 'block':
+                self.fsyncs += 2
+            queued = self.fsync == 'batch' and not self._closed
+            if queued:
+                self._pending.append((path, on_durable))
+        if queued:
+            self._wake.set()
+            return
+        if self.fsync == 'batch':
+            # Apagando: ya no hay lote, fsync inmediato
+            self._fsync_files([path])
+        if on_durable:
+            on_durable()
+
+    def _fsync_files(self, paths):
+        dirs = set()
+        for path in paths:
+            try:
+                # 'r+b': en Windows fsync necesita un descriptor con escritura
+                with open(path, 'r+b') as f:
+                    os.fsync(f.fileno())
+                dirs.add(os.path.dirname(path) or '.')
+            except OSError:
+                # Borrado después de escribirse: nada que sincronizar
+                pass
+        for d in dirs:
+            try:
+                _fsync_dir(d)
+            except OSError:
+                pass
+        with self._lock:
+            self.fsyncs += len(paths) + len(dirs)
+
+    def _sync_loop(self):
+        while not self._closed:
+            self._wake.wait()
+            if self._closed:
+                break
+            # Dejar que el lote crezca durante el intervalo
+            time.sleep(self.interval)
+            self._wake.clear()
+            self.sync()
+
+    def sync(self):
+        """Hace fsync de los bloques pendientes y llama a sus `on_durable`. Retorna cuántos eran."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        self._fsync_files([path for path, _ in batch])
+        with self._lock:
+            self.batches += 1
+        for _, on_durable in batch:
+            if on_durable:
+                try:
+                    on_durable()
+                except Exception:
+                    pass
+        return len(batch)
+
+    def close(self):
+        """Deja de agrupar y confirma lo pendiente. Las escrituras posteriores hacen fsync al momento."""
+        with self._lock:
+            self._closed = True
+        self._wake.set()
+        if self._syncer is not None:
+            self._syncer.join(timeout=max(1.0, self.interval * 4))
+        return self.sync()
+
+    def stats(self):
+        with self._lock:
+            return {'policy': self.fsync, 'writes': self.writes, 'bytes': self.bytes,
+                    'fsyncs': self.fsyncs, 'batches': self.batches, 'pending': len(self._pending)}
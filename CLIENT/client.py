@@ -1,20 +1,60 @@
 import socket
 import json
 import threading
-import time
 import os
 import base64
+import itertools
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from readahead import ReadAheadCache
+from block_writer import BlockWriter
 
 DISCOVERY_PORT = 5001   # Debe coincidir con el del coordinador
 LISTEN_PORT = 6000      # Puerto donde ESTE nodo escucharía (lo puedes usar después)
 DISCOVERY_TIMEOUT = 3   # segundos
+READAHEAD_MB = int(os.environ.get('SADTF_READAHEAD_MB', '64'))      # Memoria para lectura anticipada de bloques
+READAHEAD_DEPTH = int(os.environ.get('SADTF_READAHEAD_DEPTH', '4'))  # Bloques a anticipar tras un acceso secuencial
+NODE_WORKERS = int(os.environ.get('SADTF_NODE_WORKERS', '8'))      # Hilos que atienden STORE_BLOCK/REQUEST_BLOCK en paralelo
+MAX_INFLIGHT = int(os.environ.get('SADTF_NODE_MAX_INFLIGHT', '64'))  # Peticiones de bloque aceptadas y aún sin terminar
+FSYNC_POLICY = os.environ.get('SADTF_NODE_FSYNC', 'batch')           # 'block', 'batch' o 'none' (ver block_writer.py)
+FSYNC_INTERVAL_MS = int(os.environ.get('SADTF_NODE_FSYNC_MS', '50'))  # Ventana de agrupación con 'batch'
+REQUEST_TIMEOUT = 5     # segundos de espera de la respuesta del coordinador
+RECV_SIZE = 256 * 1024
 
 # Variables globales
 coord_socket = None
 node_id = None
 coord_ip = None
 coord_port = None
-lock_socket = threading.Lock()  # Para evitar conflictos en el socket
+storage_dir = None      # None: ~/espacioCompartido/<node_id>
+capacity_mb = None      # capacidad declarada en REGISTER_NODE (None: la que ya conozca el coordinador)
+interactivo = True      # False en node_daemon.py: sin menú que volver a mostrar
+readahead = ReadAheadCache(max_bytes=READAHEAD_MB * 1024 * 1024, depth=READAHEAD_DEPTH)
+block_writer = BlockWriter(fsync=FSYNC_POLICY, interval=FSYNC_INTERVAL_MS / 1000.0)
+
+# Conexión full-duplex con el coordinador: un hilo lector despacha los mensajes
+# entrantes y un hilo escritor vacía la cola de salida, así que leer nunca bloquea
+# un envío. Cada mensaje es una línea JSON con `req_id`; las respuestas repiten el
+# `req_id` de la petición, lo que permite tener muchas peticiones en curso a la vez.
+cola_salida = queue.Queue()
+workers = ThreadPoolExecutor(max_workers=NODE_WORKERS, thread_name_prefix='nodo')
+# Límite de peticiones de bloque en curso. Las que llegan con la ventana llena
+# esperan en `en_espera` (acotada) a que el hilo despachador las pase al pool, así
+# el lector sigue atendiendo PING y respuestas. Solo si también esa cola se llena
+# deja el lector de leer del socket y TCP frena al coordinador (en vez de acumular
+# bloques en memoria sin límite).
+inflight = threading.BoundedSemaphore(MAX_INFLIGHT)
+en_espera = queue.Queue(maxsize=MAX_INFLIGHT)
+aparcadas = 0                    # peticiones en `en_espera` o en manos del despachador
+lock_despacho = threading.Lock()
+hilo_despachador = None
+cerrando = threading.Event()     # apagado en curso: no se aceptan bloques nuevos
+hilo_lector = None
+hilo_escritor = None
+pendientes = {}                  # req_id -> {'event': Event, 'response': dict}
+lock_pendientes = threading.Lock()
+_req_ids = itertools.count(1)
+RESPUESTAS = ('NODOS_LIST',)     # las demás respuestas del coordinador no llevan `type`
 
 
 def discover_coordinator():
@@ -42,202 +82,460 @@ def discover_coordinator():
         sock.close()
 
 
+def configurar(workers_n=None, max_inflight=None, fsync=None, fsync_interval_ms=None, directorio=None, capacidad=None):
+    """
+    Ajusta el pool de workers, la ventana de peticiones, la política de fsync, el
+    directorio de bloques y la capacidad (MB) que se declara al registrarse (antes de conectar).
+    """
+    global workers, inflight, block_writer, storage_dir, capacity_mb
+    if workers_n:
+        workers = ThreadPoolExecutor(max_workers=int(workers_n), thread_name_prefix='nodo')
+    if max_inflight:
+        inflight = threading.BoundedSemaphore(int(max_inflight))
+    if fsync is not None or fsync_interval_ms is not None:
+        block_writer.close()
+        block_writer = BlockWriter(fsync=fsync or block_writer.fsync,
+                                   interval=(fsync_interval_ms if fsync_interval_ms is not None else FSYNC_INTERVAL_MS) / 1000.0)
+    if directorio:
+        storage_dir = os.path.abspath(os.path.expanduser(directorio))
+    if capacidad is not None:
+        mb = float(capacidad)
+        if mb <= 0:
+            raise ValueError(f"capacity debe ser > 0 (MB): {capacidad}")
+        capacity_mb = int(mb) if mb.is_integer() else mb
+
+
+def directorio_bloques():
+    return storage_dir or os.path.join(os.path.expanduser('~'), 'espacioCompartido', node_id)
+
+
+def enviar(msg):
+    """Encola `msg` para el hilo escritor (no bloquea). Si no trae `req_id` se le asigna uno."""
+    if 'req_id' not in msg:
+        msg = dict(msg, req_id=next(_req_ids))
+    cola_salida.put(json.dumps(msg).encode() + b'\n')
+
+
+def responder(peticion, msg):
+    """Envía `msg` como respuesta a `peticion` (repite su `req_id`)."""
+    enviar(dict(msg, req_id=peticion.get('req_id')))
+
+
+def solicitar(msg, timeout=REQUEST_TIMEOUT):
+    """Envía una petición al coordinador y espera su respuesta. Retorna el dict o None (timeout)."""
+    req_id = next(_req_ids)
+    ent = {'event': threading.Event(), 'response': None}
+    with lock_pendientes:
+        pendientes[req_id] = ent
+    try:
+        enviar(dict(msg, req_id=req_id))
+        ent['event'].wait(timeout)
+        return ent['response']
+    finally:
+        with lock_pendientes:
+            pendientes.pop(req_id, None)
+
+
+def escribir_mensajes(sock):
+    """Hilo escritor: envía en orden lo encolado por `enviar()`. `None` en la cola lo detiene."""
+    while True:
+        data = cola_salida.get()
+        if data is None:
+            break
+        try:
+            sock.sendall(data)
+        except Exception as e:
+            print(f"\n[CLIENTE] Error enviando al coordinador: {e}")
+            break
+
+
+def iter_mensajes(sock):
+    """Lee líneas JSON del socket hasta que se cierra la conexión."""
+    buf = bytearray()
+    while True:
+        chunk = sock.recv(RECV_SIZE)
+        if not chunk:
+            return
+        scan = len(buf)
+        buf += chunk
+        start = 0
+        while True:
+            end = buf.find(b'\n', scan)
+            if end == -1:
+                break
+            line = bytes(buf[start:end])
+            start = scan = end + 1
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                print(f"\n[CLIENTE] Mensaje no JSON recibido: {line[:200]!r}")
+        if start:
+            del buf[:start]
+
+
 def connect_to_coordinator(coord_ip, coord_port, node_id):
     """
-    Se conecta por TCP al coordinador y mantiene la conexión abierta.
+    Se conecta por TCP al coordinador, arranca los hilos lector y escritor y se registra.
+    La conexión queda abierta.
     """
-    global coord_socket
+    global coord_socket, hilo_lector, hilo_escritor
     
     try:
         coord_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         print(f"[CLIENTE] Conectando al coordinador en {coord_ip}:{coord_port}...")
         coord_socket.connect((coord_ip, coord_port))
 
+        hilo_lector = threading.Thread(target=escuchar_mensajes, args=(coord_socket,), name='lector', daemon=True)
+        hilo_escritor = threading.Thread(target=escribir_mensajes, args=(coord_socket,), name='escritor', daemon=True)
+        hilo_lector.start()
+        hilo_escritor.start()
+
         msg = {
             "type": "REGISTER_NODE",
             "node_id": node_id,
-            "listen_port": LISTEN_PORT
+            "listen_port": LISTEN_PORT,
+            # Acepta STORE_BLOCKS/REQUEST_BLOCKS (varios bloques por mensaje) y DELETE_BLOCKS
+            "features": ["batch", "delete"]
         }
-
-        with lock_socket:
-            coord_socket.sendall(json.dumps(msg).encode())
-            resp = coord_socket.recv(1024).decode()
+        if capacity_mb:
+            msg["capacity"] = capacity_mb
+        resp = solicitar(msg)
         print("[CLIENTE] Respuesta del coordinador:", resp)
-        return True
+        return resp is not None
     except Exception as e:
         print(f"[CLIENTE] Error conectando al coordinador: {e}")
         return False
 
 
-def escuchar_mensajes():
+def guardar_bloque(msg):
+    """STORE_BLOCK: guarda el bloque recibido del coordinador y responde con STORE_BLOCK_ACK."""
+    try:
+        block_id = msg.get('block_id')
+        block_name = msg.get('block_name')
+        is_replica = msg.get('is_replica', False)
+        data_b64 = msg.get('data_b64')
+        if data_b64 and block_name:
+            data = base64.b64decode(data_b64.encode('ascii'))
+            base_dir = directorio_bloques()
+            os.makedirs(base_dir, exist_ok=True)
+            dest_path = os.path.join(base_dir, block_name)
+            # El ACK sale cuando la política de fsync da el bloque por duradero
+            block_writer.write(dest_path, data, on_durable=lambda: responder(
+                msg, {'type': 'STORE_BLOCK_ACK', 'block_id': block_id, 'status': 'OK'}))
+            readahead.invalidate(dest_path)
+            print(f"[CLIENT] Stored block {block_name} -> {dest_path} (replica={is_replica})")
+    except Exception as e:
+        print(f"[CLIENT] Error procesando STORE_BLOCK: {e}")
+        responder(msg, {'type': 'STORE_BLOCK_ACK', 'block_id': msg.get('block_id'), 'status': 'ERROR', 'error': str(e)})
+
+
+def guardar_bloques(msg):
     """
-    Hilo dedicado a escuchar mensajes entrantes del coordinador/otros nodos.
-    Se ejecuta continuamente en background.
+    STORE_BLOCKS: varios bloques en un mensaje. Responde con un único
+    STORE_BLOCKS_ACK cuando todos están escritos (y son duraderos según la política de fsync).
     """
-    global coord_socket
-    
-    while True:
+    bloques = msg.get('blocks') or []
+    acks = []
+    lock_acks = threading.Lock()
+    restantes = [len(bloques)]
+
+    def _hecho(ack):
+        with lock_acks:
+            acks.append(ack)
+            restantes[0] -= 1
+            completo = restantes[0] == 0
+        if completo:
+            responder(msg, {'type': 'STORE_BLOCKS_ACK', 'acks': acks})
+
+    if not bloques:
+        responder(msg, {'type': 'STORE_BLOCKS_ACK', 'acks': []})
+        return
+    base_dir = directorio_bloques()
+    try:
+        os.makedirs(base_dir, exist_ok=True)
+    except Exception:
+        pass
+    for b in bloques:
+        block_id = b.get('block_id')
         try:
-            with lock_socket:
-                if coord_socket:
-                    data = coord_socket.recv(1024)
-            
-            if not data:
-                print("\n[CLIENTE] Conexión cerrada por el servidor.")
-                break
-            
+            dest_path = os.path.join(base_dir, b['block_name'])
+            block_writer.write(dest_path, base64.b64decode(b['data_b64'].encode('ascii')),
+                               on_durable=lambda bid=block_id: _hecho({'block_id': bid, 'status': 'OK'}))
+            readahead.invalidate(dest_path)
+        except Exception as e:
+            print(f"[CLIENT] Error guardando bloque {block_id}: {e}")
+            _hecho({'block_id': block_id, 'status': 'ERROR', 'error': str(e)})
+    print(f"[CLIENT] Stored {len(bloques)} blocks in {base_dir}")
+
+
+def enviar_bloques(msg):
+    """REQUEST_BLOCKS: responde con un único BLOCKS_DATA con todos los bloques pedidos."""
+    res = []
+    base_dir = directorio_bloques()
+    for b in msg.get('blocks') or []:
+        block_id = b.get('block_id')
+        try:
+            data = readahead.read(os.path.join(base_dir, b.get('block_name') or ''))
+            if data is not None:
+                res.append({'block_id': block_id, 'data_b64': base64.b64encode(data).decode('ascii')})
+            else:
+                res.append({'block_id': block_id, 'error': 'not_found'})
+        except Exception as e:
+            res.append({'block_id': block_id, 'error': str(e)})
+    responder(msg, {'type': 'BLOCKS_DATA', 'blocks': res})
+
+
+def enviar_bloque(msg):
+    """REQUEST_BLOCK: el coordinador solicita que enviemos un bloque específico."""
+    try:
+        block_id = msg.get('block_id')
+        block_name = msg.get('block_name')
+        if block_name:
+            path = os.path.join(directorio_bloques(), block_name)
+            data = readahead.read(path)
+            if data is not None:
+                b64 = base64.b64encode(data).decode('ascii')
+                resp = {'type': 'BLOCK_DATA', 'block_id': block_id, 'data_b64': b64}
+            else:
+                resp = {'type': 'BLOCK_DATA', 'block_id': block_id, 'error': 'not_found'}
+            responder(msg, resp)
+    except Exception as e:
+        print(f"[CLIENT] Error procesando REQUEST_BLOCK: {e}")
+        responder(msg, {'type': 'BLOCK_DATA', 'block_id': msg.get('block_id'), 'error': str(e)})
+
+
+def borrar_bloques(msg):
+    """DELETE_BLOCKS: borra los bloques de archivos eliminados y confirma con DELETE_BLOCKS_ACK."""
+    acks = []
+    base_dir = directorio_bloques()
+    for b in msg.get('blocks') or []:
+        block_id = b.get('block_id')
+        try:
+            name = os.path.basename(b.get('block_name') or '')
+            if not name:
+                raise ValueError('block_name vacío')
+            path = os.path.join(base_dir, name)
+            readahead.invalidate(path)
             try:
-                msg = json.loads(data.decode())
-                msg_type = msg.get("type")
-                
-                if msg_type == "RECEIVE_MESSAGE":
-                    from_node = msg.get("from")
-                    content = msg.get("content")
-                    print(f"\n╔════════════════════════════════════════╗")
-                    print(f"║ 📨 MENSAJE DE {from_node:30}║")
-                    print(f"╠════════════════════════════════════════╣")
-                    print(f"║ {content:38}║")
-                    print(f"╚════════════════════════════════════════╝\n")
-                    print("Selecciona una opción (1-4): ", end="", flush=True)
-                elif msg_type == "PING":
-                    # Responder con PONG para que el coordinador confirme la conexión
-                    try:
-                        pong = {"type": "PONG", "node_id": node_id}
-                        with lock_socket:
-                            if coord_socket:
-                                coord_socket.sendall(json.dumps(pong).encode())
-                    except Exception:
-                        pass
-                elif msg_type == "PONG":
-                    # Ignorar PONGs recibidos
-                    pass
-                elif msg_type == 'STORE_BLOCK':
-                    # Recibir bloque desde el coordinador y guardarlo localmente
-                    try:
-                        file_id = msg.get('file_id')
-                        block_id = msg.get('block_id')
-                        block_name = msg.get('block_name')
-                        is_replica = msg.get('is_replica', False)
-                        data_b64 = msg.get('data_b64')
-                        if data_b64 and block_name:
-                            data = base64.b64decode(data_b64.encode('ascii'))
-                            base_dir = os.path.join(os.path.expanduser('~'), 'espacioCompartido', node_id)
-                            os.makedirs(base_dir, exist_ok=True)
-                            dest_path = os.path.join(base_dir, block_name)
-                            with open(dest_path, 'wb') as bf:
-                                bf.write(data)
-                            print(f"[CLIENT] Stored block {block_name} -> {dest_path} (replica={is_replica})")
-                            # enviar ACK al coordinador
-                            try:
-                                ack = {'type': 'STORE_BLOCK_ACK', 'block_id': block_id, 'status': 'OK'}
-                                with lock_socket:
-                                    if coord_socket:
-                                        coord_socket.sendall(json.dumps(ack).encode())
-                            except Exception:
-                                pass
-                elif msg_type == 'REQUEST_BLOCK':
-                    # El coordinador solicita que enviemos un bloque específico
-                    try:
-                        block_id = msg.get('block_id')
-                        block_name = msg.get('block_name')
-                        if block_name:
-                            base_dir = os.path.join(os.path.expanduser('~'), 'espacioCompartido', node_id)
-                            path = os.path.join(base_dir, block_name)
-                            if os.path.exists(path):
-                                with open(path, 'rb') as bf:
-                                    data = bf.read()
-                                b64 = base64.b64encode(data).decode('ascii')
-                                resp = {'type': 'BLOCK_DATA', 'block_id': block_id, 'data_b64': b64}
-                            else:
-                                resp = {'type': 'BLOCK_DATA', 'block_id': block_id, 'error': 'not_found'}
-                            with lock_socket:
-                                if coord_socket:
-                                    coord_socket.sendall(json.dumps(resp).encode())
-                    except Exception as e:
-                        print(f"[CLIENT] Error procesando REQUEST_BLOCK: {e}")
-                elif msg_type == 'BLOCK_DATA':
-                    # Mensaje con datos de bloque en respuesta a una request (puede ignorarse en cliente)
-                    # El coordinador procesará esto; los nodos usualmente no procesan BLOCK_DATA.
-                    pass
-                    except Exception as e:
-                        print(f"[CLIENT] Error procesando STORE_BLOCK: {e}")
-                elif msg_type == "NODE_CONNECTED":
-                    nid = msg.get("node_id")
-                    ip = msg.get("ip")
-                    port = msg.get("port")
-                    print(f"\n[NOTIFICACIÓN] Nodo conectado: {nid} -> {ip}:{port}")
-                    print("Selecciona una opción (1-4): ", end="", flush=True)
-                elif msg_type == "NODE_DISCONNECTED":
-                    nid = msg.get("node_id")
-                    print(f"\n[NOTIFICACIÓN] Nodo desconectado: {nid}")
-                    print("Selecciona una opción (1-4): ", end="", flush=True)
-                
-            except json.JSONDecodeError:
-                print(f"\n[CLIENTE] Mensaje no JSON recibido: {data.decode()}")
-        
+                os.remove(path)
+            except FileNotFoundError:
+                pass    # ya no estaba: para el coordinador cuenta como borrado
+            acks.append({'block_id': block_id, 'status': 'OK'})
         except Exception as e:
-            if coord_socket:
-                print(f"\n[CLIENTE] Error escuchando mensajes: {e}")
-            break
-        
-        time.sleep(0.1)
+            acks.append({'block_id': block_id, 'status': 'ERROR', 'error': str(e)})
+    responder(msg, {'type': 'DELETE_BLOCKS_ACK', 'acks': acks})
+    print(f"[CLIENT] Deleted {sum(1 for a in acks if a['status'] == 'OK')} blocks in {base_dir}")
 
 
-def get_nodos_conectados():
+def _repetir_prompt():
+    if interactivo:
+        print("Selecciona una opción (1-4): ", end="", flush=True)
+
+
+def rechazar(msg, error):
+    """Responde a una petición de bloques que no se va a atender (p.ej. nodo apagándose)."""
+    tipo = msg.get('type')
+    if tipo == 'DELETE_BLOCKS':
+        responder(msg, {'type': 'DELETE_BLOCKS_ACK', 'acks': [
+            {'block_id': b.get('block_id'), 'status': 'ERROR', 'error': error} for b in msg.get('blocks') or []]})
+    elif tipo in ('STORE_BLOCKS', 'REQUEST_BLOCKS'):
+        items = [{'block_id': b.get('block_id'), 'status': 'ERROR', 'error': error} for b in msg.get('blocks') or []]
+        if tipo == 'STORE_BLOCKS':
+            responder(msg, {'type': 'STORE_BLOCKS_ACK', 'acks': items})
+        else:
+            responder(msg, {'type': 'BLOCKS_DATA', 'blocks': items})
+    else:
+        resp_tipo = 'STORE_BLOCK_ACK' if tipo == 'STORE_BLOCK' else 'BLOCK_DATA'
+        responder(msg, {'type': resp_tipo, 'block_id': msg.get('block_id'), 'status': 'ERROR', 'error': error})
+
+
+def _al_pool(fn, msg):
+    """Entrega al pool una petición que ya tiene su hueco en `inflight`."""
+    sem = inflight
+    try:
+        fut = workers.submit(fn, msg)
+    except RuntimeError:
+        # Pool ya detenido (apagando)
+        sem.release()
+        rechazar(msg, 'shutting_down')
+        return
+    fut.add_done_callback(lambda _f: sem.release())
+
+
+def despachar(fn, msg):
     """
-    Solicita al coordinador la lista de nodos conectados.
+    Pasa la petición al pool de workers respetando la ventana `inflight`. Con la
+    ventana llena la deja en `en_espera` sin bloquear al lector (salvo que esa
+    cola también esté llena); el orden de llegada se conserva.
     """
+    global aparcadas, hilo_despachador
+    with lock_despacho:
+        directo = not aparcadas and inflight.acquire(blocking=False)
+        if not directo:
+            aparcadas += 1
+            if hilo_despachador is None:
+                hilo_despachador = threading.Thread(target=_despachar_en_espera, name='despachador', daemon=True)
+                hilo_despachador.start()
+    if directo:
+        _al_pool(fn, msg)
+    else:
+        en_espera.put((fn, msg))
+
+
+def _despachar_en_espera():
+    """Hilo despachador: pasa al pool las peticiones aparcadas según se liberan huecos."""
+    global aparcadas
+    while True:
+        fn, msg = en_espera.get()
+        inflight.acquire()
+        _al_pool(fn, msg)
+        with lock_despacho:
+            aparcadas -= 1
+
+
+def detener(timeout=30):
+    """
+    Apagado ordenado: deja de aceptar bloques, espera a que terminen las
+    peticiones en curso, confirma las escrituras pendientes (fsync + ACK), se
+    despide del coordinador y cierra la conexión tras vaciar la cola de salida.
+    """
+    global coord_socket
+    cerrando.set()
+    workers.shutdown(wait=True)
+    block_writer.close()
+    sock = coord_socket
+    if sock is None:
+        return
     try:
-        msg = {
-            "type": "GET_NODOS",
-            "node_id": node_id
-        }
-        with lock_socket:
-            coord_socket.sendall(json.dumps(msg).encode())
-            resp = coord_socket.recv(4096).decode()
-        respuesta = json.loads(resp)
-        return respuesta.get("nodos", [])
+        solicitar({"type": "DISCONNECT", "node_id": node_id}, timeout=2)
+    except Exception:
+        pass
+    cola_salida.put(None)
+    if hilo_escritor is not None:
+        hilo_escritor.join(timeout)
+    coord_socket = None
+    try:
+        sock.close()
+    except Exception:
+        pass
+
+
+def escuchar_mensajes(sock):
+    """
+    Hilo lector: recibe los mensajes del coordinador/otros nodos y los despacha.
+    Las respuestas despiertan a quien las espera en `solicitar()`; STORE_BLOCK y
+    REQUEST_BLOCK se atienden en el pool de workers, así varias transferencias
+    avanzan a la vez y el lector sigue leyendo (PING incluido). Con la ventana
+    `inflight` llena las peticiones esperan en `en_espera`; el lector solo se
+    detiene si también esa cola está llena (2 x MAX_INFLIGHT peticiones pendientes).
+    """
+    try:
+        for msg in iter_mensajes(sock):
+            if not isinstance(msg, dict):
+                continue
+            msg_type = msg.get("type")
+
+            if msg_type is None or msg_type in RESPUESTAS:
+                with lock_pendientes:
+                    ent = pendientes.get(msg.get('req_id'))
+                if ent:
+                    ent['response'] = msg
+                    ent['event'].set()
+            elif msg_type == "RECEIVE_MESSAGE":
+                from_node = msg.get("from")
+                content = msg.get("content")
+                print(f"\n╔════════════════════════════════════════╗")
+                print(f"║ 📨 MENSAJE DE {from_node:30}║")
+                print(f"╠════════════════════════════════════════╣")
+                print(f"║ {content:38}║")
+                print(f"╚════════════════════════════════════════╝\n")
+                _repetir_prompt()
+            elif msg_type == "PING":
+                # Responder con PONG para que el coordinador confirme la conexión
+                # Adjuntar estadísticas de la caché read-ahead para el coordinador
+                # `ts` se devuelve tal cual: el coordinador mide el RTT con él
+                responder(msg, {"type": "PONG", "node_id": node_id, "readahead": readahead.stats(), "ts": msg.get("ts")})
+            elif msg_type == "PONG":
+                # Ignorar PONGs recibidos
+                pass
+            elif msg_type in ('STORE_BLOCK', 'STORE_BLOCKS'):
+                # Recibir bloque(s) desde el coordinador y guardarlos localmente
+                if cerrando.is_set():
+                    rechazar(msg, 'shutting_down')
+                else:
+                    despachar(guardar_bloque if msg_type == 'STORE_BLOCK' else guardar_bloques, msg)
+            elif msg_type == 'REQUEST_BLOCK':
+                despachar(enviar_bloque, msg)
+            elif msg_type == 'REQUEST_BLOCKS':
+                despachar(enviar_bloques, msg)
+            elif msg_type == 'DELETE_BLOCKS':
+                if cerrando.is_set():
+                    rechazar(msg, 'shutting_down')
+                else:
+                    despachar(borrar_bloques, msg)
+            elif msg_type == "NODE_CONNECTED":
+                nid = msg.get("node_id")
+                ip = msg.get("ip")
+                port = msg.get("port")
+                print(f"\n[NOTIFICACIÓN] Nodo conectado: {nid} -> {ip}:{port}")
+                _repetir_prompt()
+            elif msg_type == "NODE_DISCONNECTED":
+                nid = msg.get("node_id")
+                print(f"\n[NOTIFICACIÓN] Nodo desconectado: {nid}")
+                _repetir_prompt()
+        print("\n[CLIENTE] Conexión cerrada por el servidor.")
     except Exception as e:
-        print(f"[CLIENTE] Error obteniendo nodos: {e}")
+        if coord_socket:
+            print(f"\n[CLIENTE] Error escuchando mensajes: {e}")
+    finally:
+        cola_salida.put(None)
+
+
+def get_nodos_conectados():
+    """
+    Solicita al coordinador la lista de nodos conectados.
+    """
+    respuesta = solicitar({"type": "GET_NODOS", "node_id": node_id})
+    if respuesta is None:
+        print("[CLIENTE] Error obteniendo nodos: sin respuesta del coordinador")
         return []
+    return respuesta.get("nodos", [])
 
 
 def enviar_mensaje_a_nodo(nodo_destino, contenido):
     """
     Envía un mensaje a través del coordinador a otro nodo.
     """
-    try:
-        msg = {
-            "type": "SEND_MESSAGE",
-            "from": node_id,
-            "to": nodo_destino,
-            "content": contenido
-        }
-        with lock_socket:
-            coord_socket.sendall(json.dumps(msg).encode())
-            resp = coord_socket.recv(1024).decode()
+    msg = {
+        "type": "SEND_MESSAGE",
+        "from": node_id,
+        "to": nodo_destino,
+        "content": contenido
+    }
+    resp = solicitar(msg)
+    if resp is None:
+        print("[CLIENTE] Error enviando mensaje: sin respuesta del coordinador")
+    else:
         print(f"[CLIENTE] Respuesta: {resp}")
-    except Exception as e:
-        print(f"[CLIENTE] Error enviando mensaje: {e}")
 
 
 def enviar_mensaje_al_servidor(contenido):
     """
     Envía un mensaje al servidor (coordinador).
     """
-    try:
-        msg = {
-            "type": "SEND_MESSAGE",
-            "from": node_id,
-            "to": "COORDINADOR",
-            "content": contenido
-        }
-        with lock_socket:
-            coord_socket.sendall(json.dumps(msg).encode())
-            resp = coord_socket.recv(1024).decode()
+    msg = {
+        "type": "SEND_MESSAGE",
+        "from": node_id,
+        "to": "COORDINADOR",
+        "content": contenido
+    }
+    resp = solicitar(msg)
+    if resp is None:
+        print("[CLIENTE] Error enviando mensaje al servidor: sin respuesta del coordinador")
+    else:
         print(f"[CLIENTE] Respuesta del servidor: {resp}")
-    except Exception as e:
-        print(f"[CLIENTE] Error enviando mensaje al servidor: {e}")
 
 
 def mostrar_menu():
@@ -300,16 +598,10 @@ def mostrar_menu():
             print("[CLIENTE] Desconectando...")
             if coord_socket:
                 try:
-                    # Intentar desconexión limpia
-                    msg = {"type": "DISCONNECT", "node_id": node_id}
-                    with lock_socket:
-                        coord_socket.sendall(json.dumps(msg).encode())
-                        # intentar recibir ack (no obligatorio)
-                        try:
-                            resp = coord_socket.recv(1024).decode()
-                            print(f"[CLIENTE] ACK desconexión: {resp}")
-                        except Exception:
-                            pass
+                    # Intentar desconexión limpia (el ACK no es obligatorio)
+                    resp = solicitar({"type": "DISCONNECT", "node_id": node_id}, timeout=2)
+                    if resp is not None:
+                        print(f"[CLIENTE] ACK desconexión: {resp}")
                 except Exception as e:
                     print(f"[CLIENTE] Error enviando DISCONNECT: {e}")
                 finally:
@@ -334,16 +626,13 @@ def main():
 
     print(f"[CLIENTE] Usaré node_id = {node_id}")
 
-    # 2) Conectarse por TCP con ese node_id (mantiene conexión abierta)
+    # 2) Conectarse por TCP con ese node_id (mantiene conexión abierta; arranca
+    #    los hilos lector y escritor)
     if not connect_to_coordinator(coord_ip, coord_port, node_id):
         print("[CLIENTE] No se pudo conectar. Saliendo.")
         return
     
-    # 3) Iniciar hilo para escuchar mensajes
-    hilo_escucha = threading.Thread(target=escuchar_mensajes, daemon=True)
-    hilo_escucha.start()
-    
-    # 4) Mostrar menú interactivo
+    # 3) Mostrar menú interactivo
     mostrar_menu()
 
 
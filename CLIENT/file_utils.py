@@ -1,6 +1,12 @@
 import os
+import sys
 import json
 
+# El motor de chunking vive en SERVER/chunker.py: compartirlo garantiza que
+# cliente y coordinador corten el mismo contenido en los mismos bloques.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'SERVER'))
+import chunker  # noqa: E402
+
 
 def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
@@ -11,8 +17,10 @@ def safe_basename(filename):
     return os.path.basename(filename)
 
 
-def split_file_to_blocks(file_storage, dest_dir=None, block_size=1024*1024):
-    """Divide un archivo recibido (Flask FileStorage) en bloques de `block_size` bytes.
+def split_file_to_blocks(file_storage, dest_dir=None, block_size=1024*1024, chunking=None):
+    """Divide un archivo recibido (Flask FileStorage) en bloques.
+    Por defecto bloques fijos de `block_size` bytes; `chunking` acepta una
+    configuración de chunker.normalize_config (p.ej. modo 'cdc').
     Guarda los bloques en `dest_dir` y devuelve metadata JSON con lista de bloques.
     Cada bloque se nombra: <base>.partNNN
     """
@@ -29,10 +37,8 @@ def split_file_to_blocks(file_storage, dest_dir=None, block_size=1024*1024):
     # FileStorage provides a stream attribute
     stream = getattr(file_storage, 'stream', None) or file_storage
 
-    while True:
-        chunk = stream.read(block_size)
-        if not chunk:
-            break
+    config = chunking or chunker.normalize_config(chunker.MODE_FIXED, block_size)
+    for chunk in chunker.iter_chunks(stream, config):
         block_name = f"{base}.part{index:03d}"
         block_path = os.path.join(dest_dir, block_name)
         with open(block_path, 'wb') as bf:
@@ -41,6 +47,7 @@ def split_file_to_blocks(file_storage, dest_dir=None, block_size=1024*1024):
         blocks.append({
             'block_name': block_name,
             'size': len(chunk),
+            'hash': chunker.block_hash(chunk),
             'path': block_path,
             'index': index
         })
@@ -49,6 +56,7 @@ def split_file_to_blocks(file_storage, dest_dir=None, block_size=1024*1024):
     meta = {
         'original_filename': filename,
         'total_blocks': len(blocks),
+        'chunking': config,
         'blocks': blocks
     }
 
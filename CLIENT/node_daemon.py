@@ -0,0 +1,100 @@
+"""
+node_daemon: nodo de almacenamiento sin interfaz (para servicios y servidores).
+
+    python node_daemon.py --config nodo.json
+
+Hace lo mismo que client.py (registro, PING/PONG, STORE_BLOCK, REQUEST_BLOCK)
+pero sin menú: se configura con un JSON, no lee de la entrada estándar y con
+SIGTERM/SIGINT se apaga de forma ordenada (ver client.detener): deja de aceptar
+bloques, termina las peticiones en curso, confirma las escrituras pendientes y
+se despide del coordinador.
+
+Claves del JSON (todas opcionales; ver nodo.example.json):
+  node_id            identificador del nodo (sin él se pide por discovery)
+  coordinator        "host:puerto" TCP del coordinador (sin él, discovery UDP)
+  storage_dir        directorio de bloques (~/espacioCompartido/<node_id>)
+  capacity           MB que el nodo ofrece al coordinador (se declara al registrarse;
+                     sin ella se conserva la ya conocida, p.ej. de un POST /register)
+  workers            hilos de E/S de bloques
+  max_inflight       peticiones de bloque aceptadas y aún sin terminar
+  fsync              'block', 'batch' o 'none'
+  fsync_interval_ms  ventana de agrupación con 'batch'
+  drain_timeout      segundos máximos para vaciar la cola de salida al apagar
+
+Si la conexión con el coordinador se cae el proceso termina con código 1, para
+que el gestor de servicios (systemd, NSSM...) lo reinicie.
+"""
+import argparse
+import json
+import signal
+import sys
+import threading
+import time
+
+import client
+
+
+def load_config(path):
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='node_daemon', description='Nodo de almacenamiento SADTF sin interfaz')
+    parser.add_argument('--config', '-c', help='archivo JSON de configuración')
+    args = parser.parse_args(argv)
+
+    client.interactivo = False
+    try:
+        cfg = load_config(args.config)
+        client.configurar(workers_n=cfg.get('workers'), max_inflight=cfg.get('max_inflight'),
+                          fsync=cfg.get('fsync'), fsync_interval_ms=cfg.get('fsync_interval_ms'),
+                          directorio=cfg.get('storage_dir'), capacidad=cfg.get('capacity'))
+    except Exception as e:
+        print(f"[DAEMON] Configuración inválida: {e}", file=sys.stderr)
+        return 2
+
+    if cfg.get('coordinator') and cfg.get('node_id'):
+        host, _, port = cfg['coordinator'].rpartition(':')
+        client.coord_ip, client.coord_port, client.node_id = host, int(port), cfg['node_id']
+    else:
+        ip, port, assigned = client.discover_coordinator()
+        if ip is None:
+            print("[DAEMON] No se pudo descubrir el coordinador.", file=sys.stderr)
+            return 1
+        client.coord_ip, client.coord_port = ip, port
+        client.node_id = cfg.get('node_id') or assigned
+
+    print(f"[DAEMON] Nodo {client.node_id}: bloques en {client.directorio_bloques()}, "
+          f"fsync={client.block_writer.fsync}")
+    if not client.connect_to_coordinator(client.coord_ip, client.coord_port, client.node_id):
+        return 1
+
+    stop = threading.Event()
+
+    def _on_signal(signum, frame):
+        stop.set()
+
+    signal.signal(signal.SIGINT, _on_signal)
+    signal.signal(signal.SIGTERM, _on_signal)
+
+    # Esperar en intervalos cortos: en Windows una espera larga no atiende Ctrl+C
+    while not stop.is_set() and client.hilo_lector.is_alive():
+        stop.wait(0.5)
+
+    if not stop.is_set():
+        print("[DAEMON] Conexión con el coordinador perdida.", file=sys.stderr)
+        client.detener(timeout=cfg.get('drain_timeout', 30))
+        return 1
+
+    print("[DAEMON] Apagando: vaciando peticiones en curso...")
+    t0 = time.time()
+    client.detener(timeout=cfg.get('drain_timeout', 30))
+    print(f"[DAEMON] Apagado en {time.time() - t0:.2f}s. Escrituras: {client.block_writer.stats()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
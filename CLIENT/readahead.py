@@ -0,0 +1,145 @@
+"""
+Caché de lectura anticipada (read-ahead) para el nodo de almacenamiento.
+
+Cuando el coordinador reconstruye un archivo pide sus bloques en orden
+(`base.part001`, `base.part002`, ...). Si detectamos ese patrón secuencial,
+leemos en segundo plano los siguientes `depth` bloques del mismo archivo y los
+dejamos en memoria, de modo que el siguiente REQUEST_BLOCK se sirva sin tocar
+disco. La caché tiene un presupuesto de bytes y expulsa por LRU.
+"""
+import os
+import queue
+import re
+import threading
+from collections import OrderedDict
+
+_PART_RE = re.compile(r'^(.*)\.part(\d+)$')
+
+
+class ReadAheadCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, depth=4, queue_size=64):
+        self.max_bytes = max(0, int(max_bytes))
+        self.depth = max(0, int(depth))
+        self._data = OrderedDict()      # path -> bytes
+        self._prefetched = set()        # paths cargados por prefetch aún no leídos
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._last_index = {}           # (dir, base) -> último índice servido
+        self._inflight = {}             # path en cola o leyéndose -> invalidado mientras tanto (bool)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.prefetch_wasted = 0        # prefetch expulsado sin haberse leído
+        self.prefetch_dropped = 0       # cola de prefetch llena
+        self._worker = threading.Thread(target=self._prefetch_loop, name='readahead', daemon=True)
+        self._worker.start()
+
+    def read(self, path):
+        """Devuelve el contenido de `path` (desde caché si está) o None si no existe."""
+        with self._lock:
+            data = self._data.get(path)
+            if data is not None:
+                self._data.move_to_end(path)
+                self._prefetched.discard(path)
+                self.hits += 1
+        if data is None:
+            if not os.path.exists(path):
+                return None
+            with open(path, 'rb') as bf:
+                data = bf.read()
+            with self._lock:
+                self.misses += 1
+        self._track_sequence(path)
+        return data
+
+    def invalidate(self, path):
+        """Descarta `path` de la caché (p.ej. cuando el bloque se sobrescribe o elimina)."""
+        with self._lock:
+            data = self._data.pop(path, None)
+            if data is not None:
+                self._bytes -= len(data)
+                self._prefetched.discard(path)
+            # Un prefetch en curso leyó (o va a leer) la versión anterior: que no la guarde
+            if path in self._inflight:
+                self._inflight[path] = True
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'max_bytes': self.max_bytes,
+                'used_bytes': self._bytes,
+                'entries': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+                'prefetched': self.prefetched,
+                'prefetch_wasted': self.prefetch_wasted,
+                'prefetch_dropped': self.prefetch_dropped,
+            }
+
+    def _track_sequence(self, path):
+        if self.depth <= 0 or self.max_bytes <= 0:
+            return
+        directory, name = os.path.split(path)
+        m = _PART_RE.match(name)
+        if not m:
+            return
+        base, index = m.group(1), int(m.group(2))
+        key = (directory, base)
+        with self._lock:
+            last = self._last_index.get(key)
+            self._last_index[key] = index
+            if len(self._last_index) > 1024:
+                self._last_index.clear()
+                self._last_index[key] = index
+        # Solo anticipar si el acceso es secuencial (el anterior fue index-1)
+        if last != index - 1:
+            return
+        for n in range(index + 1, index + 1 + self.depth):
+            nxt = os.path.join(directory, f"{base}.part{n:03d}")
+            with self._lock:
+                if nxt in self._data or nxt in self._inflight:
+                    continue
+                self._inflight[nxt] = False
+            try:
+                self._queue.put_nowait(nxt)
+            except queue.Full:
+                with self._lock:
+                    self._inflight.pop(nxt, None)
+                    self.prefetch_dropped += 1
+                break
+
+    def _prefetch_loop(self):
+        while True:
+            path = self._queue.get()
+            try:
+                if not os.path.exists(path):
+                    continue
+                with open(path, 'rb') as bf:
+                    data = bf.read()
+                self._store(path, data)
+            except Exception:
+                pass
+            finally:
+                with self._lock:
+                    self._inflight.pop(path, None)
+
+    def _store(self, path, data):
+        with self._lock:
+            if len(data) > self.max_bytes or self._inflight.get(path):
+                return
+            old = self._data.pop(path, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._data[path] = data
+            self._bytes += len(data)
+            self._prefetched.add(path)
+            self.prefetched += 1
+            while self._bytes > self.max_bytes and self._data:
+                evicted_path, evicted = self._data.popitem(last=False)
+                self._bytes -= len(evicted)
+                if evicted_path in self._prefetched:
+                    self._prefetched.discard(evicted_path)
+                    self.prefetch_wasted += 1
@@ -0,0 +1,158 @@
+"""
+sadtf: CLI para transferencias con el coordinador.
+
+    python sadtf.py put archivo.bin [--block-size-kb 1024]
+    python sadtf.py put directorio/ [--name prefijo]
+    python sadtf.py get <file_id|nombre> [-o destino]
+    python sadtf.py ls
+    python sadtf.py rm <file_id|nombre>
+
+Opciones comunes: --coordinator host:puerto (o SADTF_COORDINATOR), --workers N,
+--retries N. Los uploads interrumpidos se reanudan automáticamente al repetir
+el mismo `put` (el upload_id se guarda en ~/.sadtf/uploads.json). Un directorio
+se sube completo en una sola petición (/upload/bulk).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from sadtf_client import DEFAULT_COORDINATOR, SADTFClient, SADTFError
+
+STATE_FILE = os.path.join(os.path.expanduser('~'), '.sadtf', 'uploads.json')
+
+
+def _load_state():
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _save_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmp = STATE_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, STATE_FILE)
+
+
+def _state_key(coordinator, path):
+    st = os.stat(path)
+    return f"{coordinator}|{os.path.abspath(path)}|{st.st_size}|{int(st.st_mtime)}"
+
+
+class Progress:
+    """Barra de progreso en stderr (se limita a ~10 refrescos por segundo)."""
+
+    def __init__(self, label, enabled=True):
+        self.label = label
+        self.enabled = enabled and sys.stderr.isatty()
+        self.start = time.time()
+        self._last = 0
+
+    def __call__(self, done, total):
+        now = time.time()
+        if not self.enabled or (now - self._last < 0.1 and done < total):
+            return
+        self._last = now
+        pct = done * 100.0 / total if total else 100.0
+        rate = done / max(now - self.start, 1e-6) / (1024 * 1024)
+        sys.stderr.write(f"\r{self.label}: {pct:5.1f}% {done / 1048576:.1f}/{total / 1048576:.1f} MB {rate:.1f} MB/s")
+        if done >= total:
+            sys.stderr.write('\n')
+        sys.stderr.flush()
+
+
+def cmd_put(client, args):
+    if os.path.isdir(args.path):
+        # Un directorio se importa entero en una sola petición
+        res = client.put_tree(args.path, prefix=args.name)
+        for f in res.get('files', []):
+            print(f"{f['file_id']}\t{f['filename']}")
+        for err in res.get('errors', []):
+            print(f"error: {err.get('filename') or '-'}: {err.get('message')}", file=sys.stderr)
+        return
+    state = _load_state()
+    key = _state_key(args.coordinator, args.path)
+
+    def _remember(upload_id):
+        state[key] = upload_id
+        _save_state(state)
+
+    res = client.put(args.path, filename=args.name,
+                     block_size=args.block_size_kb * 1024 if args.block_size_kb else None,
+                     upload_id=state.get(key), on_session=_remember,
+                     progress=Progress(os.path.basename(args.path), not args.quiet))
+    state.pop(key, None)
+    _save_state(state)
+    print(res.get('file_id'))
+
+
+def cmd_get(client, args):
+    file_id = client.resolve(args.file)
+    # El nombre guardado viene del servidor (p.ej. 'sub/g.txt' de un bulk): solo su último componente
+    name = os.path.basename((client.filename(file_id) or '').replace('\\', '/'))
+    if name in ('', '.', '..'):
+        name = file_id
+    dest = args.output or name
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, name)
+    res = client.get(file_id, dest, progress=Progress(os.path.basename(dest), not args.quiet))
+    print(res['path'])
+
+
+def cmd_ls(client, args):
+    for f in client.ls():
+        ts = time.strftime('%Y-%m-%d %H:%M', time.localtime(f['uploaded_at'])) if f.get('uploaded_at') else '-'
+        print(f"{f['file_id']}\t{f['size']}\t{f['blocks']}\t{ts}\t{f['filename']}")
+
+
+def cmd_rm(client, args):
+    res = client.rm(client.resolve(args.file))
+    print(res.get('message') or res.get('status'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='sadtf', description='Cliente de línea de comandos de SADTF')
+    parser.add_argument('--coordinator', default=DEFAULT_COORDINATOR, help='host:puerto del coordinador')
+    parser.add_argument('--workers', type=int, default=4, help='transferencias de bloques en paralelo')
+    parser.add_argument('--retries', type=int, default=3, help='reintentos por petición (backoff exponencial)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='sin barra de progreso')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('put', help='subir un archivo o un directorio completo')
+    p.add_argument('path')
+    p.add_argument('--name', help='nombre con el que se guarda (por defecto el del archivo); en un directorio, prefijo de los nombres')
+    p.add_argument('--block-size-kb', type=int, help='tamaño de bloque en KB')
+    p.set_defaults(func=cmd_put)
+
+    p = sub.add_parser('get', help='descargar un archivo')
+    p.add_argument('file', help='file_id o nombre del archivo')
+    p.add_argument('-o', '--output', help='ruta destino (archivo o directorio)')
+    p.set_defaults(func=cmd_get)
+
+    p = sub.add_parser('ls', help='listar archivos')
+    p.set_defaults(func=cmd_ls)
+
+    p = sub.add_parser('rm', help='eliminar un archivo')
+    p.add_argument('file', help='file_id o nombre del archivo')
+    p.set_defaults(func=cmd_rm)
+
+    args = parser.parse_args(argv)
+    try:
+        with SADTFClient(args.coordinator, workers=args.workers, retries=args.retries) as client:
+            args.func(client, args)
+    except SADTFError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print('interrumpido', file=sys.stderr)
+        return 130
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,369 @@
+"""
+sadtf_client: librería cliente para transferencias masivas contra el coordinador.
+
+Habla con la API HTTP del coordinador (puerto 8000) reutilizando conexiones
+keep-alive de un pool, y transfiere los bloques de un archivo en paralelo:
+  - put(): upload por partes (/uploads). Cada parte es un bloque; se suben varias
+           a la vez y, si se indica un upload_id previo, solo las que faltan.
+  - put_tree(): un directorio completo en una sola petición (/upload/bulk, tar).
+  - get(): descarga bloque a bloque (/files/block) en paralelo, verifica el hash
+           de cada bloque y lo escribe en su offset del archivo destino.
+  - ls() / rm(): listado y borrado de archivos.
+
+Las peticiones fallidas por errores de red o respuestas 5xx se reintentan con
+backoff exponencial y jitter. Solo usa la librería estándar.
+
+Ejemplo:
+    with SADTFClient('192.168.1.10:8000', workers=8) as c:
+        res = c.put('dataset.tar')
+        c.get(res['file_id'], 'copia.tar')
+"""
+import gzip
+import hashlib
+import http.client
+import json
+import os
+import random
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote, urlencode, urlsplit
+
+DEFAULT_COORDINATOR = os.environ.get('SADTF_COORDINATOR', 'localhost:8000')
+
+
+class SADTFError(Exception):
+    """Error devuelto por el coordinador (o agotados los reintentos)."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class _RetryableError(Exception):
+    """Fallo transitorio: se reintenta la petición."""
+
+
+class ConnectionPool:
+    """Pool de conexiones HTTP/1.1 keep-alive hacia un único host."""
+
+    def __init__(self, host, port, maxsize=8, timeout=60):
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def get(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            self.created += 1
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def put(self, conn):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class SADTFClient:
+    def __init__(self, coordinator=DEFAULT_COORDINATOR, workers=4, retries=3, backoff=0.5, timeout=60):
+        if '://' not in coordinator:
+            coordinator = 'http://' + coordinator
+        url = urlsplit(coordinator)
+        self.workers = max(1, int(workers))
+        self.retries = max(0, int(retries))
+        self.backoff = float(backoff)
+        self.pool = ConnectionPool(url.hostname or 'localhost', url.port or 8000,
+                                   maxsize=self.workers, timeout=timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+
+    # --- HTTP -------------------------------------------------------------------
+    def _once(self, method, path, body=None, headers=None):
+        conn = self.pool.get()
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            resp = conn.getresponse()
+            data = resp.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise _RetryableError(f"{method} {path}: {e}")
+        if resp.will_close:
+            conn.close()
+        else:
+            self.pool.put(conn)
+        if resp.status >= 500:
+            raise _RetryableError(f"{method} {path}: HTTP {resp.status} {_error_message(data)}")
+        return resp, data
+
+    def request(self, method, path, body=None, headers=None, check=None):
+        """
+        Ejecuta la petición con reintentos. `check(resp, data)` puede lanzar
+        _RetryableError para reintentar respuestas válidas pero incorrectas
+        (p.ej. un bloque con hash distinto). Retorna (status, headers, data).
+        """
+        attempt = 0
+        while True:
+            try:
+                resp, data = self._once(method, path, body, headers)
+                if resp.status >= 400:
+                    raise SADTFError(_error_message(data) or f"HTTP {resp.status}", status=resp.status)
+                if check:
+                    check(resp, data)
+                return resp.status, resp.headers, data
+            except _RetryableError as e:
+                if attempt >= self.retries:
+                    raise SADTFError(f"{e} (tras {attempt + 1} intentos)")
+                # Backoff exponencial con jitter completo
+                time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+                attempt += 1
+
+    def _json(self, method, path, payload=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        # Los listados grandes (/files, /blocks) se envían con gzip si se acepta
+        headers['Accept-Encoding'] = 'gzip'
+        _, resp_headers, data = self.request(method, path, body=body, headers=headers)
+        if data and (resp_headers.get('Content-Encoding') or '').lower() == 'gzip':
+            data = gzip.decompress(data)
+        return json.loads(data.decode('utf-8')) if data else {}
+
+    def _files(self, page_size=1000, **params):
+        """
+        Índice de archivos ({file_id: entrada}) recorriendo las páginas de /files con
+        los filtros y la proyección (`fields`) indicados. Un coordinador sin
+        paginación devuelve todo en la primera respuesta (sin next_cursor).
+        """
+        params = {k: v for k, v in params.items() if v is not None}
+        params['limit'] = page_size
+        files = {}
+        while True:
+            resp = self._json('GET', '/files?' + urlencode(params))
+            files.update(resp.get('files', {}))
+            cursor = resp.get('next_cursor')
+            if not cursor:
+                return files
+            params['cursor'] = cursor
+
+    # --- operaciones ---------------------------------------------------------------
+    def ls(self):
+        """Lista los archivos almacenados (lista de dicts con file_id, nombre y tamaño)."""
+        files = self._files(fields='original_filename,uploaded_at,meta.original_filename,meta.total_size,'
+                                   'meta.total_blocks')
+        out = []
+        for fid, entry in files.items():
+            meta = entry.get('meta', {})
+            out.append({
+                'file_id': fid,
+                'filename': entry.get('original_filename') or meta.get('original_filename'),
+                'size': meta.get('total_size', sum(b.get('size', 0) for b in meta.get('blocks', []))),
+                'blocks': meta.get('total_blocks', len(meta.get('blocks', []))),
+                'uploaded_at': entry.get('uploaded_at'),
+            })
+        out.sort(key=lambda f: f.get('uploaded_at') or 0)
+        return out
+
+    def resolve(self, name_or_id):
+        """Devuelve el file_id para un file_id o un nombre de archivo no ambiguo."""
+        if name_or_id in self._files(file_id=name_or_id, fields='original_filename'):
+            return name_or_id
+        files = self._files(prefix=name_or_id, fields='original_filename')
+        matches = [fid for fid, e in files.items() if e.get('original_filename') == name_or_id]
+        if not matches:
+            raise SADTFError(f"archivo no encontrado: {name_or_id}", status=404)
+        if len(matches) > 1:
+            raise SADTFError(f"nombre ambiguo ({len(matches)} archivos): usa el file_id", status=409)
+        return matches[0]
+
+    def filename(self, file_id):
+        """Nombre original de un archivo (None si no existe); consulta solo esa entrada de /files."""
+        entry = self._files(file_id=file_id, fields='original_filename,meta.original_filename').get(file_id)
+        if not entry:
+            return None
+        return entry.get('original_filename') or entry.get('meta', {}).get('original_filename')
+
+    def rm(self, file_id):
+        return self._json('POST', '/files/delete', {'file_id': file_id})
+
+    def put(self, path, filename=None, block_size=None, upload_id=None, on_session=None, progress=None):
+        """
+        Sube `path` por partes en paralelo. Si `upload_id` corresponde a una sesión
+        abierta con el mismo tamaño, se reanuda subiendo solo las partes que faltan.
+        `on_session(upload_id)` se llama en cuanto se conoce la sesión (para poder
+        guardarla y reanudar tras un corte). `progress(done, total)` recibe bytes.
+        Retorna la respuesta del commit (incluye `file_id`).
+        """
+        size = os.path.getsize(path)
+        filename = filename or os.path.basename(path)
+        sess = None
+        if upload_id:
+            try:
+                sess = self._json('GET', f"/uploads/{upload_id}")
+            except SADTFError as e:
+                if e.status != 404:
+                    raise
+            if sess and (sess.get('state') != 'open' or sess.get('size') != size):
+                sess = None
+        if sess is None:
+            payload = {'filename': filename, 'size': size}
+            if block_size:
+                payload['block_size'] = int(block_size)
+            sess = self._json('POST', '/uploads', payload)
+        upload_id = sess['upload_id']
+        if on_session:
+            on_session(upload_id)
+
+        bs = sess['block_size']
+        missing = sess.get('missing', [])
+        done = [size - sum(min(bs, size - (i - 1) * bs) for i in missing)]
+        done_lock = threading.Lock()
+        if progress:
+            progress(done[0], size)
+
+        def _send(index):
+            offset = (index - 1) * bs
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(min(bs, size - offset))
+            headers = {'Content-Type': 'application/octet-stream',
+                       'X-Part-SHA256': hashlib.sha256(data).hexdigest()}
+            self.request('PUT', f"/uploads/{upload_id}/parts/{index}", body=data, headers=headers)
+            with done_lock:
+                done[0] += len(data)
+                if progress:
+                    progress(done[0], size)
+
+        self._run_parallel(_send, missing)
+        return self._json('POST', f"/uploads/{upload_id}/commit", {})
+
+    def put_tree(self, directory, prefix=None):
+        """
+        Sube todos los archivos bajo `directory` en una sola petición a
+        /upload/bulk: se empaquetan en un tar temporal y el coordinador los divide
+        en paralelo mientras lo recibe. Los nombres se guardan relativos a
+        `directory` (con `prefix/` delante si se indica). No se reintenta: repetir
+        la petición tras un corte podría duplicar archivos.
+        Retorna la respuesta del coordinador ({'files': [...], 'errors': [...]}).
+        """
+        with tempfile.TemporaryFile() as tmp:
+            with tarfile.open(fileobj=tmp, mode='w') as tf:
+                for root, dirs, names in os.walk(directory):
+                    dirs.sort()
+                    for name in sorted(names):
+                        full = os.path.join(root, name)
+                        rel = os.path.relpath(full, directory).replace(os.sep, '/')
+                        if prefix:
+                            rel = f"{prefix.strip('/')}/{rel}"
+                        tf.add(full, arcname=rel, recursive=False)
+            size = tmp.tell()
+            tmp.seek(0)
+            # Sin timeout de lectura: el coordinador responde al terminar de importar todo el lote
+            conn = http.client.HTTPConnection(self.pool.host, self.pool.port, timeout=None)
+            try:
+                conn.request('POST', '/upload/bulk', body=tmp,
+                             headers={'Content-Type': 'application/x-tar', 'Content-Length': str(size)})
+                resp = conn.getresponse()
+                data = resp.read()
+            except (OSError, http.client.HTTPException) as e:
+                raise SADTFError(f"POST /upload/bulk: {e}")
+            finally:
+                conn.close()
+        result = json.loads(data.decode('utf-8')) if data else {}
+        if resp.status >= 400:
+            raise SADTFError(_error_message(data) or f"HTTP {resp.status}", status=resp.status)
+        return result
+
+    def get(self, file_id, dest, progress=None):
+        """
+        Descarga `file_id` en `dest` pidiendo los bloques en paralelo. Cada bloque
+        se verifica contra su hash (si la metadata lo tiene) y se escribe en su
+        offset; el archivo final aparece de forma atómica al terminar.
+        """
+        entry = self._files(file_id=file_id, fields='meta.blocks.index,meta.blocks.size,meta.blocks.hash').get(file_id)
+        if not entry:
+            raise SADTFError(f"archivo no encontrado: {file_id}", status=404)
+        blocks = sorted(entry.get('meta', {}).get('blocks', []), key=lambda b: b.get('index', 0))
+        offsets = {}
+        total = 0
+        for b in blocks:
+            offsets[b['index']] = total
+            total += b.get('size', 0)
+
+        tmp = f"{dest}.sadtf-tmp"
+        with open(tmp, 'wb') as f:
+            f.truncate(total)
+        write_lock = threading.Lock()
+        done = [0]
+        if progress:
+            progress(0, total)
+
+        with open(tmp, 'r+b') as out:
+            def _fetch(block):
+                expected = block.get('hash')
+
+                def _check(resp, data):
+                    if len(data) != block.get('size', len(data)):
+                        raise _RetryableError(f"bloque {block['index']}: tamaño {len(data)} incorrecto")
+                    if expected and hashlib.sha256(data).hexdigest() != expected:
+                        raise _RetryableError(f"bloque {block['index']}: hash no coincide")
+
+                _, _, data = self.request('GET', f"/files/block?file_id={quote(file_id)}&index={block['index']}",
+                                          check=_check)
+                with write_lock:
+                    out.seek(offsets[block['index']])
+                    out.write(data)
+                    done[0] += len(data)
+                    if progress:
+                        progress(done[0], total)
+
+            try:
+                self._run_parallel(_fetch, blocks)
+            except BaseException:
+                out.close()
+                os.remove(tmp)
+                raise
+        os.replace(tmp, dest)
+        return {'file_id': file_id, 'path': dest, 'size': total, 'blocks': len(blocks)}
+
+    def _run_parallel(self, fn, items):
+        """Ejecuta fn(item) con `workers` hilos; al primer fallo cancela lo pendiente y lo relanza."""
+        if not items:
+            return
+        with ThreadPoolExecutor(max_workers=self.workers) as ex:
+            futures = [ex.submit(fn, item) for item in items]
+            try:
+                for fut in as_completed(futures):
+                    fut.result()
+            except BaseException:
+                for fut in futures:
+                    fut.cancel()
+                raise
+
+
+def _error_message(data):
+    try:
+        obj = json.loads(data.decode('utf-8'))
+        return obj.get('message') or obj.get('error') or ''
+    except Exception:
+        return ''
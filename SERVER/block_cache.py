@@ -0,0 +1,93 @@
+"""
+BlockCache: caché en memoria de bloques para el camino de lectura del coordinador.
+
+Las descargas de archivos populares (instaladores, datasets) vuelven a leer los
+mismos bloques una y otra vez, desde disco o pidiéndolos a los nodos. Esta caché
+guarda los bytes de los bloques bajo un presupuesto de memoria fijo y expulsa
+por LRU. Se invalida explícitamente cuando los bloques se liberan.
+"""
+import threading
+from collections import OrderedDict
+
+
+class BlockCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max(0, int(max_bytes))
+        self._data = OrderedDict()   # key -> bytes (orden = recencia, el último es el más reciente)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0            # bloques mayores que el presupuesto completo
+
+    def get(self, key):
+        with self._lock:
+            data = self._data.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def __contains__(self, key):
+        # Sin contar acierto/fallo ni tocar la recencia (p.ej. para decidir qué pedir por adelantado)
+        with self._lock:
+            return key in self._data
+
+    def put(self, key, data):
+        if key is None or data is None:
+            return
+        size = len(data)
+        with self._lock:
+            if size > self.max_bytes:
+                self.rejected += 1
+                return
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._data[key] = bytes(data)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._data:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, keys):
+        """Elimina de la caché las claves indicadas. Retorna cuántas estaban presentes."""
+        removed = 0
+        with self._lock:
+            for key in keys:
+                data = self._data.pop(key, None)
+                if data is not None:
+                    self._bytes -= len(data)
+                    removed += 1
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max(0, int(max_bytes))
+            while self._bytes > self.max_bytes and self._data:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'max_bytes': self.max_bytes,
+                'used_bytes': self._bytes,
+                'entries': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+                'evictions': self.evictions,
+                'rejected': self.rejected,
+            }
@@ -0,0 +1,99 @@
+"""
+DeleteQueue: cola de borrados de bloques pendientes de confirmar por cada nodo.
+
+Borrar un archivo no libera sus slots al momento: cada bloque pasa a estado
+'deleting' en la tabla de bloques (tombstone) con la lista de nodos que aún
+deben borrar su copia (`pending_delete_on`). El hilo de GC del coordinador toma
+de esta cola los bloques de los nodos conectados, les envía DELETE_BLOCKS por
+lotes y, con cada confirmación, quita el nodo del tombstone; cuando no queda
+ninguno el slot vuelve a estar libre. Los nodos desconectados conservan su cola
+y se atienden al reconectar.
+
+La cola es un índice en memoria de los tombstones (que son los que persisten):
+al arrancar se reconstruye recorriendo la tabla (ver `rebuild`).
+"""
+import threading
+from collections import OrderedDict
+
+STATUS_DELETING = 'deleting'
+
+
+class DeleteQueue:
+    def __init__(self):
+        self._pending = {}      # node_id -> OrderedDict(block_id -> remote_name)
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.confirmed = 0
+        self.failed = 0         # bloques que un nodo no pudo borrar (se reintentan)
+        self.messages = 0
+
+    def add(self, node_id, block_id, remote_name):
+        with self._lock:
+            q = self._pending.setdefault(node_id, OrderedDict())
+            if block_id not in q:
+                q[block_id] = remote_name
+                self.enqueued += 1
+
+    def rebuild(self, blocks):
+        """Recarga la cola desde los tombstones de la tabla de bloques (`block_id -> bloque`)."""
+        with self._lock:
+            self._pending = {}
+        for bid, b in blocks.items():
+            if b.get('status') == STATUS_DELETING:
+                for nid in b.get('pending_delete_on') or []:
+                    self.add(nid, bid, b.get('remote_name'))
+
+    def take(self, node_id, limit):
+        """Hasta `limit` bloques pendientes del nodo como [(block_id, remote_name)] (siguen en la cola)."""
+        with self._lock:
+            q = self._pending.get(node_id)
+            if not q:
+                return []
+            items = []
+            for bid, name in q.items():
+                items.append((bid, name))
+                if len(items) >= limit:
+                    break
+            return items
+
+    def defer(self, node_id, block_id):
+        """Pasa al final de la cola un bloque que el nodo no pudo borrar (se reintenta después)."""
+        with self._lock:
+            q = self._pending.get(node_id)
+            if q is not None and block_id in q:
+                q.move_to_end(block_id)
+                self.failed += 1
+
+    def count(self, node_id):
+        with self._lock:
+            return len(self._pending.get(node_id) or ())
+
+    def done(self, node_id, block_id):
+        with self._lock:
+            q = self._pending.get(node_id)
+            if q is None or block_id not in q:
+                return
+            del q[block_id]
+            self.confirmed += 1
+            if not q:
+                del self._pending[node_id]
+
+    def drop_node(self, node_id):
+        """Olvida los borrados pendientes de un nodo (p.ej. retirado). Retorna sus block_ids."""
+        with self._lock:
+            q = self._pending.pop(node_id, None)
+            return list(q) if q else []
+
+    def nodes(self):
+        with self._lock:
+            return [nid for nid, q in self._pending.items() if q]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': {nid: len(q) for nid, q in self._pending.items() if q},
+                'enqueued': self.enqueued,
+                'confirmed': self.confirmed,
+                'failed': self.failed,
+                'messages': self.messages,
+            }
@@ -0,0 +1,724 @@
+"""
+BlockTable: representación compacta en memoria de la tabla global de bloques.
+
+La tabla RAW original era un dict `block_id -> dict` con un registro por cada
+slot de cada nodo, incluidos los libres. Con nodos de varios TB eso son decenas
+de millones de dicts, y registrar un nodo o cambiar su capacidad costaba en
+proporción a la capacidad bruta. Aquí, por nodo:
+
+  - el espacio libre es una lista ordenada de extents `[inicio, fin)` de slots
+    libres: registrar un nodo de 2 TB crea un único extent;
+  - solo los slots en uso (occupied/replica, o con algún campo asignado) tienen
+    registro, en un objeto con __slots__ (estado como código, tamaño y una
+    referencia a un file_id internado) más un dict disperso para los campos poco
+    frecuentes (`replica_for`, `path`, `remote_name`, `stored_on_list`, ...).
+
+Los ids de bloque no se guardan: se derivan del prefijo del nodo y del número de
+slot (`N3042`). BlockTable se comporta como un dict `block_id -> bloque`:
+`table[bid]` devuelve un BlockView que lee y escribe sobre el registro (y lo
+crea o lo libera según el estado), así que el código que hace
+`b['status'] = 'occupied'` o `b.setdefault('stored_on_list', [])` sigue
+funcionando sin cambios. Cualquier slot libre es direccionable por su id, pero
+al iterar la tabla solo aparecen los slots con registro: el coste de recorrerla
+(persistencia, `/blocks`) es proporcional al espacio usado.
+"""
+import heapq
+import re
+import sys
+from array import array
+from bisect import bisect_right
+from collections.abc import MutableMapping
+
+STATUS_FREE = 'free'
+STATUS_OCCUPIED = 'occupied'
+STATUS_REPLICA = 'replica'
+STATUS_UNAVAILABLE = 'unavailable'
+STATUS_DELETING = 'deleting'     # archivo borrado, esperando a que los nodos borren su copia
+
+# Códigos de estado; los estados desconocidos se registran al vuelo
+_STATUS_NAMES = [STATUS_FREE, STATUS_OCCUPIED, STATUS_REPLICA, STATUS_UNAVAILABLE, STATUS_DELETING]
+_STATUS_CODES = {name: code for code, name in enumerate(_STATUS_NAMES)}
+_FREE = 0
+_USED_CODES = (1, 2, 4)  # occupied, replica, deleting: cuentan como bytes ocupados (el disco aún no se liberó)
+
+_NUM_RE = re.compile(r"(\d+)$")
+_FIXED_KEYS = ('id', 'node', 'index', 'status', 'primary_for')
+
+
+def _status_code(name):
+    code = _STATUS_CODES.get(name)
+    if code is None:
+        code = len(_STATUS_NAMES)
+        _STATUS_NAMES.append(name)
+        _STATUS_CODES[name] = code
+    return code
+
+
+def node_number(node_id):
+    """Número del nodo usado en el prefijo de sus bloques ('nodo3' -> 3)."""
+    try:
+        if node_id.startswith('nodo'):
+            return int(node_id[4:])
+        m = _NUM_RE.search(node_id)
+        return int(m.group(1)) if m else 0
+    except Exception:
+        return 0
+
+
+def format_block_id(prefix, index):
+    # Formato clásico 'N3042' (3 dígitos). A partir del slot 1000 se separa con '-'
+    # para que el id sea inequívoco ('N1-1001' frente a 'N11001' = N11, slot 1).
+    return f"{prefix}{index:03d}" if index < 1000 else f"{prefix}-{index}"
+
+
+class _Slot:
+    __slots__ = ('status', 'size', 'primary', 'extra')
+
+    def __init__(self, status=_FREE, size=0, primary=-1):
+        self.status = status
+        self.size = size         # 0 = sin tamaño registrado
+        self.primary = primary   # referencia a BlockTable._files (-1 = ninguno)
+        self.extra = None        # dict con campos poco frecuentes
+
+    def copy(self):
+        rec = _Slot(self.status, self.size, self.primary)
+        if self.extra:
+            rec.extra = {k: (list(v) if isinstance(v, list) else v) for k, v in self.extra.items()}
+        return rec
+
+
+class _NodeSlots:
+    __slots__ = ('node', 'prefix', 'slots', 'records', 'starts', 'ends', 'free_count',
+                 'unavailable', 'used_bytes')
+
+    def __init__(self, node, prefix):
+        self.node = node
+        self.prefix = prefix
+        self.slots = 0           # slots totales del nodo (1..slots)
+        self.records = {}        # índice de slot -> _Slot
+        self.starts = []         # extents libres [starts[k], ends[k]) ordenados y disjuntos
+        self.ends = []
+        self.free_count = 0
+        self.unavailable = False  # los slots libres se muestran como 'unavailable'
+        self.used_bytes = 0
+
+    # --- extents libres ----------------------------------------------------------
+    def is_free(self, index):
+        k = bisect_right(self.starts, index) - 1
+        return k >= 0 and index < self.ends[k]
+
+    def take(self, index):
+        """Quita `index` del espacio libre. Retorna False si no estaba libre."""
+        k = bisect_right(self.starts, index) - 1
+        if k < 0 or index >= self.ends[k]:
+            return False
+        start, end = self.starts[k], self.ends[k]
+        if start == index and end == index + 1:
+            del self.starts[k]
+            del self.ends[k]
+        elif start == index:
+            self.starts[k] = index + 1
+        elif end == index + 1:
+            self.ends[k] = index
+        else:
+            self.ends[k] = index
+            self.starts.insert(k + 1, index + 1)
+            self.ends.insert(k + 1, end)
+        self.free_count -= 1
+        return True
+
+    def release(self, index):
+        """Devuelve `index` al espacio libre (fusionando con los extents vecinos)."""
+        k = bisect_right(self.starts, index) - 1
+        if k >= 0 and index < self.ends[k]:
+            return False
+        joins_prev = k >= 0 and self.ends[k] == index
+        joins_next = k + 1 < len(self.starts) and self.starts[k + 1] == index + 1
+        if joins_prev and joins_next:
+            self.ends[k] = self.ends[k + 1]
+            del self.starts[k + 1]
+            del self.ends[k + 1]
+        elif joins_prev:
+            self.ends[k] = index + 1
+        elif joins_next:
+            self.starts[k + 1] = index
+        else:
+            self.starts.insert(k + 1, index)
+            self.ends.insert(k + 1, index + 1)
+        self.free_count += 1
+        return True
+
+    def truncate_free(self, count):
+        """Elimina del espacio libre los slots > count."""
+        while self.starts and self.ends[-1] > count + 1:
+            if self.starts[-1] > count:
+                self.free_count -= self.ends[-1] - self.starts[-1]
+                self.starts.pop()
+                self.ends.pop()
+            else:
+                self.free_count -= self.ends[-1] - (count + 1)
+                self.ends[-1] = count + 1
+
+    def extend_free(self, start, end):
+        if start >= end:
+            return
+        if self.ends and self.ends[-1] == start:
+            self.ends[-1] = end
+        else:
+            self.starts.append(start)
+            self.ends.append(end)
+        self.free_count += end - start
+
+
+class BlockView(MutableMapping):
+    """Vista dict de un slot: lee y escribe directamente sobre la tabla."""
+
+    __slots__ = ('_table', '_ns', '_i')
+
+    def __init__(self, table, ns, index):
+        self._table = table
+        self._ns = ns
+        self._i = index
+
+    def _rec(self):
+        return self._ns.records.get(self._i)
+
+    def __getitem__(self, key):
+        rec = self._ns.records.get(self._i)
+        if key == 'status':
+            if rec is None or rec.status == _FREE:
+                return STATUS_UNAVAILABLE if self._ns.unavailable else STATUS_FREE
+            return _STATUS_NAMES[rec.status]
+        if key == 'id':
+            return format_block_id(self._ns.prefix, self._i)
+        if key == 'node':
+            return self._ns.node
+        if key == 'index':
+            return self._i
+        if key == 'primary_for':
+            return self._table._files[rec.primary] if rec is not None and rec.primary >= 0 else None
+        if key == 'size':
+            if rec is None or not rec.size:
+                raise KeyError(key)
+            return rec.size
+        if rec is None or rec.extra is None or key not in rec.extra:
+            raise KeyError(key)
+        return rec.extra[key]
+
+    def __setitem__(self, key, value):
+        table, ns = self._table, self._ns
+        if key == 'status':
+            table._set_status(ns, self._i, _status_code(value))
+        elif key == 'primary_for':
+            if value is None and self._i not in ns.records:
+                return
+            table._record(ns, self._i).primary = table._file_ref(value)
+        elif key == 'size':
+            table._set_size(ns, self._i, int(value or 0))
+        elif key in ('id', 'node', 'index'):
+            if self[key] != value:
+                raise ValueError(f"no se puede cambiar '{key}' de un slot ({self[key]} -> {value})")
+        else:
+            rec = table._record(ns, self._i)
+            if rec.extra is None:
+                rec.extra = {}
+            rec.extra[key] = value
+
+    def __delitem__(self, key):
+        rec = self._ns.records.get(self._i)
+        if key == 'primary_for':
+            if rec is not None:
+                rec.primary = -1
+        elif key == 'size':
+            if rec is None or not rec.size:
+                raise KeyError(key)
+            self._table._set_size(self._ns, self._i, 0)
+        elif key in ('id', 'node', 'index', 'status'):
+            raise KeyError(f"'{key}' es obligatorio en un slot")
+        else:
+            if rec is None or rec.extra is None or key not in rec.extra:
+                raise KeyError(key)
+            del rec.extra[key]
+            if not rec.extra:
+                rec.extra = None
+        self._table._drop_if_empty(self._ns, self._i)
+
+    def __iter__(self):
+        yield from _FIXED_KEYS
+        rec = self._ns.records.get(self._i)
+        if rec is not None:
+            if rec.size:
+                yield 'size'
+            if rec.extra:
+                yield from list(rec.extra)
+
+    def __len__(self):
+        rec = self._ns.records.get(self._i)
+        if rec is None:
+            return len(_FIXED_KEYS)
+        return len(_FIXED_KEYS) + (1 if rec.size else 0) + (len(rec.extra) if rec.extra else 0)
+
+    def __eq__(self, other):
+        if isinstance(other, BlockView):
+            return self._ns is other._ns and self._i == other._i
+        return MutableMapping.__eq__(self, other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class BlockTable(MutableMapping):
+    """Tabla global de bloques `block_id -> bloque` con espacio libre por extents."""
+
+    def __init__(self, slot_size=1024 * 1024):
+        self.slot_size = int(slot_size)
+        self._nodes = {}         # node_id -> _NodeSlots
+        self._by_prefix = {}     # prefijo -> _NodeSlots
+        self._aliases = {}       # ids heredados no canónicos -> (node_id, índice)
+        self._loose = {}         # registros que no pertenecen a ningún slot de nodo (dict normales)
+        self._files = []         # file_ids internados
+        self._file_refs = {}     # file_id -> posición en _files
+
+    # --- internos -----------------------------------------------------------------
+    def _file_ref(self, file_id):
+        if file_id is None:
+            return -1
+        ref = self._file_refs.get(file_id)
+        if ref is None:
+            ref = len(self._files)
+            self._files.append(sys.intern(str(file_id)))
+            self._file_refs[file_id] = ref
+        return ref
+
+    def _contribution(self, rec):
+        if rec is not None and rec.status in _USED_CODES:
+            return rec.size or self.slot_size
+        return 0
+
+    def _record(self, ns, index):
+        rec = ns.records.get(index)
+        if rec is None:
+            rec = ns.records[index] = _Slot()
+        return rec
+
+    def _set_status(self, ns, index, code):
+        rec = ns.records.get(index)
+        if code == _FREE:
+            # Un slot libre no tiene registro: se descartan también sus campos
+            if rec is not None:
+                ns.used_bytes -= self._contribution(rec)
+                del ns.records[index]
+                ns.release(index)
+            return
+        if rec is None:
+            rec = ns.records[index] = _Slot()
+        before = self._contribution(rec)
+        if rec.status == _FREE:
+            ns.take(index)
+        rec.status = code
+        ns.used_bytes += self._contribution(rec) - before
+
+    def _set_size(self, ns, index, size):
+        rec = ns.records.get(index)
+        if rec is None:
+            if not size:
+                return
+            rec = self._record(ns, index)
+        before = self._contribution(rec)
+        rec.size = size
+        ns.used_bytes += self._contribution(rec) - before
+        self._drop_if_empty(ns, index)
+
+    def _drop_if_empty(self, ns, index):
+        rec = ns.records.get(index)
+        if rec is not None and rec.status == _FREE and rec.primary < 0 and not rec.size and not rec.extra:
+            del ns.records[index]
+
+    def _locate(self, bid):
+        alias = self._aliases.get(bid)
+        if alias is not None:
+            ns = self._nodes.get(alias[0])
+            return (ns, alias[1]) if ns is not None and alias[1] <= ns.slots else None
+        if not isinstance(bid, str) or len(bid) < 4:
+            return None
+        if '-' in bid:
+            prefix, _, digits = bid.rpartition('-')
+        else:
+            prefix, digits = bid[:-3], bid[-3:]
+        ns = self._by_prefix.get(prefix)
+        if ns is None or not digits.isdigit():
+            return None
+        index = int(digits)
+        if not (1 <= index <= ns.slots) or format_block_id(prefix, index) != bid:
+            return None
+        # Slot eliminado en medio del rango: ni libre ni con registro
+        if index not in ns.records and not ns.is_free(index):
+            return None
+        return ns, index
+
+    def _assign(self, ns, index, record):
+        self._set_status(ns, index, _status_code(record.get('status') or STATUS_FREE))
+        if record.get('status') in (None, STATUS_FREE, STATUS_UNAVAILABLE):
+            # Registros libres heredados: solo conservar campos si los hay
+            extra = {k: v for k, v in record.items() if k not in _FIXED_KEYS and k != 'size'}
+            if not extra and not record.get('primary_for') and not record.get('size'):
+                return
+        rec = self._record(ns, index)
+        rec.primary = self._file_ref(record.get('primary_for'))
+        self._set_size(ns, index, int(record.get('size') or 0))
+        extra = {k: v for k, v in record.items() if k not in _FIXED_KEYS and k != 'size'}
+        rec.extra = extra or None
+        self._drop_if_empty(ns, index)
+
+    # --- gestión de nodos ---------------------------------------------------------
+    def ensure_node(self, node_id, prefix=None):
+        """Devuelve los slots de `node_id`, creándolo con un prefijo único si no existe."""
+        ns = self._nodes.get(node_id)
+        if ns is not None:
+            return ns
+        if prefix is None or prefix in self._by_prefix:
+            base = prefix or f"N{node_number(node_id)}"
+            prefix, k = base, 1
+            while prefix in self._by_prefix:
+                k += 1
+                prefix = f"{base}x{k}"
+        ns = _NodeSlots(node_id, prefix)
+        self._nodes[node_id] = ns
+        self._by_prefix[prefix] = ns
+        return ns
+
+    def node_ids(self):
+        return list(self._nodes)
+
+    def has_node(self, node_id):
+        return node_id in self._nodes
+
+    def slot_count(self, node_id):
+        ns = self._nodes.get(node_id)
+        return ns.slots if ns else 0
+
+    def total_slots(self):
+        return sum(ns.slots for ns in self._nodes.values()) + len(self._loose)
+
+    def resize_node(self, node_id, count):
+        """
+        Ajusta el número de slots del nodo: añade un extent libre al final o
+        descarta los slots por encima de `count`. Coste proporcional a los slots
+        en uso, no a la capacidad.
+        """
+        ns = self.ensure_node(node_id)
+        count = max(0, int(count))
+        if count > ns.slots:
+            ns.extend_free(ns.slots + 1, count + 1)
+        elif count < ns.slots:
+            ns.truncate_free(count)
+            for index in [i for i in ns.records if i > count]:
+                ns.used_bytes -= self._contribution(ns.records.pop(index))
+            for bid in [b for b, (n, i) in self._aliases.items() if n == node_id and i > count]:
+                del self._aliases[bid]
+        ns.slots = count
+
+    def replace_status(self, node_id, old, new):
+        """Cambia a `new` todos los slots del nodo con estado `old`. Retorna True si hubo cambios."""
+        ns = self._nodes.get(node_id)
+        if ns is None:
+            return False
+        if old == STATUS_FREE and new == STATUS_UNAVAILABLE:
+            changed = not ns.unavailable and ns.free_count > 0
+            ns.unavailable = True
+            return changed
+        if old == STATUS_UNAVAILABLE and new == STATUS_FREE:
+            changed = ns.unavailable and ns.free_count > 0
+            ns.unavailable = False
+            return changed
+        old_code, new_code = _status_code(old), _status_code(new)
+        targets = [i for i, rec in ns.records.items() if rec.status == old_code]
+        for index in targets:
+            self._set_status(ns, index, new_code)
+        return bool(targets)
+
+    def free_slot_ids(self, node_id, limit=None):
+        """Ids de slots libres del nodo en orden de slot (como mucho `limit`)."""
+        ns = self._nodes.get(node_id)
+        res = []
+        if ns is None or ns.unavailable:
+            return res
+        for start, end in zip(ns.starts, ns.ends):
+            if limit is not None:
+                end = min(end, start + limit - len(res))
+            res.extend(format_block_id(ns.prefix, i) for i in range(start, end))
+            if limit is not None and len(res) >= limit:
+                break
+        return res
+
+    def free_extents(self, node_id):
+        """Lista de extents libres `(inicio, fin)` (fin exclusivo) del nodo."""
+        ns = self._nodes.get(node_id)
+        return list(zip(ns.starts, ns.ends)) if ns else []
+
+    def used_bytes_by_node(self):
+        """node_id -> bytes ocupados (primarios + réplicas), mantenido de forma incremental."""
+        return {nid: ns.used_bytes for nid, ns in self._nodes.items() if ns.used_bytes}
+
+    def node_summary(self):
+        """node_id -> {prefix, slots, free, used, unavailable}: basta para reconstruir el espacio libre."""
+        return {nid: {'prefix': ns.prefix, 'slots': ns.slots, 'free': ns.free_count,
+                      'used': len(ns.records), 'used_bytes': ns.used_bytes, 'unavailable': ns.unavailable}
+                for nid, ns in self._nodes.items()}
+
+    def node_views(self, node_id):
+        """Vistas de los slots con registro del nodo, en orden de slot."""
+        ns = self._nodes.get(node_id)
+        if ns is None:
+            return
+        for index in sorted(ns.records):
+            yield BlockView(self, ns, index)
+
+    # --- interfaz dict -----------------------------------------------------------------
+    def __getitem__(self, bid):
+        loc = self._locate(bid)
+        if loc is None:
+            return self._loose[bid]
+        return BlockView(self, loc[0], loc[1])
+
+    def __contains__(self, bid):
+        return self._locate(bid) is not None or bid in self._loose
+
+    def __setitem__(self, bid, record):
+        loc = self._locate(bid)
+        if loc is not None:
+            if isinstance(record, BlockView) and record._ns is loc[0] and record._i == loc[1]:
+                return
+            self._assign(loc[0], loc[1], dict(record))
+            return
+        node, index = record.get('node'), record.get('index')
+        if node is None or not isinstance(index, int) or index < 1:
+            self._loose[bid] = dict(record)
+            return
+        ns = self.ensure_node(node)
+        if index > ns.slots:
+            # los slots del salto no existían: no quedan libres
+            ns.slots = index
+        ns.release(index)
+        if format_block_id(ns.prefix, index) != bid:
+            self._aliases[bid] = (node, index)
+        self._assign(ns, index, dict(record))
+
+    def __delitem__(self, bid):
+        loc = self._locate(bid)
+        if loc is None:
+            del self._loose[bid]
+            return
+        ns, index = loc
+        rec = ns.records.pop(index, None)
+        ns.used_bytes -= self._contribution(rec)
+        ns.take(index)
+        if index == ns.slots:
+            ns.slots -= 1
+        for alias in [a for a, (n, i) in self._aliases.items() if n == ns.node and i == index]:
+            del self._aliases[alias]
+
+    def __iter__(self):
+        """Itera los ids de los slots con registro (los libres no se materializan)."""
+        aliased = {(n, i): a for a, (n, i) in self._aliases.items()}
+        for nid, ns in list(self._nodes.items()):
+            prefix = ns.prefix
+            for index in sorted(ns.records):
+                yield aliased.get((nid, index)) or format_block_id(prefix, index)
+        yield from list(self._loose)
+
+    def __len__(self):
+        return sum(len(ns.records) for ns in self._nodes.values()) + len(self._loose)
+
+    def __repr__(self):
+        return f"<BlockTable nodes={len(self._nodes)} slots={self.total_slots()} used={len(self)}>"
+
+    def copy(self):
+        """Copia independiente (para guardarla fuera del lock). Coste proporcional a los slots en uso."""
+        new = BlockTable(slot_size=self.slot_size)
+        new._files = list(self._files)
+        new._file_refs = dict(self._file_refs)
+        new._aliases = dict(self._aliases)
+        new._loose = {bid: dict(b) for bid, b in self._loose.items()}
+        for nid, ns in self._nodes.items():
+            c = _NodeSlots(ns.node, ns.prefix)
+            c.slots, c.free_count, c.unavailable, c.used_bytes = ns.slots, ns.free_count, ns.unavailable, ns.used_bytes
+            c.starts, c.ends = list(ns.starts), list(ns.ends)
+            c.records = {i: rec.copy() for i, rec in ns.records.items()}
+            new._nodes[nid] = c
+            new._by_prefix[c.prefix] = c
+        return new
+
+    # --- volcado como arrays (snapshots binarios, ver snapshot.py) ------------------
+    def export_state(self):
+        """
+        Estado completo como arrays paralelos por nodo (índice, estado, tamaño y
+        archivo primario de cada slot con registro, y los extents libres) más los
+        campos dispersos, alias y registros sueltos como estructuras JSON.
+        """
+        nodes = {}
+        for nid, ns in self._nodes.items():
+            indices = sorted(ns.records)
+            recs = [ns.records[i] for i in indices]
+            nodes[nid] = {
+                'prefix': ns.prefix, 'slots': ns.slots, 'unavailable': ns.unavailable,
+                'indices': array('I', indices),
+                'status': array('B', [r.status for r in recs]),
+                'sizes': array('Q', [r.size for r in recs]),
+                'primary': array('i', [r.primary for r in recs]),
+                'starts': array('I', ns.starts),
+                'ends': array('I', ns.ends),
+                'extras': {pos: r.extra for pos, r in enumerate(recs) if r.extra},
+            }
+        return {
+            'slot_size': self.slot_size,
+            'status_names': list(_STATUS_NAMES),
+            'files': list(self._files),
+            'aliases': [[bid, nid, index] for bid, (nid, index) in self._aliases.items()],
+            'loose': self._loose,
+            'nodes': nodes,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Reconstruye la tabla a partir de `export_state()` en una sola pasada por slot."""
+        table = cls(slot_size=state.get('slot_size', 1024 * 1024))
+        table._files = [sys.intern(f) for f in state.get('files', [])]
+        table._file_refs = {f: i for i, f in enumerate(table._files)}
+        # Los códigos de estado se asignan al vuelo: traducir si difieren de los guardados
+        remap = [_status_code(name) for name in state.get('status_names') or _STATUS_NAMES]
+        identity = remap == list(range(len(remap)))
+        slot_size = table.slot_size
+        for nid, data in state.get('nodes', {}).items():
+            ns = table.ensure_node(nid, data.get('prefix'))
+            ns.slots = int(data.get('slots', 0))
+            ns.unavailable = bool(data.get('unavailable'))
+            ns.starts = list(data.get('starts', ()))
+            ns.ends = list(data.get('ends', ()))
+            ns.free_count = sum(e - s for s, e in zip(ns.starts, ns.ends))
+            status = data['status']
+            if not identity:
+                status = array('B', [remap[code] for code in status])
+            # Construcción en bloque (map/zip en C) en lugar de asignar campo a campo
+            records = dict(zip(data['indices'], map(_Slot, status, data['sizes'], data['primary'])))
+            if data.get('extras'):
+                recs = list(records.values())
+                for pos, extra in data['extras'].items():
+                    recs[pos].extra = extra
+            ns.records = records
+            ns.used_bytes = sum((size or slot_size) for code, size in zip(status, data['sizes']) if code in _USED_CODES)
+        for bid, nid, index in state.get('aliases', []):
+            table._aliases[bid] = (nid, index)
+        table._loose = dict(state.get('loose') or {})
+        return table
+
+    def to_dict(self):
+        """Copia como dict normal `block_id -> dict` (solo slots con registro)."""
+        return {bid: dict(b) for bid, b in self.items()}
+
+    def iter_all(self, node_id=None):
+        """Vistas de TODOS los slots (también los libres), en orden. Coste proporcional a la capacidad."""
+        nodes = [self._nodes[node_id]] if node_id in self._nodes else ([] if node_id else list(self._nodes.values()))
+        for ns in nodes:
+            for index in range(1, ns.slots + 1):
+                if index in ns.records or ns.is_free(index):
+                    yield BlockView(self, ns, index)
+
+    def position(self, bid):
+        """
+        `(node_id, índice)` de un id de bloque para paginar (aunque el slot ya no
+        exista), `(None, bid)` si es un registro suelto, o None si no se reconoce.
+        """
+        alias = self._aliases.get(bid)
+        if alias is not None:
+            return alias
+        if bid in self._loose:
+            return None, bid
+        if not isinstance(bid, str) or len(bid) < 4:
+            return None
+        if '-' in bid:
+            prefix, _, digits = bid.rpartition('-')
+        else:
+            prefix, digits = bid[:-3], bid[-3:]
+        ns = self._by_prefix.get(prefix)
+        if ns is None or not digits.isdigit() or format_block_id(prefix, int(digits)) != bid:
+            return None
+        return ns.node, int(digits)
+
+    def iter_ordered(self, after=None, include_free=False, node_id=None):
+        """
+        Pares `(block_id, vista)` en orden estable (node_id, slot) y al final los
+        registros sueltos (por id), empezando justo después de `after` (ver `position()`).
+        Sin `include_free` solo recorre los slots con registro; el coste de
+        llegar a `after` no depende de cuántas páginas se hayan pedido antes.
+        """
+        a_node, a_key = after if after else ('', 0)
+        for nid in sorted(self._nodes):
+            if (node_id is not None and nid != node_id) or a_node is None or nid < a_node:
+                continue
+            ns = self._nodes[nid]
+            start = a_key + 1 if nid == a_node else 1
+            if include_free:
+                for index in range(start, ns.slots + 1):
+                    if index in ns.records or ns.is_free(index):
+                        yield format_block_id(ns.prefix, index), BlockView(self, ns, index)
+                continue
+            # Los siguientes slots con registro por tandas crecientes: sin ordenar
+            # el nodo entero cuando solo se va a leer una página
+            batch = 256
+            while True:
+                indices = heapq.nsmallest(batch, (i for i in list(ns.records) if i >= start))
+                for index in indices:
+                    if index in ns.records:
+                        yield format_block_id(ns.prefix, index), BlockView(self, ns, index)
+                if len(indices) < batch:
+                    break
+                start = indices[-1] + 1
+                batch *= 2
+        if node_id is None:
+            for bid in sorted(self._loose):
+                if a_node is not None or bid > a_key:
+                    yield bid, self._loose[bid]
+
+    @classmethod
+    def from_dict(cls, blocks, slot_size=1024 * 1024, nodes=None):
+        """
+        Construye la tabla a partir del dict clásico `block_id -> dict` y, si se
+        indica, del resumen por nodo de `node_summary()` (prefijos y nº de slots).
+        Los registros 'free' heredados no se materializan.
+        """
+        if isinstance(blocks, BlockTable):
+            return blocks
+        table = cls(slot_size=slot_size)
+        nodes = nodes or {}
+        for nid, info in nodes.items():
+            table.ensure_node(nid, info.get('prefix'))
+        # Fijar prefijo y tamaño de cada nodo a partir de sus ids existentes
+        max_index = {nid: int(info.get('slots', 0)) for nid, info in nodes.items()}
+        for bid, b in blocks.items():
+            node, index = b.get('node'), b.get('index')
+            if node is None or not isinstance(index, int) or index < 1:
+                continue
+            max_index[node] = max(max_index.get(node, 0), index)
+            if node not in table._nodes and index < 1000 and bid.endswith(f"{index:03d}"):
+                prefix = bid[:-3]
+                if prefix not in table._by_prefix:
+                    table.ensure_node(node, prefix)
+        for node, count in max_index.items():
+            table.resize_node(node, count)
+        for bid, b in blocks.items():
+            table[bid] = b
+        for nid, info in nodes.items():
+            if info.get('unavailable'):
+                table._nodes[nid].unavailable = True
+        return table
+
+
+def ensure_table(raw, slot_size=1024 * 1024):
+    """Garantiza que `raw['blocks']` sea una BlockTable (convierte dicts clásicos)."""
+    blocks = raw.get('blocks')
+    if not isinstance(blocks, BlockTable):
+        raw['blocks'] = BlockTable.from_dict(blocks or {}, slot_size=slot_size, nodes=raw.get('nodes'))
+    return raw['blocks']
@@ -1,6 +1,10 @@
 import os
-import json
 import shutil
+from collections.abc import Mapping
+import listing
+import log_manager as log
+import metadata_store
+from block_table import BlockTable, ensure_table, node_number
 
 # Carpeta base donde el coordinador guardará los bloques físicamente
 # Ejemplo Windows: C:\\Users\\<usuario>\\espacioCompartido
@@ -15,33 +19,24 @@ def ensure_node_dir(node_id: str):
 blocks_persistent_file = os.path.join(os.path.dirname(__file__), 'info', 'blocks_data.json')
 
 
-def load_persistent_blocks():
+def load_persistent_blocks(slot_size=1024 * 1024):
     try:
-        if os.path.exists(blocks_persistent_file):
-            with open(blocks_persistent_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-                if not content.strip():
-                    data = {'blocks': {}, 'table_size': 0}
-                else:
-                    data = json.loads(content)
-        else:
-            data = {'blocks': {}, 'table_size': 0}
+        data = metadata_store.get_store().load_blocks()
         if 'blocks' not in data:
             data['blocks'] = {}
-        if 'table_size' not in data:
-            data['table_size'] = len(data.get('blocks', {}))
+        data['table_size'] = ensure_table(data, slot_size=slot_size).total_slots()
         # Devolver RAW (mapping) para uso del coordinador
         return data
     except Exception as e:
-        print(f"[BLOCKS_MANAGER] Error cargando bloques persistentes: {e}")
-        return {'blocks': {}, 'table_size': 0}
+        log.error(f"[BLOCKS_MANAGER] Error cargando bloques persistentes: {e}")
+        return {'blocks': BlockTable(slot_size=slot_size), 'table_size': 0, 'nodes': {}}
 
 
 def save_persistent_blocks(blocks_data):
     try:
         # blocks_data puede venir como RAW {'blocks': {id: block,...}, 'table_size': n}
         # o como UI {'blocks': [...], 'table_size': n, '_raw': {...}}
-        if isinstance(blocks_data, dict) and ('_raw' in blocks_data or (isinstance(blocks_data.get('blocks', None), dict))):
+        if isinstance(blocks_data, dict) and ('_raw' in blocks_data or (isinstance(blocks_data.get('blocks', None), Mapping))):
             # si tiene _raw usamos ese raw, si 'blocks' es mapping, asumimos que es raw
             if '_raw' in blocks_data:
                 raw = blocks_data['_raw']
@@ -53,100 +48,143 @@ def save_persistent_blocks(blocks_data):
             for b in blocks_data.get('blocks', []):
                 raw['blocks'][b['id']] = b
             raw['table_size'] = blocks_data.get('table_size', len(raw['blocks']))
-        with open(blocks_persistent_file, 'w', encoding='utf-8') as f:
-            json.dump(raw, f, indent=2)
-        print(f"[BLOCKS_MANAGER] Guardado {len(raw.get('blocks', {}))} bloques en {blocks_persistent_file}")
+        table = raw.get('blocks')
+        if isinstance(table, BlockTable):
+            # Resumen por nodo (prefijo y nº de slots): con él se reconstruye el espacio libre
+            raw['nodes'] = table.node_summary()
+            raw['table_size'] = table.total_slots()
+        metadata_store.get_store().save_blocks(raw)
     except Exception as e:
-        print(f"[BLOCKS_MANAGER] Error guardando bloques persistentes: {e}")
+        log.error(f"[BLOCKS_MANAGER] Error guardando bloques persistentes: {e}")
+
+
+def snapshot_blocks(blocks_data_raw):
+    """
+    Copia de la tabla lista para guardar (BlockTable independiente + resumen por nodo).
+    Llamar con el lock de la tabla tomado; cuesta en proporción a los slots en uso.
+    """
+    table = ensure_table(blocks_data_raw).copy()
+    return {'blocks': table, 'table_size': table.total_slots(), 'nodes': table.node_summary()}
+
+
+def reconcile_node_capacities(blocks_data_raw, nodos, slot_size=1024 * 1024):
+    """
+    Ajusta en una sola pasada los slots de todos los nodos a su capacidad declarada
+    y los marca disponibles (arranque del coordinador). Retorna True si algo cambió,
+    para no reescribir la tabla si ya estaba al día.
+    """
+    table = ensure_table(blocks_data_raw, slot_size=slot_size)
+    changed = False
+    for node_id, info in nodos.items():
+        before = table.slot_count(node_id) if table.has_node(node_id) else None
+        update_blocks_for_node(node_id, (info or {}).get('capacity', 0) or 0, blocks_data_raw, slot_size=slot_size)
+        if table.slot_count(node_id) != before:
+            changed = True
+        if table.replace_status(node_id, 'unavailable', 'free'):
+            changed = True
+    blocks_data_raw['table_size'] = table.total_slots()
+    return changed
+
+
+def free_block_ids_on_node(node_id, limit=None):
+    """Ids de slots libres de `node_id` según lo persistido (complemento de los slots en uso)."""
+    return metadata_store.get_store().free_blocks_on_node(node_id, limit=limit)
 
 
-def update_blocks_for_node(node_id, capacity_mb, blocks_data_raw):
-    """Ajusta registros RAW (dict) de bloques para un nodo en base a capacity_mb (1 bloque = 1MB)."""
+def update_blocks_for_node(node_id, capacity_mb, blocks_data_raw, slot_size=1024 * 1024):
+    """
+    Ajusta los slots de un nodo en la tabla RAW en base a capacity_mb.
+    El nodo tiene capacity / slot_size slots; la capacidad real se contabiliza en bytes
+    (ver used_bytes_by_node y Partitioner), los slots solo dan identidad a cada copia.
+    Los slots libres no se materializan (extents en BlockTable): el coste no depende
+    de la capacidad.
+    """
     raw = blocks_data_raw
-    if 'blocks' not in raw:
-        raw['blocks'] = {}
+    table = ensure_table(raw, slot_size=slot_size)
+    if not table.has_node(node_id):
+        table.ensure_node(node_id, f"N{node_number(node_id)}")
 
-    # extraer número del nodo
-    try:
-        node_num = 0
-        if node_id.startswith('nodo'):
-            node_num = int(node_id[4:])
-        else:
-            import re
-            m = re.search(r"(\d+)$", node_id)
-            node_num = int(m.group(1)) if m else 0
-    except Exception:
-        node_num = 0
-
-    prefix = f"N{node_num}"
-
-    existing = [b for b in raw['blocks'].values() if b.get('node') == node_id]
-    existing_count = len(existing)
-    desired = int(capacity_mb)
-
-    if desired > existing_count:
-        for i in range(existing_count + 1, desired + 1):
-            bid = f"{prefix}{str(i).zfill(3)}"
-            raw['blocks'][bid] = {
-                'id': bid,
-                'node': node_id,
-                'index': i,
-                'status': 'free',
-                'primary_for': None
-            }
-    elif desired < existing_count:
-        node_blocks = sorted([b for b in raw['blocks'].values() if b.get('node') == node_id], key=lambda x: x.get('index', 0), reverse=True)
-        to_remove = node_blocks[:(existing_count - desired)]
-        for b in to_remove:
-            bid = b.get('id')
-            try:
-                del raw['blocks'][bid]
-            except KeyError:
-                pass
+    desired = int(float(capacity_mb) * 1024 * 1024) // max(1, int(slot_size))
+    if desired != table.slot_count(node_id):
+        table.resize_node(node_id, desired)
 
-    raw['table_size'] = len(raw['blocks'])
+    raw['table_size'] = table.total_slots()
     return raw
 
 
 def set_node_blocks_unavailable(node_id, blocks_data_raw):
-    changed = False
-    for b in blocks_data_raw.get('blocks', {}).values():
-        if b.get('node') == node_id:
-            if b.get('status') != 'unavailable':
-                b['status'] = 'unavailable'
-                changed = True
-    return changed
+    return ensure_table(blocks_data_raw).replace_status(node_id, 'free', 'unavailable')
 
 
 def set_node_blocks_available(node_id, blocks_data_raw):
-    changed = False
-    for b in blocks_data_raw.get('blocks', {}).values():
-        if b.get('node') == node_id:
-            if b.get('status') == 'unavailable':
-                b['status'] = 'free'
-                changed = True
-    return changed
+    return ensure_table(blocks_data_raw).replace_status(node_id, 'unavailable', 'free')
 
 
-def raw_to_ui_struct(raw):
+def raw_to_ui_struct(raw, include_free=False):
     # raw: {'blocks': {id: block, ...}, 'table_size': n}
-    return {'blocks': list(raw.get('blocks', {}).values()), 'table_size': raw.get('table_size', 0), '_raw': raw}
+    # Solo los slots en uso más un resumen por nodo; include_free=True lista también
+    # cada slot libre (coste proporcional a la capacidad, solo para compatibilidad)
+    table = ensure_table(raw)
+    views = table.iter_all() if include_free else table.values()
+    return {'blocks': [dict(b) for b in views], 'table_size': table.total_slots(),
+            'nodes': table.node_summary(), '_raw': raw}
+
+
+def query_blocks(raw, node=None, statuses=None, file_id=None, cursor=None, limit=None, fields=None, include_free=False):
+    """
+    Página de `/blocks`: slots en orden (node_id, slot) filtrados por nodo, estado
+    y archivo (primario o réplica), a partir del block_id `cursor`.
+    Retorna (bloques, next_cursor); next_cursor es None en la última página.
+    Los slots libres solo se recorren si se piden (`include_free` o un estado
+    'free'/'unavailable').
+    """
+    table = ensure_table(raw)
+    after = None
+    if cursor:
+        after = table.position(cursor)
+        if after is None:
+            raise listing.ListQueryError(f"cursor inválido: {cursor}")
+    wanted = set(statuses) if statuses else None
+    walk_free = include_free or bool(wanted and wanted & {'free', 'unavailable'})
+    out = []
+    last = None
+    for bid, b in table.iter_ordered(after=after, include_free=walk_free, node_id=node):
+        if wanted is not None and b.get('status') not in wanted:
+            continue
+        if file_id is not None and b.get('primary_for') != file_id:
+            if file_id not in (b.get('replica_for') or ()):
+                continue
+        if limit is not None and len(out) >= limit:
+            return out, last
+        out.append(listing.project(b, fields))
+        last = bid
+    return out, None
 
 
 def find_free_blocks_by_node(blocks_data_raw):
     """Devuelve mapping node_id -> lista de block_ids libres"""
+    table = ensure_table(blocks_data_raw)
     res = {}
-    for bid, b in blocks_data_raw.get('blocks', {}).items():
-        if b.get('status') == 'free':
-            node = b.get('node')
-            res.setdefault(node, []).append(bid)
+    for node in table.node_ids():
+        free = table.free_slot_ids(node)
+        if free:
+            res[node] = free
     return res
 
 
-def assign_blocks_to_file(blocks_data_raw, file_id: str, placements: list):
+def used_bytes_by_node(blocks_data_raw, slot_size=1024 * 1024):
+    """
+    Devuelve mapping node_id -> bytes ocupados (primarios + réplicas).
+    Los bloques sin tamaño registrado (metadata antigua) cuentan como un slot completo.
+    """
+    return ensure_table(blocks_data_raw, slot_size=slot_size).used_bytes_by_node()
+
+
+def assign_blocks_to_file(blocks_data_raw, file_id: str, placements: list, block_sizes: list = None):
     """
     Marca en `blocks_data_raw` las asignaciones para un archivo.
     `placements` es lista de dicts con keys: 'primary_block_id', 'replica_block_ids'
+    `block_sizes` (opcional) son los tamaños en bytes por índice de bloque (1-based en placements).
     Modifica estados: primary -> status='occupied', primary_for=file_id
                      replica -> status='replica', replica_for=file_id
     Retorna True si al menos una asignación fue aplicada.
@@ -157,11 +195,17 @@ def assign_blocks_to_file(blocks_data_raw, file_id: str, placements: list):
     for p in placements:
         prim = p.get('primary_block_id')
         reps = p.get('replica_block_ids', [])
+        size = None
+        idx = p.get('file_block_index', 0)
+        if block_sizes and 1 <= idx <= len(block_sizes):
+            size = block_sizes[idx - 1]
         try:
             if prim and prim in blocks_data_raw.get('blocks', {}):
                 b = blocks_data_raw['blocks'][prim]
                 b['status'] = 'occupied'
                 b['primary_for'] = file_id
+                if size is not None:
+                    b['size'] = size
                 changed = True
         except Exception:
             pass
@@ -171,6 +215,8 @@ def assign_blocks_to_file(blocks_data_raw, file_id: str, placements: list):
                 if r and r in blocks_data_raw.get('blocks', {}):
                     rb = blocks_data_raw['blocks'][r]
                     rb['status'] = 'replica'
+                    if size is not None:
+                        rb['size'] = size
                     # mantener lista de replicas si hace falta
                     if 'replica_for' not in rb:
                         rb['replica_for'] = []
@@ -182,7 +228,7 @@ def assign_blocks_to_file(blocks_data_raw, file_id: str, placements: list):
 
     if changed:
         # recompute table_size (no cambia normalmente)
-        blocks_data_raw['table_size'] = len(blocks_data_raw.get('blocks', {}))
+        blocks_data_raw['table_size'] = ensure_table(blocks_data_raw).total_slots()
     return changed
 
 
@@ -213,15 +259,94 @@ def free_blocks(blocks_data_raw, block_ids: list):
                         del b['path']
                     except Exception:
                         pass
+                b.pop('size', None)
                 changed = True
         except Exception:
             pass
 
     if changed:
-        blocks_data_raw['table_size'] = len(blocks_data_raw.get('blocks', {}))
+        blocks_data_raw['table_size'] = ensure_table(blocks_data_raw).total_slots()
     return changed
 
 
+def mark_blocks_deleting(blocks_data_raw, block_ids: list):
+    """
+    Convierte los bloques en tombstones: estado 'deleting' y `pending_delete_on`
+    con los nodos que deben borrar su copia (el dueño del slot y los que guardan
+    una copia según stored_on/stored_on_list). El slot no se reutiliza hasta que
+    todos lo confirman (ver confirm_block_deleted).
+    Retorna lista de (block_id, nodos, remote_name, path_local).
+    """
+    marked = []
+    blocks = blocks_data_raw.get('blocks', {})
+    for bid in block_ids:
+        try:
+            if bid not in blocks:
+                continue
+            b = blocks[bid]
+            if b.get('status') in ('free', 'unavailable'):
+                continue
+            nodes = [b.get('node')]
+            for nid in [b.get('stored_on')] + list(b.get('stored_on_list', []) or []):
+                if nid and nid not in nodes:
+                    nodes.append(nid)
+            nodes = [n for n in nodes if n]
+            b['status'] = 'deleting'
+            b['pending_delete_on'] = nodes
+            if 'primary_for' in b:
+                del b['primary_for']
+            b.pop('replica_for', None)
+            marked.append((bid, nodes, b.get('remote_name'), b.pop('path', None)))
+        except Exception:
+            pass
+    return marked
+
+
+def confirm_block_deleted(blocks_data_raw, block_id: str, node_id: str):
+    """
+    Registra que `node_id` borró su copia del bloque. Cuando no quedan nodos
+    pendientes el slot se libera. Retorna True si el slot quedó libre.
+    """
+    b = blocks_data_raw.get('blocks', {}).get(block_id)
+    if b is None or b.get('status') != 'deleting':
+        return False
+    pending = [n for n in (b.get('pending_delete_on') or []) if n != node_id]
+    if pending:
+        b['pending_delete_on'] = pending
+        return False
+    b['status'] = 'free'
+    blocks_data_raw['table_size'] = ensure_table(blocks_data_raw).total_slots()
+    return True
+
+
+def mark_block_durable(blocks_data_raw, block_id: str, node_id: str):
+    """
+    Registra el STORE_BLOCK_ACK de `node_id` para el bloque. Solo cuenta el ACK
+    del nodo dueño del slot (la copia extra del uploader no es una réplica).
+    Retorna True si el bloque pasó a duradero.
+    """
+    b = blocks_data_raw.get('blocks', {}).get(block_id)
+    if b is None or b.get('node') != node_id or b.get('status') not in ('occupied', 'replica'):
+        return False
+    if b.get('durable'):
+        return False
+    b['durable'] = True
+    return True
+
+
+def placements_durable(blocks_data_raw, placements: list):
+    """True si todas las copias (primario y réplicas) de `placements` están confirmadas por su nodo."""
+    if not placements:
+        return False
+    raw = blocks_data_raw.get('blocks', {})
+    for p in placements:
+        ids = [p.get('primary_block_id')] + list(p.get('replica_block_ids', []) or [])
+        for bid in ids:
+            if bid and not (raw.get(bid) or {}).get('durable'):
+                return False
+    return True
+
+
 def assign_and_copy_blocks(blocks_data_raw, file_id: str, placements: list, metadata: dict = None, temp_dir: str = None):
     """
     Asigna bloques en la tabla RAW y copia los binarios desde `metadata` (archivos en temp)
@@ -257,7 +382,7 @@ def assign_and_copy_blocks(blocks_data_raw, file_id: str, placements: list, meta
                         shutil.copy2(src_path, dest_path)
                         block_meta['path'] = dest_path
                     except Exception as e:
-                        print(f"[BLOCKS_MANAGER] Error copiando primary {primary_id} a {dest_path}: {e}")
+                        log.error(f"[BLOCKS_MANAGER] Error copiando primary {primary_id} a {dest_path}: {e}")
                 block_meta['status'] = 'occupied'
                 block_meta['primary_for'] = file_id
                 changed = True
@@ -279,7 +404,7 @@ def assign_and_copy_blocks(blocks_data_raw, file_id: str, placements: list, meta
                             shutil.copy2(src_path, dest_path)
                             rmeta['path'] = dest_path
                         except Exception as e:
-                            print(f"[BLOCKS_MANAGER] Error copiando replica {rid} a {dest_path}: {e}")
+                            log.error(f"[BLOCKS_MANAGER] Error copiando replica {rid} a {dest_path}: {e}")
                     rmeta['status'] = 'replica'
                     if 'replica_for' not in rmeta:
                         rmeta['replica_for'] = []
@@ -291,7 +416,7 @@ def assign_and_copy_blocks(blocks_data_raw, file_id: str, placements: list, meta
 
     # marcar tamaño tabla
     if changed:
-        blocks_data_raw['table_size'] = len(blocks_data_raw.get('blocks', {}))
+        blocks_data_raw['table_size'] = ensure_table(blocks_data_raw).total_slots()
     return changed
 
 
@@ -303,7 +428,10 @@ def replicate_blocks_to_node(blocks_data_raw, files_data, node_id: str):
     """
     created = 0
     # encontrar bloques libres en target node
-    free_blocks = [b for b in blocks_data_raw.get('blocks', {}).values() if b.get('node') == node_id and b.get('status') == 'free']
+    table = ensure_table(blocks_data_raw)
+    # Como mucho se crea una réplica por placement: no hace falta listar más slots libres
+    wanted = sum(len(f.get('placements', [])) for f in files_data.get('files', {}).values())
+    free_blocks = [table[bid] for bid in table.free_slot_ids(node_id, limit=wanted)]
     if not free_blocks:
         return created
 
@@ -337,6 +465,8 @@ def replicate_blocks_to_node(blocks_data_raw, files_data, node_id: str):
                         # actualizar tabla
                         blocks_data_raw['blocks'][tid]['path'] = dest
                         blocks_data_raw['blocks'][tid]['status'] = 'replica'
+                        if primary_meta.get('size') is not None:
+                            blocks_data_raw['blocks'][tid]['size'] = primary_meta.get('size')
                         if 'replica_for' not in blocks_data_raw['blocks'][tid]:
                             blocks_data_raw['blocks'][tid]['replica_for'] = []
                         blocks_data_raw['blocks'][tid]['replica_for'].append(fid)
@@ -349,7 +479,7 @@ def replicate_blocks_to_node(blocks_data_raw, files_data, node_id: str):
                         p['replica_nodes'].append(node_id)
                         created += 1
                     except Exception as e:
-                        print(f"[BLOCKS_MANAGER] Error replicando a nodo {node_id}: {e}")
+                        log.error(f"[BLOCKS_MANAGER] Error replicando a nodo {node_id}: {e}")
                 else:
                     # si no está disponible el fichero fuente, saltar
                     continue
@@ -357,5 +487,5 @@ def replicate_blocks_to_node(blocks_data_raw, files_data, node_id: str):
                 continue
 
     if created:
-        blocks_data_raw['table_size'] = len(blocks_data_raw.get('blocks', {}))
+        blocks_data_raw['table_size'] = ensure_table(blocks_data_raw).total_slots()
     return created
@@ -0,0 +1,148 @@
+"""
+Chunker: motor de división de archivos en bloques.
+
+Dos modos:
+  - 'fixed': bloques de tamaño fijo `block_size` (comportamiento clásico, 1MB).
+  - 'cdc':   content-defined chunking (FastCDC con gear hash). Los cortes
+             dependen del contenido, así que insertar unos bytes en medio de un
+             archivo grande solo cambia los bloques cercanos; el resto conserva
+             sus cortes (y su hash), lo que hace efectivos la deduplicación y los
+             uploads delta.
+
+Tanto el coordinador como el cliente usan este módulo para producir los mismos
+cortes sobre el mismo contenido.
+
+Coste: en 'cdc' el gear hash se calcula byte a byte en Python (ya se salta
+`min_size` bytes por bloque), unos 7-8 MB/s por hilo. No se puede vectorizar sin
+cambiar los cortes (y con ellos los hashes ya guardados): se probaron variantes
+con `bytes.translate` y enteros grandes por carriles y no mejoran. Para ingesta
+rápida, 'fixed'; 'cdc' cuando importe más la deduplicación que el throughput.
+"""
+import hashlib
+import random
+
+MODE_FIXED = 'fixed'
+MODE_CDC = 'cdc'
+MODES = (MODE_FIXED, MODE_CDC)
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+# Tabla gear determinista: el mismo contenido debe producir los mismos cortes
+# en cualquier máquina y en cualquier versión del proceso.
+_rng = random.Random(0x5ADF7002)
+GEAR = tuple(_rng.getrandbits(64) for _ in range(256))
+del _rng
+
+
+def _top_bits_mask(bits):
+    bits = max(1, min(63, bits))
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def normalize_config(mode=MODE_FIXED, block_size=None, min_size=None, avg_size=None, max_size=None):
+    """
+    Valida y completa la configuración de chunking. Retorna un dict:
+      {'mode', 'block_size'} en modo fijo, o
+      {'mode', 'min_size', 'avg_size', 'max_size'} en modo cdc.
+    En cdc, por defecto avg=block_size, min=avg/4, max=avg*4.
+    """
+    mode = (mode or MODE_FIXED).lower()
+    if mode not in MODES:
+        raise ValueError(f"modo de chunking desconocido: {mode}")
+    block_size = int(block_size or DEFAULT_BLOCK_SIZE)
+    if block_size <= 0:
+        raise ValueError("block_size debe ser > 0")
+    if mode == MODE_FIXED:
+        return {'mode': MODE_FIXED, 'block_size': block_size}
+
+    avg = int(avg_size or block_size)
+    mn = int(min_size or max(64, avg // 4))
+    mx = int(max_size or avg * 4)
+    if not (0 < mn <= avg <= mx):
+        raise ValueError("se requiere 0 < min_size <= avg_size <= max_size")
+    return {'mode': MODE_CDC, 'min_size': mn, 'avg_size': avg, 'max_size': mx}
+
+
+def max_chunk_size(config):
+    """Tamaño máximo que puede tener un bloque con esta configuración."""
+    return config['block_size'] if config['mode'] == MODE_FIXED else config['max_size']
+
+
+def _iter_fixed(stream, block_size):
+    while True:
+        chunk = stream.read(block_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _cut_point(data, start, end, min_size, avg_size, max_size, mask_s, mask_l):
+    """Devuelve el tamaño del siguiente bloque que empieza en data[start:] (FastCDC normalizado)."""
+    remaining = end - start
+    if remaining <= min_size:
+        return remaining
+    if remaining > max_size:
+        remaining = max_size
+    normal = min(avg_size, remaining)
+    gear = GEAR
+    h = 0
+    i = start + min_size
+    limit = start + normal
+    # Primera fase (hasta avg): máscara más estricta -> cortes menos probables
+    while i < limit:
+        h = ((h << 1) + gear[data[i]]) & _MASK64
+        i += 1
+        if not (h & mask_s):
+            return i - start
+    # Segunda fase (hasta max): máscara más laxa -> cortes más probables
+    limit = start + remaining
+    while i < limit:
+        h = ((h << 1) + gear[data[i]]) & _MASK64
+        i += 1
+        if not (h & mask_l):
+            return i - start
+    return remaining
+
+
+def _iter_cdc(stream, min_size, avg_size, max_size):
+    bits = max(1, avg_size.bit_length() - 1)
+    mask_s = _top_bits_mask(bits + 2)
+    mask_l = _top_bits_mask(bits - 2)
+    read_size = max_size * 4
+    buf = b''
+    eof = False
+    while True:
+        if not eof and len(buf) < max_size:
+            more = stream.read(read_size)
+            if more:
+                buf = buf + more if buf else more
+            else:
+                eof = True
+        if not buf:
+            break
+        if not eof and len(buf) < max_size:
+            continue
+        pos = 0
+        # Consumir todos los bloques completos del buffer (los que no tocan el final
+        # salvo que ya no haya más datos).
+        while pos < len(buf) and (eof or len(buf) - pos >= max_size):
+            n = _cut_point(buf, pos, len(buf), min_size, avg_size, max_size, mask_s, mask_l)
+            yield buf[pos:pos + n]
+            pos += n
+        buf = buf[pos:]
+        if eof and not buf:
+            break
+
+
+def iter_chunks(stream, config=None):
+    """Genera los bloques (bytes) de `stream` según `config` (ver normalize_config)."""
+    config = config or normalize_config()
+    if config['mode'] == MODE_FIXED:
+        return _iter_fixed(stream, config['block_size'])
+    return _iter_cdc(stream, config['min_size'], config['avg_size'], config['max_size'])
+
+
+def block_hash(data):
+    """Hash de contenido de un bloque (hex sha256)."""
+    return hashlib.sha256(data).hexdigest()
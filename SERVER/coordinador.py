@@ -1,29 +1,72 @@
 import socket
+import signal
+import weakref
+import sys
 import threading
 import json
 import os
 import time
+import math
+import tarfile
+import queue
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qs
 from io import BytesIO
+from contextlib import contextmanager
 import node_manager
 import blocks_manager
 import files_manager
 import partitioner
+import chunker
+import upload_sessions
+import profiler
+import block_cache as block_cache_mod
+import replica_selector as replica_selector_mod
+import protocol
+import failure_detector as failure_detector_mod
+import packing
+import block_gc
+import staging
+import listing
+import json_stream
+import persistence
+import metadata_store
 import base64
+import log_manager as log
 
 # --- Configuración ---
 COORD_HOST = "0.0.0.0"   # Escucha en todas las interfaces de red
 COORD_PORT = 5000        # Puerto TCP del coordinador (para REGISTER_NODE)
 DISCOVERY_PORT = 5001    # Puerto UDP para descubrimiento automático
 HTTP_PORT = 8000        # Puerto HTTP para API (UI)
-
-# Tabla de nodos registrados: node_id -> {ip, port, conexión}
-nodos_registrados = {}
+# 'cdc' recorre el gear hash byte a byte en Python puro: ~7-8 MB/s por upload (medido con 8 MB
+# aleatorios y bloques de 1MB), muy por debajo de la red. Con 'fixed' el corte es gratis.
+CHUNKING_MODE = os.environ.get('SADTF_CHUNKING', chunker.MODE_FIXED)          # 'fixed' o 'cdc' (content-defined)
+BLOCK_SIZE = int(os.environ.get('SADTF_BLOCK_SIZE_KB', '1024')) * 1024         # Tamaño de bloque (fijo) o promedio (cdc)
+SLOT_SIZE = int(os.environ.get('SADTF_SLOT_SIZE_KB', '1024')) * 1024           # Granularidad de la tabla de bloques por nodo
+UPLOAD_SESSION_TTL = int(os.environ.get('SADTF_UPLOAD_TTL', str(24 * 3600)))  # Segundos sin actividad antes de borrar un upload por partes
+BLOCK_CACHE_MB = int(os.environ.get('SADTF_BLOCK_CACHE_MB', '256'))  # Presupuesto de la caché de bloques (0 = desactivada)
+PERSIST_INTERVAL = float(os.environ.get('SADTF_PERSIST_INTERVAL', '1.0'))  # Segundos máximos entre escrituras de una misma tabla de metadata
+PACK_THRESHOLD = int(os.environ.get('SADTF_PACK_THRESHOLD_KB', '64')) * 1024     # Archivos de hasta este tamaño se empaquetan (0 = desactivado)
+PACK_MAX_AGE = float(os.environ.get('SADTF_PACK_MAX_AGE', '10'))                  # Segundos máximos que un pack queda abierto antes de sellarse
+PACK_COMPACT_RATIO = float(os.environ.get('SADTF_PACK_COMPACT_RATIO', '0.5'))     # Compactar packs con menos de esta fracción de datos vivos
+GC_INTERVAL = float(os.environ.get('SADTF_GC_INTERVAL', '30'))                    # Segundos entre reintentos del GC de bloques borrados
+STAGING_MAX_MB = int(os.environ.get('SADTF_STAGING_MAX_MB', '512'))                 # Tope del área de staging en temp (0 = expulsar tras replicar)
+PIPELINE_DEPTH = int(os.environ.get('SADTF_PIPELINE_DEPTH', '8'))                 # Bloques en vuelo entre etapas del upload en streaming
+LISTING_CACHE_MB = int(os.environ.get('SADTF_LISTING_CACHE_MB', '64'))            # Caché de respuestas ya codificadas de /blocks y /files
+BULK_WORKERS = int(os.environ.get('SADTF_BULK_WORKERS', str(min(8, os.cpu_count() or 2))))  # Hilos que dividen archivos en /upload/bulk
+
+# Tabla de nodos registrados: node_id -> {ip, port, capacity, status, last_seen}, con
+# índices por IP y estado y snapshots para lectores sin lock (ver node_manager.NodeRegistry)
+nodos_registrados = node_manager.NodeRegistry()
+NODES_USED_MAX_AGE = 1.0   # segundos que /nodes puede servir el 'used' de cada nodo desde caché
 conexiones_activas = {}  # node_id -> socket conexión TCP
 last_pong = {}  # node_id -> timestamp del último PONG recibido
-nodes_persistent_file = os.path.join(os.path.dirname(__file__), 'info', 'nodes_data.json')
-blocks_persistent_file = os.path.join(os.path.dirname(__file__), 'info', 'blocks_data.json')
+node_readahead_stats = {}  # node_id -> estadísticas de la caché read-ahead reportadas en el PONG
+node_features = {}  # node_id -> capacidades anunciadas en REGISTER_NODE (p.ej. {'batch'})
 
 # Tabla de bloques global
 blocks_store = {}
@@ -31,14 +74,55 @@ blocks_store = {}
 # Índice persistente de archivos subidos
 files_store = {'files': {}}
 
+# Caché LRU de bloques para descargas (clave: block_id primario)
+block_cache = block_cache_mod.BlockCache(BLOCK_CACHE_MB * 1024 * 1024)
+
+# RTT, peticiones en curso y throughput por nodo para elegir réplica en las lecturas
+replica_selector = replica_selector_mod.ReplicaSelector()
+
+# Detector de fallos phi-accrual sobre los PONG (intervalo = el del monitor de conexiones)
+MONITOR_INTERVAL = 5
+failure_detector = failure_detector_mod.PhiAccrualDetector(expected_interval=MONITOR_INTERVAL)
+
+# Borrados de bloques pendientes de confirmar por los nodos (tombstones) y ficheros
+# locales del coordinador por borrar; el hilo block_gc_loop los procesa fuera del lock
+delete_queue = block_gc.DeleteQueue()
+gc_wakeup = threading.Event()
+gc_local_paths = deque()
+
+# Área de staging de los uploads (se inicializa en main) y STORE_BLOCK_ACK por aplicar:
+# el hilo lector del nodo solo encola (node_id, block_id), block_gc_loop marca los
+# bloques como duraderos y expulsa de temp los archivos ya replicados
+staging_area = None
+# Últimos cuerpos de /blocks y /files por query y versión de tabla (ver json_stream.PayloadCache)
+listing_cache = json_stream.PayloadCache(LISTING_CACHE_MB * 1024 * 1024)
+durable_acks = deque()
+_staging_warned = False   # aviso de tope superado con datos sin replicar (una vez hasta que se recupere)
+
+# Sesiones de upload reanudable por partes (se inicializa en main)
+upload_sessions_mgr = None
+
+# Pack abierto para archivos pequeños (se inicializa en main) y aviso al hilo que sella/compacta
+pack_writer = None
+pack_wakeup = threading.Event()
+pack_stats = {'seals': 0, 'compactions': 0, 'seal_failures': 0}
+_seal_failed = set()   # packs cuyo último sellado falló (para no repetir el aviso en cada pasada)
+
+# Duración de cada fase del arranque en segundos (GET /admin/startup)
+startup_timings = {}
+
 # Estructura para esperar respuestas de bloques solicitados a nodos
-pending_block_responses = {}  # (node_id, block_id) -> {'event': Event, 'data': bytes or None, 'error': str or None}
+pending_requests = {}  # req_id -> {'event': Event, 'node_id': str, 'response': dict or None}
 pending_lock = threading.Lock()
 
 # Contador simple para generar nombres nodo1, nodo2, nodo3, ...
 next_node_number = 1
 lock_nodos = threading.Lock()   # Para modificar contador/tablas de forma segura
 
+# Persistencia diferida: los handlers marcan tablas como sucias y un hilo las escribe
+# agrupando los cambios (como mucho una escritura por tabla cada PERSIST_INTERVAL)
+persistence_svc = persistence.PersistenceService(PERSIST_INTERVAL)
+
 
 def obtener_ip_servidor():
     """
@@ -70,53 +154,71 @@ def load_persistent_nodes():
             next_node_number = node_manager.compute_next_node_number(nodos_registrados)
         except Exception:
             pass
-        print(f"[NODE_MANAGER] Cargados {len(nodos_registrados)} nodos persistentes")
+        log.info(f"[NODE_MANAGER] Cargados {len(nodos_registrados)} nodos persistentes")
     except Exception as e:
-        print(f"[NODE_MANAGER] Error cargando nodos: {e}")
+        log.error(f"[NODE_MANAGER] Error cargando nodos: {e}")
 
 
-def save_persistent_nodes():
-    """Wrapper que delega a node_manager para guardar nodos persistentes."""
+@contextmanager
+def _startup_phase(name):
+    """Cronometra una fase del arranque (se acumula en startup_timings)."""
+    t0 = time.perf_counter()
     try:
-        node_manager.save_persistent_nodes(nodos_registrados)
-    except Exception as e:
-        print(f"[NODE_MANAGER] Error guardando nodos: {e}")
+        yield
+    finally:
+        startup_timings[name] = round(time.perf_counter() - t0, 4)
+
+
+def _snapshot_nodes():
+    # Se llama con lock_nodos tomado (ver persistence_svc)
+    return {nid: dict(info) for nid, info in nodos_registrados.items()}
+
+
+persistence_svc.register('nodes', _snapshot_nodes, lambda data: metadata_store.get_store().save_nodes(data), lock_nodos)
+persistence_svc.register('blocks', lambda: blocks_manager.snapshot_blocks(blocks_store),
+                         lambda data: metadata_store.get_store().save_blocks(data), lock_nodos)
+# El índice de archivos se copia por tandas, tomando lock_nodos en cada una (ver snapshot_files)
+persistence_svc.register('files', lambda: files_manager.snapshot_files(files_store, lock=lock_nodos),
+                         lambda data: metadata_store.get_store().save_files(data))
 
 
 # Delegar funciones de bloques
 load_persistent_blocks = blocks_manager.load_persistent_blocks
-save_persistent_blocks = blocks_manager.save_persistent_blocks
 update_blocks_for_node = blocks_manager.update_blocks_for_node
 set_node_blocks_unavailable = blocks_manager.set_node_blocks_unavailable
 set_node_blocks_available = blocks_manager.set_node_blocks_available
 raw_blocks_to_ui = blocks_manager.raw_to_ui_struct
 assign_blocks_to_file = blocks_manager.assign_blocks_to_file
 free_blocks = blocks_manager.free_blocks
+mark_blocks_deleting = blocks_manager.mark_blocks_deleting
+mark_block_durable = blocks_manager.mark_block_durable
+confirm_block_deleted = blocks_manager.confirm_block_deleted
 assign_and_copy_blocks = blocks_manager.assign_and_copy_blocks
 replicate_blocks_to_node = blocks_manager.replicate_blocks_to_node
 
 
-def split_file_to_blocks(file_data, dest_dir, block_size=1024*1024):
+def split_file_to_blocks(file_data, dest_dir, block_size=1024*1024, chunking=None, block_prefix=None):
     """
-    Divide un archivo en bloques de 1MB y los guarda en dest_dir.
-    Retorna metadata con la lista de bloques creados.
+    Divide un archivo en bloques y los guarda en dest_dir.
+    `chunking` es una configuración de chunker.normalize_config (por defecto,
+    bloques fijos de `block_size`). Los bloques se nombran `<block_prefix>.partNNN`
+    (por defecto, el nombre del archivo sin extensión). Retorna metadata con la
+    lista de bloques creados.
     """
     os.makedirs(dest_dir, exist_ok=True)
+    config = chunking or chunker.normalize_config(chunker.MODE_FIXED, block_size)
     
     # Obtener nombre original
     filename = getattr(file_data, 'filename', 'archivo') if hasattr(file_data, 'filename') else 'archivo'
+    base = block_prefix or os.path.splitext(filename)[0]
     
     blocks = []
     block_index = 0
     total_size = 0
     
-    while True:
-        chunk = file_data.read(block_size)
-        if not chunk:
-            break
-        
+    for chunk in chunker.iter_chunks(file_data, config):
         block_index += 1
-        block_name = f"{os.path.splitext(filename)[0]}.part{block_index:03d}"
+        block_name = f"{base}.part{block_index:03d}"
         block_path = os.path.join(dest_dir, block_name)
         
         with open(block_path, 'wb') as f:
@@ -126,6 +228,7 @@ def split_file_to_blocks(file_data, dest_dir, block_size=1024*1024):
         blocks.append({
             'block_name': block_name,
             'size': len(chunk),
+            'hash': chunker.block_hash(chunk),
             'path': block_path,
             'index': block_index
         })
@@ -135,10 +238,11 @@ def split_file_to_blocks(file_data, dest_dir, block_size=1024*1024):
         'original_filename': filename,
         'total_blocks': block_index,
         'total_size': total_size,
+        'chunking': config,
         'blocks': blocks
     }
     
-    metadata_path = os.path.join(dest_dir, f"{os.path.splitext(filename)[0]}_blocks.json")
+    metadata_path = os.path.join(dest_dir, f"{base}_blocks.json")
     with open(metadata_path, 'w', encoding='utf-8') as f:
         json.dump(metadata, f, indent=2)
     
@@ -154,7 +258,7 @@ def discovery_server():
     global next_node_number
 
     ip_servidor = obtener_ip_servidor()
-    print(f"[DISCOVERY] Usando IP servidor: {ip_servidor}")
+    log.info(f"[DISCOVERY] Usando IP servidor: {ip_servidor}")
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
@@ -162,26 +266,19 @@ def discovery_server():
     except Exception:
         pass
     sock.bind(("", DISCOVERY_PORT))  # Escucha en DISCOVERY_PORT en cualquier interfaz
-    print(f"[DISCOVERY] Escuchando broadcast UDP en puerto {DISCOVERY_PORT}...")
+    log.info(f"[DISCOVERY] Escuchando broadcast UDP en puerto {DISCOVERY_PORT}...")
 
     while True:
         data, addr = sock.recvfrom(1024)
         mensaje = data.decode().strip()
         client_ip = addr[0]
-        print(f"[DISCOVERY] Mensaje '{mensaje}' desde {addr}")
+        log.info(f"[DISCOVERY] Mensaje '{mensaje}' desde {addr}")
 
         if mensaje == "DISCOVER_COORDINATOR":
             # Si ya tenemos un nodo registrado con esa IP, devolvemos el mismo node_id
-            with lock_nodos:
-                existing = None
-                for nid, info in nodos_registrados.items():
-                    if info.get('ip') == client_ip:
-                        existing = nid
-                        break
-
-                if existing:
-                    node_id = existing
-                else:
+            node_id = nodos_registrados.node_for_ip(client_ip)
+            if node_id is None:
+                with lock_nodos:
                     node_id = f"nodo{next_node_number}"
                     next_node_number += 1
 
@@ -192,47 +289,34 @@ def discovery_server():
             }
 
             sock.sendto(json.dumps(respuesta).encode(), addr)
-            print(f"[DISCOVERY] Asignado {node_id} para {addr}")
+            log.info(f"[DISCOVERY] Asignado {node_id} para {addr}")
 
 
-def load_persistent_nodes():
-    try:
-        if os.path.exists(nodes_persistent_file):
-            # Leer de forma robusta: si el archivo está vacío o tiene JSON inválido,
-            # regeneramos la estructura mínima para evitar fallos posteriores.
-            try:
-                with open(nodes_persistent_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    if not content.strip():
-                        data = {'nodos': {}}
-                    else:
-                        data = json.loads(content)
-            except Exception as e:
-                print(f"[HTTP] Archivo de nodos persistentes corrupto o vacío: {e}. Reiniciando archivo.")
-                data = {'nodos': {}}
-                try:
-                    with open(nodes_persistent_file, 'w', encoding='utf-8') as f:
-                        json.dump(data, f, indent=2)
-                except Exception as e2:
-                    print(f"[HTTP] Error al regenerar {nodes_persistent_file}: {e2}")
-            with lock_nodos:
-                nodos_registrados.update(data.get('nodos', {}))
-            # Ajustar next_node_number para evitar colisiones
-            global next_node_number
-            max_n = 0
-            for nid in nodos_registrados.keys():
-                if nid.startswith('nodo'):
-                    try:
-                        n = int(nid[4:])
-                        if n > max_n: max_n = n
-                    except Exception:
-                        pass
-            next_node_number = max_n + 1
-            print(f"[HTTP] Cargados {len(nodos_registrados)} nodos desde disco. next_node_number={next_node_number}")
-    except Exception as e:
-        print(f"[HTTP] Error cargando nodos persistentes: {e}")
+# Un lock de envío por socket: varios hilos (monitor, handlers HTTP, reenvíos)
+# escriben en la misma conexión y un sendall grande no debe intercalarse con otro
+_send_locks = weakref.WeakKeyDictionary()
+_send_locks_guard = threading.Lock()
+
+
+def _send_bytes(sock, payload):
+    with _send_locks_guard:
+        lock = _send_locks.get(sock)
+        if lock is None:
+            lock = _send_locks[sock] = threading.Lock()
+    with lock:
+        sock.sendall(payload)
 
 
+def send_json(sock, obj, reply_to=None):
+    """
+    Envía `obj` como un mensaje (una línea JSON, ver protocol.py) por la conexión de un nodo.
+    Si es la respuesta a `reply_to` repite su `req_id`; si no, lleva uno nuevo.
+    """
+    if reply_to is not None:
+        obj = dict(obj, req_id=reply_to.get('req_id'))
+    elif 'req_id' not in obj:
+        obj = dict(obj, req_id=protocol.new_req_id())
+    _send_bytes(sock, protocol.encode(obj))
 
 
 def _broadcast_event(event_obj, exclude_node=None):
@@ -247,9 +331,9 @@ def _broadcast_event(event_obj, exclude_node=None):
             if exclude_node and nid == exclude_node:
                 continue
             try:
-                sock.sendall(json.dumps(event_obj).encode())
+                send_json(sock, event_obj)
             except Exception as e:
-                print(f"[BROADCAST] Error enviando a {nid}: {e}. Se eliminará la conexión.")
+                log.error(f"[BROADCAST] Error enviando a {nid}: {e}. Se eliminará la conexión.")
                 remove_list.append(nid)
 
         for nid in remove_list:
@@ -260,11 +344,57 @@ def _broadcast_event(event_obj, exclude_node=None):
             if nid in nodos_registrados:
                 # Marcar offline (persistir fuera del lock)
                 nodos_registrados[nid]['status'] = 'offline'
-                print(f"[BROADCAST] Nodo {nid} marcado offline tras fallo de envío.")
+                log.warning(f"[BROADCAST] Nodo {nid} marcado offline tras fallo de envío.")
                 changed = True
 
     if changed:
-        save_persistent_nodes()
+        persistence_svc.mark_dirty('nodes')
+
+
+def request_from_node(node_id, msg, timeout=6):
+    """
+    Envía `msg` al nodo y espera la respuesta con su mismo `req_id`.
+    Varias peticiones al mismo nodo pueden estar en curso a la vez.
+    Retorna el mensaje de respuesta o None (nodo no conectado, error de envío o timeout).
+    """
+    req_id = protocol.new_req_id()
+    ent = {'event': threading.Event(), 'node_id': node_id, 'block_id': msg.get('block_id'), 'response': None}
+    with pending_lock:
+        pending_requests[req_id] = ent
+    try:
+        sock = conexiones_activas.get(node_id)
+        if not sock:
+            return None
+        try:
+            send_json(sock, dict(msg, req_id=req_id))
+        except Exception as e:
+            log.error(f"[REQUEST] Error enviando {msg.get('type')} a {node_id}: {e}")
+            return None
+        ent['event'].wait(timeout)
+        return ent['response']
+    finally:
+        with pending_lock:
+            pending_requests.pop(req_id, None)
+
+
+def _resolve_pending(node_id, msg):
+    """
+    Entrega una respuesta (BLOCK_DATA, STORE_BLOCK_ACK) a la petición que la espera.
+    Los nodos antiguos no repiten `req_id`: para ellos se busca por (nodo, block_id).
+    Retorna False si nadie la esperaba (p.ej. llegó después del timeout).
+    """
+    req_id = msg.get('req_id')
+    with pending_lock:
+        ent = pending_requests.get(req_id) if req_id is not None else None
+        if ent is None and req_id is None:
+            bid = msg.get('block_id')
+            ent = next((e for e in pending_requests.values()
+                        if e['node_id'] == node_id and e['response'] is None and e.get('block_id') == bid), None)
+        if ent is None or ent['node_id'] != node_id:
+            return False
+        ent['response'] = msg
+    ent['event'].set()
+    return True
 
 
 def request_block_from_node(node_id, block_id, block_name=None, timeout=6):
@@ -272,192 +402,1455 @@ def request_block_from_node(node_id, block_id, block_name=None, timeout=6):
     Solicita a un nodo conectado que envíe un bloque (por nombre). Espera respuesta BLOCK_DATA.
     Retorna bytes o None si fallo.
     """
-    key = (node_id, block_id)
-    ev = threading.Event()
-    with pending_lock:
-        pending_block_responses[key] = {'event': ev, 'data': None, 'error': None}
+    resp = request_from_node(node_id, {'type': 'REQUEST_BLOCK', 'block_id': block_id, 'block_name': block_name},
+                             timeout=timeout)
+    if not resp or resp.get('error') or not resp.get('data_b64'):
+        return None
+    try:
+        return base64.b64decode(resp['data_b64'].encode('ascii'))
+    except Exception:
+        return None
+
+
+def request_blocks_from_node(node_id, items, timeout=8):
+    """
+    Pide varios bloques al nodo en un único REQUEST_BLOCKS.
+    `items`: lista de (block_id, block_name). Retorna {block_id: bytes} con los que llegaron.
+    """
+    resp = request_from_node(node_id, {'type': 'REQUEST_BLOCKS',
+                                       'blocks': [{'block_id': bid, 'block_name': name} for bid, name in items]},
+                             timeout=timeout)
+    result = {}
+    for b in (resp or {}).get('blocks', []) or []:
+        if b.get('error') or not b.get('data_b64'):
+            continue
+        try:
+            result[b.get('block_id')] = base64.b64decode(b['data_b64'].encode('ascii'))
+        except Exception:
+            pass
+    return result
+
+
+def _supports_batch(node_id):
+    return protocol.FEATURE_BATCH in node_features.get(node_id, ())
+
+
+def _new_store_batcher():
+    return protocol.StoreBatcher(send_json, _supports_batch)
+
+
+def _log_batch_errors(batcher, tag):
+    for nid, bids, e in batcher.errors:
+        log.warning(f"[{tag}] No se pudieron enviar {len(bids)} bloques a {nid}: {e}")
+
 
-    # Construir mensaje
-    msg = {'type': 'REQUEST_BLOCK', 'block_id': block_id, 'block_name': block_name}
-    sent = False
+def _block_sources(placement):
+    """
+    Lista de (node_id, block_id, remote_name) que tienen una copia del bloque
+    descrito por `placement` (primario primero, luego réplicas).
+    """
+    sources = []
+    raw = blocks_store.get('blocks', {})
+    ids = [placement.get('primary_block_id')] + list(placement.get('replica_block_ids', []) or [])
+    for bid in ids:
+        blk = raw.get(bid) if bid else None
+        if not blk:
+            continue
+        holders = list(blk.get('stored_on_list', []) or [])
+        if blk.get('stored_on') and blk.get('stored_on') not in holders:
+            holders.insert(0, blk.get('stored_on'))
+        for nid in holders:
+            sources.append((nid, bid, blk.get('remote_name')))
+    return sources
+
+
+def _block_cache_key(file_id, index, binfo):
+    """
+    Clave de block_cache: (file_id, nombre del bloque). No se usa el id del slot
+    (`N3042`): el GC reutiliza el slot al liberarlo, y una lectura en curso del
+    archivo borrado podría dejar sus bytes bajo el id del slot de otro archivo.
+    """
+    return file_id, binfo.get('block_name') or index
+
+
+def read_file_block(file_id, entry, index, exclude=None):
+    """
+    Devuelve los bytes del bloque `index` (1-based) del archivo, o None.
+    Orden: caché en memoria -> fichero local en staging -> nodos que guardan una
+    copia (salvo el nodo `exclude`). Los archivos empaquetados se leen como un
+    rango del bloque de su pack.
+    """
+    if entry.get('pack'):
+        return _read_packed(file_id, entry) if index == 1 else None
+    meta = entry.get('meta', {}) or {}
+    blocks_meta = meta.get('blocks', []) or []
+    placement = None
+    for p in entry.get('placements', []) or []:
+        if p.get('file_block_index') == index:
+            placement = p
+            break
+    binfo = blocks_meta[index - 1] if 1 <= index <= len(blocks_meta) else {}
+    cache_key = _block_cache_key(file_id, index, binfo)
+    data = block_cache.get(cache_key)
+    if data is not None:
+        return data
+
+    path_b = binfo.get('path')
+    if path_b:
+        # La copia en staging puede expulsarse entre la comprobación y la lectura
+        try:
+            with open(path_b, 'rb') as bf:
+                data = bf.read()
+            if staging_area is not None:
+                staging_area.touch(file_id)
+        except OSError:
+            data = None
+    if data is None and placement:
+        with lock_nodos:
+            sources = [s for s in _block_sources(placement) if s[0] in conexiones_activas and s[0] != exclude]
+        # Probar primero la copia con menor coste estimado (RTT, carga y throughput del nodo).
+        # Mientras queden otras copias el timeout se ajusta a lo esperado para ese nodo,
+        # así un nodo lento u ocupado no retiene la lectura
+        size = binfo.get('size') or BLOCK_SIZE
+        ranked = replica_selector.rank(sources, size)
+        for k, (nid, bid, remote_name) in enumerate(ranked):
+            timeout = replica_selector.timeout_for(nid, size) if k < len(ranked) - 1 else 8
+            started = replica_selector.begin(nid)
+            data = request_block_from_node(nid, bid, block_name=remote_name or binfo.get('block_name'), timeout=timeout)
+            replica_selector.end(nid, started, len(data) if data else 0, ok=bool(data))
+            if data:
+                break
+            log.warning(f"[READ] Sin respuesta de {nid} para {bid} en {timeout:.1f}s, probando otra copia")
+
+    if data is not None:
+        block_cache.put(cache_key, data)
+    return data
+
+
+def _read_packed(file_id, entry, retry=True):
+    """Bytes de un archivo empaquetado: su rango dentro del pack (local o pidiendo el bloque del pack)."""
+    ref = entry['pack']
+    with lock_nodos:
+        pack = files_store['files'].get(ref['pack_id'])
+    data = None
+    if pack:
+        path = packing.pack_path(pack)
+        if path:
+            # Copia local del pack (abierto, o sellado y aún en staging)
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(ref['offset'])
+                    data = f.read(ref['length'])
+                if staging_area is not None:
+                    staging_area.touch(ref['pack_id'])
+            except OSError:
+                data = None
+        if data is None:
+            blob = read_file_block(ref['pack_id'], pack, 1)
+            if blob is not None:
+                data = blob[ref['offset']:ref['offset'] + ref['length']]
+    if data is not None and len(data) == ref['length']:
+        return data
+    # Una compactación pudo mover el archivo a otro pack mientras se leía
+    if retry:
+        with lock_nodos:
+            current = files_store['files'].get(file_id)
+        if current and current.get('pack') and current['pack'] != ref:
+            return _read_packed(file_id, current, retry=False)
+    return None
+
+
+def prefetch_small_blocks(file_id, entry, start):
+    """
+    Descarga de muchos bloques pequeños: a partir del bloque `start` reúne los
+    siguientes bloques pequeños que no están en caché ni en temp (hasta un lote
+    de protocol.BATCH_MAX_BYTES), los agrupa por la copia con menor coste y los
+    pide con un REQUEST_BLOCKS por nodo. Retorna ({índice: bytes}, siguiente
+    índice por revisar); lo que falte lo lee después read_file_block.
+    """
+    meta = entry.get('meta', {}) or {}
+    blocks_meta = meta.get('blocks', []) or []
+    total = meta.get('total_blocks', len(blocks_meta))
+    placements = {p.get('file_block_index'): p for p in entry.get('placements', []) or []}
+    groups = {}     # nid -> [(índice, block_id, nombre)]
+    acc = 0
+    index = start
+    with lock_nodos:
+        while index <= total:
+            binfo = blocks_meta[index - 1] if index <= len(blocks_meta) else {}
+            size = binfo.get('size') or BLOCK_SIZE
+            p = placements.get(index)
+            if not p or size > protocol.BATCH_SMALL_BLOCK or acc + size > protocol.BATCH_MAX_BYTES:
+                break
+            acc += size
+            index += 1
+            if _block_cache_key(file_id, index, binfo) in block_cache or (binfo.get('path') and os.path.exists(binfo['path'])):
+                continue
+            sources = [s for s in _block_sources(p) if s[0] in conexiones_activas and _supports_batch(s[0])]
+            if sources:
+                nid, bid, remote_name = replica_selector.rank(sources, size)[0]
+                groups.setdefault(nid, []).append((index - 1, bid, remote_name or binfo.get('block_name'), binfo))
+    result = {}
+    for nid, items in groups.items():
+        if len(items) < 2:
+            continue
+        started = replica_selector.begin(nid)
+        got = request_blocks_from_node(nid, [(bid, name) for _, bid, name, _ in items])
+        replica_selector.end(nid, started, sum(len(d) for d in got.values()), ok=bool(got))
+        for idx, bid, _, binfo in items:
+            data = got.get(bid)
+            if data is not None:
+                result[idx] = data
+                block_cache.put(_block_cache_key(file_id, idx, binfo), data)
+    return result, max(index, start + 1)
+
+
+def send_pending_blocks(node_id):
+    """
+    Envía por TCP a `node_id` las copias asignadas a ese nodo que todavía no
+    confirmó (sin STORE_BLOCK_ACK del nodo, el bloque no es 'durable').
+    El origen es la copia en staging o, si ya se expulsó, otra copia leída de un
+    nodo conectado. La lista se arma bajo el lock; las lecturas (que pueden
+    esperar a otro nodo) y los envíos se hacen fuera. Actualiza `blocks_store`.
+    """
     try:
         with lock_nodos:
             sock = conexiones_activas.get(node_id)
             if not sock:
-                return None
-            sock.sendall(json.dumps(msg).encode())
-            sent = True
+                log.info(f"[PENDING] No hay conexión activa para {node_id}")
+                return 0
+            raw = blocks_store.get('blocks', {})
+            work = []   # (file_id, entrada, índice, block_id, es_réplica)
+            for fid, fentry in files_store.get('files', {}).items():
+                for p in fentry.get('placements', []) or []:
+                    idx = p.get('file_block_index', 0)
+                    copies = [(p.get('primary_block_id'), p.get('primary_node'), False)]
+                    copies += [(rid, rnode, True) for rid, rnode in
+                               zip(p.get('replica_block_ids', []) or [], p.get('replica_nodes', []) or [])]
+                    for bid, nid, is_replica in copies:
+                        if nid == node_id and bid and not (raw.get(bid) or {}).get('durable'):
+                            work.append((fid, fentry, idx, bid, is_replica))
+        if not work:
+            return 0
+
+        sent = []       # (block_id, es_réplica, block_name)
+        missing = 0
+        # Los bloques pequeños hacia el nodo viajan agrupados en STORE_BLOCKS
+        batcher = _new_store_batcher()
+        for fid, fentry, idx, bid, is_replica in work:
+            blocks_meta = (fentry.get('meta') or {}).get('blocks', []) or []
+            src_info = blocks_meta[idx - 1] if 1 <= idx <= len(blocks_meta) else {}
+            try:
+                data_b = read_file_block(fid, fentry, idx, exclude=node_id)
+            except Exception as e:
+                log.error(f"[PENDING] Error leyendo {bid} (file {fid}): {e}")
+                data_b = None
+            if data_b is None:
+                missing += 1
+                log.warning(f"[PENDING] Origen no disponible para {bid} (file {fid}): ni en staging ni en otro nodo")
+                continue
+            msg = {
+                'type': 'STORE_BLOCK',
+                'file_id': fid,
+                'block_id': bid,
+                'block_name': src_info.get('block_name'),
+                'is_replica': is_replica,
+                'data_b64': base64.b64encode(data_b).decode('ascii')
+            }
+            batcher.add(node_id, sock, msg, len(data_b))
+            sent.append((bid, is_replica, src_info.get('block_name')))
+        batcher.flush()
+        _log_batch_errors(batcher, 'PENDING')
+
+        if sent:
+            with lock_nodos:
+                for bid, is_replica, block_name in sent:
+                    blk = blocks_store['blocks'].get(bid)
+                    if blk is None:
+                        continue
+                    if not is_replica:
+                        blk['stored_on'] = node_id
+                    stored_list = list(blk.get('stored_on_list', []) or [])
+                    if node_id not in stored_list:
+                        stored_list.append(node_id)
+                        blk['stored_on_list'] = stored_list
+                    blk['remote_name'] = block_name
+            persistence_svc.mark_dirty('blocks')
+        log.info(f"[PENDING] Enviados {len(sent)} bloques pendientes a {node_id} en {batcher.messages} mensajes"
+                 + (f", {missing} sin origen disponible" if missing else ""))
+        return len(sent)
     except Exception as e:
-        print(f"[REQUEST_BLOCK] Error enviando request a {node_id}: {e}")
+        log.error(f"[PENDING] Error general al enviar pendientes a {node_id}: {e}")
+        return 0
 
-    # esperar respuesta
-    if not sent:
-        with pending_lock:
+
+def store_file_blocks(file_id, filename, metadata, uploader_node=None, allow_pack=True):
+    """
+    Coloca y distribuye los bloques ya divididos de un archivo (descritos en
+    `metadata`, con rutas en temp) y registra el archivo en el índice.
+    Los archivos pequeños se empaquetan en el pack abierto en vez de ocupar un
+    slot propio. Retorna (ok, http_status, mensaje).
+    """
+    if allow_pack and _should_pack(metadata):
+        return _store_packed_file(file_id, filename, metadata, uploader_node)
+    return store_files_blocks([(file_id, filename, metadata)], uploader_node)
+
+
+def store_files_blocks(items, uploader_node=None):
+    """
+    Coloca y distribuye los bloques de un lote de archivos `items` =
+    [(file_id, filename, metadata), ...] y los registra en el índice.
+    Una sola llamada al Partitioner para todo el lote (bajo el lock), un solo
+    batcher para los envíos (los bloques pequeños hacia un mismo nodo viajan
+    juntos aunque sean de archivos distintos) y un solo registro en el índice.
+    Retorna (ok, http_status, mensaje); si no hay espacio no se registra ninguno.
+    """
+    sizes_by_file = [[b.get('size', 0) for b in metadata.get('blocks', [])] for _, _, metadata in items]
+    all_sizes = [size for sizes in sizes_by_file for size in sizes]
+    # Calcular y aplicar placements bajo el lock: dos uploads concurrentes no deben
+    # recibir los mismos slots libres.
+    with lock_nodos:
+        # Calcular placements usando el Partitioner (no persiste cambios)
+        try:
+            part = partitioner.Partitioner(replication=2)
+            ok, placements, msg = part.allocate_blocks_for_file(len(all_sizes), nodos_registrados, blocks_store,
+                                                                block_sizes=all_sizes, slot_size=SLOT_SIZE)
+            if not ok:
+                # No hay recursos para asignar réplicas/primarios
+                return False, 500, f'No se pudo asignar bloques: {msg}'
+        except Exception as e:
+            log.error(f"[PARTITION] Error calculando placements: {e}")
+            return False, 500, 'Error interno en particionador'
+
+        # Repartir los placements del lote entre sus archivos (índices 1-based por archivo)
+        per_file = []
+        pos = 0
+        for sizes in sizes_by_file:
+            chunk = placements[pos:pos + len(sizes)]
+            for k, p in enumerate(chunk, 1):
+                p['file_block_index'] = k
+            per_file.append(chunk)
+            pos += len(sizes)
+
+        # Aplicar las asignaciones a la tabla global de bloques (marcar primarios/replicas)
+        try:
+            changed = False
+            for (file_id, _, _), chunk, sizes in zip(items, per_file, sizes_by_file):
+                changed = assign_blocks_to_file(blocks_store, file_id, chunk, block_sizes=sizes) or changed
+        except Exception as e:
+            log.error(f"[BLOCKS] Error asignando bloques: {e}")
+            return False, 500, 'Error asignando bloques en tabla global'
+    if changed:
+        persistence_svc.mark_dirty('blocks')
+
+    # Enviar los bloques a los nodos correspondientes por TCP (si están conectados).
+    # Los bloques pequeños que van al mismo nodo se agrupan en mensajes STORE_BLOCKS
+    batcher = _new_store_batcher()
+    try:
+        for (file_id, _, metadata), chunk in zip(items, per_file):
+            _send_file_blocks(batcher, file_id, metadata, chunk, uploader_node)
+        batcher.flush()
+        _log_batch_errors(batcher, 'BLOCKS')
+        # Persistir cambios de stored_on/remote_name
+        persistence_svc.mark_dirty('blocks')
+    except Exception as e:
+        log.error(f"[BLOCKS] Error al enviar bloques a nodos: {e}")
+
+    # Registrar metadatos de los archivos en el índice persistente (incluye placements)
+    _register_files([(file_id, filename, metadata, chunk) for (file_id, filename, metadata), chunk in zip(items, per_file)],
+                    uploader_node)
+
+    return True, 200, 'OK'
+
+
+def _register_files(rows, uploader_node=None):
+    """
+    Registra en el índice los archivos ya colocados, `rows` =
+    [(file_id, filename, metadata, placements), ...], y cuenta en staging sus
+    copias locales.
+    """
+    try:
+        now = time.time()
+        with lock_nodos:
+            for file_id, filename, metadata, placements in rows:
+                entry = {
+                    'file_id': file_id,
+                    'original_filename': filename,
+                    'uploader_node': uploader_node,
+                    'uploaded_at': now,
+                    'meta': metadata,
+                    'placements': placements
+                }
+                prev = files_store['files'].get(file_id)
+                if packing.is_pack(prev):
+                    # Sellado de un pack: conservar sus miembros (alguno pudo borrarse mientras se enviaba)
+                    entry = dict(prev, meta=metadata, placements=placements)
+                files_store['files'][file_id] = entry
+        try:
+            persistence_svc.mark_dirty('files')
+        except Exception as e:
+            log.error(f"[FILES] Error guardando metadatos de archivo: {e}")
+        # Las copias en temp pasan a contar en el área de staging hasta que se repliquen
+        for file_id, _, metadata, _ in rows:
+            _stage_file(file_id, metadata)
+    except Exception as e:
+        log.error(f"[FILES] Error registrando archivo en índice persistente: {e}")
+
+
+def _stage_file(file_id, metadata):
+    """Cuenta en el área de staging los bloques de `metadata` que tienen copia local."""
+    if staging_area is None:
+        return
+    staged = sum(b.get('size', 0) for b in metadata.get('blocks', []) or [] if b.get('path'))
+    if staged:
+        staging_area.add(file_id, staged)
+
+
+def _send_file_blocks(batcher, file_id, metadata, placements, uploader_node=None):
+    """Encola en `batcher` cada copia de los bloques de un archivo hacia su nodo (y al uploader)."""
+    for p in placements:
+        idx = p.get('file_block_index', 0)
+        # obtener info del bloque en metadata (ruta temporal creada por split)
+        try:
+            src_info = metadata.get('blocks', [])[idx - 1]
+        except Exception:
+            src_info = None
+        if not src_info:
+            continue
+        src_path = src_info.get('path')
+        data_b = None
+        if src_path and os.path.exists(src_path):
             try:
-                del pending_block_responses[key]
-            except Exception:
-                pass
-        return None
+                with open(src_path, 'rb') as f:
+                    data_b = f.read()
+            except OSError as e:
+                log.warning(f"[BLOCKS] No se pudo leer {src_path}: {e}")
+        _send_block_copies(batcher, file_id, p, src_info, data_b, uploader_node)
 
-    ev.wait(timeout)
-    with pending_lock:
-        res = pending_block_responses.pop(key, None)
 
-    if not res:
-        return None
-    if res.get('error'):
+def _send_block_copies(sink, file_id, p, src_info, data_b, uploader_node=None):
+    """
+    Encola en `sink` (StoreBatcher o StoreFanOut) las copias de un bloque: primario,
+    réplicas y una copia para el uploader si no es ya uno de ellos. Con `data_b`
+    None (sin origen local) todas quedan pendientes para send_pending_blocks.
+    """
+    block_name = src_info.get('block_name')
+    b64 = base64.b64encode(data_b).decode('ascii') if data_b is not None else None
+
+    def queue_copy(node, block_id, is_replica):
+        if data_b is None or node not in conexiones_activas:
+            return False
+        msg = {
+            'type': 'STORE_BLOCK',
+            'file_id': file_id,
+            'block_id': block_id,
+            'block_name': block_name,
+            'is_replica': is_replica,
+            'data_b64': b64
+        }
+        sink.add(node, conexiones_activas[node], msg, len(data_b))
+        return True
+
+    # Enviar primary al nodo primario si está conectado
+    prim_node = p.get('primary_node')
+    prim_block_id = p.get('primary_block_id')
+    if prim_node and prim_block_id:
+        try:
+            if queue_copy(prim_node, prim_block_id, False):
+                blocks_store['blocks'][prim_block_id]['stored_on'] = prim_node
+                blocks_store['blocks'][prim_block_id]['remote_name'] = block_name
+            else:
+                log.info(f"[BLOCKS] Nodo {prim_node} no conectado. Dejar primary {prim_block_id} pendiente.")
+        except Exception as e:
+            log.warning(f"[BLOCKS] No se pudo enviar primary {prim_block_id} a {prim_node}: {e}")
+
+    # Enviar réplicas
+    for rid, rnode in zip(p.get('replica_block_ids', []), p.get('replica_nodes', [])):
+        if rnode and rid:
+            try:
+                if queue_copy(rnode, rid, True):
+                    # mantener lista de nodos que almacenaron este bloque
+                    blk = blocks_store['blocks'].get(rid, {})
+                    blk.setdefault('stored_on_list', [])
+                    if rnode not in blk['stored_on_list']:
+                        blk['stored_on_list'].append(rnode)
+                    blk['remote_name'] = block_name
+                    blocks_store['blocks'][rid] = blk
+                else:
+                    log.info(f"[BLOCKS] Nodo {rnode} no conectado. Dejar replica {rid} pendiente.")
+            except Exception as e:
+                log.warning(f"[BLOCKS] No se pudo enviar replica {rid} a {rnode}: {e}")
+
+    # Asegurar que el uploader (si existe) reciba también una copia local del bloque,
+    # salvo que ya sea el primario o una de las réplicas
+    if not uploader_node or uploader_node == prim_node or uploader_node in (p.get('replica_nodes') or []):
+        return
+    try:
+        bid_for_meta = prim_block_id or (p.get('replica_block_ids') or [None])[0]
+        if queue_copy(uploader_node, bid_for_meta, False):
+            # registrar en stored_on_list
+            if bid_for_meta and bid_for_meta in blocks_store.get('blocks', {}):
+                blk = blocks_store['blocks'][bid_for_meta]
+                blk.setdefault('stored_on_list', [])
+                if uploader_node not in blk['stored_on_list']:
+                    blk['stored_on_list'].append(uploader_node)
+                blk['remote_name'] = block_name
+                blocks_store['blocks'][bid_for_meta] = blk
+    except Exception as e:
+        log.warning(f"[BLOCKS] No se pudo enviar copia al uploader {uploader_node}: {e}")
+
+
+def _should_pack(metadata):
+    limit = min(PACK_THRESHOLD, SLOT_SIZE)
+    return (pack_writer is not None and limit > 0 and metadata.get('total_blocks') == 1
+            and 0 < metadata.get('total_size', 0) <= limit)
+
+
+def _store_packed_file(file_id, filename, metadata, uploader_node=None):
+    """
+    Añade un archivo pequeño (un solo bloque) al pack abierto y lo registra en el
+    índice con una referencia (pack_id, offset, length) en vez de placements.
+    El pack se coloca y replica al sellarse (ver pack_maintenance).
+    """
+    binfo = metadata['blocks'][0]
+    src_path = binfo.get('path')
+    try:
+        with open(src_path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        log.error(f"[PACK] No se pudo leer el bloque de {file_id}: {e}")
+        return False, 500, 'Error leyendo el bloque temporal'
+    result = _pack_data(file_id, filename, metadata, data, uploader_node)
+    if result[0]:
+        try:
+            os.remove(src_path)
+        except OSError:
+            pass
+        if staging_area is not None:
+            staging_area.remove_dir(file_id)
+    return result
+
+
+def _pack_data(file_id, filename, metadata, data, uploader_node=None):
+    """Escribe `data` en el pack abierto y registra el archivo (ver _store_packed_file)."""
+    # El archivo no tiene fichero propio en temp: sus bytes están en el pack
+    file_meta = dict(metadata, blocks=[{k: v for k, v in metadata['blocks'][0].items() if k != 'path'}])
+    placed = {}
+
+    def register(pack_id, path, offset, is_new):
+        with lock_nodos:
+            pack = files_store['files'].get(pack_id)
+            if pack is None:
+                pack = files_store['files'][pack_id] = packing.new_pack_entry(pack_id, path)
+            packing.add_member(pack, file_id, offset, len(data))
+            placed.update(pack_id=pack_id, offset=offset, length=len(data))
+            files_store['files'][file_id] = {
+                'file_id': file_id,
+                'original_filename': filename,
+                'uploader_node': uploader_node,
+                'uploaded_at': time.time(),
+                'meta': file_meta,
+                'placements': [],
+                'pack': dict(placed),
+            }
+
+    try:
+        closed = pack_writer.append(data, register)
+    except OSError as e:
+        log.error(f"[PACK] Error escribiendo en el pack: {e}")
+        return False, 500, 'Error escribiendo en el pack'
+    persistence_svc.mark_dirty('files')
+    if closed:
+        pack_wakeup.set()
+    log.info(f"[PACK] {file_id} ({len(data)} bytes) empaquetado en {placed['pack_id']} @ {placed['offset']}")
+    return True, 200, 'OK'
+
+
+def _release_file_locked(file_id):
+    """
+    Quita un archivo del índice y deja sus bloques como tombstones para el GC
+    (llamar con lock_nodos; no hace E/S). Si estaba empaquetado, lo descuenta de
+    su pack y libera el pack sellado que se queda sin miembros.
+    Retorna la entrada eliminada o None.
+    """
+    entry = files_store['files'].pop(file_id, None)
+    if not entry:
         return None
-    return res.get('data')
+    persistence_svc.mark_dirty('files')
+    block_ids = []
+    for p in entry.get('placements', []) or []:
+        if p.get('primary_block_id'):
+            block_ids.append(p.get('primary_block_id'))
+        block_ids.extend(p.get('replica_block_ids', []) or [])
+    if block_ids:
+        _tombstone_blocks_locked(block_ids)
+    block_cache.invalidate([_block_cache_key(file_id, i, b) for i, b in
+                            enumerate((entry.get('meta') or {}).get('blocks', []) or [], 1)])
+    # Copias locales en temp (bloques en staging o el fichero del pack) y el directorio de staging
+    for b in (entry.get('meta') or {}).get('blocks', []) or []:
+        if b.get('path'):
+            gc_local_paths.append(b['path'])
+    if staging_area is not None:
+        staging_area.forget(file_id)
+        gc_local_paths.append(staging_area.path_for(file_id))
+
+    ref = entry.get('pack')
+    if ref:
+        pack = files_store['files'].get(ref['pack_id'])
+        if pack:
+            packing.remove_member(pack, file_id)
+            if not pack['members'] and packing.is_sealed(pack):
+                _release_file_locked(ref['pack_id'])
+    if packing.is_pack(entry):
+        _seal_failed.discard(file_id)
+    gc_wakeup.set()
+    return entry
+
+
+def _tombstone_blocks_locked(block_ids):
+    """Marca bloques como 'deleting' y encola su borrado en cada nodo que tiene copia (con lock_nodos)."""
+    marked = mark_blocks_deleting(blocks_store, block_ids)
+    for bid, nodes, remote_name, local_path in marked:
+        for nid in nodes:
+            delete_queue.add(nid, bid, remote_name)
+        if local_path:
+            gc_local_paths.append(local_path)
+    if marked:
+        persistence_svc.mark_dirty('blocks')
+    return len(marked)
+
+
+def _live_block_names(node_ids):
+    """
+    (node_id, remote_name) de las copias vivas en esos nodos: un nombre que aún
+    usa otro bloque (p.ej. dos archivos con el mismo `<base>.partNNN`) no se borra.
+    Llamar con lock_nodos; recorre los slots en uso.
+    """
+    live = set()
+    for b in blocks_store.get('blocks', {}).values():
+        if b.get('status') not in ('occupied', 'replica') or not b.get('remote_name'):
+            continue
+        for nid in [b.get('node'), b.get('stored_on')] + list(b.get('stored_on_list', []) or []):
+            if nid in node_ids:
+                live.add((nid, b.get('remote_name')))
+    return live
+
+
+def _gc_node(node_id, live):
+    """Envía al nodo sus borrados pendientes en lotes DELETE_BLOCKS y libera los slots confirmados."""
+    supports = protocol.FEATURE_DELETE in node_features.get(node_id, ())
+    budget = delete_queue.count(node_id)
+    deleted = freed = 0
+    while budget > 0:
+        items = delete_queue.take(node_id, protocol.DELETE_BATCH_MAX)
+        if not items:
+            break
+        budget -= len(items)
+        confirmed, to_send = [], []
+        for bid, name in items:
+            # Sin nombre remoto nunca llegó a guardarse; con un nombre aún en uso no se borra el fichero.
+            # Un nodo sin soporte de borrado no puede recuperar el disco: solo se libera el slot
+            if not name or (node_id, name) in live or not supports:
+                confirmed.append(bid)
+            else:
+                to_send.append((bid, name))
+        if to_send:
+            resp = request_from_node(node_id, {'type': 'DELETE_BLOCKS', 'blocks': [
+                {'block_id': bid, 'block_name': name} for bid, name in to_send]}, timeout=30)
+            delete_queue.messages += 1
+            if resp is None:
+                log.warning(f"[GC] {node_id} no respondió a DELETE_BLOCKS ({len(to_send)} bloques), se reintentará")
+                budget = 0
+            else:
+                for ack in resp.get('acks') or []:
+                    if ack.get('status') == 'OK':
+                        confirmed.append(ack.get('block_id'))
+                        deleted += 1
+                    else:
+                        delete_queue.defer(node_id, ack.get('block_id'))
+                        log.warning(f"[GC] {node_id} no pudo borrar {ack.get('block_id')}: {ack.get('error')}")
+        if confirmed:
+            with lock_nodos:
+                for bid in confirmed:
+                    if confirm_block_deleted(blocks_store, bid, node_id):
+                        freed += 1
+                    delete_queue.done(node_id, bid)
+            persistence_svc.mark_dirty('blocks')
+    if deleted or freed:
+        log.info(f"[GC] {node_id}: {deleted} bloques borrados en el nodo, {freed} slots liberados")
+
+
+def run_block_gc():
+    """Una pasada del GC: ficheros locales por borrar y borrados pendientes de los nodos conectados."""
+    while gc_local_paths:
+        path = gc_local_paths.popleft()
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning(f"[GC] No se pudo borrar {path}: {e}")
+    with lock_nodos:
+        targets = [nid for nid in delete_queue.nodes() if nid in conexiones_activas]
+        live = _live_block_names(set(targets)) if targets else set()
+    for nid in targets:
+        try:
+            _gc_node(nid, live)
+        except Exception as e:
+            log.error(f"[GC] Error borrando bloques en {nid}: {e}")
+
+
+def apply_durable_acks():
+    """Marca como duraderos los bloques confirmados por su nodo (STORE_BLOCK_ACK encolados)."""
+    if not durable_acks:
+        return 0
+    marked = 0
+    with lock_nodos:
+        while durable_acks:
+            node_id, block_id = durable_acks.popleft()
+            if mark_block_durable(blocks_store, block_id, node_id):
+                marked += 1
+    if marked:
+        persistence_svc.mark_dirty('blocks')
+    return marked
+
+
+def evict_staged(file_id):
+    """
+    Quita de temp las copias locales de un archivo (o pack sellado) ya replicado:
+    el índice deja de apuntar a ellas y las lecturas pasan a los nodos.
+    Retorna los bytes liberados.
+    """
+    with lock_nodos:
+        entry = files_store['files'].get(file_id)
+        paths = []
+        if entry:
+            for b in (entry.get('meta') or {}).get('blocks', []) or []:
+                path = b.pop('path', None)
+                if path:
+                    paths.append(path)
+    if paths:
+        persistence_svc.mark_dirty('files')
+    nbytes = staging_area.evicted(file_id)
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning(f"[STAGING] No se pudo borrar {path}: {e}")
+    staging_area.remove_dir(file_id)
+    return nbytes
+
+
+def run_staging_eviction():
+    """
+    Si el área de staging supera su tope, expulsa en orden LRU los archivos cuyas
+    copias (primario y réplicas) ya confirmó cada nodo. Lo que no está replicado
+    nunca se expulsa: es el único origen para los nodos que aún no lo tienen.
+    """
+    global _staging_warned
+    if staging_area is None or staging_area.excess() <= 0:
+        _staging_warned = False
+        return 0
+    candidates, blocked = [], 0
+    with lock_nodos:
+        for fid in staging_area.lru():
+            entry = files_store['files'].get(fid)
+            if entry is None:
+                staging_area.forget(fid)
+            elif blocks_manager.placements_durable(blocks_store, entry.get('placements')):
+                candidates.append(fid)
+            else:
+                blocked += 1
+    evicted = freed = 0
+    for fid in candidates:
+        if staging_area.excess() <= 0:
+            break
+        freed += evict_staged(fid)
+        evicted += 1
+    if evicted:
+        log.info(f"[STAGING] {evicted} archivos replicados expulsados de temp ({freed} bytes)")
+    # Con tope 0 es lo normal mientras llegan los ACK: solo se avisa con un tope real
+    if STAGING_MAX_MB > 0 and staging_area.excess() > 0 and blocked and not _staging_warned:
+        _staging_warned = True
+        log.warning(f"[STAGING] Tope de {STAGING_MAX_MB} MB superado: {blocked} archivos aún sin replicar no se pueden expulsar")
+    return evicted
+
+
+def rebuild_staging():
+    """Al arrancar, cuenta en staging las copias locales que siguen en disco (orden LRU = fecha de subida)."""
+    staging_area.reset()
+    entries = sorted(files_store.get('files', {}).items(), key=lambda kv: kv[1].get('uploaded_at') or 0)
+    for fid, entry in entries:
+        if not entry.get('placements'):
+            continue    # archivos empaquetados y packs sin sellar: no se expulsan por separado
+        meta = entry.get('meta') or {}
+        _stage_file(fid, dict(meta, blocks=[b for b in meta.get('blocks', []) or []
+                                            if b.get('path') and os.path.exists(b['path'])]))
+
+
+def block_gc_loop():
+    """
+    Hilo de GC: se despierta con cada borrado, reconexión de un nodo o
+    STORE_BLOCK_ACK, y cada GC_INTERVAL para reintentar. También aplica los ACK
+    y expulsa de staging lo que ya está replicado.
+    """
+    while True:
+        gc_wakeup.wait(GC_INTERVAL)
+        gc_wakeup.clear()
+        try:
+            run_block_gc()
+        except Exception as e:
+            log.error(f"[GC] Error en el GC de bloques: {e}")
+        try:
+            apply_durable_acks()
+            run_staging_eviction()
+        except Exception as e:
+            log.error(f"[STAGING] Error expulsando bloques de staging: {e}")
+
+
+def seal_pack(pack_id):
+    """Coloca y envía a los nodos un pack cerrado. Retorna True si quedó sellado (o ya no existe)."""
+    with lock_nodos:
+        pack = files_store['files'].get(pack_id)
+        if not packing.is_pack(pack) or packing.is_sealed(pack):
+            return True
+        if not pack['members']:
+            _release_file_locked(pack_id)
+            return True
+        path = packing.pack_path(pack)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except (OSError, TypeError) as e:
+        log.error(f"[PACK] No se puede leer {pack_id} para sellarlo: {e}")
+        return False
+    metadata = {
+        'original_filename': pack_id,
+        'total_blocks': 1,
+        'total_size': len(data),
+        'blocks': [{'block_name': f"{pack_id}.part001", 'size': len(data),
+                    'hash': chunker.block_hash(data), 'path': path, 'index': 1}],
+    }
+    ok, _, msg = store_file_blocks(pack_id, pack_id, metadata, None, allow_pack=False)
+    if not ok:
+        pack_stats['seal_failures'] += 1
+        if pack_id not in _seal_failed:
+            _seal_failed.add(pack_id)
+            log.warning(f"[PACK] No se pudo sellar {pack_id}, se reintentará: {msg}")
+        return False
+    _seal_failed.discard(pack_id)
+    pack_stats['seals'] += 1
+    with lock_nodos:
+        pack = files_store['files'].get(pack_id)
+        members = len(pack['members']) if pack else 0
+        if pack and not members:
+            _release_file_locked(pack_id)
+    log.info(f"[PACK] {pack_id} sellado: {len(data)} bytes, {members} archivos")
+    return True
+
+
+def compact_pack(pack_id):
+    """
+    Copia los archivos vivos de un pack con muchos huecos al pack abierto y
+    libera el pack viejo cuando se queda vacío. Retorna True si se liberó.
+    """
+    with lock_nodos:
+        pack = files_store['files'].get(pack_id)
+        if not packing.is_pack(pack):
+            return False
+        members = list(pack['members'])
+    for fid in members:
+        with lock_nodos:
+            entry = files_store['files'].get(fid)
+        if not entry or (entry.get('pack') or {}).get('pack_id') != pack_id:
+            continue
+        data = _read_packed(fid, entry)
+        if data is None:
+            log.warning(f"[PACK] Compactación de {pack_id} aplazada: {fid} no disponible")
+            return False
+
+        def register(new_id, path, offset, is_new, fid=fid, length=len(data)):
+            with lock_nodos:
+                cur = files_store['files'].get(fid)
+                # Borrado o movido mientras se copiaba: los bytes copiados quedan como hueco
+                if not cur or (cur.get('pack') or {}).get('pack_id') != pack_id:
+                    return
+                new_pack = files_store['files'].get(new_id)
+                if new_pack is None:
+                    new_pack = files_store['files'][new_id] = packing.new_pack_entry(new_id, path)
+                packing.add_member(new_pack, fid, offset, length)
+                old = files_store['files'].get(pack_id)
+                if old:
+                    packing.remove_member(old, fid)
+                cur['pack'] = {'pack_id': new_id, 'offset': offset, 'length': length}
+
+        pack_writer.append(data, register)
+    persistence_svc.mark_dirty('files')
+    with lock_nodos:
+        old = files_store['files'].get(pack_id)
+        if old and old['members']:
+            return False
+        _release_file_locked(pack_id)
+    pack_stats['compactions'] += 1
+    log.info(f"[PACK] {pack_id} compactado: {len(members)} archivos movidos al pack abierto")
+    return True
+
+
+def pack_maintenance():
+    """
+    Hilo de mantenimiento de packs: cierra el pack abierto cuando pasa
+    PACK_MAX_AGE, sella los packs cerrados (reintenta los que fallaron, p.ej. sin
+    nodos) y compacta los sellados con pocos datos vivos.
+    """
+    interval = max(1.0, PACK_MAX_AGE / 2)
+    while True:
+        pack_wakeup.wait(interval)
+        pack_wakeup.clear()
+        try:
+            pack_writer.close_expired()
+            with lock_nodos:
+                packs = [(fid, e) for fid, e in files_store['files'].items() if packing.is_pack(e)]
+            for pack_id, pack in packs:
+                if pack_writer.is_open(pack_id):
+                    continue
+                if not packing.is_sealed(pack):
+                    seal_pack(pack_id)
+                elif packing.needs_compaction(pack, PACK_COMPACT_RATIO):
+                    compact_pack(pack_id)
+        except Exception as e:
+            log.error(f"[PACK] Error en mantenimiento de packs: {e}")
+
+
+def pack_summary():
+    with lock_nodos:
+        packs = [e for e in files_store['files'].values() if packing.is_pack(e)]
+        resp = {
+            'threshold': min(PACK_THRESHOLD, SLOT_SIZE),
+            'pack_size': pack_writer.pack_size if pack_writer else SLOT_SIZE,
+            'max_age': PACK_MAX_AGE,
+            'compact_ratio': PACK_COMPACT_RATIO,
+            'packs': len(packs),
+            'sealed': sum(1 for e in packs if packing.is_sealed(e)),
+            'files': sum(len(e.get('members', {})) for e in packs),
+            'live_bytes': sum(e.get('live_bytes', 0) for e in packs),
+            'total_bytes': sum(e.get('meta', {}).get('total_size', 0) for e in packs),
+        }
+    resp['open'] = pack_writer.current() if pack_writer else None
+    resp.update(pack_stats)
+    return resp
+
+
+def _split_bulk_item(file_id, name, data, chunking, uploader_node=None):
+    """
+    Divide un archivo de un lote (en un hilo del pool) en su directorio de
+    staging. Los pequeños van directos al pack sin pasar por temp.
+    Retorna (metadata, empaquetado).
+    """
+    limit = min(PACK_THRESHOLD, SLOT_SIZE)
+    if pack_writer is not None and 0 < len(data) <= limit and \
+            sum(1 for _ in chunker.iter_chunks(BytesIO(data), chunking)) == 1:
+        metadata = {
+            'original_filename': name,
+            'total_blocks': 1,
+            'total_size': len(data),
+            'chunking': chunking,
+            'blocks': [{'block_name': f"{file_id}.part001", 'size': len(data),
+                        'hash': chunker.block_hash(data), 'index': 1}],
+        }
+        ok, _, msg = _pack_data(file_id, name, metadata, data, uploader_node)
+        if not ok:
+            raise RuntimeError(msg)
+        return metadata, True
+    # Los bloques se nombran por file_id: en un directorio se repiten nombres (README, __init__.py...)
+    file_obj = BytesIO(data)
+    file_obj.filename = name
+    metadata = split_file_to_blocks(file_obj, staging_area.create(file_id), chunking=chunking, block_prefix=file_id)
+    return metadata, False
+
+
+def ingest_files(items, uploader_node=None, chunking=None):
+    """
+    Importa un lote de archivos. `items` es un iterable de (nombre, bytes), p.ej.
+    los miembros de un tar leídos en streaming: el hilo que llama solo lee la
+    entrada, mientras BULK_WORKERS hilos dividen y calculan hashes (con un número
+    acotado de archivos en memoria). Los pequeños se empaquetan; el resto se
+    coloca con una sola llamada a store_files_blocks (un Partitioner, un registro
+    en el índice). Retorna {'files': [...], 'errors': [...]}.
+    """
+    chunking = chunking or chunker.normalize_config(CHUNKING_MODE, BLOCK_SIZE)
+    batch_ts = int(time.time() * 1000)
+    t0 = time.perf_counter()
+    errors = []
+    pending = []
+    inflight = threading.BoundedSemaphore(BULK_WORKERS * 4)
+    with ThreadPoolExecutor(max_workers=BULK_WORKERS, thread_name_prefix='bulk') as pool:
+        try:
+            for k, (name, data) in enumerate(items, 1):
+                file_id = f"file_{batch_ts}_{k}_{os.path.splitext(safe_basename(name))[0]}"
+                inflight.acquire()
+                fut = pool.submit(_split_bulk_item, file_id, name, data, chunking, uploader_node)
+                fut.add_done_callback(lambda _f: inflight.release())
+                pending.append((file_id, name, fut))
+        except Exception as e:
+            # Entrada truncada o corrupta: se importa lo leído hasta ahí
+            log.warning(f"[BULK] Error leyendo la entrada tras {len(pending)} archivos: {e}")
+            errors.append({'filename': None, 'message': f'entrada inválida tras {len(pending)} archivos: {e}'})
+
+    files, to_place = [], []
+    for file_id, name, fut in pending:
+        try:
+            metadata, packed = fut.result()
+        except Exception as e:
+            errors.append({'filename': name, 'message': str(e)})
+            staging_area.remove_dir(file_id)
+            continue
+        files.append({'file_id': file_id, 'filename': name, 'size': metadata['total_size'],
+                      'total_blocks': metadata['total_blocks'], 'packed': packed})
+        if not packed:
+            to_place.append((file_id, name, metadata))
+
+    if to_place:
+        ok, _, msg = store_files_blocks(to_place, uploader_node)
+        if not ok:
+            failed = {file_id for file_id, _, _ in to_place}
+            for file_id in failed:
+                staging_area.remove_dir(file_id)
+            files = [f for f in files if f['file_id'] not in failed]
+            errors.extend({'filename': name, 'message': msg} for _, name, _ in to_place)
+
+    total = sum(f['size'] for f in files)
+    log.info(f"[BULK] {len(files)} archivos ({total} bytes) en {time.perf_counter() - t0:.2f}s: "
+             f"{sum(1 for f in files if f['packed'])} empaquetados, {len(to_place)} con bloques propios, "
+             f"{len(errors)} errores")
+    return {'files': files, 'errors': errors}
+
+
+def stream_upload(stream, file_id, filename, chunking=None, uploader_node=None):
+    """
+    Upload en streaming (POST /upload): los bloques se colocan y se envían a los
+    nodos mientras el cliente sigue enviando el resto del archivo. Tres etapas
+    unidas por colas acotadas (PIPELINE_DEPTH bloques):
+      1. el hilo que llama lee `stream` y lo corta en bloques (chunker);
+      2. un hilo calcula el hash, guarda el bloque en staging y lo coloca
+         (Partitioner bloque a bloque, continuando el round-robin);
+      3. un hilo por nodo destino envía sus copias (protocol.StoreFanOut).
+    Así el tiempo total tiende a max(subida del cliente, envío a nodos) en vez
+    de a su suma. Un archivo de un solo bloque pequeño va al pack abierto. Si
+    falta espacio a mitad de archivo, lo ya colocado queda como tombstones para
+    el GC. Retorna (ok, http_status, mensaje, metadata).
+    """
+    chunking = chunking or chunker.normalize_config(CHUNKING_MODE, BLOCK_SIZE)
+    dest_dir = staging_area.create(file_id)
+    blocks_q = queue.Queue(PIPELINE_DEPTH)
+    fanout = protocol.StoreFanOut(send_json, _supports_batch, depth=PIPELINE_DEPTH)
+    part = partitioner.Partitioner(replication=2)
+    blocks, placements = [], []
+    failed = []         # (http_status, mensaje) del primer error
+    packed = []         # resultado de _pack_data si el archivo acabó en un pack
+    t0 = time.perf_counter()
+
+    def place(index, data):
+        block_name = f"{file_id}.part{index:03d}"
+        path = os.path.join(dest_dir, block_name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        binfo = {'block_name': block_name, 'size': len(data), 'hash': chunker.block_hash(data),
+                 'path': path, 'index': index}
+        with lock_nodos:
+            ok, got, msg = part.allocate_blocks_for_file(1, nodos_registrados, blocks_store, block_sizes=[len(data)],
+                                                         slot_size=SLOT_SIZE, start=index - 1)
+            if not ok:
+                failed.append((500, f'No se pudo asignar bloques: {msg}'))
+                return
+            p = got[0]
+            p['file_block_index'] = index
+            assign_blocks_to_file(blocks_store, file_id, [p], block_sizes=[len(data)])
+            blocks.append(binfo)
+            placements.append(p)
+        _send_block_copies(fanout, file_id, p, binfo, data, uploader_node)
+
+    def placer():
+        # El primer bloque espera al segundo (o al final): un archivo de un bloque pequeño se empaqueta
+        held = None
+        while True:
+            item = blocks_q.get()
+            if item is None:
+                break
+            if failed:
+                continue    # seguir vaciando la cola para no bloquear al lector
+            try:
+                if item[0] == 1:
+                    held = item
+                    continue
+                if held:
+                    place(*held)
+                    held = None
+                place(*item)
+            except Exception as e:
+                log.error(f"[UPLOAD] Error colocando bloque {item[0]} de {file_id}: {e}")
+                failed.append((500, str(e)))
+        if held and not failed:
+            try:
+                data = held[1]
+                metadata = {'original_filename': filename, 'total_blocks': 1, 'total_size': len(data),
+                            'chunking': chunking, 'blocks': [{'block_name': f"{file_id}.part001", 'size': len(data),
+                                                              'hash': chunker.block_hash(data), 'index': 1}]}
+                if _should_pack(metadata):
+                    packed.append((_pack_data(file_id, filename, metadata, data, uploader_node), metadata))
+                else:
+                    place(*held)
+            except Exception as e:
+                log.error(f"[UPLOAD] Error colocando {file_id}: {e}")
+                failed.append((500, str(e)))
+
+    worker = threading.Thread(target=placer, daemon=True, name=f"upload-{file_id}")
+    worker.start()
+    count = 0
+    try:
+        for chunk in chunker.iter_chunks(stream, chunking):
+            if failed:
+                break
+            count += 1
+            blocks_q.put((count, chunk))
+    except Exception as e:
+        failed.append((400, f'Cuerpo inválido: {e}'))
+    finally:
+        blocks_q.put(None)
+    t_recv = time.perf_counter() - t0
+    worker.join()
+    fanout.close()
+    _log_batch_errors(fanout, 'UPLOAD')
+    if placements:
+        persistence_svc.mark_dirty('blocks')
+    if not count and not failed:
+        failed.append((400, 'No file data found'))
+
+    if failed:
+        # Lo ya colocado (y quizá enviado) se libera como cualquier borrado
+        ids = [bid for p in placements for bid in [p.get('primary_block_id')] + list(p.get('replica_block_ids') or []) if bid]
+        if ids:
+            with lock_nodos:
+                _tombstone_blocks_locked(ids)
+            gc_wakeup.set()
+        staging_area.remove_dir(file_id)
+        return False, failed[0][0], failed[0][1], None
+    if packed:
+        staging_area.remove_dir(file_id)
+        (ok, status, msg), metadata = packed[0]
+        return ok, status, msg, metadata
+
+    metadata = {
+        'original_filename': filename,
+        'total_blocks': len(blocks),
+        'total_size': sum(b['size'] for b in blocks),
+        'chunking': chunking,
+        'blocks': blocks
+    }
+    _register_files([(file_id, filename, metadata, placements)], uploader_node)
+    log.info(f"[UPLOAD] {file_id}: {len(blocks)} bloques ({metadata['total_size']} bytes) recibidos en {t_recv:.2f}s, "
+             f"colocados y enviados en {time.perf_counter() - t0:.2f}s ({fanout.messages} mensajes)")
+    return True, 200, 'OK', metadata
+
+
+def _tar_members(fileobj):
+    """(nombre, bytes) de cada archivo regular de un tar (comprimido o no) leído en streaming."""
+    with tarfile.open(fileobj=fileobj, mode='r|*') as tf:
+        for member in tf:
+            if not member.isfile():
+                continue
+            parts = [p for p in member.name.replace('\\', '/').split('/') if p not in ('', '.')]
+            if not parts or '..' in parts:
+                log.warning(f"[BULK] Entrada del tar ignorada: {member.name!r}")
+                continue
+            yield '/'.join(parts), tf.extractfile(member).read()
+
+
+class _BodyReader:
+    """Lee como mucho `length` bytes del cuerpo de la petición (para no bloquear en keep-alive)."""
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def read(self, n=-1):
+        if self.remaining <= 0:
+            return b''
+        n = self.remaining if n is None or n < 0 else min(n, self.remaining)
+        data = self.rfile.read(n)
+        self.remaining -= len(data)
+        if not data:
+            self.remaining = 0
+        return data
+
+    def drain(self):
+        while self.read(1024 * 1024):
+            pass
+
 
+class _MultipartFileReader:
+    """
+    Lee en streaming el contenido del primer archivo de un cuerpo
+    multipart/form-data: `open()` salta hasta la parte con `filename=` y
+    devuelve el nombre; después `read(n)` se comporta como un fichero (n bytes
+    salvo al final de la parte). Nunca guarda en memoria más que lo pedido.
+    """
 
-def send_pending_blocks(node_id):
+    READ_SIZE = 256 * 1024
+
+    def __init__(self, body, content_type):
+        boundary = content_type.split('boundary=')
+        if len(boundary) < 2:
+            raise ValueError('No boundary found in Content-Type')
+        boundary = boundary[1].split(';')[0].strip().strip('"')
+        self.body = body
+        # El primer delimitador no lleva CRLF delante: se añade al buffer para tratarlos igual
+        self.delim = b'\r\n--' + boundary.encode()
+        self.buf = b'\r\n'
+        self.scanned = 0        # hasta aquí el buffer no contiene el delimitador
+        self.done = False
+        self.filename = None
+
+    def _fill(self):
+        data = self.body.read(self.READ_SIZE)
+        if not data:
+            raise ValueError('cuerpo multipart truncado')
+        self.buf += data
+
+    def _find(self, token, start=0):
+        """Posición de `token` en el buffer, leyendo más cuerpo hasta encontrarlo."""
+        while True:
+            i = self.buf.find(token, start)
+            if i >= 0:
+                return i
+            start = max(start, len(self.buf) - len(token) + 1)
+            self._fill()
+
+    def open(self):
+        while True:
+            i = self._find(self.delim)
+            end = self._find(b'\r\n\r\n', i + len(self.delim))
+            headers = self.buf[i + len(self.delim):end]
+            if headers.startswith(b'--'):
+                raise ValueError('No file data found')
+            self.buf = self.buf[end + 4:]
+            if b'filename=' in headers:
+                fn_start = headers.find(b'filename="') + 10
+                self.filename = headers[fn_start:headers.find(b'"', fn_start)].decode('utf-8', 'replace') or 'archivo'
+                self.scanned = 0
+                return self.filename
+
+    def read(self, n=-1):
+        if self.done:
+            return b''
+        n = self.READ_SIZE if n is None or n < 0 else n
+        while True:
+            i = self.buf.find(self.delim, self.scanned)
+            if i >= 0:
+                # Fin de la parte: entregar lo que queda antes del delimitador
+                out = self.buf[:min(i, n)]
+                self.buf = self.buf[len(out):]
+                self.scanned = 0
+                if not out:
+                    self.done = True
+                return out
+            safe = len(self.buf) - len(self.delim) + 1
+            if safe >= n:
+                out, self.buf = self.buf[:n], self.buf[n:]
+                self.scanned = safe - n
+                return out
+            self.scanned = max(0, safe)
+            self._fill()
+
+
+def _chunking_from_params(params):
     """
-    Recorre `files_store` y envía por TCP a `node_id` los bloques asignados a ese nodo
-    que todavía no aparecen en `stored_on_list`. Actualiza `blocks_store` y persiste.
+    Configuración de chunking para un upload: la del cluster, sobrescrita por
+    parámetros opcionales `chunking`, `block_size`, `min_size`, `max_size` (bytes).
     """
-    try:
+    return chunker.normalize_config(
+        params.get('chunking') or CHUNKING_MODE,
+        block_size=params.get('block_size') or BLOCK_SIZE,
+        min_size=params.get('min_size'),
+        avg_size=params.get('avg_size'),
+        max_size=params.get('max_size'),
+    )
+
+
+def _uploader_node(client_ip):
+    """Retorna (node_id, status) del nodo registrado con esa IP, o (None, None). No toma el lock."""
+    nid = nodos_registrados.node_for_ip(client_ip)
+    return nid, nodos_registrados.status_of(nid)
+
+
+def _touch_client_node(node_id):
+    """Un cliente HTTP del nodo da señal de vida: last_seen sin lock; el lock solo si pasa a online."""
+    nodos_registrados.touch(node_id)
+    if nodos_registrados.status_of(node_id) != 'online':
         with lock_nodos:
-            # snapshot de conexiones y stores
-            sock = conexiones_activas.get(node_id)
-            if not sock:
-                print(f"[PENDING] No hay conexión activa para {node_id}")
-                return 0
+            if node_id in nodos_registrados:
+                nodos_registrados[node_id]['status'] = 'online'
 
-            sent_count = 0
-            # Recorrer archivos registrados
-            for fid, fentry in list(files_store.get('files', {}).items()):
-                meta = fentry.get('meta', {}) or {}
-                blocks_meta = meta.get('blocks', []) or []
-                placements = fentry.get('placements', []) or []
-
-                for p in placements:
-                    # primary
-                    prim_id = p.get('primary_block_id')
-                    prim_node = p.get('primary_node')
-                    idx = p.get('file_block_index', 0)
 
-                    # Si este bloque está asignado a node_id y aún no se almacenó allí
-                    if prim_node == node_id and prim_id:
-                        try:
-                            blk_meta = blocks_store.get('blocks', {}).get(prim_id, {})
-                            stored_list = blk_meta.get('stored_on_list', []) or []
-                            if node_id not in stored_list:
-                                # obtener archivo fuente desde metadata (temp)
-                                src_info = None
-                                try:
-                                    if idx and 1 <= idx <= len(blocks_meta):
-                                        src_info = blocks_meta[idx-1]
-                                except Exception:
-                                    src_info = None
-
-                                if src_info and src_info.get('path') and os.path.exists(src_info.get('path')):
-                                    try:
-                                        with open(src_info.get('path'), 'rb') as bf:
-                                            data_b = bf.read()
-                                        b64 = base64.b64encode(data_b).decode('ascii')
-                                        msg = {
-                                            'type': 'STORE_BLOCK',
-                                            'file_id': fid,
-                                            'block_id': prim_id,
-                                            'block_name': src_info.get('block_name'),
-                                            'is_replica': False,
-                                            'data_b64': b64
-                                        }
-                                        sock.sendall(json.dumps(msg).encode())
-                                        # actualizar metadata
-                                        blk_meta.setdefault('stored_on_list', [])
-                                        if node_id not in blk_meta['stored_on_list']:
-                                            blk_meta['stored_on_list'].append(node_id)
-                                        blk_meta['remote_name'] = src_info.get('block_name')
-                                        blocks_store['blocks'][prim_id] = blk_meta
-                                        sent_count += 1
-                                    except Exception as e:
-                                        print(f"[PENDING] Error enviando primary {prim_id} a {node_id}: {e}")
-                                else:
-                                    # no tenemos origen local, marcar intención o esperar otra fuente
-                                    print(f"[PENDING] Origen no disponible para primary {prim_id} (file {fid})")
-                        except Exception as e:
-                            print(f"[PENDING] Error procesando primary {prim_id}: {e}")
+def _nodes_payload(include_all):
+    """Cuerpo JSON de GET /nodes (lo cachea nodos_registrados.cached)."""
+    with lock_nodos:
+        used_by_node = blocks_manager.used_bytes_by_node(blocks_store, slot_size=SLOT_SIZE)
+    nodes_list = []
+    for nid, info in nodos_registrados.snapshot().items():
+        status = info.get('status', 'unknown')
+        if not include_all and status != 'online':
+            continue
+        nodes_list.append({'id': nid, 'ip': info.get('ip'), 'port': info.get('port'), 'capacity': info.get('capacity', 0),
+                           'status': status, 'used': round(used_by_node.get(nid, 0) / (1024 * 1024), 2)})
+    return json.dumps({'nodes': nodes_list}).encode('utf-8')
+
+
+def _multipart_files(body, content_type):
+    """Archivos de un cuerpo multipart/form-data: lista de (filename, bytes) en orden."""
+    # Extraer el boundary de forma robusta (puede venir sin quotes o con charset)
+    boundary_match = content_type.split('boundary=')
+    if len(boundary_match) < 2:
+        raise ValueError('No boundary found in Content-Type')
+    boundary_str = boundary_match[1].strip()
+    # Si viene entre comillas, removerlas
+    if boundary_str.startswith('"') and boundary_str.endswith('"'):
+        boundary_str = boundary_str[1:-1]
+    # Si contiene caracteres adicionales (ej: ;), tomar solo hasta ese punto
+    if ';' in boundary_str:
+        boundary_str = boundary_str.split(';')[0].strip()
+
+    files = []
+    for part in body.split(b'--' + boundary_str.encode()):
+        if b'filename=' not in part:
+            continue
+        filename = 'archivo'
+        try:
+            fn_start = part.find(b'filename="') + 10
+            fn_end = part.find(b'"', fn_start)
+            filename = part[fn_start:fn_end].decode('utf-8')
+        except Exception:
+            pass
+        # Contenido: tras la línea en blanco de las cabeceras de la parte, sin el CRLF final
+        content_start = part.find(b'\r\n\r\n') + 4
+        content_end = part.rfind(b'\r\n')
+        files.append((filename, part[content_start:content_end]))
+    return files
 
-                    # replicas
-                    reps = p.get('replica_block_ids', []) or []
-                    rep_nodes = p.get('replica_nodes', []) or []
-                    for rid, rnode in zip(reps, rep_nodes):
-                        if rnode == node_id and rid:
-                            try:
-                                rblk_meta = blocks_store.get('blocks', {}).get(rid, {})
-                                stored_list = rblk_meta.get('stored_on_list', []) or []
-                                if node_id not in stored_list:
-                                    # obtener src_info desde metadata
-                                    src_info = None
-                                    try:
-                                        if idx and 1 <= idx <= len(blocks_meta):
-                                            src_info = blocks_meta[idx-1]
-                                    except Exception:
-                                        src_info = None
-
-                                    if src_info and src_info.get('path') and os.path.exists(src_info.get('path')):
-                                        try:
-                                            with open(src_info.get('path'), 'rb') as bf:
-                                                data_b = bf.read()
-                                            b64 = base64.b64encode(data_b).decode('ascii')
-                                            msg = {
-                                                'type': 'STORE_BLOCK',
-                                                'file_id': fid,
-                                                'block_id': rid,
-                                                'block_name': src_info.get('block_name'),
-                                                'is_replica': True,
-                                                'data_b64': b64
-                                            }
-                                            sock.sendall(json.dumps(msg).encode())
-                                            rblk_meta.setdefault('stored_on_list', [])
-                                            if node_id not in rblk_meta['stored_on_list']:
-                                                rblk_meta['stored_on_list'].append(node_id)
-                                            rblk_meta['remote_name'] = src_info.get('block_name')
-                                            blocks_store['blocks'][rid] = rblk_meta
-                                            sent_count += 1
-                                        except Exception as e:
-                                            print(f"[PENDING] Error enviando replica {rid} a {node_id}: {e}")
-                                    else:
-                                        print(f"[PENDING] Origen no disponible para replica {rid} (file {fid})")
-                            except Exception as e:
-                                print(f"[PENDING] Error procesando replica {rid}: {e}")
 
-            if sent_count:
-                try:
-                    save_persistent_blocks(blocks_store)
-                except Exception:
-                    pass
-            print(f"[PENDING] Enviados {sent_count} bloques pendientes a {node_id}")
-            return sent_count
-    except Exception as e:
-        print(f"[PENDING] Error general al enviar pendientes a {node_id}: {e}")
-        return 0
+def safe_basename(name, default='archivo'):
+    """
+    Último componente de un nombre de archivo recibido de un cliente ('d/big.bin',
+    '..\\x.bin' -> 'big.bin', 'x.bin'). Acaba en file_id y en nombres de bloque,
+    que los nodos usan como ruta: nunca debe llevar separadores ni '..'.
+    """
+    base = os.path.basename(str(name or '').replace('\\', '/')).strip()
+    return default if base in ('', '.', '..') else base
+
+
+def _query_params(query):
+    """Convierte la query string en dict (primer valor de cada parámetro)."""
+    return {k: v[0] for k, v in parse_qs(query or '').items()}
 
 
-def save_persistent_nodes():
+def _number_param(data, name, default=None, cast=int, minimum=1):
+    """
+    Parámetro numérico del cuerpo JSON de un POST de administración: `default`
+    si falta; ValueError (el handler responde 400) si no es un número finito
+    >= minimum (json.loads acepta NaN e Infinity).
+    """
+    raw = data.get(name)
+    if raw is None or raw == '':
+        return default
+    if isinstance(raw, bool):
+        raise ValueError(f"{name} inválido: {raw}")
     try:
-        with lock_nodos:
-            data = {'nodos': nodos_registrados}
-        with open(nodes_persistent_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
-        print(f"[HTTP] Guardado {len(nodos_registrados)} nodos en {nodes_persistent_file}")
-    except Exception as e:
-        print(f"[HTTP] Error guardando nodos persistentes: {e}")
+        value = cast(raw)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"{name} inválido: {raw}")
+    if not math.isfinite(value):
+        raise ValueError(f"{name} inválido: {raw}")
+    if value < minimum:
+        raise ValueError(f"{name} debe ser >= {minimum}: {raw}")
+    return value
 
 
 class SimpleAPIHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1: conexiones keep-alive para clientes que reutilizan conexiones
+    # (toda respuesta debe llevar Content-Length o cerrar la conexión)
+    protocol_version = 'HTTP/1.1'
+
+    def handle_one_request(self):
+        # Con una sesión de perfilado 'cprofile' activa, cada petición se perfila en su hilo
+        with profiler.profiled():
+            super().handle_one_request()
+
+    def log_message(self, format, *args):
+        # Access log de http.server: por el logger asíncrono en lugar de stderr síncrono
+        log.info(f"[HTTP] {self.address_string()} - {format % args}")
+
     def _send_json(self, obj, status=200):
-        resp = json.dumps(obj).encode('utf-8')
+        self._send_body(json.dumps(obj).encode('utf-8'), status)
+
+    def _send_head(self, status=200, length=None, headers=None):
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.send_header('Content-Length', str(len(resp)))
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Part-SHA256')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if length is not None:
+            self.send_header('Content-Length', str(length))
         self.end_headers()
+
+    def _send_body(self, resp, status=200, headers=None):
+        """Envía un cuerpo JSON ya serializado."""
+        self._send_head(status, len(resp), headers)
         self.wfile.write(resp)
 
+    def _send_listing(self, name, params, tables, build):
+        """
+        Respuesta de un listado grande (/blocks, /files). Si las tablas `tables` no
+        cambiaron desde la última petición igual, se reenvía el cuerpo cacheado; si
+        no, `build()` arma el objeto (con el lock) y se codifica por entradas
+        mientras se envía: chunked, y con gzip si el cliente lo acepta.
+        """
+        gz = json_stream.accepts_gzip(self.headers.get('Accept-Encoding'))
+        headers = {'Vary': 'Accept-Encoding'}
+        if gz:
+            headers['Content-Encoding'] = 'gzip'
+        key = (name, tuple(sorted(params.items())), gz)
+        # Versión leída antes de construir: lo construido es al menos igual de reciente
+        version = persistence_svc.version(*tables)
+        body = listing_cache.get(key, version)
+        if body is not None:
+            self._send_body(body, headers=headers)
+            return
+        obj = build()
+        chunked = self.request_version != 'HTTP/1.0'
+        if chunked:
+            headers['Transfer-Encoding'] = 'chunked'
+        else:
+            # HTTP/1.0 no tiene chunked: el fin del cuerpo es el cierre de la conexión
+            self.close_connection = True
+        self._send_head(200, headers=headers)
+        writer = json_stream.BodyWriter(self.wfile, chunked=chunked, gzip=gz, keep=listing_cache.entry_limit())
+        try:
+            for chunk in json_stream.iter_json(obj):
+                writer.write(chunk)
+            writer.close()
+        except Exception as e:
+            # Las cabeceras ya salieron: solo queda cortar la conexión
+            log.warning(f"[HTTP] Envío de {name} interrumpido: {e}")
+            self.close_connection = True
+            return
+        listing_cache.put(key, version, writer.kept())
+
     def do_GET(self):
         parsed = urlparse(self.path)
         path = parsed.path
@@ -469,23 +1862,13 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
         if path == '/discover':
             # Reusar node_id si existe registro para esta IP
             client_ip = self.client_address[0]
-            with lock_nodos:
-                existing = None
-                for nid, info in nodos_registrados.items():
-                    if info.get('ip') == client_ip:
-                        existing = nid
-                        break
-
-                if existing:
-                    node_id = existing
-                    # actualizar last_seen ya que el cliente realizó discovery
-                    try:
-                        nodos_registrados[node_id]['last_seen'] = time.time()
-                        nodos_registrados[node_id]['status'] = 'online'
-                    except Exception:
-                        pass
-                else:
-                    global next_node_number
+            node_id = nodos_registrados.node_for_ip(client_ip)
+            if node_id is not None:
+                # actualizar last_seen ya que el cliente realizó discovery
+                _touch_client_node(node_id)
+            else:
+                global next_node_number
+                with lock_nodos:
                     node_id = f"nodo{next_node_number}"
                     next_node_number += 1
 
@@ -499,56 +1882,73 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
                 include_all = True
 
             client_ip = self.client_address[0]
-            with lock_nodos:
-                # si el cliente que pide la lista está registrado, actualizar su last_seen
-                for nid, info in nodos_registrados.items():
-                    if info.get('ip') == client_ip:
-                        nodos_registrados[nid]['last_seen'] = time.time()
-                        nodos_registrados[nid]['status'] = 'online'
-
-                nodes_list = []
-                for nid, info in nodos_registrados.items():
-                    status = info.get('status', 'unknown')
-                    if not include_all and status != 'online':
-                        continue
-                    nodes_list.append({'id': nid, 'ip': info.get('ip'), 'port': info.get('port'), 'capacity': info.get('capacity', 0), 'status': status, 'used': info.get('used', 0)})
-            self._send_json({'nodes': nodes_list})
+            # si el cliente que pide la lista está registrado, actualizar su last_seen
+            for nid in nodos_registrados.ids_for_ip(client_ip):
+                _touch_client_node(nid)
+            # Lista ya serializada: se rehace cuando cambia la tabla de nodos o, para 'used', cada NODES_USED_MAX_AGE s
+            payload = nodos_registrados.cached(('nodes', include_all), lambda: _nodes_payload(include_all),
+                                               max_age=NODES_USED_MAX_AGE)
+            self._send_body(payload)
         elif path == '/whoami':
             # Devuelve la IP del cliente y si está asociado a un nodo conocido
             try:
-                node_id = None
-                node_status = None
-                with lock_nodos:
-                    for nid, info in nodos_registrados.items():
-                        if info.get('ip') == client_ip:
-                            node_id = nid
-                            node_status = info.get('status')
-                            break
+                node_id = nodos_registrados.node_for_ip(client_ip)
+                node_status = nodos_registrados.status_of(node_id)
                 resp = {'ip': client_ip, 'node_id': node_id, 'node_status': node_status, 'editable': (node_status == 'online')}
                 self._send_json(resp)
             except Exception as e:
-                print(f"[HTTP] Error en /whoami: {e}")
+                log.error(f"[HTTP] Error en /whoami: {e}")
                 self._send_json({'ip': client_ip, 'node_id': None, 'node_status': None, 'editable': False})
         elif path == '/blocks':
-            # Devuelve la tabla de bloques global
+            # Devuelve la tabla de bloques global: los slots en uso y un resumen por nodo
+            # ({prefix, slots, free, used, ...}); ?include_free=1 lista también cada slot libre.
+            # Filtros: node, status (lista con comas), file_id; paginación: limit, cursor; proyección: fields
             try:
-                with lock_nodos:
-                    bd = blocks_store
-                    # Convertir a formato UI si es necesario
-                    blocks_list = list(bd.get('blocks', {}).values())
-                    table_size = bd.get('table_size', 0)
-                self._send_json({'table_size': table_size, 'blocks': blocks_list})
+                params = _query_params(query)
+                include_free = params.get('include_free') in ('1', 'true')
+                limit = listing.parse_limit(params)
+                fields = listing.parse_fields(params.get('fields'))
+
+                def build():
+                    with lock_nodos:
+                        table = blocks_manager.ensure_table(blocks_store)
+                        blocks, next_cursor = blocks_manager.query_blocks(
+                            blocks_store, node=params.get('node') or None, statuses=listing.parse_csv(params.get('status')),
+                            file_id=params.get('file_id') or None, cursor=params.get('cursor') or None, limit=limit,
+                            fields=fields, include_free=include_free)
+                        resp = {'table_size': table.total_slots(), 'blocks': blocks, 'next_cursor': next_cursor}
+                        if params.get('summary') not in ('0', 'false'):
+                            resp['nodes'] = table.node_summary()
+                    return resp
+
+                self._send_listing('/blocks', params, ('blocks',), build)
+            except listing.ListQueryError as e:
+                self._send_json({'status': 'ERROR', 'message': str(e)}, status=400)
             except Exception as e:
-                print(f"[HTTP] Error devolviendo /blocks: {e}")
-                self._send_json({'table_size': 0, 'blocks': []})
+                log.error(f"[HTTP] Error devolviendo /blocks: {e}")
+                self._send_json({'table_size': 0, 'blocks': [], 'nodes': {}})
         elif path == '/files':
-            # Devuelve el índice persistente de archivos subidos
+            # Devuelve el índice persistente de archivos subidos.
+            # Filtros: file_id, prefix (del nombre), uploader; paginación: limit, cursor; proyección: fields
             try:
-                with lock_nodos:
-                    fs = files_store
-                self._send_json(fs)
+                params = _query_params(query)
+                limit = listing.parse_limit(params)
+                fields = listing.parse_fields(params.get('fields'))
+
+                def build():
+                    # Los packs de archivos pequeños son internos: no se listan
+                    with lock_nodos:
+                        files, next_cursor = files_manager.query_files(
+                            files_store, file_id=params.get('file_id') or None, prefix=params.get('prefix') or None,
+                            uploader=params.get('uploader') or None, cursor=params.get('cursor') or None,
+                            limit=limit, fields=fields, exclude=packing.is_pack)
+                    return {'files': files, 'next_cursor': next_cursor}
+
+                self._send_listing('/files', params, ('files',), build)
+            except listing.ListQueryError as e:
+                self._send_json({'status': 'ERROR', 'message': str(e)}, status=400)
             except Exception as e:
-                print(f"[HTTP] Error devolviendo /files: {e}")
+                log.error(f"[HTTP] Error devolviendo /files: {e}")
                 self._send_json({'files': {}})
         elif path == '/storage':
             # Devuelve estadísticas de almacenamiento global distribuido
@@ -557,7 +1957,7 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
                 block_size = 1024 * 1024
                 with lock_nodos:
                     # Considerar sólo nodos online como capacidad disponible en este momento
-                    total_capacity_mb = sum([info.get('capacity', 0) for nid, info in nodos_registrados.items() if info.get('status') == 'online'])
+                    total_capacity_mb = sum(nodos_registrados[nid].get('capacity', 0) for nid in nodos_registrados.ids_with_status('online'))
 
                     # Calcular usado en bytes sumando tamaños de bloques por copia (primary + replicas)
                     used_bytes = 0
@@ -590,7 +1990,7 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
                                 used_bytes += size * len(reps)
                                 used_blocks += len(reps)
                     except Exception as e:
-                        print(f"[STORAGE] Error calculando usado: {e}")
+                        log.error(f"[STORAGE] Error calculando usado: {e}")
 
                 total_bytes = int(total_capacity_mb * block_size)
                 percent = (used_bytes / total_bytes * 100) if total_bytes > 0 else 0
@@ -604,18 +2004,13 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
                 }
                 self._send_json(resp)
             except Exception as e:
-                print(f"[HTTP] Error devolviendo /storage: {e}")
+                log.error(f"[HTTP] Error devolviendo /storage: {e}")
                 self._send_json({'total_capacity_mb': 0, 'used_bytes': 0, 'used_mb': 0, 'percent': 0})
-        else:
-            self._send_json({'error': 'Not found'}, status=404)
-
-        # Manejar descarga de archivo en ruta especializada (query parsing)
-        # Soporte: /files/download?file_id=...
-        # Nota: no se entra aquí si ya se respondió arriba.
-        if path.startswith('/files/download'):
-            # extraer file_id
+        elif path == '/files/download':
+            # Soporte: /files/download?file_id=...
+            headers_sent = False
             try:
-                params = dict([p.split('=') for p in query.split('&') if '=' in p]) if query else {}
+                params = _query_params(query)
                 file_id = params.get('file_id')
                 if not file_id:
                     self._send_json({'status': 'ERROR', 'message': 'missing file_id'}, status=400)
@@ -632,62 +2027,131 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
                 blocks_meta = meta.get('blocks', [])
                 total_blocks = meta.get('total_blocks', len(blocks_meta))
                 original_name = meta.get('original_filename', entry.get('original_filename') or f"{file_id}.bin")
+                total_size = sum(b.get('size', 0) for b in blocks_meta) if len(blocks_meta) == total_blocks else None
 
                 # Preparar respuesta como flujo binario
-                try:
-                    self.send_response(200)
-                    self.send_header('Content-Type', 'application/octet-stream')
-                    self.send_header('Content-Disposition', f'attachment; filename="{original_name}"')
-                    # Sin Content-Length (stream)
-                    self.end_headers()
-
-                    # Escribir cada bloque en orden
-                    for i in range(1, total_blocks + 1):
-                        try:
-                            binfo = blocks_meta[i-1]
-                            path_b = binfo.get('path')
-                            if path_b and os.path.exists(path_b):
-                                with open(path_b, 'rb') as bf:
-                                    chunk = bf.read()
-                                    self.wfile.write(chunk)
-                            else:
-                                    # Intentar pedir el bloque al nodo que lo almacena (si lo conocemos)
-                                    blk_id = binfo.get('id') or binfo.get('block_id')
-                                    stored_on = None
-                                    remote_name = None
-                                    try:
-                                        raw = blocks_store.get('blocks', {})
-                                        if blk_id and blk_id in raw:
-                                            stored_on = raw[blk_id].get('stored_on')
-                                            remote_name = raw[blk_id].get('remote_name')
-                                    except Exception:
-                                        pass
-
-                                    if stored_on and stored_on in conexiones_activas:
-                                        # pedir bloque al nodo
-                                        data_bytes = request_block_from_node(stored_on, blk_id, block_name=remote_name, timeout=8)
-                                        if data_bytes:
-                                            try:
-                                                self.wfile.write(data_bytes)
-                                                continue
-                                            except Exception as e:
-                                                print(f"[DOWNLOAD] Error escribiendo bloque recibido: {e}")
-                                    print(f"[DOWNLOAD] Bloque {i} no disponible localmente ni en nodo conectado: {path_b}")
-                        except Exception as e:
-                            print(f"[DOWNLOAD] Error leyendo bloque {i} para {file_id}: {e}")
-                    return
-                except Exception as e:
-                    print(f"[DOWNLOAD] Error sirviendo descarga de {file_id}: {e}")
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Disposition', f'attachment; filename="{original_name}"')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                if total_size is not None:
+                    self.send_header('Content-Length', str(total_size))
+                else:
+                    # Sin tamaño conocido: el fin del cuerpo lo marca el cierre de la conexión
+                    self.close_connection = True
+                self.end_headers()
+                headers_sent = True
+
+                # Escribir cada bloque en orden. Los bloques pequeños se piden por lotes
+                # (REQUEST_BLOCKS) a los nodos; el resto, uno a uno
+                prefetched, prefetch_next = {}, 1
+                for i in range(1, total_blocks + 1):
+                    try:
+                        if i >= prefetch_next and total_blocks > 1:
+                            prefetched, prefetch_next = prefetch_small_blocks(file_id, entry, i)
+                        chunk = prefetched.pop(i, None)
+                        if chunk is None:
+                            chunk = read_file_block(file_id, entry, i)
+                    except Exception as e:
+                        log.error(f"[DOWNLOAD] Error leyendo bloque {i} para {file_id}: {e}")
+                        chunk = None
+                    if chunk is None:
+                        # No se puede completar el cuerpo anunciado: cortar la conexión
+                        # para que el cliente detecte la descarga incompleta.
+                        log.warning(f"[DOWNLOAD] Bloque {i} de {file_id} no disponible localmente ni en nodo conectado")
+                        self.close_connection = True
+                        return
+                    self.wfile.write(chunk)
+            except Exception as e:
+                log.error(f"[DOWNLOAD] Error en handler: {e}")
+                if headers_sent:
+                    self.close_connection = True
+                else:
                     self._send_json({'status': 'ERROR', 'message': 'internal error'}, status=500)
-                    return
+        elif path == '/files/block':
+            # Un bloque individual: /files/block?file_id=...&index=N (para descargas en paralelo)
+            params = _query_params(query)
+            file_id = params.get('file_id')
+            try:
+                index = int(params.get('index', 0))
+            except ValueError:
+                index = 0
+            with lock_nodos:
+                entry = files_store.get('files', {}).get(file_id) if file_id else None
+            if not entry:
+                self._send_json({'status': 'ERROR', 'message': 'file not found'}, status=404)
+                return
+            try:
+                chunk = read_file_block(file_id, entry, index)
             except Exception as e:
-                print(f"[DOWNLOAD] Error en handler: {e}")
-                self._send_json({'status': 'ERROR', 'message': 'internal error'}, status=500)
+                log.error(f"[DOWNLOAD] Error leyendo bloque {index} para {file_id}: {e}")
+                chunk = None
+            if chunk is None:
+                self._send_json({'status': 'ERROR', 'message': f'bloque {index} no disponible'}, status=503)
                 return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Content-Length', str(len(chunk)))
+            self.end_headers()
+            self.wfile.write(chunk)
+        elif path.startswith('/uploads/'):
+            # Estado de un upload por partes: /uploads/<upload_id>
+            try:
+                self._send_json(upload_sessions_mgr.status(path.split('/')[2]))
+            except upload_sessions.UploadError as e:
+                self._send_json({'status': 'ERROR', 'message': str(e)}, status=e.status)
+        elif path == '/admin/cache':
+            resp = block_cache.stats()
+            with lock_nodos:
+                resp['nodes_readahead'] = dict(node_readahead_stats)
+            resp['listings'] = listing_cache.stats()
+            self._send_json(resp)
+        elif path == '/admin/packs':
+            self._send_json(pack_summary())
+        elif path == '/admin/gc':
+            resp = delete_queue.stats()
+            resp['local_pending'] = len(gc_local_paths)
+            self._send_json(resp)
+        elif path == '/admin/staging':
+            # Copias locales de los uploads: bytes en temp, tope y expulsiones tras replicar
+            resp = staging_area.stats()
+            resp['pending_acks'] = len(durable_acks)
+            self._send_json(resp)
+        elif path == '/admin/profile':
+            # Estado de la sesión de perfilado y último informe
+            self._send_json(profiler.profile_status())
+        elif path == '/admin/tracemalloc':
+            self._send_json(profiler.tracemalloc_status())
+        elif path == '/admin/logging':
+            self._send_json({'levels': log.levels(), 'stats': log.stats()})
+        elif path == '/admin/replicas':
+            # Métricas por nodo usadas para elegir réplica en las lecturas
+            self._send_json({'nodes': replica_selector.stats()})
+        elif path == '/admin/heartbeats':
+            # Estado del detector de fallos (phi, silencio, intervalo medio y RTT por nodo)
+            self._send_json({'interval': MONITOR_INTERVAL, 'suspect_phi': failure_detector.suspect_phi,
+                             'offline_phi': failure_detector.offline_phi,
+                             'min_offline_after_s': failure_detector.min_offline_after,
+                             'nodes': failure_detector.stats()})
+        elif path == '/admin/startup':
+            self._send_json({'timings': startup_timings, 'metadata_backend': metadata_store.get_store().name})
+        elif path == '/admin/persistence':
+            self._send_json({'interval': persistence_svc.interval, 'pending': persistence_svc.pending(),
+                             'stats': dict(persistence_svc.stats)})
+        else:
+            self._send_json({'error': 'Not found'}, status=404)
 
     def do_POST(self):
         parsed = urlparse(self.path)
         path = parsed.path
+        # Los uploads leen el cuerpo en streaming: no cargarlo entero como en el resto de endpoints
+        if path == '/upload':
+            self._stream_upload(parsed)
+            return
+        if path == '/upload/bulk':
+            self._bulk_upload(parsed)
+            return
         length = int(self.headers.get('Content-Length', 0))
         body = self.rfile.read(length) if length > 0 else b''
         try:
@@ -700,260 +2164,49 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
             client_ip = self.client_address[0]
         except Exception:
             client_ip = 'unknown'
-        print(f"[HTTP] do_POST {path} desde {client_ip}")
+        log.info(f"[HTTP] do_POST {path} desde {client_ip}")
 
-        if path == '/upload':
-            # Endpoint para recibir archivos y dividirlos en bloques
-            # Detectar si es multipart/form-data
-            # Bloquear uploads si la IP cliente corresponde a un nodo desconectado
-            try:
-                with lock_nodos:
-                    for nid, info in nodos_registrados.items():
-                        if info.get('ip') == client_ip and info.get('status') != 'online':
-                            self._send_json({'status': 'ERROR', 'message': 'Nodo desconectado: no se permiten subidas/ modificaciones'}, status=403)
-                            return
-            except Exception:
-                pass
-            content_type = self.headers.get('Content-Type', '')
-            if 'multipart/form-data' not in content_type:
-                self._send_json({'status': 'ERROR', 'message': 'Expected multipart/form-data'}, status=400)
+        if path == '/uploads':
+            # Inicia un upload por partes. JSON: { filename, size, block_size (opcional) }
+            _, uploader_status = _uploader_node(client_ip)
+            if uploader_status and uploader_status != 'online':
+                self._send_json({'status': 'ERROR', 'message': 'Nodo desconectado: no se permiten subidas/ modificaciones'}, status=403)
                 return
-            
             try:
-                # Parsear multipart (forma simple sin librerías externas)
-                # Extraer el boundary de forma robusta (puede venir sin quotes o con charset)
-                boundary_match = content_type.split('boundary=')
-                if len(boundary_match) < 2:
-                    self._send_json({'status': 'ERROR', 'message': 'No boundary found in Content-Type'}, status=400)
-                    return
-                
-                boundary_str = boundary_match[1].strip()
-                # Si viene entre comillas, removerlas
-                if boundary_str.startswith('"') and boundary_str.endswith('"'):
-                    boundary_str = boundary_str[1:-1]
-                # Si contiene caracteres adicionales (ej: ;), tomar solo hasta ese punto
-                if ';' in boundary_str:
-                    boundary_str = boundary_str.split(';')[0].strip()
-                
-                boundary = boundary_str.encode()
-                parts = body.split(b'--' + boundary)
-                
-                file_data = None
-                filename = 'archivo'
-                
-                for part in parts:
-                    if b'filename=' in part:
-                        # Extraer nombre del archivo
-                        try:
-                            fn_start = part.find(b'filename="') + 10
-                            fn_end = part.find(b'"', fn_start)
-                            filename = part[fn_start:fn_end].decode('utf-8')
-                        except Exception:
-                            pass
-                        
-                        # Extraer contenido del archivo
-                        content_start = part.find(b'\r\n\r\n') + 4
-                        content_end = part.rfind(b'\r\n')
-                        file_data = part[content_start:content_end]
-                        break
-                
-                if not file_data:
-                    self._send_json({'status': 'ERROR', 'message': 'No file data found'}, status=400)
-                    return
-                
-                # Crear objeto similar a FileStorage para split_file_to_blocks
-                from io import BytesIO
-                file_obj = BytesIO(file_data)
-                file_obj.filename = filename
-                
-                # Dividir en bloques
-                temp_dir = os.path.join(os.path.dirname(__file__), 'temp')
-                metadata = split_file_to_blocks(file_obj, temp_dir, block_size=1024*1024)
-                
-                # Determinar uploader (si existe un nodo con esta IP)
-                uploader_node = None
-                with lock_nodos:
-                    for nid, info in nodos_registrados.items():
-                        if info.get('ip') == client_ip:
-                            uploader_node = nid
-                            break
-
-                # Crear file_id
+                sess = upload_sessions_mgr.create(data.get('filename'), data.get('size'),
+                                                  block_size=data.get('block_size') or BLOCK_SIZE, uploader_ip=client_ip)
+                self._send_json(dict(sess, status='OK'))
+            except upload_sessions.UploadError as e:
+                self._send_json({'status': 'ERROR', 'message': str(e)}, status=e.status)
+
+        elif path.startswith('/uploads/') and path.endswith('/commit'):
+            # Confirma un upload por partes: coloca y distribuye los bloques
+            upload_id = path.split('/')[2]
+            try:
+                filename = safe_basename(upload_sessions_mgr.status(upload_id)['filename'])
                 file_id = f"file_{int(time.time()*1000)}_{os.path.splitext(filename)[0]}"
-
-                # Calcular placements usando el Partitioner (no persiste cambios)
-                try:
-                    part = partitioner.Partitioner(replication=2)
-                    ok, placements, msg = part.allocate_blocks_for_file(metadata.get('total_blocks', 0), nodos_registrados, blocks_store)
-                    if not ok:
-                        # No hay recursos para asignar réplicas/primarios
-                        self._send_json({'status': 'ERROR', 'message': f'No se pudo asignar bloques: {msg}'}, status=500)
-                        return
-                except Exception as e:
-                    print(f"[PARTITION] Error calculando placements: {e}")
-                    self._send_json({'status': 'ERROR', 'message': 'Error interno en particionador'}, status=500)
-                    return
-
-                # Aplicar las asignaciones a la tabla global de bloques (marcar primarios/replicas)
-                try:
-                    changed = assign_blocks_to_file(blocks_store, file_id, placements)
-                    if changed:
-                        save_persistent_blocks(blocks_store)
-                except Exception as e:
-                    print(f"[BLOCKS] Error asignando bloques: {e}")
-                    self._send_json({'status': 'ERROR', 'message': 'Error asignando bloques en tabla global'}, status=500)
-                    return
-
-                # Enviar los bloques a los nodos correspondientes por TCP (si están conectados)
-                try:
-                    for p in placements:
-                        idx = p.get('file_block_index', 0)
-                        # obtener info del bloque en metadata (ruta temporal creada por split)
-                        try:
-                            src_info = metadata.get('blocks', [])[idx - 1]
-                        except Exception:
-                            src_info = None
-                        if not src_info:
-                            continue
-                        src_path = src_info.get('path')
-                        block_name = src_info.get('block_name')
-
-                        # Enviar primary al nodo primario si está conectado
-                        prim_node = p.get('primary_node')
-                        prim_block_id = p.get('primary_block_id')
-                        if prim_node and prim_block_id:
-                            if prim_node in conexiones_activas and src_path and os.path.exists(src_path):
-                                try:
-                                    with open(src_path, 'rb') as f:
-                                        data_b = f.read()
-                                    b64 = base64.b64encode(data_b).decode('ascii')
-                                    msg = {
-                                        'type': 'STORE_BLOCK',
-                                        'file_id': file_id,
-                                        'block_id': prim_block_id,
-                                        'block_name': block_name,
-                                        'is_replica': False,
-                                        'data_b64': b64
-                                    }
-                                    conexiones_activas[prim_node].sendall(json.dumps(msg).encode())
-                                    blocks_store['blocks'][prim_block_id]['stored_on'] = prim_node
-                                    blocks_store['blocks'][prim_block_id]['remote_name'] = block_name
-                                except Exception as e:
-                                    print(f"[BLOCKS] No se pudo enviar primary {prim_block_id} a {prim_node}: {e}")
-                            else:
-                                print(f"[BLOCKS] Nodo {prim_node} no conectado. Dejar primary {prim_block_id} pendiente.")
-
-                        # Enviar réplicas
-                        for rid, rnode in zip(p.get('replica_block_ids', []), p.get('replica_nodes', [])):
-                            if rnode and rid:
-                                if rnode in conexiones_activas and src_path and os.path.exists(src_path):
-                                    try:
-                                        with open(src_path, 'rb') as f:
-                                            data_b = f.read()
-                                        b64 = base64.b64encode(data_b).decode('ascii')
-                                        msg = {
-                                            'type': 'STORE_BLOCK',
-                                            'file_id': file_id,
-                                            'block_id': rid,
-                                            'block_name': block_name,
-                                            'is_replica': True,
-                                            'data_b64': b64
-                                        }
-                                        conexiones_activas[rnode].sendall(json.dumps(msg).encode())
-                                        # mantener lista de nodos que almacenaron este bloque
-                                        blk = blocks_store['blocks'].get(rid, {})
-                                        blk.setdefault('stored_on_list', [])
-                                        if rnode not in blk['stored_on_list']:
-                                            blk['stored_on_list'].append(rnode)
-                                        blk['remote_name'] = block_name
-                                        blocks_store['blocks'][rid] = blk
-                                    except Exception as e:
-                                        print(f"[BLOCKS] No se pudo enviar replica {rid} a {rnode}: {e}")
-                                else:
-                                    print(f"[BLOCKS] Nodo {rnode} no conectado. Dejar replica {rid} pendiente.")
-
-                        # Asegurar que el uploader (si existe) reciba también una copia local del bloque
-                        try:
-                            if uploader_node and uploader_node in conexiones_activas and src_path and os.path.exists(src_path):
-                                # Para este bloque, evitar doble envío si ya fue almacenado en uploader
-                                already = False
-                                # prim_node y replica nodes pueden haber sido enviados antes
-                                sent_list = []
-                                primn = p.get('primary_node')
-                                if primn:
-                                    sent_list.append(primn)
-                                sent_list.extend([n for n in (p.get('replica_nodes') or []) if n])
-                                if uploader_node in sent_list:
-                                    already = True
-
-                                if not already:
-                                    # enviar copia al uploader
-                                    try:
-                                        with open(src_path, 'rb') as f:
-                                            data_b = f.read()
-                                        b64 = base64.b64encode(data_b).decode('ascii')
-                                        msg = {
-                                            'type': 'STORE_BLOCK',
-                                            'file_id': file_id,
-                                            'block_id': prim_block_id or p.get('primary_block_id') or p.get('replica_block_ids', [None])[0],
-                                            'block_name': block_name,
-                                            'is_replica': False,
-                                            'data_b64': b64
-                                        }
-                                        conexiones_activas[uploader_node].sendall(json.dumps(msg).encode())
-                                        # registrar en stored_on_list
-                                        bid_for_meta = prim_block_id or p.get('primary_block_id') or (p.get('replica_block_ids') or [None])[0]
-                                        if bid_for_meta and bid_for_meta in blocks_store.get('blocks', {}):
-                                            blk = blocks_store['blocks'][bid_for_meta]
-                                            blk.setdefault('stored_on_list', [])
-                                            if uploader_node not in blk['stored_on_list']:
-                                                blk['stored_on_list'].append(uploader_node)
-                                            blk['remote_name'] = block_name
-                                            blocks_store['blocks'][bid_for_meta] = blk
-                                    except Exception as e:
-                                        print(f"[BLOCKS] No se pudo enviar copia al uploader {uploader_node}: {e}")
-                        except Exception:
-                            pass
-
-                    # Persistir cambios de stored_on/remote_name
-                    save_persistent_blocks(blocks_store)
-                except Exception as e:
-                    print(f"[BLOCKS] Error al enviar bloques a nodos: {e}")
-
-                # Registrar metadatos del archivo en el índice persistente de archivos (incluye placements)
-                try:
-                    entry = {
-                        'file_id': file_id,
-                        'original_filename': filename,
-                        'uploader_node': uploader_node,
-                        'uploaded_at': time.time(),
-                        'meta': metadata,
-                        'placements': placements
-                    }
-                    with lock_nodos:
-                        files_store['files'][file_id] = entry
-                    try:
-                        files_manager.save_persistent_files(files_store)
-                    except Exception as e:
-                        print(f"[FILES] Error guardando metadatos de archivo: {e}")
-                except Exception as e:
-                    print(f"[FILES] Error registrando archivo en índice persistente: {e}")
-
-                # No crear nuevas entradas en la tabla global de bloques aquí.
-                # Guardamos los bloques en disco (split_file_to_blocks ya guardó metadata)
-                # y devolvemos la metadata al cliente. La asignación a nodos
-                # deberá realizarse mediante la lógica de asignación cuando existan nodos.
-                print(f"[HTTP] Archivo '{filename}' dividido en {metadata['total_blocks']} bloques (guardados en temp)")
-                self._send_json({
-                    'status': 'ok',
-                    'meta': metadata,
-                    'message': f'Archivo dividido en {metadata["total_blocks"]} bloques'
-                })
-                
+                # Las partes pasan al directorio de staging del archivo, nombradas por file_id
+                metadata = upload_sessions_mgr.commit(upload_id, dest_dir=staging_area.path_for(file_id),
+                                                      block_prefix=file_id)
+            except upload_sessions.UploadError as e:
+                self._send_json({'status': 'ERROR', 'message': str(e)}, status=e.status)
+                return
+            uploader_node, _ = _uploader_node(client_ip)
+            try:
+                ok, status, msg = store_file_blocks(file_id, filename, metadata, uploader_node)
             except Exception as e:
-                print(f"[HTTP] Error procesando /upload: {e}")
-                self._send_json({'status': 'ERROR', 'message': str(e)}, status=500)
+                log.error(f"[UPLOADS] Error colocando bloques de {upload_id}: {e}")
+                ok, status, msg = False, 500, 'internal error'
+            if not ok:
+                # Permitir reintentar el commit sin volver a subir las partes
+                upload_sessions_mgr.reopen(upload_id)
+                staging_area.remove_dir(file_id)
+                self._send_json({'status': 'ERROR', 'message': msg}, status=status)
                 return
+            upload_sessions_mgr.finish(upload_id)
+            log.info(f"[UPLOADS] Upload {upload_id} confirmado como {file_id} ({metadata['total_blocks']} bloques)")
+            self._send_json({'status': 'ok', 'file_id': file_id, 'meta': metadata,
+                             'message': f'Archivo dividido en {metadata["total_blocks"]} bloques'})
 
         elif path == '/register':
             node_id = data.get('node_id')
@@ -966,26 +2219,24 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
                 nodos_registrados[node_id] = {'ip': client_ip, 'port': COORD_PORT, 'capacity': capacity, 'status': 'online', 'used': 0, 'last_seen': time.time()}
                 # Actualizar bloques globales para este nodo
                 try:
-                    update_blocks_for_node(node_id, capacity, blocks_store)
+                    update_blocks_for_node(node_id, capacity, blocks_store, slot_size=SLOT_SIZE)
                     # Si el nodo está online, asegurar que sus bloques están disponibles
                     set_node_blocks_available(node_id, blocks_store)
                 except Exception as e:
-                    print(f"[BLOCKS] Error al actualizar bloques en /register: {e}")
+                    log.error(f"[BLOCKS] Error al actualizar bloques en /register: {e}")
                 # Intentar replicar bloques existentes hacia este nuevo nodo si hay espacio
                 try:
                     created = replicate_blocks_to_node(blocks_store, files_store, node_id)
                     if created:
-                        print(f"[BLOCKS] Se crearon {created} réplicas en {node_id} tras registro")
+                        log.info(f"[BLOCKS] Se crearon {created} réplicas en {node_id} tras registro")
                         try:
-                            save_persistent_blocks(blocks_store)
-                            files_manager.save_persistent_files(files_store)
+                            persistence_svc.mark_dirty('blocks', 'files')
                         except Exception as e:
-                            print(f"[BLOCKS] Error guardando tras replicado: {e}")
+                            log.error(f"[BLOCKS] Error guardando tras replicado: {e}")
                 except Exception as e:
-                    print(f"[BLOCKS] Error replicando bloques al registrar nodo {node_id}: {e}")
-            save_persistent_nodes()
-            save_persistent_blocks(blocks_store)
-            print(f"[HTTP] Nodo registrado via HTTP: {node_id} -> {client_ip} cap={capacity}")
+                    log.error(f"[BLOCKS] Error replicando bloques al registrar nodo {node_id}: {e}")
+            persistence_svc.mark_dirty('nodes', 'blocks')
+            log.info(f"[HTTP] Nodo registrado via HTTP: {node_id} -> {client_ip} cap={capacity}")
 
             # Notificar a nodos TCP activos que un nuevo nodo se registró via API
             evento = {
@@ -995,7 +2246,7 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
                 'port': COORD_PORT,
                 'capacity': capacity
             }
-            print(f"[HTTP][BROADCAST] Notificando conexión de {node_id} a {len(conexiones_activas)} nodos TCP activos")
+            log.info(f"[HTTP][BROADCAST] Notificando conexión de {node_id} a {len(conexiones_activas)} nodos TCP activos")
             _broadcast_event(evento, exclude_node=None)
 
             self._send_json({'status': 'OK', 'node_id': node_id})
@@ -1024,17 +2275,113 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
                         pass
 
             if changed:
-                save_persistent_nodes()
+                persistence_svc.mark_dirty('nodes')
 
             evento = {'type': 'NODE_DISCONNECTED', 'node_id': node_id}
-            print(f"[HTTP] Petición de desconexión para {node_id} recibida. Marcado offline.")
+            log.info(f"[HTTP] Petición de desconexión para {node_id} recibida. Marcado offline.")
             _broadcast_event(evento, exclude_node=node_id)
             self._send_json({'status': 'OK', 'node_id': node_id})
 
         elif path == '/message':
-            print(f"[HTTP] Mensaje recibido via API: {data}")
+            log.info(f"[HTTP] Mensaje recibido via API: {data}")
             self._send_json({'status': 'OK'})
 
+        elif path == '/admin/profile/start':
+            # JSON: { mode: 'sample'|'cprofile', seconds: N (opcional), interval: s (solo sample) }
+            try:
+                seconds = _number_param(data, 'seconds', cast=float, minimum=0)
+                interval = _number_param(data, 'interval', 0.005, cast=float, minimum=0.0001)
+            except ValueError as e:
+                self._send_json({'status': 'ERROR', 'message': str(e)}, status=400)
+                return
+            try:
+                ok, msg = profiler.start_profile(mode=data.get('mode', 'sample'), seconds=seconds, interval=interval)
+            except Exception as e:
+                ok, msg = False, str(e)
+            if ok:
+                self._send_json({'status': 'OK'})
+            else:
+                self._send_json({'status': 'ERROR', 'message': msg}, status=409)
+
+        elif path == '/admin/profile/stop':
+            try:
+                top = _number_param(data, 'top', 30)
+            except ValueError as e:
+                self._send_json({'status': 'ERROR', 'message': str(e)}, status=400)
+                return
+            report = profiler.stop_profile(top=top, sort=data.get('sort', 'cumulative'))
+            if report is None:
+                self._send_json({'status': 'ERROR', 'message': 'no hay sesión de perfilado activa'}, status=409)
+            else:
+                self._send_json({'status': 'OK', 'profile': report})
+
+        elif path == '/admin/persistence/flush':
+            # Escribe ahora las tablas pendientes (sin esperar al intervalo)
+            written = persistence_svc.flush()
+            self._send_json({'status': 'OK', 'written': written})
+
+        elif path == '/admin/cache':
+            # JSON: { max_mb: N (opcional, redimensiona; 0 desactiva), clear: true (opcional) }
+            try:
+                max_mb = _number_param(data, 'max_mb', minimum=0)
+            except ValueError as e:
+                self._send_json({'status': 'ERROR', 'message': str(e)}, status=400)
+                return
+            if data.get('clear'):
+                block_cache.clear()
+            if max_mb is not None:
+                block_cache.resize(max_mb * 1024 * 1024)
+            self._send_json({'status': 'OK', 'cache': block_cache.stats()})
+
+        elif path == '/admin/gc':
+            # JSON: { forget_node: 'nodo3' (opcional: nodo retirado, liberar sus slots sin esperar su confirmación) }
+            forget = data.get('forget_node')
+            if forget:
+                bids = delete_queue.drop_node(forget)
+                with lock_nodos:
+                    freed = sum(1 for bid in bids if confirm_block_deleted(blocks_store, bid, forget))
+                persistence_svc.mark_dirty('blocks')
+                log.info(f"[GC] Olvidados {len(bids)} borrados pendientes de {forget} ({freed} slots liberados)")
+            gc_wakeup.set()
+            self._send_json({'status': 'OK', 'gc': delete_queue.stats()})
+
+        elif path == '/admin/logging':
+            # JSON: { component: 'TCP' (opcional, sin él cambia el nivel por defecto), level: 'WARNING' }
+            try:
+                log.set_level(data.get('component'), data.get('level', 'INFO'))
+                self._send_json({'status': 'OK', 'levels': log.levels()})
+            except ValueError as e:
+                self._send_json({'status': 'ERROR', 'message': str(e)}, status=400)
+
+        elif path == '/admin/tracemalloc/start':
+            # JSON: { frames: N, seconds: N (opcional) }
+            try:
+                frames = _number_param(data, 'frames', 10)
+                seconds = _number_param(data, 'seconds', cast=float, minimum=0)
+            except ValueError as e:
+                self._send_json({'status': 'ERROR', 'message': str(e)}, status=400)
+                return
+            try:
+                ok, msg = profiler.start_tracemalloc(frames=frames, seconds=seconds)
+            except Exception as e:
+                ok, msg = False, str(e)
+            if ok:
+                self._send_json({'status': 'OK'})
+            else:
+                self._send_json({'status': 'ERROR', 'message': msg}, status=409)
+
+        elif path == '/admin/tracemalloc/stop':
+            try:
+                top = _number_param(data, 'top', 25)
+            except ValueError as e:
+                self._send_json({'status': 'ERROR', 'message': str(e)}, status=400)
+                return
+            report = profiler.stop_tracemalloc(top=top)
+            if report is None:
+                self._send_json({'status': 'ERROR', 'message': 'no hay sesión tracemalloc activa'}, status=409)
+            else:
+                self._send_json({'status': 'OK', 'tracemalloc': report})
+
         elif path == '/files/delete':
             # Espera JSON: { file_id: 'file_xxx' }
             file_id = data.get('file_id')
@@ -1045,43 +2392,176 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
             try:
                 with lock_nodos:
                     entry = files_store.get('files', {}).get(file_id)
-                    if not entry:
+                    if not entry or packing.is_pack(entry):
                         self._send_json({'status': 'ERROR', 'message': 'file not found'}, status=404)
                         return
-                    # recopilar block ids (primarios + réplicas)
-                    placements = entry.get('placements', [])
-                    block_ids = []
-                    for p in placements:
-                        if p.get('primary_block_id'):
-                            block_ids.append(p.get('primary_block_id'))
-                        for rid in p.get('replica_block_ids', []):
-                            block_ids.append(rid)
-
-                    # Liberar bloques (elimina ficheros físicos)
-                    freed = free_blocks(blocks_store, block_ids)
-                    if freed:
-                        save_persistent_blocks(blocks_store)
-
-                    # eliminar entrada de índice de archivos
-                    try:
-                        del files_store['files'][file_id]
-                        files_manager.save_persistent_files(files_store)
-                    except Exception as e:
-                        print(f"[FILES] Error eliminando metadatos de archivo: {e}")
+                    _release_file_locked(file_id)
 
                 self._send_json({'status': 'OK', 'file_id': file_id})
             except Exception as e:
-                print(f"[HTTP] Error en /files/delete: {e}")
+                log.error(f"[HTTP] Error en /files/delete: {e}")
+                self._send_json({'status': 'ERROR', 'message': 'internal error'}, status=500)
+
+        else:
+            self._send_json({'error': 'Not found'}, status=404)
+
+    def _stream_upload(self, parsed):
+        """
+        POST /upload: un archivo en multipart/form-data. Los bloques se colocan y
+        se envían a los nodos mientras llega el resto del cuerpo (ver stream_upload).
+        """
+        client_ip = self.client_address[0]
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = 0
+        log.info(f"[HTTP] do_POST /upload desde {client_ip} ({length} bytes)")
+        if length <= 0:
+            self.close_connection = True
+            self._send_json({'status': 'ERROR', 'message': 'Content-Length requerido'}, status=411)
+            return
+        # Bloquear uploads si la IP cliente corresponde a un nodo desconectado
+        uploader_node, uploader_status = _uploader_node(client_ip)
+        if uploader_status and uploader_status != 'online':
+            self.close_connection = True
+            self._send_json({'status': 'ERROR', 'message': 'Nodo desconectado: no se permiten subidas/ modificaciones'}, status=403)
+            return
+        content_type = self.headers.get('Content-Type', '')
+        if 'multipart/form-data' not in content_type:
+            self.close_connection = True
+            self._send_json({'status': 'ERROR', 'message': 'Expected multipart/form-data'}, status=400)
+            return
+        # Dividir en bloques (configuración del cluster, o por archivo vía query string)
+        try:
+            chunking = _chunking_from_params(_query_params(parsed.query))
+        except ValueError as e:
+            self.close_connection = True
+            self._send_json({'status': 'ERROR', 'message': str(e)}, status=400)
+            return
+
+        body = _BodyReader(self.rfile, length)
+        try:
+            reader = _MultipartFileReader(body, content_type)
+            filename = safe_basename(reader.open())
+        except ValueError as e:
+            self.close_connection = True
+            self._send_json({'status': 'ERROR', 'message': str(e)}, status=400)
+            return
+        # Los bloques se nombran por file_id (dos subidas con el mismo nombre no se pisan)
+        file_id = f"file_{int(time.time()*1000)}_{os.path.splitext(filename)[0]}"
+        try:
+            ok, status, msg, metadata = stream_upload(reader, file_id, filename, chunking, uploader_node)
+        except Exception as e:
+            log.error(f"[HTTP] Error procesando /upload: {e}")
+            ok, status, msg = False, 500, str(e)
+        if not ok:
+            # El resto del cuerpo no se lee: cerrar la conexión al responder
+            self.close_connection = True
+            self._send_json({'status': 'ERROR', 'message': msg}, status=status)
+            return
+        body.drain()
+        log.info(f"[HTTP] Archivo '{filename}' dividido en {metadata['total_blocks']} bloques (en staging)")
+        self._send_json({
+            'status': 'ok',
+            'file_id': file_id,
+            'meta': metadata,
+            'message': f'Archivo dividido en {metadata["total_blocks"]} bloques'
+        })
+
+    def _bulk_upload(self, parsed):
+        """
+        POST /upload/bulk: importa muchos archivos en una petición. Cuerpo: un tar
+        (application/x-tar, también .tar.gz) que se procesa mientras llega, o
+        multipart/form-data con varios archivos. Acepta los mismos parámetros de
+        chunking que /upload.
+        """
+        client_ip = self.client_address[0]
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = 0
+        log.info(f"[HTTP] do_POST /upload/bulk desde {client_ip} ({length} bytes)")
+        if length <= 0:
+            self.close_connection = True
+            self._send_json({'status': 'ERROR', 'message': 'Content-Length requerido'}, status=411)
+            return
+        uploader_node, uploader_status = _uploader_node(client_ip)
+        if uploader_status and uploader_status != 'online':
+            self.close_connection = True
+            self._send_json({'status': 'ERROR', 'message': 'Nodo desconectado: no se permiten subidas/ modificaciones'}, status=403)
+            return
+        try:
+            chunking = _chunking_from_params(_query_params(parsed.query))
+        except ValueError as e:
+            self.close_connection = True
+            self._send_json({'status': 'ERROR', 'message': str(e)}, status=400)
+            return
+
+        body = _BodyReader(self.rfile, length)
+        content_type = self.headers.get('Content-Type', '')
+        try:
+            if 'multipart/form-data' in content_type:
+                try:
+                    items = _multipart_files(body.read(), content_type)
+                except ValueError as e:
+                    self._send_json({'status': 'ERROR', 'message': str(e)}, status=400)
+                    return
+            else:
+                items = _tar_members(body)
+            result = ingest_files(items, uploader_node, chunking)
+            body.drain()
+        except Exception as e:
+            log.error(f"[HTTP] Error en /upload/bulk: {e}")
+            self.close_connection = True
+            self._send_json({'status': 'ERROR', 'message': str(e)}, status=500)
+            return
+        status = 'ok' if not result['errors'] else ('partial' if result['files'] else 'ERROR')
+        self._send_json(dict(result, status=status), status=200 if result['files'] or not result['errors'] else 500)
+
+    def do_PUT(self):
+        parsed = urlparse(self.path)
+        parts = parsed.path.strip('/').split('/')
+        # /uploads/<upload_id>/parts/<index>  (cuerpo = bytes de la parte)
+        if len(parts) == 4 and parts[0] == 'uploads' and parts[2] == 'parts':
+            try:
+                index = int(parts[3])
+                length = int(self.headers.get('Content-Length', 0))
+            except ValueError:
+                self._send_json({'status': 'ERROR', 'message': 'índice o Content-Length inválido'}, status=400)
+                return
+            try:
+                res = upload_sessions_mgr.put_part(parts[1], index, self.rfile, length,
+                                                   sha256=self.headers.get('X-Part-SHA256'))
+                self._send_json(dict(res, status='OK'))
+            except upload_sessions.UploadError as e:
+                # Si no consumimos el cuerpo, la conexión no puede reutilizarse
+                self.close_connection = True
+                self._send_json({'status': 'ERROR', 'message': str(e)}, status=e.status)
+            except Exception as e:
+                log.error(f"[UPLOADS] Error guardando parte {parts[3]} de {parts[1]}: {e}")
+                self.close_connection = True
                 self._send_json({'status': 'ERROR', 'message': 'internal error'}, status=500)
+        else:
+            self._send_json({'error': 'Not found'}, status=404)
 
+    def do_DELETE(self):
+        parsed = urlparse(self.path)
+        parts = parsed.path.strip('/').split('/')
+        # /uploads/<upload_id>: aborta un upload por partes
+        if len(parts) == 2 and parts[0] == 'uploads':
+            try:
+                upload_sessions_mgr.abort(parts[1])
+                self._send_json({'status': 'OK', 'upload_id': parts[1]})
+            except upload_sessions.UploadError as e:
+                self._send_json({'status': 'ERROR', 'message': str(e)}, status=e.status)
         else:
             self._send_json({'error': 'Not found'}, status=404)
 
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Part-SHA256')
         self.send_header('Content-Length', '0')
         self.end_headers()
 
@@ -1089,85 +2569,107 @@ class SimpleAPIHandler(BaseHTTPRequestHandler):
 def start_http_server():
     server_address = ('', HTTP_PORT)
     httpd = ThreadingHTTPServer(server_address, SimpleAPIHandler)
-    print(f"[HTTP] API escuchando en puerto {HTTP_PORT}...")
+    log.info(f"[HTTP] API escuchando en puerto {HTTP_PORT}...")
     httpd.serve_forever()
+
+
+def _mark_nodes_offline(node_ids, reason):
+    """Cierra la conexión de los nodos, los marca offline y notifica al resto."""
+    removed = []
+    with lock_nodos:
+        for nid in node_ids:
+            sock = conexiones_activas.pop(nid, None)
+            if sock is not None:
+                try:
+                    sock.close()
+                except Exception:
+                    pass
+            if nid in nodos_registrados:
+                nodos_registrados[nid]['status'] = 'offline'
+                nodos_registrados[nid]['last_seen'] = time.time()
+                last_pong.pop(nid, None)
+                log.info(f"[MONITOR] Nodo marcado como offline: {nid} ({reason})")
+                removed.append(nid)
+    for nid in node_ids:
+        failure_detector.remove(nid)
+        replica_selector.set_suspect(nid, False)
+    # fuera del lock: persistir y notificar
+    if removed:
+        persistence_svc.mark_dirty('nodes')
+        for nid in removed:
+            _broadcast_event({"type": "NODE_DISCONNECTED", "node_id": nid}, exclude_node=nid)
+
+
 def monitor_connections(interval=10):
     """
-    Hilo que chequea periódicamente las conexiones activas enviando un PING.
-    Si al enviar se produce una excepción, se marca el nodo como desconectado.
+    Hilo de heartbeats: envía PING a las conexiones activas y evalúa cada nodo con
+    el detector phi-accrual (ver failure_detector.py). Un nodo pasa a 'suspect'
+    cuando su silencio es anómalo para él (las lecturas prefieren otras copias) y
+    a offline solo cuando phi supera el umbral y lleva un mínimo de silencio.
+
+    El barrido no toma lock_nodos: trabaja sobre copias de las tablas y solo
+    bloquea para aplicar las transiciones a offline, que son raras.
     """
-    print(f"[MONITOR] Monitor de conexiones iniciado (interval={interval}s)")
-    timeout = max(10, interval * 3)  # tiempo sin PONG para considerar offline
+    log.info(f"[MONITOR] Monitor de conexiones iniciado (interval={interval}s)")
+    timeout = max(10, interval * 3)  # nodos registrados vía HTTP: tiempo sin actividad para considerar offline
+    # Si en un mismo barrido cae más de la mitad de los nodos, lo más probable es que
+    # el problema sea local (coordinador saturado): se dejan en 'suspect' hasta este límite
+    hard_timeout = max(60.0, interval * 12)
+    storm_held = set()
     while True:
         now = time.time()
+        mono = time.monotonic()
         to_remove = []
 
-        # 1) Intentar enviar PING a todas las conexiones activas
-        with lock_nodos:
-            for nid, sock in list(conexiones_activas.items()):
-                try:
-                    ping = {"type": "PING"}
-                    sock.sendall(json.dumps(ping).encode())
-                except Exception as e:
-                    print(f"[MONITOR] Error al enviar PING a {nid}: {e}. Marcando para verificación/desconexión.")
-                    to_remove.append(nid)
+        # 1) PING a todas las conexiones activas (copia de la tabla, sin lock global)
+        active = list(conexiones_activas.items())
+        for nid, sock in active:
+            try:
+                # `ts` vuelve en el PONG: RTT para el detector y la selección de réplicas
+                send_json(sock, {"type": "PING", "ts": mono})
+            except Exception as e:
+                log.error(f"[MONITOR] Error al enviar PING a {nid}: {e}. Marcando para desconexión.")
+                to_remove.append(nid)
 
-        # 2) Revisar timestamps de last_pong para detectar nodos que no respondieron
-        with lock_nodos:
-            for nid in list(conexiones_activas.keys()):
-                lp = last_pong.get(nid)
-                if lp is None:
-                    # Si no tenemos registro de PONG y hace más de timeout desde registro, marcar
-                    if now - last_pong.get(nid, 0) > timeout:
-                        to_remove.append(nid)
+        # 2) Evaluar cada nodo conectado con el detector phi-accrual
+        candidates = []
+        for nid, _ in active:
+            if nid in to_remove:
+                continue
+            previous, state, phi, silence = failure_detector.check(nid, mono)
+            if state == failure_detector_mod.OFFLINE:
+                candidates.append((nid, phi, silence))
+            elif state != previous:
+                if state == failure_detector_mod.SUSPECT:
+                    log.warning(f"[MONITOR] Nodo {nid} sospechoso: phi={phi:.1f}, {silence:.1f}s sin respuesta")
                 else:
-                    if now - lp > timeout:
-                        print(f"[MONITOR] No PONG de {nid} en {now-lp:.1f}s (> {timeout}s). Marcando offline.")
-                        to_remove.append(nid)
-
-            # 2b) Detectar nodos registrados vía HTTP (sin socket TCP) que llevan mucho sin actividad
-            for nid, info in list(nodos_registrados.items()):
-                if info.get('status') == 'online' and nid not in conexiones_activas:
-                    last = info.get('last_seen', 0)
-                    if last and (now - last > timeout):
-                        print(f"[MONITOR] Nodo {nid} registrado vía HTTP sin actividad en {now-last:.1f}s (> {timeout}s). Marcando offline.")
-                        to_remove.append(nid)
-
-            # Unir removals únicos
-            to_remove = list(dict.fromkeys(to_remove))
-
-            # Procesar desconexiones detectadas: actualizar estructuras bajo lock
-            removed_copy = []
-            for nid in to_remove:
-                try:
-                    if nid in conexiones_activas:
-                        try:
-                            conexiones_activas[nid].close()
-                        except Exception:
-                            pass
-                        del conexiones_activas[nid]
-                except KeyError:
-                    pass
-
-                if nid in nodos_registrados:
-                    nodos_registrados[nid]['status'] = 'offline'
-                    nodos_registrados[nid]['last_seen'] = time.time()
-                    print(f"[MONITOR] Nodo marcado como offline: {nid}")
-                    # limpiar last_pong
-                    try:
-                        del last_pong[nid]
-                    except KeyError:
-                        pass
-                    removed_copy.append(nid)
+                    log.info(f"[MONITOR] Nodo {nid} vuelve a responder (phi={phi:.1f})")
+                replica_selector.set_suspect(nid, state == failure_detector_mod.SUSPECT)
+        storm = len(candidates) > max(1, len(active) // 2)
+        for nid, phi, silence in candidates:
+            if storm and silence < hard_timeout:
+                failure_detector.set_state(nid, failure_detector_mod.SUSPECT)
+                replica_selector.set_suspect(nid, True)
+                continue
+            log.warning(f"[MONITOR] Nodo {nid} sin PONG en {silence:.1f}s (phi={phi:.1f}). Marcando offline.")
+            to_remove.append(nid)
+        held = {nid for nid, _, _ in candidates} if storm else set()
+        if held and held != storm_held:
+            log.warning(f"[MONITOR] {len(candidates)} de {len(active)} nodos sin respuesta a la vez: "
+                        f"se mantienen como sospechosos (posible saturación local)")
+        storm_held = held
+
+        # 2b) Nodos registrados vía HTTP (sin socket TCP) que llevan mucho sin actividad
+        for nid in nodos_registrados.ids_with_status('online'):
+            if nid not in conexiones_activas:
+                last = nodos_registrados.get(nid, {}).get('last_seen', 0)
+                if last and (now - last > timeout):
+                    log.warning(f"[MONITOR] Nodo {nid} registrado vía HTTP sin actividad en {now-last:.1f}s (> {timeout}s). Marcando offline.")
+                    to_remove.append(nid)
 
-        # fuera del lock: persistir y notificar
-        if removed_copy:
-            save_persistent_nodes()
-            for nid in removed_copy:
-                evento = {"type": "NODE_DISCONNECTED", "node_id": nid}
-                _broadcast_event(evento, exclude_node=nid)
+        if to_remove:
+            _mark_nodes_offline(list(dict.fromkeys(to_remove)), 'heartbeat')
 
-        # dormir fuera del lock
         threading.Event().wait(interval)
 
 
@@ -1177,53 +2679,68 @@ def manejar_nodo(conn, addr):
     Aquí el nodo envía REGISTER_NODE con el node_id que recibió por discovery.
     Mantiene la conexión abierta para mensajes posteriores.
     """
-    print(f"[TCP] Nueva conexión TCP desde {addr}")
+    log.info(f"[TCP] Nueva conexión TCP desde {addr}")
     
     node_id_actual = None
     conn.settimeout(None)  # Sin timeout para conexión persistente
 
-    try:
-        while True:
-            data = conn.recv(1024)
-            if not data:
-                print(f"[TCP] {node_id_actual or addr} cerró la conexión.")
-                break
+    def _bad_frame(e):
+        log.error(f"[TCP] Error al decodificar JSON de {node_id_actual or addr}: {e}")
 
-            try:
-                msg = json.loads(data.decode())
-            except Exception as e:
-                print(f"[TCP] Error al decodificar JSON: {e}")
+    try:
+        for msg in protocol.iter_messages(conn, on_error=_bad_frame):
+            if not isinstance(msg, dict):
                 continue
 
             # Actualizar last_seen para clientes que ya se han identificado
             if node_id_actual:
-                with lock_nodos:
-                    if node_id_actual in nodos_registrados:
-                        nodos_registrados[node_id_actual]['last_seen'] = time.time()
+                nodos_registrados.touch(node_id_actual)
+                # Cualquier mensaje reinicia el silencio del nodo en el detector de fallos
+                failure_detector.activity(node_id_actual)
 
             msg_type = msg.get("type")
 
             if msg_type == "REGISTER_NODE":
                 node_id_actual = msg.get("node_id")
                 listen_port = msg.get("listen_port")
+                # Capacidad declarada por el nodo (node_daemon: clave 'capacity' de su configuración)
+                declared = msg.get("capacity")
+                if declared is not None and (isinstance(declared, bool) or not isinstance(declared, (int, float)) or declared <= 0):
+                    log.warning(f"[TCP] {node_id_actual} declaró una capacidad inválida: {declared!r}")
+                    declared = None
 
                 # Guardamos la info del nodo en la tabla global
                 with lock_nodos:
+                    # Sin capacidad declarada se conserva la conocida (p.ej. vía /register)
+                    prev = nodos_registrados.get(node_id_actual, {})
+                    capacity = declared if declared is not None else prev.get('capacity', 0)
                     nodos_registrados[node_id_actual] = {
                         "ip": addr[0],
                         "port": listen_port,
+                        "capacity": capacity,
                         "status": "online",
                         "used": 0,
                         "last_seen": time.time()
                     }
+                    if declared is not None:
+                        try:
+                            update_blocks_for_node(node_id_actual, capacity, blocks_store, slot_size=SLOT_SIZE)
+                            set_node_blocks_available(node_id_actual, blocks_store)
+                        except Exception as e:
+                            log.error(f"[BLOCKS] Error al actualizar bloques de {node_id_actual} en REGISTER_NODE: {e}")
                     conexiones_activas[node_id_actual] = conn
+                    node_features[node_id_actual] = set(msg.get('features') or [])
                     # Registrar last_pong al momento del registro
                     last_pong[node_id_actual] = time.time()
+                # Historial de heartbeats nuevo: la conexión anterior ya no es representativa
+                failure_detector.remove(node_id_actual)
+                failure_detector.heartbeat(node_id_actual)
+                replica_selector.set_suspect(node_id_actual, False)
 
-                print(f"[TCP] Nodo registrado: {node_id_actual} -> {addr[0]}:{listen_port}")
-                print(f"[TCP] Tabla actual de nodos: {list(nodos_registrados.keys())}")
+                log.info(f"[TCP] Nodo registrado: {node_id_actual} -> {addr[0]}:{listen_port} cap={capacity}")
+                log.info(f"[TCP] Tabla actual de nodos: {list(nodos_registrados.keys())}")
 
-                conn.sendall(json.dumps({"status": "REGISTER_OK", "node_id": node_id_actual}).encode())
+                send_json(conn, {"status": "REGISTER_OK", "node_id": node_id_actual}, reply_to=msg)
                 # Notificar a los demás nodos que este nodo se ha conectado
                 evento = {
                     "type": "NODE_CONNECTED",
@@ -1231,14 +2748,16 @@ def manejar_nodo(conn, addr):
                     "ip": addr[0],
                     "port": listen_port
                 }
-                print(f"[BROADCAST] Notificando conexión de {node_id_actual} a {len(conexiones_activas)-1} nodos")
+                log.info(f"[BROADCAST] Notificando conexión de {node_id_actual} a {len(conexiones_activas)-1} nodos")
                 _broadcast_event(evento, exclude_node=node_id_actual)
-                save_persistent_nodes()
+                persistence_svc.mark_dirty(*(('nodes', 'blocks') if declared is not None else ('nodes',)))
                 # Reintentar enviar bloques pendientes asignados a este nodo
                 try:
                     threading.Thread(target=send_pending_blocks, args=(node_id_actual,), daemon=True).start()
+                    # Borrados que quedaron pendientes mientras estaba desconectado
+                    gc_wakeup.set()
                 except Exception as e:
-                    print(f"[TCP] Error lanzando reintento de bloques pendientes para {node_id_actual}: {e}")
+                    log.error(f"[TCP] Error lanzando reintento de bloques pendientes para {node_id_actual}: {e}")
 
             elif msg_type == "GET_NODOS":
                 # Retorna la lista de todos los nodos conectados
@@ -1249,8 +2768,8 @@ def manejar_nodo(conn, addr):
                     "type": "NODOS_LIST",
                     "nodos": nodos_lista
                 }
-                conn.sendall(json.dumps(respuesta).encode())
-                print(f"[TCP] {node_id_actual} solicitó lista de nodos. Enviados: {nodos_lista}")
+                send_json(conn, respuesta, reply_to=msg)
+                log.info(f"[TCP] {node_id_actual} solicitó lista de nodos. Enviados: {nodos_lista}")
 
             elif msg_type == "SEND_MESSAGE":
                 from_node = msg.get("from")
@@ -1258,12 +2777,11 @@ def manejar_nodo(conn, addr):
                 contenido = msg.get("content")
                 if to_node == "COORDINADOR":
                     # Mensaje dirigido al servidor
-                    print(f"\n[MENSAJE] {from_node} → COORDINADOR: {contenido}")
-                    respuesta = json.dumps({"status": "MESSAGE_RECEIVED", "message": f"Servidor recibió: {contenido}"})
-                    conn.sendall(respuesta.encode())
+                    log.info(f"[MENSAJE] {from_node} → COORDINADOR: {contenido}")
+                    send_json(conn, {"status": "MESSAGE_RECEIVED", "message": f"Servidor recibió: {contenido}"}, reply_to=msg)
                 else:
                     # Mensaje dirigido a otro nodo
-                    print(f"\n[MENSAJE] {from_node} → {to_node}: {contenido}")
+                    log.info(f"[MENSAJE] {from_node} → {to_node}: {contenido}")
                     with lock_nodos:
                         if to_node in conexiones_activas:
                             try:
@@ -1273,14 +2791,14 @@ def manejar_nodo(conn, addr):
                                     "from": from_node,
                                     "content": contenido
                                 }
-                                conexiones_activas[to_node].sendall(json.dumps(msg_reenvio).encode())
-                                respuesta = json.dumps({"status": "MESSAGE_SENT", "to": to_node})
+                                send_json(conexiones_activas[to_node], msg_reenvio)
+                                respuesta = {"status": "MESSAGE_SENT", "to": to_node}
                             except Exception as e:
-                                print(f"[ERROR] No se pudo enviar mensaje a {to_node}: {e}")
-                                respuesta = json.dumps({"status": "ERROR", "message": f"No se pudo enviar a {to_node}"})
+                                log.error(f"[ERROR] No se pudo enviar mensaje a {to_node}: {e}")
+                                respuesta = {"status": "ERROR", "message": f"No se pudo enviar a {to_node}"}
                         else:
-                            respuesta = json.dumps({"status": "ERROR", "message": f"Nodo {to_node} no conectado"})
-                    conn.sendall(respuesta.encode())
+                            respuesta = {"status": "ERROR", "message": f"Nodo {to_node} no conectado"}
+                    send_json(conn, respuesta, reply_to=msg)
 
             elif msg_type == "PONG":
                 # Cliente responde a un PING enviado por el coordinador
@@ -1288,6 +2806,10 @@ def manejar_nodo(conn, addr):
                 if pong_id:
                     with lock_nodos:
                         last_pong[pong_id] = time.time()
+                        if msg.get('readahead') is not None:
+                            node_readahead_stats[pong_id] = msg.get('readahead')
+                    rtt = replica_selector.record_pong(pong_id, msg.get('ts')) if msg.get('ts') is not None else None
+                    failure_detector.heartbeat(pong_id, rtt=rtt)
                 # opcional: log corto
                 # print(f"[TCP] PONG recibido de {pong_id}")
                 continue
@@ -1298,7 +2820,7 @@ def manejar_nodo(conn, addr):
                 if requested_id:
                     node_id_actual = requested_id
 
-                print(f"[TCP] Nodo {node_id_actual} solicitó desconexión (graceful).")
+                log.info(f"[TCP] Nodo {node_id_actual} solicitó desconexión (graceful).")
                 changed = False
                 with lock_nodos:
                     if node_id_actual and node_id_actual in conexiones_activas:
@@ -1312,46 +2834,44 @@ def manejar_nodo(conn, addr):
                         changed = True
 
                 if changed:
-                    save_persistent_nodes()
+                    persistence_svc.mark_dirty('nodes')
 
                 # Notificar a otros nodos y log claro
                 evento = {
                     "type": "NODE_DISCONNECTED",
                     "node_id": node_id_actual
                 }
-                print(f"[TCP] Nodo {node_id_actual} marcado offline por solicitud del cliente.")
+                log.info(f"[TCP] Nodo {node_id_actual} marcado offline por solicitud del cliente.")
                 _broadcast_event(evento, exclude_node=node_id_actual)
 
                 try:
-                    conn.sendall(json.dumps({"status": "DISCONNECTED", "node_id": node_id_actual}).encode())
+                    send_json(conn, {"status": "DISCONNECTED", "node_id": node_id_actual}, reply_to=msg)
                 except Exception:
                     pass
 
                 break
+            elif msg_type in ('BLOCK_DATA', 'STORE_BLOCK_ACK', 'BLOCKS_DATA', 'STORE_BLOCKS_ACK', 'DELETE_BLOCKS_ACK'):
+                # Copia confirmada por el nodo: se marca como duradera en el hilo de GC (sin tomar el lock aquí)
+                acks = []
+                if msg_type == 'STORE_BLOCK_ACK':
+                    acks = [msg]
+                elif msg_type == 'STORE_BLOCKS_ACK':
+                    acks = msg.get('acks') or []
+                for ack in acks:
+                    if ack.get('status') == 'OK' and ack.get('block_id'):
+                        durable_acks.append((node_id_actual, ack['block_id']))
+                if acks:
+                    gc_wakeup.set()
+                # Respuesta a una petición del coordinador: se entrega a quien la espera (por req_id)
+                if not _resolve_pending(node_id_actual, msg):
+                    log.debug(f"[TCP] {msg_type} de {node_id_actual} sin petición pendiente (req_id={msg.get('req_id')})")
             else:
-                # Procesar mensajes de bloque en respuesta a requests (BLOCK_DATA)
-                if msg_type == 'BLOCK_DATA':
-                    bid = msg.get('block_id')
-                    data_b64 = msg.get('data_b64')
-                    error = msg.get('error')
-                    key = (node_id_actual, bid)
-                    with pending_lock:
-                        ent = pending_block_responses.get(key)
-                        if ent:
-                            if error:
-                                ent['error'] = error
-                                ent['event'].set()
-                            else:
-                                try:
-                                    ent['data'] = base64.b64decode(data_b64.encode('ascii')) if data_b64 else None
-                                except Exception:
-                                    ent['data'] = None
-                                ent['event'].set()
-                else:
-                    print(f"[TCP] Mensaje desconocido de {node_id_actual}: {msg}")
+                log.info(f"[TCP] Mensaje desconocido de {node_id_actual}: {msg}")
+        else:
+            log.info(f"[TCP] {node_id_actual or addr} cerró la conexión.")
 
     except Exception as e:
-        print(f"[TCP] Error en conexión de {node_id_actual or addr}: {e}")
+        log.error(f"[TCP] Error en conexión de {node_id_actual or addr}: {e}")
     finally:
         changed = False
         with lock_nodos:
@@ -1367,16 +2887,17 @@ def manejar_nodo(conn, addr):
                 changed = True
 
         if changed:
-            save_persistent_nodes()
+            failure_detector.remove(node_id_actual)
+            persistence_svc.mark_dirty('nodes')
             # Notificar a los demás nodos
             evento = {
                 "type": "NODE_DISCONNECTED",
                 "node_id": node_id_actual
             }
-            print(f"[BROADCAST] Notificando desconexión de {node_id_actual} a {len(conexiones_activas)} nodos")
+            log.info(f"[BROADCAST] Notificando desconexión de {node_id_actual} a {len(conexiones_activas)} nodos")
             _broadcast_event(evento, exclude_node=node_id_actual)
         
-        print(f"[TCP] Desconexión de {node_id_actual or addr}. Nodos activos: {list(nodos_registrados.keys())}")
+        log.info(f"[TCP] Desconexión de {node_id_actual or addr}. Nodos activos: {list(nodos_registrados.keys())}")
         conn.close()
 
 
@@ -1392,10 +2913,10 @@ def tcp_server():
         try:
             s.bind((COORD_HOST, COORD_PORT))
         except OSError as e:
-            print(f"[ERROR] No se pudo enlazar TCP en {COORD_HOST}:{COORD_PORT} -> {e}")
+            log.error(f"[ERROR] No se pudo enlazar TCP en {COORD_HOST}:{COORD_PORT} -> {e}")
             raise
         s.listen()
-        print(f"[COORDINADOR] Escuchando conexiones TCP en {COORD_HOST}:{COORD_PORT}...")
+        log.info(f"[COORDINADOR] Escuchando conexiones TCP en {COORD_HOST}:{COORD_PORT}...")
 
         while True:
             conn, addr = s.accept()
@@ -1410,29 +2931,61 @@ def main():
     hilo_discovery = threading.Thread(target=discovery_server, daemon=True)
     hilo_discovery.start()
 
-    # Cargar nodos persistentes
-    load_persistent_nodes()
+    # Carga de metadata, cronometrada por fase (ver GET /admin/startup)
+    t_start = time.perf_counter()
+    with _startup_phase('nodes'):
+        load_persistent_nodes()
     # Cargar índice persistente de archivos
-    try:
-        global files_store
-        files_store = files_manager.load_persistent_files() or {'files': {}}
-        print(f"[FILES] Cargados {len(files_store.get('files', {}))} archivos persistentes")
-    except Exception as e:
-        print(f"[FILES] Error cargando índice de archivos persistentes: {e}")
-    
+    with _startup_phase('files'):
+        try:
+            global files_store
+            files_store = files_manager.load_persistent_files() or {'files': {}}
+            log.info(f"[FILES] Cargados {len(files_store.get('files', {}))} archivos persistentes")
+        except Exception as e:
+            log.error(f"[FILES] Error cargando índice de archivos persistentes: {e}")
+
     # Cargar bloques persistentes
-    blocks_store = load_persistent_blocks()
-    
-    # Sincronizar bloques con nodos cargados
-    try:
-        with lock_nodos:
-            for nid, info in nodos_registrados.items():
-                cap = info.get('capacity', 0) or 0
-                update_blocks_for_node(nid, cap, blocks_store)
-                set_node_blocks_available(nid, blocks_store)
-        save_persistent_blocks(blocks_store)
-    except Exception as e:
-        print(f"[BLOCKS] Error sincronizando bloques después de cargar nodos: {e}")
+    with _startup_phase('blocks'):
+        blocks_store = load_persistent_blocks(slot_size=SLOT_SIZE)
+
+    # Borrados de bloques que quedaron pendientes (tombstones en la tabla)
+    delete_queue.rebuild(blocks_store.get('blocks', {}))
+
+    # Sesiones de upload por partes (reanuda las que quedaron abiertas) y su GC
+    with _startup_phase('upload_sessions'):
+        global upload_sessions_mgr
+        upload_sessions_mgr = upload_sessions.UploadSessionManager(
+            os.path.join(os.path.dirname(__file__), 'temp', 'uploads'), default_block_size=BLOCK_SIZE, ttl=UPLOAD_SESSION_TTL)
+        threading.Thread(target=upload_sessions_mgr.run_gc_loop, kwargs={'interval': 600}, daemon=True).start()
+
+    # Área de staging de los uploads: vuelve a contar las copias locales que siguen en temp
+    global staging_area
+    staging_area = staging.StagingArea(os.path.join(os.path.dirname(__file__), 'temp', 'staging'),
+                                       STAGING_MAX_MB * 1024 * 1024)
+    rebuild_staging()
+    log.info(f"[STAGING] {staging_area.stats()['files']} archivos con copia local en temp "
+             f"({staging_area.stats()['used_bytes']} bytes, tope {STAGING_MAX_MB} MB)")
+
+    # Pack abierto para archivos pequeños (los packs que quedaron sin sellar se sellan en el hilo de mantenimiento)
+    global pack_writer
+    pack_writer = packing.PackWriter(os.path.join(os.path.dirname(__file__), 'temp', 'packs'),
+                                     SLOT_SIZE, max_age=PACK_MAX_AGE)
+
+    # Ajustar los slots de cada nodo a su capacidad en una sola pasada; solo se
+    # reescribe la tabla si algo cambió
+    with _startup_phase('reconcile'):
+        try:
+            with lock_nodos:
+                changed = blocks_manager.reconcile_node_capacities(blocks_store, nodos_registrados, slot_size=SLOT_SIZE)
+            if changed:
+                persistence_svc.mark_dirty('blocks')
+        except Exception as e:
+            log.error(f"[BLOCKS] Error sincronizando bloques después de cargar nodos: {e}")
+    startup_timings['total'] = round(time.perf_counter() - t_start, 4)
+    log.info("[MAIN] Arranque: " + ", ".join(f"{k} {v:.3f}s" for k, v in startup_timings.items()))
+
+    # A partir de aquí las escrituras de metadata las agrupa el hilo de persistencia
+    persistence_svc.start()
 
     # Hilo para servidor HTTP (API)
     hilo_http = threading.Thread(target=start_http_server, daemon=True)
@@ -1444,16 +2997,34 @@ def main():
         base_dir = getattr(_bm, 'BASE_SHARE_DIR', None)
         if base_dir:
             os.makedirs(base_dir, exist_ok=True)
-            print(f"[MAIN] Asegurado BASE_SHARE_DIR: {base_dir}")
+            log.info(f"[MAIN] Asegurado BASE_SHARE_DIR: {base_dir}")
     except Exception as e:
-        print(f"[MAIN] Error creando BASE_SHARE_DIR: {e}")
+        log.error(f"[MAIN] Error creando BASE_SHARE_DIR: {e}")
 
     # Hilo monitor de conexiones
-    hilo_monitor = threading.Thread(target=monitor_connections, kwargs={'interval':5}, daemon=True)
+    hilo_monitor = threading.Thread(target=monitor_connections, kwargs={'interval': MONITOR_INTERVAL}, daemon=True)
     hilo_monitor.start()
 
+    # Hilo que sella y compacta los packs de archivos pequeños
+    threading.Thread(target=pack_maintenance, daemon=True).start()
+
+    # Hilo que borra en los nodos los bloques de archivos eliminados
+    threading.Thread(target=block_gc_loop, daemon=True).start()
+
+    # SIGTERM como Ctrl+C: salir por el finally para no perder cambios pendientes
+    try:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    except Exception:
+        pass
+
     # Servidor TCP principal (bloqueante)
-    tcp_server()
+    try:
+        tcp_server()
+    except KeyboardInterrupt:
+        log.info("[MAIN] Interrumpido, cerrando coordinador...")
+    finally:
+        written = persistence_svc.stop()
+        log.info(f"[PERSIST] Metadata pendiente guardada al salir: {written or 'nada'}")
 
 
 if __name__ == "__main__":
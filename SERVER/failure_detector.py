@@ -0,0 +1,148 @@
+"""
+Detector de fallos phi-accrual para los heartbeats (PING/PONG) de los nodos.
+
+En lugar de un timeout fijo, por cada nodo se guarda una ventana con los
+intervalos entre PONGs y se calcula phi = -log10(P(el siguiente heartbeat llega
+aún más tarde)), suponiendo intervalos con distribución normal (media y
+desviación de la ventana). phi crece de forma continua con el silencio y se
+adapta a cada nodo: uno que suele tardar en contestar (porque su único hilo
+está escribiendo un bloque) necesita más silencio para llegar al mismo phi.
+
+Estados:
+  - 'alive':   phi < SUSPECT_PHI
+  - 'suspect': SUSPECT_PHI <= phi < OFFLINE_PHI. El nodo sigue online pero las
+               lecturas prefieren otras copias.
+  - 'offline': phi >= OFFLINE_PHI y además lleva al menos `min_offline_after`
+               segundos en silencio (evita pasar a offline por un único retraso).
+
+Cualquier otro mensaje del nodo cuenta como actividad (reinicia el silencio)
+pero no entra en la ventana de intervalos.
+"""
+import math
+import threading
+import time
+from collections import deque
+
+ALIVE = 'alive'
+SUSPECT = 'suspect'
+OFFLINE = 'offline'
+
+SUSPECT_PHI = 3.0      # ~1 entre 1000 de que sea un retraso normal
+OFFLINE_PHI = 8.0      # ~1 entre 10^8
+WINDOW = 100           # intervalos recordados por nodo
+MIN_STD = 0.5          # s: desviación mínima absoluta
+MIN_STD_RATIO = 0.25   # y relativa a la media: con intervalos muy regulares un pequeño retraso no dispara phi
+
+
+class _Heartbeats:
+    __slots__ = ('intervals', 'last', 'last_hb', 'rtt', 'state')
+
+    def __init__(self, now, expected):
+        # Arranque: se supone el intervalo esperado hasta tener muestras reales
+        self.intervals = deque([expected, expected], maxlen=WINDOW)
+        self.last = now          # último mensaje de cualquier tipo (silencio)
+        self.last_hb = now       # último heartbeat (intervalos)
+        self.rtt = None
+        self.state = ALIVE
+
+
+class PhiAccrualDetector:
+    def __init__(self, expected_interval=5.0, acceptable_pause=None, min_offline_after=None,
+                 suspect_phi=SUSPECT_PHI, offline_phi=OFFLINE_PHI):
+        self.expected_interval = float(expected_interval)
+        # Pausa tolerada además de la media (p.ej. un nodo escribiendo un bloque grande)
+        self.acceptable_pause = self.expected_interval if acceptable_pause is None else float(acceptable_pause)
+        self.min_offline_after = max(10.0, self.expected_interval * 3) if min_offline_after is None else float(min_offline_after)
+        self.suspect_phi = suspect_phi
+        self.offline_phi = offline_phi
+        self._nodes = {}
+        self._lock = threading.Lock()
+
+    def _get(self, node_id, now):
+        hb = self._nodes.get(node_id)
+        if hb is None:
+            hb = self._nodes[node_id] = _Heartbeats(now, self.expected_interval)
+        return hb
+
+    def heartbeat(self, node_id, now=None, rtt=None):
+        """Registra un heartbeat (PONG) del nodo y, si se conoce, su RTT."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            hb = self._nodes.get(node_id)
+            if hb is None:
+                hb = self._get(node_id, now)
+            else:
+                hb.intervals.append(max(0.0, now - hb.last_hb))
+                hb.last_hb = now
+                hb.last = max(hb.last, now)
+            if rtt is not None and rtt >= 0:
+                hb.rtt = rtt if hb.rtt is None else hb.rtt + 0.3 * (rtt - hb.rtt)
+
+    def activity(self, node_id, now=None):
+        """Cualquier mensaje del nodo: reinicia el silencio sin añadir un intervalo."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            hb = self._get(node_id, now)
+            hb.last = max(hb.last, now)
+
+    def remove(self, node_id):
+        with self._lock:
+            self._nodes.pop(node_id, None)
+
+    def _phi(self, hb, now):
+        elapsed = now - hb.last
+        n = len(hb.intervals)
+        mean = sum(hb.intervals) / n
+        std = max(MIN_STD, mean * MIN_STD_RATIO, math.sqrt(sum((x - mean) ** 2 for x in hb.intervals) / n))
+        y = (elapsed - (mean + self.acceptable_pause)) / std
+        if y < -10:
+            return 0.0
+        # Aproximación logística de la CDF normal (como en Akka/Cassandra)
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        if y > 0:
+            return -math.log10(e / (1.0 + e)) if e > 0 else float('inf')
+        return max(0.0, -math.log10(1.0 - 1.0 / (1.0 + e)))
+
+    def phi(self, node_id, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            hb = self._nodes.get(node_id)
+            return self._phi(hb, now) if hb else 0.0
+
+    def check(self, node_id, now=None):
+        """
+        Evalúa el nodo y retorna (estado_anterior, estado_nuevo, phi, silencio_en_s).
+        El estado se guarda: las transiciones se detectan comparando ambos.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            hb = self._get(node_id, now)
+            phi = self._phi(hb, now)
+            silence = now - hb.last
+            if phi >= self.offline_phi and silence >= self.min_offline_after:
+                state = OFFLINE
+            elif phi >= self.suspect_phi:
+                state = SUSPECT
+            else:
+                state = ALIVE
+            previous, hb.state = hb.state, state
+            return previous, state, phi, silence
+
+    def set_state(self, node_id, state):
+        """Fija el estado guardado (p.ej. mantener 'suspect' cuando se aplaza el paso a offline)."""
+        with self._lock:
+            hb = self._nodes.get(node_id)
+            if hb is not None:
+                hb.state = state
+
+    def stats(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            res = {}
+            for nid, hb in self._nodes.items():
+                n = len(hb.intervals)
+                res[nid] = {'state': hb.state, 'phi': round(min(self._phi(hb, now), 1e6), 3),
+                            'silence_s': round(now - hb.last, 3),
+                            'mean_interval_s': round(sum(hb.intervals) / n, 3),
+                            'rtt_ms': round(hb.rtt * 1000, 2) if hb.rtt is not None else None}
+            return res
@@ -1,33 +1,102 @@
+import heapq
 import os
-import json
+import listing
+import log_manager as log
+import metadata_store
 
 files_persistent_file = os.path.join(os.path.dirname(__file__), 'info', 'files_data.json')
 
 
 def load_persistent_files():
     try:
-        if os.path.exists(files_persistent_file):
-            with open(files_persistent_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-                if not content.strip():
-                    data = {'files': {}}
-                else:
-                    data = json.loads(content)
-        else:
-            data = {'files': {}}
+        data = metadata_store.get_store().load_files()
         if 'files' not in data:
             data['files'] = {}
         return data
     except Exception as e:
-        print(f"[FILES_MANAGER] Error cargando files persistentes: {e}")
+        log.error(f"[FILES_MANAGER] Error cargando files persistentes: {e}")
         return {'files': {}}
 
 
 def save_persistent_files(files_data):
     try:
         # files_data expected as {'files': {id: obj, ...}}
-        with open(files_persistent_file, 'w', encoding='utf-8') as f:
-            json.dump(files_data, f, indent=2, ensure_ascii=False)
-        print(f"[FILES_MANAGER] Guardado {len(files_data.get('files', {}))} archivos en {files_persistent_file}")
+        metadata_store.get_store().save_files(files_data)
     except Exception as e:
-        print(f"[FILES_MANAGER] Error guardando files persistentes: {e}")
+        log.error(f"[FILES_MANAGER] Error guardando files persistentes: {e}")
+
+
+SNAPSHOT_BATCH = 256   # entradas copiadas por cada vez que se toma el lock
+
+
+def _copy_entry(value):
+    """Copia de una entrada del índice (solo dicts, listas y escalares JSON): sin el memo de deepcopy."""
+    if isinstance(value, dict):
+        return {k: _copy_entry(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_copy_entry(v) for v in value]
+    return value
+
+
+def snapshot_files(files_data, lock=None, batch=SNAPSHOT_BATCH):
+    """
+    Copia del índice de archivos lista para guardar. Con `lock` se copia por
+    tandas de `batch` entradas tomando el lock en cada una: cada entrada sale
+    entera y consistente, y los demás hilos esperan como mucho una tanda en
+    lugar de la copia del índice completo. Lo que cambie durante la copia vuelve
+    a marcar la tabla como sucia, así que la siguiente escritura lo recoge.
+    Sin `lock`, el llamador ya lo tiene tomado.
+    """
+    if lock is None:
+        return {'files': {fid: _copy_entry(e) for fid, e in files_data.get('files', {}).items()}}
+    with lock:
+        ids = list(files_data.get('files', {}))
+    out = {}
+    for start in range(0, len(ids), batch):
+        with lock:
+            files = files_data.get('files', {})
+            for fid in ids[start:start + batch]:
+                entry = files.get(fid)
+                if entry is not None:
+                    out[fid] = _copy_entry(entry)
+    return {'files': out}
+
+
+def files_on_node(node_id):
+    """Ids de archivos con alguna copia en `node_id` (consulta al backend de metadata)."""
+    return metadata_store.get_store().files_on_node(node_id)
+
+
+def query_files(files_data, file_id=None, prefix=None, uploader=None, cursor=None, limit=None, fields=None, exclude=None):
+    """
+    Página de `/files` en orden de file_id a partir de `cursor` (el último file_id
+    devuelto), filtrada por id, prefijo del nombre y nodo que lo subió.
+    `exclude(entry)` descarta entradas internas (packs). Retorna (files, next_cursor).
+    """
+    files = files_data.get('files', {})
+    if file_id is not None:
+        ids = [file_id] if file_id in files else []
+    else:
+        ids = files.keys()
+
+    def keep(fid):
+        if cursor is not None and fid <= cursor:
+            return False
+        e = files[fid]
+        if exclude is not None and exclude(e):
+            return False
+        if prefix is not None and not str(e.get('original_filename') or '').startswith(prefix):
+            return False
+        if uploader is not None and e.get('uploader_node') != uploader:
+            return False
+        return True
+
+    selected = filter(keep, list(ids))
+    if limit is None:
+        page, next_cursor = sorted(selected), None
+    else:
+        # Solo las limit+1 primeras: sin ordenar el índice entero
+        page = heapq.nsmallest(limit + 1, selected)
+        next_cursor = page[limit - 1] if len(page) > limit else None
+        page = page[:limit]
+    return {fid: listing.project(files[fid], fields) for fid in page}, next_cursor
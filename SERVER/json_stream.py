@@ -0,0 +1,182 @@
+"""
+Respuestas JSON grandes (/blocks, /files) sin materializarlas enteras.
+
+`json.dumps` de un listado grande, más su `.encode()`, tenía en memoria a la
+vez los objetos, el str y los bytes del cuerpo completo antes de escribir el
+primer byte. Aquí:
+
+  - `iter_json(obj)` codifica por entradas: las listas y mapas del primer nivel
+    (`blocks`, `files`) se emiten por tandas de BATCH elementos, cada tanda con
+    `json.dumps` (codificador en C), agrupados en trozos de ~CHUNK_SIZE bytes;
+  - `BodyWriter` los escribe con `Transfer-Encoding: chunked` (o hasta cerrar
+    la conexión en HTTP/1.0), comprimidos con gzip si el cliente lo acepta;
+  - `PayloadCache` guarda el último cuerpo ya codificado de cada listado junto
+    con la versión de las tablas de las que sale: mientras no cambien, la
+    siguiente petición igual se sirve tal cual, sin tocar el lock ni volver a
+    serializar.
+"""
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from itertools import islice
+
+CHUNK_SIZE = 64 * 1024
+BATCH = 256             # entradas por llamada a json.dumps
+GZIP_LEVEL = 1          # el JSON comprime bien ya con nivel 1, y cuesta mucha menos CPU que el 6
+
+
+def accepts_gzip(accept_encoding):
+    """True si la cabecera Accept-Encoding admite gzip (sin q=0)."""
+    for part in (accept_encoding or '').split(','):
+        token, _, params = part.strip().partition(';')
+        if token.strip().lower() in ('gzip', 'x-gzip', '*'):
+            q = params.strip().lower()
+            if q.startswith('q='):
+                try:
+                    return float(q[2:]) > 0
+                except ValueError:
+                    return False
+            return True
+    return False
+
+
+def _iter_pieces(obj):
+    dumps = json.dumps
+    if not isinstance(obj, dict):
+        yield dumps(obj)
+        return
+    yield '{'
+    first = True
+    for key, value in obj.items():
+        yield ('' if first else ', ') + dumps(str(key)) + ': '
+        first = False
+        # Listas y mapas por tandas de BATCH entradas: json.dumps de la tanda sin sus
+        # corchetes/llaves (el codificador en C hace el trabajo, no un bucle por entrada)
+        if isinstance(value, list) and value:
+            yield '['
+            for start in range(0, len(value), BATCH):
+                yield ('' if start == 0 else ', ') + dumps(value[start:start + BATCH])[1:-1]
+            yield ']'
+        elif isinstance(value, dict) and value:
+            yield '{'
+            items = iter(value.items())
+            sep = ''
+            while True:
+                batch = dict(islice(items, BATCH))
+                if not batch:
+                    break
+                yield sep + dumps(batch)[1:-1]
+                sep = ', '
+            yield '}'
+        else:
+            yield dumps(value)
+    yield '}'
+
+
+def iter_json(obj, chunk_size=CHUNK_SIZE):
+    """Bytes UTF-8 del JSON de `obj` en trozos de ~chunk_size (mismo resultado que json.dumps)."""
+    buf = []
+    size = 0
+    for piece in _iter_pieces(obj):
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buf).encode('utf-8')
+            buf = []
+            size = 0
+    if buf:
+        yield ''.join(buf).encode('utf-8')
+
+
+class BodyWriter:
+    """
+    Escribe un cuerpo de longitud desconocida: con chunked encoding (HTTP/1.1) o
+    tal cual hasta cerrar la conexión (`chunked=False`), comprimiendo con gzip
+    si se pide. `keep` conserva una copia de lo escrito (para PayloadCache)
+    mientras no pase de `keep` bytes.
+    """
+
+    def __init__(self, wfile, chunked=True, gzip=False, keep=0):
+        self.wfile = wfile
+        self.chunked = chunked
+        self._z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) if gzip else None
+        self._keep = keep
+        self._kept = [] if keep else None
+        self._kept_size = 0
+        self.bytes_out = 0
+
+    def _emit(self, data):
+        if not data:
+            return
+        if self._kept is not None:
+            self._kept_size += len(data)
+            if self._kept_size > self._keep:
+                self._kept = None
+            else:
+                self._kept.append(data)
+        if self.chunked:
+            self.wfile.write(b'%x\r\n' % len(data) + data + b'\r\n')
+        else:
+            self.wfile.write(data)
+        self.bytes_out += len(data)
+
+    def write(self, data):
+        self._emit(self._z.compress(data) if self._z is not None else data)
+
+    def close(self):
+        if self._z is not None:
+            self._emit(self._z.flush())
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+    def kept(self):
+        """Cuerpo completo tal como se envió, o None si superó `keep`."""
+        return b''.join(self._kept) if self._kept is not None else None
+
+
+class PayloadCache:
+    """
+    Últimos cuerpos codificados por clave (listado + query + codificación), cada
+    uno con la versión de las tablas de la que salió. LRU con tope de bytes.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries = OrderedDict()    # clave -> (versión, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def entry_limit(self):
+        """Tamaño máximo de un cuerpo cacheable (un cuarto del tope)."""
+        return self.max_bytes // 4
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, body):
+        if body is None or len(body) > self.entry_limit():
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = (version, body)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self._bytes -= len(dropped)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
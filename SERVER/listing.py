@@ -0,0 +1,70 @@
+"""
+Utilidades comunes de los listados de la API (/blocks, /files).
+
+- Paginación por cursor: cada listado tiene un orden estable y el cursor es la
+  clave de la última entrada devuelta (un block_id o un file_id). La página
+  siguiente empieza justo después, así que altas y bajas entre páginas no
+  repiten ni saltan entradas que ya existían.
+- Proyección de campos: `fields=file_id,meta.total_size,meta.blocks.hash`
+  devuelve solo esas rutas. Una ruta que atraviesa una lista se aplica a cada
+  elemento (`meta.blocks.hash` -> la lista de bloques con solo su hash).
+"""
+from collections.abc import Mapping
+
+DEFAULT_LIMIT = 1000    # tamaño de página si hay cursor pero no `limit`
+MAX_LIMIT = 10000       # tope de `limit` por petición
+
+
+class ListQueryError(ValueError):
+    """Parámetros de listado inválidos (el handler responde 400)."""
+
+
+def parse_limit(params):
+    """
+    `limit` de la query: None si no se pide paginar (ni `limit` ni `cursor`,
+    listado completo como antes); si no, un entero entre 1 y MAX_LIMIT.
+    """
+    raw = params.get('limit')
+    if raw in (None, ''):
+        return DEFAULT_LIMIT if params.get('cursor') else None
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise ListQueryError(f"limit inválido: {raw}")
+    if limit < 1:
+        raise ListQueryError(f"limit debe ser >= 1: {raw}")
+    return min(limit, MAX_LIMIT)
+
+
+def parse_csv(value):
+    """'a, b,,c' -> ['a', 'b', 'c']; None o '' -> None."""
+    if not value:
+        return None
+    items = [v.strip() for v in value.split(',') if v.strip()]
+    return items or None
+
+
+def parse_fields(value):
+    """Convierte `fields=a,b.c` en el árbol de rutas {'a': {}, 'b': {'c': {}}} (None = todo)."""
+    paths = parse_csv(value)
+    if not paths:
+        return None
+    tree = {}
+    for path in paths:
+        node = tree
+        for part in path.split('.'):
+            if not part:
+                raise ListQueryError(f"campo inválido: {path}")
+            node = node.setdefault(part, {})
+    return tree
+
+
+def project(value, tree):
+    """Copia de `value` con solo las rutas de `tree` (las que no existen se omiten)."""
+    if not tree:
+        return dict(value) if isinstance(value, Mapping) else value
+    if isinstance(value, Mapping):
+        return {key: project(value[key], sub) for key, sub in tree.items() if key in value}
+    if isinstance(value, (list, tuple)):
+        return [project(item, tree) for item in value]
+    return value
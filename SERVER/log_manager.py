@@ -0,0 +1,239 @@
+"""
+log_manager: logging asíncrono para el coordinador.
+
+Los hilos de petición nunca escriben en stdout directamente: cada llamada
+(`info`, `warning`, ...) solo construye un LogRecord y lo encola sin bloquear.
+Un hilo de fondo (QueueListener) formatea y escribe. Si la cola está llena el
+mensaje se descarta y se contabiliza, de modo que el coste en el hot path está
+acotado aunque la consola o el pipe estén lentos.
+
+El componente se toma de la etiqueta inicial del mensaje (`[HTTP] ...`,
+`[TCP] ...`, `[BLOCKS] ...`), y cada componente puede tener su propio nivel.
+
+Configuración por variables de entorno:
+  SADTF_LOG_LEVEL        nivel por defecto (INFO)
+  SADTF_LOG_LEVELS       niveles por componente, p.ej. "TCP=WARNING,MONITOR=DEBUG"
+  SADTF_LOG_FORMAT       'text' (por defecto, igual que antes) o 'json'
+  SADTF_LOG_QUEUE_SIZE   tamaño máximo de la cola (10000)
+  SADTF_LOG_RATE_LIMIT   mensajes idénticos permitidos por ventana (5; 0 desactiva;
+                         WARNING y ERROR no se limitan nunca)
+  SADTF_LOG_RATE_WINDOW  ventana del rate limit en segundos (10)
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+DEFAULT_COMPONENT = 'MAIN'
+
+_default_level = logging.getLevelName(os.environ.get('SADTF_LOG_LEVEL', 'INFO').upper())
+if not isinstance(_default_level, int):
+    _default_level = logging.INFO
+_component_levels = {}
+_log_format = os.environ.get('SADTF_LOG_FORMAT', 'text').lower()
+_queue = queue.Queue(maxsize=int(os.environ.get('SADTF_LOG_QUEUE_SIZE', '10000')))
+_rate_limit = int(os.environ.get('SADTF_LOG_RATE_LIMIT', '5'))
+_rate_window = float(os.environ.get('SADTF_LOG_RATE_WINDOW', '10'))
+
+_listener = None
+_start_lock = threading.Lock()
+_rate_lock = threading.Lock()
+_rate_state = {}            # (component, mensaje) -> [inicio_ventana, contador, suprimidos]
+_RATE_MAX_KEYS = 4096
+_stats_lock = threading.Lock()
+
+_stats = {
+    'enqueued': 0,
+    'dropped': 0,           # cola llena
+    'filtered': 0,          # por debajo del nivel del componente
+    'suppressed': 0,        # rate limit de mensajes repetidos
+    'enqueue_ns_total': 0,
+    'enqueue_ns_max': 0,
+}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'component': getattr(record, 'component', DEFAULT_COMPONENT),
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = f"[{getattr(record, 'component', DEFAULT_COMPONENT)}] {record.getMessage()}"
+        if record.levelno >= logging.WARNING:
+            text = f"{record.levelname}: {text}"
+        if record.exc_info:
+            text += '\n' + self.formatException(record.exc_info)
+        return text
+
+
+def _parse_levels(spec):
+    levels = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        comp, lvl = item.split('=', 1)
+        value = logging.getLevelName(lvl.strip().upper())
+        if isinstance(value, int):
+            levels[comp.strip().upper()] = value
+    return levels
+
+
+_component_levels.update(_parse_levels(os.environ.get('SADTF_LOG_LEVELS')))
+
+
+def start():
+    """Arranca el hilo escritor (idempotente; se llama sola en el primer mensaje)."""
+    global _listener
+    with _start_lock:
+        if _listener is not None:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter() if _log_format == 'json' else TextFormatter())
+        _listener = logging.handlers.QueueListener(_queue, handler, respect_handler_level=False)
+        _listener.start()
+        atexit.register(stop)
+
+
+def stop():
+    """Vacía la cola y detiene el hilo escritor."""
+    global _listener
+    with _start_lock:
+        listener = _listener
+        _listener = None
+    if listener is not None:
+        listener.stop()
+
+
+def set_level(component=None, level='INFO'):
+    """Cambia el nivel por defecto (component=None) o el de un componente concreto."""
+    global _default_level
+    value = logging.getLevelName(str(level).upper()) if not isinstance(level, int) else level
+    if not isinstance(value, int):
+        raise ValueError(f"nivel desconocido: {level}")
+    if component is None:
+        _default_level = value
+    else:
+        _component_levels[component.upper()] = value
+
+
+def levels():
+    return {
+        'default': logging.getLevelName(_default_level),
+        'components': {c: logging.getLevelName(l) for c, l in _component_levels.items()},
+    }
+
+
+def stats():
+    """Contadores del logger, incluido el coste medio/máximo de encolar (hot path)."""
+    with _stats_lock:
+        s = dict(_stats)
+    s['queue_depth'] = _queue.qsize()
+    s['queue_max'] = _queue.maxsize
+    s['format'] = _log_format
+    calls = s['enqueued'] + s['dropped']
+    s['enqueue_us_avg'] = round(s['enqueue_ns_total'] / calls / 1000, 3) if calls else 0
+    s['enqueue_us_max'] = round(s['enqueue_ns_max'] / 1000, 3)
+    del s['enqueue_ns_total'], s['enqueue_ns_max']
+    return s
+
+
+def _split_component(msg):
+    """'[HTTP][BROADCAST] texto' -> ('HTTP', '[BROADCAST] texto')."""
+    msg = msg.lstrip('\n')
+    if msg.startswith('['):
+        end = msg.find(']')
+        if end > 1:
+            return msg[1:end].upper(), msg[end + 1:].lstrip()
+    return DEFAULT_COMPONENT, msg
+
+
+def _rate_limited(level, component, msg, now):
+    """
+    True si el mensaje debe suprimirse. Devuelve además el número de suprimidos a reportar.
+    Solo se limitan repeticiones exactas del mismo texto (mensajes que difieren en un
+    nodo, IP o bloque son eventos distintos) y nunca WARNING o superior.
+    """
+    if _rate_limit <= 0 or level >= logging.WARNING:
+        return False, 0
+    key = (component, msg)
+    with _rate_lock:
+        st = _rate_state.get(key)
+        if st is None or now - st[0] >= _rate_window:
+            suppressed = st[2] if st else 0
+            if st is None and len(_rate_state) >= _RATE_MAX_KEYS:
+                _rate_state.clear()
+            _rate_state[key] = [now, 1, 0]
+            return False, suppressed
+        st[1] += 1
+        if st[1] > _rate_limit:
+            st[2] += 1
+            return True, 0
+        return False, 0
+
+
+def _log(level, msg, args, exc_info=None):
+    t0 = time.perf_counter_ns()
+    component, text = _split_component(str(msg))
+    if level < _component_levels.get(component, _default_level):
+        with _stats_lock:
+            _stats['filtered'] += 1
+        return
+    now = time.time()
+    limited, suppressed = _rate_limited(level, component, text, now)
+    if limited:
+        with _stats_lock:
+            _stats['suppressed'] += 1
+        return
+    if suppressed:
+        text = f"{text} (+{suppressed} mensajes iguales suprimidos)"
+    if _listener is None:
+        start()
+    record = logging.LogRecord(f"sadtf.{component}", level, '', 0, text, args or None, exc_info)
+    record.component = component
+    record.created = now
+    try:
+        _queue.put_nowait(record)
+        counter = 'enqueued'
+    except queue.Full:
+        counter = 'dropped'
+    elapsed = time.perf_counter_ns() - t0
+    with _stats_lock:
+        _stats[counter] += 1
+        _stats['enqueue_ns_total'] += elapsed
+        if elapsed > _stats['enqueue_ns_max']:
+            _stats['enqueue_ns_max'] = elapsed
+
+
+def debug(msg, *args):
+    _log(logging.DEBUG, msg, args)
+
+
+def info(msg, *args):
+    _log(logging.INFO, msg, args)
+
+
+def warning(msg, *args):
+    _log(logging.WARNING, msg, args)
+
+
+def error(msg, *args):
+    _log(logging.ERROR, msg, args)
+
+
+def exception(msg, *args):
+    _log(logging.ERROR, msg, args, exc_info=sys.exc_info())
@@ -0,0 +1,461 @@
+"""
+metadata_store: almacenamiento persistente de la metadata del coordinador
+(nodos, tabla de bloques e índice de archivos) detrás de una interfaz común.
+
+Backends:
+  - 'json':   los tres ficheros de SERVER/info (nodes_data.json, blocks_data.json,
+              files_data.json). Cada guardado reescribe el fichero completo, de forma
+              atómica (temporal + rename). Adecuado para instalaciones pequeñas.
+  - 'snapshot': como 'json' para los nodos, pero la tabla de bloques y el índice
+              de archivos se guardan como snapshots binarios (snapshot.py:
+              arrays por nodo, sin pickle) en SERVER/info/*.snap. Es el que más
+              rápido arranca; si aún no hay snapshots, carga los JSON.
+  - 'sqlite': una base SQLite (sqlite3 de la librería estándar, modo WAL) con tablas
+              e índices para nodos, slots de bloques, archivos y placements. Cada
+              guardado escribe en una sola transacción solo las filas que cambiaron
+              desde el último guardado, y consultas como "bloques libres del nodo X"
+              o "archivos con copias en el nodo Y" son búsquedas por índice.
+
+El backend se elige con la variable de entorno SADTF_METADATA_BACKEND (por
+defecto 'json'); la ruta de la base con SADTF_METADATA_DB. Para pasar los datos
+de un backend a otro: `python tools/migrate_metadata.py`.
+
+Las estructuras que se cargan y guardan son las mismas que usa el coordinador:
+  nodos:   {node_id: info}
+  bloques: {'blocks': {block_id: bloque}, 'table_size': n, 'nodes': {node_id: resumen}}
+           (solo se guardan los slots en uso; el espacio libre de cada nodo se
+           reconstruye a partir de su resumen: prefijo y número de slots)
+  archivos:{'files': {file_id: entrada}}
+"""
+import json
+import os
+import sqlite3
+import threading
+
+import log_manager as log
+import snapshot
+from block_table import BlockTable, format_block_id
+
+INFO_DIR = os.path.join(os.path.dirname(__file__), 'info')
+BACKEND_JSON = 'json'
+BACKEND_SQLITE = 'sqlite'
+BACKEND_SNAPSHOT = 'snapshot'
+BACKENDS = (BACKEND_JSON, BACKEND_SQLITE, BACKEND_SNAPSHOT)
+DEFAULT_DB_PATH = os.path.join(INFO_DIR, 'metadata.db')
+
+
+class MetadataStore:
+    """Interfaz común de los backends de metadata."""
+
+    name = None
+
+    def load_nodes(self):
+        raise NotImplementedError
+
+    def save_nodes(self, nodos):
+        raise NotImplementedError
+
+    def load_blocks(self):
+        raise NotImplementedError
+
+    def save_blocks(self, raw):
+        raise NotImplementedError
+
+    def load_files(self):
+        raise NotImplementedError
+
+    def save_files(self, files_data):
+        raise NotImplementedError
+
+    # --- consultas -------------------------------------------------------------
+    def free_blocks_on_node(self, node_id, limit=None):
+        """Ids de los slots libres del nodo (según lo último guardado), como mucho `limit`."""
+        raise NotImplementedError
+
+    def files_on_node(self, node_id):
+        """Ids de los archivos con alguna copia (primaria o réplica) en el nodo."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _empty_blocks():
+    return {'blocks': {}, 'table_size': 0, 'nodes': {}}
+
+
+def _complement_free(node_id, info, records, limit=None):
+    """
+    Slots libres de un nodo: los de 1..slots (según su resumen) sin registro en uso.
+    Sin resumen (metadata antigua, con los libres materializados) se usan los registros 'free'.
+    """
+    if not info:
+        return [b['id'] for b in records if b.get('node') == node_id and b.get('status') == 'free'][:limit]
+    if info.get('unavailable'):
+        return []
+    used = {b.get('index') for b in records if b.get('node') == node_id and b.get('status') != 'free'}
+    res = []
+    for index in range(1, int(info.get('slots', 0)) + 1):
+        if index not in used:
+            res.append(format_block_id(info['prefix'], index))
+            if limit is not None and len(res) >= limit:
+                break
+    return res
+
+
+class JsonMetadataStore(MetadataStore):
+    name = BACKEND_JSON
+
+    def __init__(self, info_dir=INFO_DIR):
+        self.nodes_file = os.path.join(info_dir, 'nodes_data.json')
+        self.blocks_file = os.path.join(info_dir, 'blocks_data.json')
+        self.files_file = os.path.join(info_dir, 'files_data.json')
+        self._lock = threading.Lock()
+        self._blocks = None   # última tabla cargada/guardada (para las consultas)
+        self._files = None
+
+    def _read(self, path, default):
+        if not os.path.exists(path):
+            return default
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        return json.loads(content) if content.strip() else default
+
+    def _write(self, path, data, ensure_ascii=True):
+        # Escritura atómica: un guardado concurrente o un corte a mitad nunca deja el fichero a medias
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with self._lock:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=ensure_ascii)
+            os.replace(tmp, path)
+
+    def load_nodes(self):
+        data = self._read(self.nodes_file, {'nodos': {}})
+        return data.get('nodos', {}) if isinstance(data, dict) else {}
+
+    def save_nodes(self, nodos):
+        self._write(self.nodes_file, {'nodos': nodos})
+        log.info(f"[NODE_MANAGER] Guardado {len(nodos)} nodos en {self.nodes_file}")
+
+    def load_blocks(self):
+        data = self._read(self.blocks_file, _empty_blocks())
+        if 'blocks' not in data:
+            data['blocks'] = {}
+        if 'table_size' not in data:
+            data['table_size'] = len(data.get('blocks', {}))
+        self._blocks = data
+        return data
+
+    def save_blocks(self, raw):
+        blocks = raw.get('blocks', {})
+        data = raw
+        if not isinstance(blocks, dict):
+            # BlockTable u otro mapping: volcar como dict clásico
+            data = dict(raw, blocks={bid: dict(b) for bid, b in blocks.items()})
+        self._write(self.blocks_file, data)
+        self._blocks = raw
+        log.info(f"[BLOCKS_MANAGER] Guardado {len(blocks)} bloques en {self.blocks_file}")
+
+    def load_files(self):
+        data = self._read(self.files_file, {'files': {}})
+        if 'files' not in data:
+            data['files'] = {}
+        self._files = data
+        return data
+
+    def save_files(self, files_data):
+        self._write(self.files_file, files_data, ensure_ascii=False)
+        self._files = files_data
+        log.info(f"[FILES_MANAGER] Guardado {len(files_data.get('files', {}))} archivos en {self.files_file}")
+
+    def free_blocks_on_node(self, node_id, limit=None):
+        raw = self._blocks if self._blocks is not None else self.load_blocks()
+        blocks = raw.get('blocks', {})
+        if hasattr(blocks, 'free_slot_ids'):
+            return blocks.free_slot_ids(node_id, limit=limit)
+        return _complement_free(node_id, raw.get('nodes', {}).get(node_id), blocks.values(), limit)
+
+    def files_on_node(self, node_id):
+        files = self._files if self._files is not None else self.load_files()
+        res = []
+        for fid, entry in files.get('files', {}).items():
+            for p in entry.get('placements', []):
+                if p.get('primary_node') == node_id or node_id in p.get('replica_nodes', []):
+                    res.append(fid)
+                    break
+        return res
+
+
+class SnapshotMetadataStore(JsonMetadataStore):
+    """Bloques y archivos en snapshots binarios (ver snapshot.py); nodos en JSON."""
+    name = BACKEND_SNAPSHOT
+
+    def __init__(self, info_dir=INFO_DIR):
+        super().__init__(info_dir)
+        self.blocks_snapshot = os.path.join(info_dir, 'blocks.snap')
+        self.files_snapshot = os.path.join(info_dir, 'files.snap')
+
+    def load_blocks(self):
+        if not os.path.exists(self.blocks_snapshot):
+            # Primera vez: partir de blocks_data.json (se escribirá el snapshot al guardar)
+            return super().load_blocks()
+        data = snapshot.load_blocks(self.blocks_snapshot)
+        self._blocks = data
+        return data
+
+    def save_blocks(self, raw):
+        blocks = raw.get('blocks', {})
+        table = blocks if isinstance(blocks, BlockTable) else BlockTable.from_dict(blocks, nodes=raw.get('nodes'))
+        with self._lock:
+            snapshot.save_blocks(self.blocks_snapshot, table, raw.get('table_size'))
+        self._blocks = raw
+        log.info(f"[BLOCKS_MANAGER] Guardado {len(table)} bloques en {self.blocks_snapshot}")
+
+    def load_files(self):
+        if not os.path.exists(self.files_snapshot):
+            return super().load_files()
+        data = snapshot.load_files(self.files_snapshot)
+        self._files = data
+        return data
+
+    def save_files(self, files_data):
+        with self._lock:
+            snapshot.save_files(self.files_snapshot, files_data)
+        self._files = files_data
+        log.info(f"[FILES_MANAGER] Guardado {len(files_data.get('files', {}))} archivos en {self.files_snapshot}")
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id TEXT PRIMARY KEY,
+    ip TEXT,
+    status TEXT,
+    capacity REAL,
+    last_seen REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_nodes_ip ON nodes(ip);
+CREATE INDEX IF NOT EXISTS idx_nodes_status ON nodes(status);
+CREATE TABLE IF NOT EXISTS blocks (
+    block_id TEXT PRIMARY KEY,
+    node TEXT,
+    slot INTEGER,
+    status TEXT,
+    primary_for TEXT,
+    size INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_blocks_node_status ON blocks(node, status);
+CREATE INDEX IF NOT EXISTS idx_blocks_primary_for ON blocks(primary_for);
+CREATE TABLE IF NOT EXISTS files (
+    file_id TEXT PRIMARY KEY,
+    original_filename TEXT,
+    uploader_node TEXT,
+    uploaded_at REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_name ON files(original_filename);
+CREATE TABLE IF NOT EXISTS placements (
+    file_id TEXT NOT NULL,
+    file_block_index INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (file_id, file_block_index)
+);
+CREATE TABLE IF NOT EXISTS block_copies (
+    file_id TEXT NOT NULL,
+    file_block_index INTEGER NOT NULL,
+    node_id TEXT,
+    block_id TEXT,
+    role TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_copies_node ON block_copies(node_id);
+CREATE INDEX IF NOT EXISTS idx_copies_block ON block_copies(block_id);
+CREATE INDEX IF NOT EXISTS idx_copies_file ON block_copies(file_id);
+"""
+
+SCHEMA_VERSION = '1'
+
+
+def _dumps(obj):
+    return json.dumps(obj, sort_keys=True, ensure_ascii=False)
+
+
+class SQLiteMetadataStore(MetadataStore):
+    name = BACKEND_SQLITE
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA foreign_keys=OFF')
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+            self._conn.execute("INSERT OR IGNORE INTO kv(key, value) VALUES ('schema_version', ?)", (SCHEMA_VERSION,))
+        # Última versión serializada de cada fila guardada: permite escribir solo los cambios
+        self._saved = {'nodes': None, 'blocks': None, 'files': None}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _diff(self, table, rows):
+        """Compara `rows` (key -> json) con lo último guardado. Retorna (cambiadas, eliminadas)."""
+        previous = self._saved[table]
+        if previous is None:
+            previous = {r[0]: r[1] for r in self._conn.execute(f"SELECT {_KEYS[table]}, data FROM {table}")}
+        changed = [k for k, v in rows.items() if previous.get(k) != v]
+        removed = [k for k in previous if k not in rows]
+        return changed, removed
+
+    # --- nodos ----------------------------------------------------------------------
+    def load_nodes(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT node_id, data FROM nodes').fetchall()
+            self._saved['nodes'] = dict(rows)
+        return {nid: json.loads(data) for nid, data in rows}
+
+    def save_nodes(self, nodos):
+        rows = {nid: _dumps(info) for nid, info in nodos.items()}
+        with self._lock:
+            changed, removed = self._diff('nodes', rows)
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO nodes(node_id, ip, status, capacity, last_seen, data) VALUES (?, ?, ?, ?, ?, ?)',
+                    [(nid, nodos[nid].get('ip'), nodos[nid].get('status'), nodos[nid].get('capacity'),
+                      nodos[nid].get('last_seen'), rows[nid]) for nid in changed])
+                self._conn.executemany('DELETE FROM nodes WHERE node_id = ?', [(nid,) for nid in removed])
+            self._saved['nodes'] = rows
+        log.info(f"[NODE_MANAGER] Guardado {len(nodos)} nodos en {self.path} ({len(changed)} cambios)")
+
+    # --- bloques --------------------------------------------------------------------
+    def load_blocks(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT block_id, data FROM blocks').fetchall()
+            ts = self._conn.execute("SELECT value FROM kv WHERE key = 'table_size'").fetchone()
+            summary = self._conn.execute("SELECT value FROM kv WHERE key = 'block_nodes'").fetchone()
+            self._saved['blocks'] = dict(rows)
+        blocks = {bid: json.loads(data) for bid, data in rows}
+        return {'blocks': blocks, 'table_size': int(ts[0]) if ts else len(blocks),
+                'nodes': json.loads(summary[0]) if summary else {}}
+
+    def save_blocks(self, raw):
+        blocks = raw.get('blocks', {})
+        rows = {bid: _dumps(dict(b)) for bid, b in blocks.items()}
+        with self._lock:
+            changed, removed = self._diff('blocks', rows)
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO blocks(block_id, node, slot, status, primary_for, size, data) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(bid, blocks[bid].get('node'), blocks[bid].get('index'), blocks[bid].get('status'),
+                      blocks[bid].get('primary_for'), blocks[bid].get('size'), rows[bid]) for bid in changed])
+                self._conn.executemany('DELETE FROM blocks WHERE block_id = ?', [(bid,) for bid in removed])
+                self._conn.execute("INSERT OR REPLACE INTO kv(key, value) VALUES ('table_size', ?)",
+                                   (str(raw.get('table_size', len(blocks))),))
+                self._conn.execute("INSERT OR REPLACE INTO kv(key, value) VALUES ('block_nodes', ?)",
+                                   (_dumps(raw.get('nodes', {})),))
+            self._saved['blocks'] = rows
+        log.info(f"[BLOCKS_MANAGER] Guardado {len(blocks)} bloques en {self.path} ({len(changed)} cambios)")
+
+    # --- archivos -------------------------------------------------------------------
+    def load_files(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT file_id, data FROM files').fetchall()
+            prows = self._conn.execute(
+                'SELECT file_id, data FROM placements ORDER BY file_id, file_block_index').fetchall()
+            self._saved['files'] = None
+        files = {}
+        for fid, data in rows:
+            entry = json.loads(data)
+            entry['placements'] = []
+            files[fid] = entry
+        for fid, data in prows:
+            if fid in files:
+                files[fid]['placements'].append(json.loads(data))
+        # Recalcular la serialización de referencia con el mismo formato que save_files
+        self._saved['files'] = {fid: _dumps(e) for fid, e in files.items()}
+        return {'files': files}
+
+    def save_files(self, files_data):
+        files = files_data.get('files', {})
+        rows = {fid: _dumps(e) for fid, e in files.items()}
+        with self._lock:
+            changed, removed = self._diff('files', rows)
+            with self._conn:
+                stale = [(fid,) for fid in changed + removed]
+                self._conn.executemany('DELETE FROM placements WHERE file_id = ?', stale)
+                self._conn.executemany('DELETE FROM block_copies WHERE file_id = ?', stale)
+                self._conn.executemany('DELETE FROM files WHERE file_id = ?', [(fid,) for fid in removed])
+                for fid in changed:
+                    entry = files[fid]
+                    placements = entry.get('placements', [])
+                    head = {k: v for k, v in entry.items() if k != 'placements'}
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO files(file_id, original_filename, uploader_node, uploaded_at, data) VALUES (?, ?, ?, ?, ?)',
+                        (fid, entry.get('original_filename'), entry.get('uploader_node'), entry.get('uploaded_at'), _dumps(head)))
+                    self._conn.executemany(
+                        'INSERT OR REPLACE INTO placements(file_id, file_block_index, data) VALUES (?, ?, ?)',
+                        [(fid, p.get('file_block_index', i + 1), _dumps(p)) for i, p in enumerate(placements)])
+                    copies = []
+                    for i, p in enumerate(placements):
+                        idx = p.get('file_block_index', i + 1)
+                        copies.append((fid, idx, p.get('primary_node'), p.get('primary_block_id'), 'primary'))
+                        for rnode, rbid in zip(p.get('replica_nodes', []), p.get('replica_block_ids', [])):
+                            copies.append((fid, idx, rnode, rbid, 'replica'))
+                    self._conn.executemany(
+                        'INSERT INTO block_copies(file_id, file_block_index, node_id, block_id, role) VALUES (?, ?, ?, ?, ?)',
+                        copies)
+            self._saved['files'] = rows
+        log.info(f"[FILES_MANAGER] Guardado {len(files)} archivos en {self.path} ({len(changed)} cambios)")
+
+    # --- consultas ------------------------------------------------------------------
+    def free_blocks_on_node(self, node_id, limit=None):
+        # Solo los slots en uso tienen fila: los libres son el complemento dentro de 1..slots
+        with self._lock:
+            summary = self._conn.execute("SELECT value FROM kv WHERE key = 'block_nodes'").fetchone()
+            rows = self._conn.execute(
+                'SELECT block_id, slot, status FROM blocks WHERE node = ? ORDER BY slot', (node_id,)).fetchall()
+        info = json.loads(summary[0]).get(node_id) if summary else None
+        records = [{'id': bid, 'node': node_id, 'index': slot, 'status': status} for bid, slot, status in rows]
+        return _complement_free(node_id, info, records, limit)
+
+    def files_on_node(self, node_id):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT DISTINCT file_id FROM block_copies WHERE node_id = ?', (node_id,)).fetchall()
+        return [r[0] for r in rows]
+
+
+_KEYS = {'nodes': 'node_id', 'blocks': 'block_id', 'files': 'file_id'}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def open_store(backend=None, path=None):
+    """Crea un store del backend indicado (por defecto, el de SADTF_METADATA_BACKEND)."""
+    backend = (backend or os.environ.get('SADTF_METADATA_BACKEND', BACKEND_JSON)).lower()
+    if backend == BACKEND_SQLITE:
+        return SQLiteMetadataStore(path or os.environ.get('SADTF_METADATA_DB', DEFAULT_DB_PATH))
+    if backend == BACKEND_JSON:
+        return JsonMetadataStore(path or INFO_DIR)
+    if backend == BACKEND_SNAPSHOT:
+        return SnapshotMetadataStore(path or INFO_DIR)
+    raise ValueError(f"backend de metadata desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+
+
+def get_store():
+    """Store compartido del proceso (se crea la primera vez que se usa)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = open_store()
+            log.info(f"[METADATA] Backend de metadata: {_store.name}")
+        return _store
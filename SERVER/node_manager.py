@@ -1,42 +1,29 @@
 import os
-import json
+import threading
 import time
+from collections.abc import MutableMapping
+from types import MappingProxyType
+import log_manager as log
+import metadata_store
 
 nodes_persistent_file = os.path.join(os.path.dirname(__file__), 'info', 'nodes_data.json')
 
 
 def load_persistent_nodes():
-    """Carga y devuelve la estructura {'nodos': {node_id: info}} o {} si no existe."""
+    """Carga y devuelve el mapping {node_id: info} desde el backend de metadata ({} si no hay)."""
     try:
-        if os.path.exists(nodes_persistent_file):
-            with open(nodes_persistent_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-                if not content.strip():
-                    data = {'nodos': {}}
-                else:
-                    data = json.loads(content)
-        else:
-            data = {'nodos': {}}
-        # Normalizar estructura
-        if 'nodos' not in data:
-            data = {'nodos': {}}
-        return data.get('nodos', {})
+        return metadata_store.get_store().load_nodes() or {}
     except Exception as e:
-        print(f"[NODE_MANAGER] Error cargando nodos persistentes: {e}")
+        log.error(f"[NODE_MANAGER] Error cargando nodos persistentes: {e}")
         return {}
 
 
 def save_persistent_nodes(nodos_dict):
-    """Guarda la estructura de nodos en disco. Espera un mapping node_id -> info."""
+    """Guarda la estructura de nodos en el backend de metadata. Espera un mapping node_id -> info."""
     try:
-        data = {'nodos': nodos_dict}
-        os.makedirs(os.path.dirname(nodes_persistent_file), exist_ok=True)
-        with open(nodes_persistent_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
-        # pequeña señal para debugging
-        print(f"[NODE_MANAGER] Guardado {len(nodos_dict)} nodos en {nodes_persistent_file}")
+        metadata_store.get_store().save_nodes(nodos_dict)
     except Exception as e:
-        print(f"[NODE_MANAGER] Error guardando nodos persistentes: {e}")
+        log.error(f"[NODE_MANAGER] Error guardando nodos persistentes: {e}")
 
 
 def compute_next_node_number(nodos_dict):
@@ -61,5 +48,218 @@ def mark_node_offline(nodos_dict, node_id):
             save_persistent_nodes(nodos_dict)
             return True
     except Exception as e:
-        print(f"[NODE_MANAGER] Error marcando nodo offline: {e}")
+        log.error(f"[NODE_MANAGER] Error marcando nodo offline: {e}")
     return False
+
+
+_DELETE = object()
+
+
+class NodeView(MutableMapping):
+    """Vista dict de un nodo del registro: las escrituras pasan por el registro (índices y versión)."""
+
+    __slots__ = ('_registry', '_node_id')
+
+    def __init__(self, registry, node_id):
+        self._registry = registry
+        self._node_id = node_id
+
+    def _info(self):
+        info = self._registry._nodes.get(self._node_id)
+        if info is None:
+            raise KeyError(self._node_id)
+        return info
+
+    def __getitem__(self, key):
+        return self._info()[key]
+
+    def __setitem__(self, key, value):
+        self._registry.set_field(self._node_id, key, value)
+
+    def __delitem__(self, key):
+        self._registry.set_field(self._node_id, key, _DELETE)
+
+    def __iter__(self):
+        return iter(list(self._info()))
+
+    def __len__(self):
+        return len(self._info())
+
+    def __repr__(self):
+        return f"NodeView({self._node_id!r}, {self._info()!r})"
+
+
+class NodeRegistry(MutableMapping):
+    """
+    Tabla de nodos registrados (node_id -> info) con índices por IP y por estado.
+
+    Se usa como el dict de antes (`reg[nid]['status'] = 'offline'`, `.items()`,
+    `.get()`), pero cada nodo es una NodeView y sus escrituras mantienen los
+    índices: `node_for_ip()` e `ids_with_status()` no recorren la tabla.
+    Las escrituras se siguen haciendo con el lock del coordinador.
+
+    Para lectores sin lock (discovery, /whoami, /nodes con mucho polling):
+      - `node_for_ip()`, `status_of()` y `touch()` son operaciones de un solo
+        acceso a dict (atómicas con el GIL);
+      - `snapshot()` devuelve una copia de solo lectura que se rehace cuando cambia
+        la versión, es decir, cuando cambian altas, bajas, IP, estado o capacidad;
+      - `cached(key, build)` guarda un valor derivado (p.ej. la lista de nodos ya
+        serializada) hasta el siguiente cambio de versión.
+    `last_seen` cambia con cada mensaje de un nodo. Por eso no sube la versión:
+    la snapshot lo refleja con `max_age` segundos de retraso como mucho.
+    """
+
+    VOLATILE = ('last_seen',)
+
+    def __init__(self, max_age=1.0):
+        self.max_age = max_age
+        self._nodes = {}        # node_id -> dict
+        self._by_ip = {}        # ip -> tupla de node_ids (orden de registro)
+        self._by_status = {}    # estado -> dict node_id -> None (conjunto ordenado)
+        self._version = 0
+        self._touched = False   # hay cambios de campos volátiles que no están en la snapshot
+        self._snap = (-1, 0.0, MappingProxyType({}))
+        self._cache = {}        # clave -> (versión, instante, valor)
+        self._snap_guard = threading.Lock()
+        self._cache_guard = threading.Lock()   # `build` puede tomar el lock del coordinador: no llamar a cached() con él
+
+    # --- índices ------------------------------------------------------------------
+    def _index(self, node_id, info):
+        ip = info.get('ip')
+        if ip is not None:
+            ids = self._by_ip.get(ip, ())
+            if node_id not in ids:
+                self._by_ip[ip] = ids + (node_id,)
+        self._by_status.setdefault(info.get('status'), {})[node_id] = None
+
+    def _unindex(self, node_id, info):
+        ip = info.get('ip')
+        ids = self._by_ip.get(ip)
+        if ids and node_id in ids:
+            rest = tuple(n for n in ids if n != node_id)
+            if rest:
+                self._by_ip[ip] = rest
+            else:
+                del self._by_ip[ip]
+        members = self._by_status.get(info.get('status'))
+        if members is not None:
+            members.pop(node_id, None)
+
+    # --- interfaz dict -----------------------------------------------------------------
+    def __getitem__(self, node_id):
+        if node_id not in self._nodes:
+            raise KeyError(node_id)
+        return NodeView(self, node_id)
+
+    def __setitem__(self, node_id, info):
+        info = dict(info)
+        old = self._nodes.get(node_id)
+        if old is not None:
+            self._unindex(node_id, old)
+        self._nodes[node_id] = info
+        self._index(node_id, info)
+        self._version += 1
+
+    def __delitem__(self, node_id):
+        info = self._nodes.pop(node_id)
+        self._unindex(node_id, info)
+        self._version += 1
+
+    def __contains__(self, node_id):
+        return node_id in self._nodes
+
+    def __iter__(self):
+        return iter(list(self._nodes))
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def set_field(self, node_id, key, value):
+        info = self._nodes[node_id]
+        if key in ('ip', 'status'):
+            self._unindex(node_id, info)
+        if value is _DELETE:
+            del info[key]
+        else:
+            info[key] = value
+        if key in ('ip', 'status'):
+            self._index(node_id, info)
+        if key in self.VOLATILE:
+            self._touched = True
+        else:
+            self._version += 1
+
+    # --- consultas sin recorrer la tabla --------------------------------------------------
+    @property
+    def version(self):
+        return self._version
+
+    def node_for_ip(self, ip):
+        """Primer node_id registrado con esa IP, o None."""
+        ids = self._by_ip.get(ip)
+        return ids[0] if ids else None
+
+    def ids_for_ip(self, ip):
+        return list(self._by_ip.get(ip, ()))
+
+    def status_of(self, node_id):
+        info = self._nodes.get(node_id)
+        return info.get('status') if info is not None else None
+
+    def ids_with_status(self, status):
+        return list(self._by_status.get(status, ()))
+
+    def count(self, status=None):
+        if status is None:
+            return len(self._nodes)
+        return len(self._by_status.get(status, ()))
+
+    def touch(self, node_id, now=None):
+        """Actualiza `last_seen` (sin lock: una asignación en el dict del nodo)."""
+        info = self._nodes.get(node_id)
+        if info is not None:
+            info['last_seen'] = time.time() if now is None else now
+            self._touched = True
+
+    # --- lecturas sin lock ------------------------------------------------------------
+    def snapshot(self):
+        """Copia de solo lectura {node_id: info} (ver la nota sobre `last_seen`)."""
+        version, built_at, snap = self._snap
+        if version == self._version and not (self._touched and time.monotonic() - built_at >= self.max_age):
+            return snap
+        with self._snap_guard:
+            version, built_at, snap = self._snap
+            current = self._version
+            if version == current and not (self._touched and time.monotonic() - built_at >= self.max_age):
+                return snap
+            self._touched = False
+            # Una escritura concurrente puede cambiar el tamaño del dict mientras se copia
+            for _ in range(5):
+                try:
+                    data = {nid: MappingProxyType(dict(info)) for nid, info in list(self._nodes.items())}
+                    break
+                except RuntimeError:
+                    continue
+            else:
+                return snap
+            snap = MappingProxyType(data)
+            self._snap = (current, time.monotonic(), snap)
+            return snap
+
+    def cached(self, key, build, max_age=None):
+        """
+        Valor derivado de la tabla (p.ej. la lista de /nodes ya serializada):
+        `build()` se llama solo si cambió la versión o pasaron `max_age` segundos.
+        """
+        entry = self._cache.get(key)
+        now = time.monotonic()
+        if entry is not None and entry[0] == self._version and (max_age is None or now - entry[1] < max_age):
+            return entry[2]
+        with self._cache_guard:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] == self._version and (max_age is None or now - entry[1] < max_age):
+                return entry[2]
+            version = self._version
+            value = build()
+            self._cache[key] = (version, now, value)
+            return value
@@ -0,0 +1,145 @@
+"""
+Empaquetado de archivos pequeños en bloques compartidos (packs).
+
+Sin empaquetar, cada archivo ocupa al menos un slot por copia: un archivo de
+2 KB con replicación 2 gasta 2 slots. Los archivos de hasta `threshold` bytes
+(y un solo bloque) se añaden al final del pack abierto, un fichero en temp del
+coordinador. Cuando el pack se llena (`pack_size`, un slot) o pasa `max_age`
+segundos abierto, se cierra y se sella: se coloca y replica como un archivo
+normal de un bloque (`<pack_id>.part001`).
+
+En el índice de archivos:
+  - el pack es una entrada más con `kind: 'pack'` (oculta en /files), con sus
+    placements, y `members` = {file_id: [offset, length]} y `live_bytes`;
+  - cada archivo empaquetado tiene `pack: {pack_id, offset, length}` y sin
+    placements propios. Leerlo es leer el bloque del pack y cortar el rango.
+
+Al borrar archivos el pack se queda con huecos; cuando lo vivo baja de
+`compact_ratio` del tamaño, los miembros restantes se copian al pack abierto y
+el pack viejo se libera (compactación).
+"""
+import itertools
+import os
+import threading
+import time
+
+_counter = itertools.count(1)
+
+
+def new_pack_id():
+    return f"pack_{int(time.time() * 1000)}_{next(_counter)}"
+
+
+def is_pack(entry):
+    return bool(entry) and entry.get('kind') == 'pack'
+
+
+def new_pack_entry(pack_id, path):
+    """Entrada del índice de archivos para un pack recién abierto (sin sellar: sin placements)."""
+    return {
+        'file_id': pack_id,
+        'kind': 'pack',
+        'original_filename': pack_id,
+        'uploader_node': None,
+        'uploaded_at': time.time(),
+        'meta': {
+            'original_filename': pack_id,
+            'total_blocks': 1,
+            'total_size': 0,
+            'blocks': [{'block_name': f"{pack_id}.part001", 'size': 0, 'path': path, 'index': 1}],
+        },
+        'placements': [],
+        'members': {},
+        'live_bytes': 0,
+    }
+
+
+def is_sealed(pack):
+    return bool(pack.get('placements'))
+
+
+def pack_path(pack):
+    blocks = pack.get('meta', {}).get('blocks') or [{}]
+    return blocks[0].get('path')
+
+
+def add_member(pack, file_id, offset, length):
+    pack['members'][file_id] = [offset, length]
+    pack['live_bytes'] = pack.get('live_bytes', 0) + length
+    end = offset + length
+    meta = pack['meta']
+    if end > meta.get('total_size', 0):
+        meta['total_size'] = end
+        meta['blocks'][0]['size'] = end
+
+
+def remove_member(pack, file_id):
+    """Quita un miembro del pack. Retorna su longitud (0 si no estaba)."""
+    ref = pack.get('members', {}).pop(file_id, None)
+    if not ref:
+        return 0
+    pack['live_bytes'] = max(0, pack.get('live_bytes', 0) - ref[1])
+    return ref[1]
+
+
+def needs_compaction(pack, ratio):
+    size = pack.get('meta', {}).get('total_size', 0)
+    return is_sealed(pack) and bool(pack.get('members')) and size > 0 and pack.get('live_bytes', 0) < ratio * size
+
+
+class PackWriter:
+    """
+    El pack abierto en disco. `append()` escribe al final y llama a `register`
+    con el lock del writer tomado, de modo que cuando un pack se cierra todos los
+    archivos escritos en él ya están registrados en el índice.
+    """
+
+    def __init__(self, directory, pack_size, max_age=10.0):
+        self.directory = directory
+        self.pack_size = int(pack_size)
+        self.max_age = float(max_age)
+        self._lock = threading.Lock()
+        self._current = None        # {'pack_id', 'path', 'size', 'opened_at'}
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, data, register):
+        """
+        Añade `data` al pack abierto (abre uno nuevo si no cabe) y llama a
+        `register(pack_id, path, offset, nuevo)`; `nuevo` indica que el pack se
+        acaba de abrir. Retorna el pack_id cerrado por estar lleno, o None.
+        """
+        with self._lock:
+            closed = None
+            cur = self._current
+            if cur is not None and cur['size'] + len(data) > self.pack_size:
+                closed, cur = cur['pack_id'], None
+            is_new = cur is None
+            if is_new:
+                pack_id = new_pack_id()
+                cur = {'pack_id': pack_id, 'path': os.path.join(self.directory, f"{pack_id}.pack"),
+                       'size': 0, 'opened_at': time.time()}
+            with open(cur['path'], 'ab') as f:
+                f.write(data)
+            offset = cur['size']
+            cur['size'] += len(data)
+            self._current = cur
+            register(cur['pack_id'], cur['path'], offset, is_new)
+            return closed
+
+    def close_expired(self, now=None):
+        """Cierra el pack abierto si lleva más de `max_age` segundos. Retorna su id o None."""
+        now = time.time() if now is None else now
+        with self._lock:
+            cur = self._current
+            if cur is not None and now - cur['opened_at'] >= self.max_age:
+                self._current = None
+                return cur['pack_id']
+        return None
+
+    def is_open(self, pack_id):
+        with self._lock:
+            return self._current is not None and self._current['pack_id'] == pack_id
+
+    def current(self):
+        with self._lock:
+            return dict(self._current) if self._current else None
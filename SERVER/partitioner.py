@@ -7,6 +7,9 @@ ser proporcionada por el coordinador/blocks_manager.
 
 Algoritmo principal: round-robin sobre nodos ONLINE que tengan bloques libres,
 asignando para cada bloque un 'primary' y N-1 réplicas en nodos distintos.
+
+La capacidad se contabiliza en bytes: un nodo solo recibe un bloque si tiene un
+slot libre y además bytes suficientes (capacity en MB menos bytes ya ocupados).
 """
 from typing import List, Dict, Any, Tuple
 
@@ -18,20 +21,54 @@ class Partitioner:
         self.replication = replication
 
     def _online_nodes(self, nodos_registrados: Dict[str, Any]) -> List[str]:
+        if hasattr(nodos_registrados, 'ids_with_status'):
+            # NodeRegistry: conjunto indexado por estado, sin recorrer la tabla
+            return nodos_registrados.ids_with_status('online')
         return [nid for nid, info in nodos_registrados.items() if info.get('status') == 'online']
 
-    def _free_blocks_by_node(self, blocks_raw: Dict[str, Any]) -> Dict[str, List[str]]:
-        """Devuelve mapping node_id -> lista de block_ids libres"""
+    def _free_blocks_by_node(self, blocks_raw: Dict[str, Any], limit: int = None) -> Dict[str, List[str]]:
+        """Devuelve mapping node_id -> lista de block_ids libres (como mucho `limit` por nodo)"""
         res = {}
-        for bid, b in blocks_raw.get('blocks', {}).items():
+        blocks = blocks_raw.get('blocks', {})
+        if hasattr(blocks, 'free_slot_ids'):
+            # BlockTable: recorrido de los extents libres de cada nodo
+            for node in blocks.node_ids():
+                free = blocks.free_slot_ids(node, limit=limit)
+                if free:
+                    res[node] = free
+            return res
+        for bid, b in blocks.items():
             if b.get('status') == 'free':
                 node = b.get('node')
                 res.setdefault(node, []).append(bid)
         return res
 
-    def allocate_blocks_for_file(self, num_blocks: int, nodos_registrados: Dict[str, Any], blocks_raw: Dict[str, Any]) -> Tuple[bool, List[Dict[str, Any]], str]:
+    def _free_bytes_by_node(self, nodos_registrados: Dict[str, Any], blocks_raw: Dict[str, Any], slot_size: int) -> Dict[str, Any]:
+        """Devuelve mapping node_id -> bytes libres (None si el nodo no declaró capacidad)."""
+        blocks = blocks_raw.get('blocks', {})
+        used: Dict[str, int] = {}
+        if hasattr(blocks, 'used_bytes_by_node'):
+            used = blocks.used_bytes_by_node()
+        else:
+            for b in blocks.values():
+                if b.get('status') in ('occupied', 'replica', 'deleting'):
+                    node = b.get('node')
+                    used[node] = used.get(node, 0) + int(b.get('size', slot_size) or 0)
+        res = {}
+        for nid, info in nodos_registrados.items():
+            cap = info.get('capacity')
+            res[nid] = (int(float(cap) * 1024 * 1024) - used.get(nid, 0)) if cap else None
+        return res
+
+    def allocate_blocks_for_file(self, num_blocks: int, nodos_registrados: Dict[str, Any], blocks_raw: Dict[str, Any],
+                                 block_sizes: List[int] = None, slot_size: int = 1024 * 1024,
+                                 start: int = 0) -> Tuple[bool, List[Dict[str, Any]], str]:
         """
         Calcula las asignaciones para `num_blocks` bloques del archivo.
+        `block_sizes` (opcional) son los tamaños en bytes de cada bloque; sin ellos
+        cada bloque cuenta como un slot completo. `start` es la posición inicial
+        del round-robin: al colocar un archivo por tramos (upload en streaming) se
+        pasa el número de bloques ya colocados para seguir repartiendo entre nodos.
 
         Retorna: (ok: bool, placements: list, message: str)
         Cada placement es: {
@@ -46,7 +83,8 @@ class Partitioner:
         if not online_nodes:
             return False, [], 'No hay nodos ONLINE para almacenar bloques.'
 
-        free_by_node = self._free_blocks_by_node(blocks_raw)
+        # Ningún nodo puede recibir más de num_blocks * replication copias
+        free_by_node = self._free_blocks_by_node(blocks_raw, limit=max(1, num_blocks) * self.replication)
 
         # Filtrar nodes que realmente tengan bloques libres
         candidate_nodes = [n for n in online_nodes if free_by_node.get(n)]
@@ -55,15 +93,28 @@ class Partitioner:
 
         # Round-robin index over candidate_nodes
         node_count = len(candidate_nodes)
-        rr_index = 0
+        rr_index = start
 
         # Ajustar factor de réplica en función de nodos disponibles
         replication_effective = min(self.replication, max(1, node_count))
 
         # Copia local de listas para consumir sin modificar original
         free_local = {n: list(v) for n, v in free_by_node.items()}
+        free_bytes = self._free_bytes_by_node(nodos_registrados, blocks_raw, slot_size)
+
+        def fits(node, size):
+            if not free_local.get(node):
+                return False
+            fb = free_bytes.get(node)
+            return fb is None or fb >= size
+
+        def take(node, size):
+            if free_bytes.get(node) is not None:
+                free_bytes[node] -= size
+            return free_local[node].pop(0)
 
         for i in range(num_blocks):
+            size = block_sizes[i] if block_sizes and i < len(block_sizes) else slot_size
             # seleccionar primary node por round-robin saltando nodos sin bloques
             tries = 0
             primary_node = None
@@ -71,14 +122,14 @@ class Partitioner:
                 candidate = candidate_nodes[rr_index % node_count]
                 rr_index += 1
                 tries += 1
-                if free_local.get(candidate):
+                if fits(candidate, size):
                     primary_node = candidate
                     break
 
             if not primary_node:
-                return False, placements, f'No se pudo asignar primary para el bloque {i+1} (no hay bloques libres).'
+                return False, placements, f'No se pudo asignar primary para el bloque {i+1} (no hay espacio libre).'
 
-            primary_block_id = free_local[primary_node].pop(0)
+            primary_block_id = take(primary_node, size)
 
             # Elegir réplicas en nodos distintos
             replica_block_ids = []
@@ -92,11 +143,12 @@ class Partitioner:
                 other_nodes = [n for n in candidate_nodes if n != primary_node]
                 on_count = len(other_nodes)
                 k = 0
-                while needed > 0 and on_count > 0:
-                    node_pick = other_nodes[k % on_count]
+                # cada nodo distinto se visita una vez (evita bucle infinito si ninguno tiene espacio)
+                while needed > 0 and k < on_count:
+                    node_pick = other_nodes[k]
                     k += 1
-                    if free_local.get(node_pick):
-                        replica_block_ids.append(free_local[node_pick].pop(0))
+                    if fits(node_pick, size):
+                        replica_block_ids.append(take(node_pick, size))
                         replica_nodes.append(node_pick)
                         needed -= 1
                     else:
@@ -113,13 +165,13 @@ class Partitioner:
                             break
                         if extra_node == primary_node:
                             # intentar obtener más bloques del primary si tiene
-                            if free_local.get(extra_node):
-                                replica_block_ids.append(free_local[extra_node].pop(0))
+                            if fits(extra_node, size):
+                                replica_block_ids.append(take(extra_node, size))
                                 replica_nodes.append(extra_node)
                                 needed -= 1
                         else:
-                            if free_local.get(extra_node):
-                                replica_block_ids.append(free_local[extra_node].pop(0))
+                            if fits(extra_node, size):
+                                replica_block_ids.append(take(extra_node, size))
                                 replica_nodes.append(extra_node)
                                 needed -= 1
 
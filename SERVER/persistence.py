@@ -0,0 +1,129 @@
+"""
+Persistencia diferida (group commit) de las tablas del coordinador.
+
+Antes cada cambio reescribía la tabla completa en el momento: una subida
+guardaba los bloques dos veces y los archivos una, un /register guardaba
+bloques, archivos y nodos, y cada cambio de estado de un nodo reescribía
+nodes_data.json. Ahora quien modifica una tabla solo la marca como sucia:
+
+    persistence.mark_dirty('blocks', 'files')
+
+y un hilo de fondo escribe cada tabla sucia como mucho una vez por intervalo.
+Una ráfaga de cambios dentro del intervalo se agrupa en una única escritura.
+
+Cada tabla se registra con dos funciones:
+  - snapshot(): copia de la tabla; se llama con el lock de la tabla tomado,
+    así que debe ser rápida y no hacer E/S. Si se registra sin lock, la
+    función toma el lock por su cuenta (p.ej. por tandas, ver
+    files_manager.snapshot_files).
+  - save(copia): escribe la copia (fuera del lock). Los backends de
+    metadata_store escriben de forma atómica (temporal + rename en JSON, una
+    transacción en SQLite).
+
+Como todo cambio pasa por `mark_dirty`, `version(nombre)` (cuántas veces se
+marcó la tabla) sirve también para invalidar cachés de datos derivados.
+
+`flush()` escribe en el momento lo pendiente (apagado, herramientas y pruebas).
+Si una escritura falla, la tabla vuelve a quedar sucia y se reintenta en el
+siguiente ciclo.
+"""
+import threading
+import time
+from contextlib import nullcontext
+import log_manager as log
+
+DEFAULT_INTERVAL = 1.0
+
+
+class PersistenceService:
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = max(0.0, float(interval))
+        self._tables = {}            # nombre -> (snapshot, save, lock)
+        self._dirty = set()
+        self._lock = threading.Lock()        # protege _dirty y _versions
+        self._write_lock = threading.Lock()  # serializa las escrituras (hilo de fondo y flush)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'marks': 0, 'writes': 0, 'errors': 0}
+        self._versions = {}          # nombre -> nº de veces marcada (versión de la tabla para cachés)
+
+    def register(self, name, snapshot, save, lock=None):
+        """Registra una tabla: `snapshot()` se llama bajo `lock` y `save(copia)` fuera de él."""
+        self._tables[name] = (snapshot, save, lock)
+
+    def mark_dirty(self, *names):
+        """Marca tablas como modificadas; se escribirán en el próximo ciclo."""
+        with self._lock:
+            for name in names:
+                if name not in self._tables:
+                    log.warning(f"[PERSIST] Tabla desconocida: {name}")
+                    continue
+                self._dirty.add(name)
+                self._versions[name] = self._versions.get(name, 0) + 1
+                self.stats['marks'] += 1
+        if self._thread is None:
+            # Sin hilo de fondo (herramientas, pruebas): escritura inmediata
+            self.flush(names)
+        else:
+            self._wake.set()
+
+    def version(self, *names):
+        """
+        Versión de las tablas indicadas: cambia cada vez que alguna se marca como
+        sucia. Sirve de clave para cachear datos derivados (p.ej. los listados de la API).
+        """
+        with self._lock:
+            return tuple(self._versions.get(name, 0) for name in names)
+
+    def pending(self):
+        with self._lock:
+            return sorted(self._dirty)
+
+    def flush(self, names=None):
+        """Escribe ahora las tablas sucias (todas, o solo `names`). Retorna las escritas."""
+        with self._write_lock:
+            with self._lock:
+                todo = [n for n in self._dirty if names is None or n in names]
+                self._dirty.difference_update(todo)
+            written = []
+            for name in todo:
+                snapshot, save, lock = self._tables[name]
+                try:
+                    with lock if lock is not None else nullcontext():
+                        data = snapshot()
+                    save(data)
+                    written.append(name)
+                    self.stats['writes'] += 1
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    log.error(f"[PERSIST] Error guardando '{name}': {e}")
+                    with self._lock:
+                        self._dirty.add(name)
+            return written
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            if self._stop.is_set():
+                break
+            # Dejar que se acumulen los cambios de la ráfaga antes de escribir
+            self._stop.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='persistence', daemon=True)
+            self._thread.start()
+            log.info(f"[PERSIST] Escritura diferida cada {self.interval:.2f}s como máximo")
+        return self
+
+    def stop(self):
+        """Detiene el hilo de fondo y escribe lo pendiente."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            self._wake.set()
+            thread.join(timeout=max(5.0, self.interval * 2))
+        return self.flush()
@@ -0,0 +1,272 @@
+"""
+Profiler: diagnóstico bajo demanda del coordinador sin reiniciarlo.
+
+Modos disponibles:
+  - 'sample':   hilo muestreador que captura periódicamente las pilas de TODOS
+                los hilos (sys._current_frames). Coste acotado por el intervalo y
+                útil para ver convoyes de locks (hilos esperando en `with lock_nodos`).
+  - 'cprofile': cProfile por petición. Cada petición HTTP (o cualquier bloque
+                envuelto con `profiled()`) se perfila en su propio hilo y las
+                estadísticas se fusionan al terminar.
+
+Además permite tomar snapshots de tracemalloc y comparar contra una línea base
+para detectar crecimiento de memoria (p.ej. en `files_store`).
+
+Todas las funciones son seguras para llamarse desde varios hilos.
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+import log_manager as log
+
+_lock = threading.Lock()
+_session = None          # sesión de perfilado activa (dict) o None
+_last_report = None      # último informe generado (dict)
+
+_tm_lock = threading.Lock()
+_tm_session = None       # sesión tracemalloc activa
+_tm_last_report = None
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{frame.f_lineno}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """Muestrea las pilas de todos los hilos cada `interval` segundos."""
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = max(0.001, float(interval))
+        self.max_depth = max_depth
+        self.samples = 0
+        self.self_counts = Counter()    # frame superior de cada pila
+        self.cum_counts = Counter()     # cualquier frame presente en la pila
+        self.stack_counts = Counter()   # pila completa colapsada (formato flamegraph)
+        self.thread_counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                stack = []
+                f = frame
+                while f is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_label(f))
+                    f = f.f_back
+                if not stack:
+                    continue
+                self.self_counts[stack[0]] += 1
+                for label in set(stack):
+                    self.cum_counts[label] += 1
+                self.stack_counts[';'.join(reversed(stack))] += 1
+                self.thread_counts[names.get(tid, str(tid))] += 1
+            self.samples += 1
+
+    def report(self, top=30):
+        def _rows(counter):
+            return [{'frame': k, 'samples': v, 'percent': round(v * 100.0 / self.samples, 2) if self.samples else 0}
+                    for k, v in counter.most_common(top)]
+        return {
+            'samples': self.samples,
+            'interval': self.interval,
+            'threads': dict(self.thread_counts.most_common()),
+            'top_self': _rows(self.self_counts),
+            'top_cumulative': _rows(self.cum_counts),
+            'top_stacks': [f"{k} {v}" for k, v in self.stack_counts.most_common(top)],
+        }
+
+
+class RequestProfiler:
+    """Acumula estadísticas cProfile de bloques perfilados en distintos hilos."""
+
+    def __init__(self):
+        self._stats = None
+        self._lock = threading.Lock()
+        self.profiled_calls = 0
+
+    def add(self, prof):
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(prof)
+            else:
+                self._stats.add(prof)
+            self.profiled_calls += 1
+
+    def report(self, top=30, sort='cumulative'):
+        with self._lock:
+            if self._stats is None:
+                return {'profiled_calls': 0, 'pstats': ''}
+            out = io.StringIO()
+            self._stats.stream = out
+            try:
+                self._stats.sort_stats(sort)
+            except KeyError:
+                self._stats.sort_stats('cumulative')
+            self._stats.print_stats(top)
+            return {'profiled_calls': self.profiled_calls, 'sort': sort, 'pstats': out.getvalue()}
+
+
+@contextmanager
+def profiled():
+    """Perfila el bloque con cProfile si hay una sesión 'cprofile' activa (coste nulo si no)."""
+    session = _session
+    if not session or session['mode'] != 'cprofile':
+        yield
+        return
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:
+        # Otro profiler ya activo en este hilo (p.ej. llamada anidada)
+        yield
+        return
+    try:
+        yield
+    finally:
+        prof.disable()
+        session['collector'].add(prof)
+
+
+def start_profile(mode='sample', seconds=None, interval=0.005):
+    """
+    Inicia una sesión de perfilado. Si `seconds` se indica, la sesión se detiene
+    sola y su informe queda disponible en `profile_status()`.
+    Retorna (ok, mensaje).
+    """
+    global _session
+    if mode not in ('sample', 'cprofile'):
+        return False, f"modo desconocido: {mode}"
+    with _lock:
+        if _session is not None:
+            return False, 'ya hay una sesión de perfilado activa'
+        session = {'mode': mode, 'started_at': time.time(), 'seconds': seconds, 'timer': None}
+        if mode == 'sample':
+            sampler = SamplingProfiler(interval=interval)
+            sampler.start()
+            session['collector'] = sampler
+        else:
+            session['collector'] = RequestProfiler()
+        if seconds:
+            t = threading.Timer(float(seconds), stop_profile)
+            t.daemon = True
+            session['timer'] = t
+            t.start()
+        _session = session
+    log.info(f"[PROFILER] Sesión '{mode}' iniciada (seconds={seconds})")
+    return True, 'OK'
+
+
+def stop_profile(top=30, sort='cumulative'):
+    """Detiene la sesión activa y devuelve su informe (o None si no había sesión)."""
+    global _session, _last_report
+    with _lock:
+        session = _session
+        _session = None
+    if session is None:
+        return None
+    if session.get('timer'):
+        session['timer'].cancel()
+    collector = session['collector']
+    if session['mode'] == 'sample':
+        collector.stop()
+        body = collector.report(top=top)
+    else:
+        body = collector.report(top=top, sort=sort)
+    report = {
+        'mode': session['mode'],
+        'started_at': session['started_at'],
+        'duration': round(time.time() - session['started_at'], 3),
+        'report': body,
+    }
+    _last_report = report
+    log.info(f"[PROFILER] Sesión '{session['mode']}' detenida tras {report['duration']}s")
+    return report
+
+
+def profile_status():
+    session = _session
+    active = None
+    if session:
+        active = {'mode': session['mode'], 'started_at': session['started_at'], 'seconds': session['seconds']}
+    return {'active': active, 'last_report': _last_report}
+
+
+def start_tracemalloc(frames=10, seconds=None):
+    """Activa tracemalloc y toma una snapshot base para comparar al detener."""
+    global _tm_session
+    with _tm_lock:
+        if _tm_session is not None:
+            return False, 'ya hay una sesión tracemalloc activa'
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(int(frames))
+        session = {'started_at': time.time(), 'seconds': seconds, 'started_here': started_here,
+                   'baseline': tracemalloc.take_snapshot(), 'timer': None}
+        if seconds:
+            t = threading.Timer(float(seconds), stop_tracemalloc)
+            t.daemon = True
+            session['timer'] = t
+            t.start()
+        _tm_session = session
+    log.info(f"[PROFILER] tracemalloc iniciado (frames={frames}, seconds={seconds})")
+    return True, 'OK'
+
+
+def stop_tracemalloc(top=25):
+    """Toma una snapshot final, la compara con la base y detiene tracemalloc."""
+    global _tm_session, _tm_last_report
+    with _tm_lock:
+        session = _tm_session
+        _tm_session = None
+    if session is None:
+        return None
+    if session.get('timer'):
+        session['timer'].cancel()
+    snap = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    if session['started_here']:
+        tracemalloc.stop()
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    snap = snap.filter_traces(filters)
+    baseline = session['baseline'].filter_traces(filters)
+    report = {
+        'started_at': session['started_at'],
+        'duration': round(time.time() - session['started_at'], 3),
+        'traced_current_bytes': current,
+        'traced_peak_bytes': peak,
+        'top_allocations': [str(s) for s in snap.statistics('lineno')[:top]],
+        'top_growth': [str(d) for d in snap.compare_to(baseline, 'lineno')[:top]],
+    }
+    _tm_last_report = report
+    log.info(f"[PROFILER] tracemalloc detenido tras {report['duration']}s")
+    return report
+
+
+def tracemalloc_status():
+    session = _tm_session
+    active = None
+    if session:
+        active = {'started_at': session['started_at'], 'seconds': session['seconds']}
+    return {'active': active, 'tracing': tracemalloc.is_tracing(), 'last_report': _tm_last_report}
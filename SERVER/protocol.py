@@ -0,0 +1,220 @@
+"""
+Protocolo de mensajes TCP entre coordinador y nodos.
+
+Cada mensaje es un objeto JSON en una línea (terminado en '\\n'). json.dumps no
+genera saltos de línea, así que el separador nunca aparece dentro de un mensaje,
+y un mensaje puede llegar repartido en varios recv o varios mensajes en uno.
+
+Todo mensaje lleva `req_id`. Las respuestas (REGISTER_OK, BLOCK_DATA,
+STORE_BLOCK_ACK, ...) repiten el `req_id` de la petición: así una misma conexión
+puede tener muchas peticiones en curso a la vez y cada respuesta se entrega a
+quien la espera, aunque lleguen desordenadas.
+
+Mensajes por lotes (nodos que anuncian `"features": ["batch"]` al registrarse):
+  - STORE_BLOCKS   {'blocks': [{file_id, block_id, block_name, is_replica, data_b64}, ...]}
+    -> STORE_BLOCKS_ACK {'acks': [{block_id, status, error?}, ...]}
+  - REQUEST_BLOCKS {'blocks': [{block_id, block_name}, ...]}
+    -> BLOCKS_DATA   {'blocks': [{block_id, data_b64} o {block_id, error}, ...]}
+Con archivos pequeños el coste de cada mensaje (sobre JSON, sendall, despacho y
+ACK en el nodo) domina sobre los datos: un lote lo paga una vez.
+
+Borrado de bloques (nodos con `"features": ["delete"]`, ver block_gc):
+  - DELETE_BLOCKS  {'blocks': [{block_id, block_name}, ...]}
+    -> DELETE_BLOCKS_ACK {'acks': [{block_id, status, error?}, ...]}
+  Un bloque que el nodo ya no tiene se confirma como borrado ('OK').
+"""
+import itertools
+import json
+import os
+import queue
+import threading
+
+RECV_SIZE = 256 * 1024
+MAX_FRAME = 256 * 1024 * 1024   # un bloque en base64 cabe de sobra; más que esto es un flujo corrupto
+
+FEATURE_BATCH = 'batch'
+FEATURE_DELETE = 'delete'
+DELETE_BATCH_MAX = int(os.environ.get('SADTF_DELETE_BATCH', '512'))                # bloques por DELETE_BLOCKS
+BATCH_MAX_BYTES = int(os.environ.get('SADTF_BATCH_MAX_KB', '4096')) * 1024   # datos (sin base64) por lote
+BATCH_MAX_BLOCKS = int(os.environ.get('SADTF_BATCH_MAX_BLOCKS', '256'))
+BATCH_SMALL_BLOCK = int(os.environ.get('SADTF_BATCH_SMALL_KB', '256')) * 1024  # bloques mayores van solos (STORE_BLOCK)
+
+_req_ids = itertools.count(1)
+
+
+def new_req_id():
+    """Identificador de petición único en este proceso (itertools.count es atómico con el GIL)."""
+    return next(_req_ids)
+
+
+def encode(obj):
+    return json.dumps(obj).encode() + b'\n'
+
+
+def iter_messages(sock, on_error=None):
+    """
+    Lee mensajes de `sock` hasta que el otro extremo cierra la conexión.
+    Las líneas que no son JSON válido se descartan (llamando a `on_error(exc)`).
+    """
+    buf = bytearray()
+    while True:
+        chunk = sock.recv(RECV_SIZE)
+        if not chunk:
+            return
+        scan = len(buf)
+        buf += chunk
+        start = 0
+        while True:
+            end = buf.find(b'\n', scan)
+            if end == -1:
+                break
+            line = bytes(buf[start:end])
+            start = scan = end + 1
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                if on_error:
+                    on_error(e)
+        if start:
+            del buf[:start]
+        if len(buf) > MAX_FRAME:
+            raise ValueError(f"mensaje de más de {MAX_FRAME} bytes sin terminar")
+
+
+def batch_ranges(sizes, max_bytes=BATCH_MAX_BYTES, max_blocks=BATCH_MAX_BLOCKS):
+    """Parte una lista de tamaños en rangos [inicio, fin) que respetan los límites de un lote."""
+    ranges = []
+    start, acc = 0, 0
+    for i, size in enumerate(sizes):
+        if i > start and (acc + size > max_bytes or i - start >= max_blocks):
+            ranges.append((start, i))
+            start, acc = i, 0
+        acc += size
+    if start < len(sizes):
+        ranges.append((start, len(sizes)))
+    return ranges
+
+
+class StoreBatcher:
+    """
+    Agrupa por nodo destino los STORE_BLOCK de bloques pequeños y los envía como
+    STORE_BLOCKS al llenarse un lote o en `flush()`. Los bloques grandes y los
+    nodos sin soporte de lotes se envían al momento como STORE_BLOCK.
+
+        batcher = StoreBatcher(send_json, lambda nid: ...)
+        batcher.add(node_id, sock, msg, size)   # msg: un STORE_BLOCK
+        ...
+        batcher.flush()
+
+    `send(sock, msg)` puede lanzar excepción; `add` y `flush` la registran en
+    `errors` (lista de (node_id, block_ids, excepción)) y siguen con el resto.
+    """
+
+    def __init__(self, send, supports_batch, max_bytes=BATCH_MAX_BYTES, max_blocks=BATCH_MAX_BLOCKS,
+                 small_block=BATCH_SMALL_BLOCK):
+        self._send = send
+        self._supports_batch = supports_batch
+        self.max_bytes = max_bytes
+        self.max_blocks = max_blocks
+        self.small_block = small_block
+        self._queues = {}       # node_id -> [sock, [bloques], bytes]
+        self.messages = 0
+        self.blocks = 0
+        self.errors = []
+
+    def add(self, node_id, sock, msg, size):
+        self.blocks += 1
+        if size > self.small_block or not self._supports_batch(node_id):
+            self._deliver(node_id, sock, msg, [msg.get('block_id')])
+            return
+        q = self._queues.get(node_id)
+        if q is None or q[0] is not sock:
+            if q is not None:
+                self._flush_node(node_id)
+            q = self._queues[node_id] = [sock, [], 0]
+        entry = {k: v for k, v in msg.items() if k not in ('type', 'req_id')}
+        q[1].append(entry)
+        q[2] += size
+        if q[2] >= self.max_bytes or len(q[1]) >= self.max_blocks:
+            self._flush_node(node_id)
+
+    def _flush_node(self, node_id):
+        q = self._queues.pop(node_id, None)
+        if not q or not q[1]:
+            return
+        sock, blocks, _ = q
+        if len(blocks) == 1:
+            msg = dict(blocks[0], type='STORE_BLOCK')
+        else:
+            msg = {'type': 'STORE_BLOCKS', 'blocks': blocks}
+        self._deliver(node_id, sock, msg, [b.get('block_id') for b in blocks])
+
+    def _deliver(self, node_id, sock, msg, block_ids):
+        try:
+            self._send(sock, msg)
+            self.messages += 1
+        except Exception as e:
+            self.errors.append((node_id, block_ids, e))
+
+    def flush(self):
+        for node_id in list(self._queues):
+            self._flush_node(node_id)
+
+
+class StoreFanOut:
+    """
+    Como StoreBatcher, pero cada nodo destino tiene su cola acotada y su hilo de
+    envío: `add()` vuelve en cuanto el mensaje está encolado (o espera si la cola
+    de ese nodo está llena), así los envíos a varios nodos van en paralelo entre
+    sí y con quien produce los bloques. Cada hilo agrupa con su propio
+    StoreBatcher y vacía el lote cuando su cola se queda sin mensajes.
+    `close()` espera a que se envíe todo; después `errors` y `messages` suman los
+    de todos los nodos.
+    """
+
+    def __init__(self, send, supports_batch, depth=8):
+        self._send = send
+        self._supports_batch = supports_batch
+        self.depth = max(1, int(depth))
+        self._workers = {}      # node_id -> (cola, hilo, batcher)
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.blocks = 0
+        self.errors = []
+
+    def add(self, node_id, sock, msg, size):
+        with self._lock:
+            worker = self._workers.get(node_id)
+            if worker is None:
+                q = queue.Queue(self.depth)
+                batcher = StoreBatcher(self._send, self._supports_batch)
+                thread = threading.Thread(target=self._run, args=(q, batcher), daemon=True,
+                                          name=f"fanout-{node_id}")
+                worker = self._workers[node_id] = (q, thread, batcher)
+                thread.start()
+        worker[0].put((node_id, sock, msg, size))
+
+    @staticmethod
+    def _run(q, batcher):
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            batcher.add(*item)
+            if q.empty():
+                batcher.flush()
+        batcher.flush()
+
+    def close(self):
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers = {}
+        for q, _, _ in workers:
+            q.put(None)
+        for _, thread, batcher in workers:
+            thread.join()
+            self.messages += batcher.messages
+            self.blocks += batcher.blocks
+            self.errors.extend(batcher.errors)
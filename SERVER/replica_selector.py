@@ -0,0 +1,155 @@
+"""
+ReplicaSelector: elige desde qué nodo leer cada bloque cuando hay varias copias.
+
+Por nodo se mantiene:
+  - RTT: medido con el PING/PONG del monitor (el PING lleva `ts` y el nodo lo
+    devuelve en el PONG), suavizado con una media móvil exponencial (EWMA);
+  - peticiones en curso (in-flight) hacia el nodo;
+  - throughput reciente: bytes / tiempo de las últimas transferencias (EWMA);
+  - fallos recientes (timeouts o errores), con una penalización que decae;
+  - si el detector de fallos lo tiene como sospechoso (heartbeats anómalos).
+
+El coste estimado de leer un bloque de `size` bytes de un nodo es
+
+    rtt + (in_flight + 1) * size / throughput + penalización
+
+es decir, lo que tardaría si tuviera que esperar detrás de lo que ya tiene en
+curso. Las fuentes se ordenan por ese coste con un pequeño ruido aleatorio para
+repartir la carga entre réplicas equivalentes: un nodo ocupado o lento deja de
+ser el primero en cuanto acumula peticiones o su throughput cae.
+"""
+import random
+import threading
+import time
+
+DEFAULT_RTT = 0.05                     # s, para nodos aún sin medir
+DEFAULT_THROUGHPUT = 20 * 1024 * 1024  # B/s, para nodos aún sin medir
+ALPHA = 0.3                            # peso de la última muestra en las EWMA
+FAILURE_PENALTY = 5.0                  # s añadidos al coste por cada fallo reciente
+FAILURE_DECAY = 30.0                   # s para que la penalización de un fallo se reduzca a la mitad
+SUSPECT_PENALTY = 10.0                 # s añadidos mientras el nodo está en 'suspect'
+JITTER = 0.1                           # ruido relativo para repartir empates
+
+
+class _NodeStats:
+    __slots__ = ('rtt', 'throughput', 'inflight', 'penalty', 'penalty_ts', 'requests', 'failures', 'bytes', 'suspect')
+
+    def __init__(self):
+        self.rtt = None
+        self.throughput = None
+        self.inflight = 0
+        self.penalty = 0.0
+        self.penalty_ts = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.bytes = 0
+        self.suspect = False
+
+
+class ReplicaSelector:
+    def __init__(self, alpha=ALPHA):
+        self.alpha = alpha
+        self._nodes = {}
+        self._lock = threading.Lock()
+
+    def _get(self, node_id):
+        st = self._nodes.get(node_id)
+        if st is None:
+            st = self._nodes[node_id] = _NodeStats()
+        return st
+
+    def _ewma(self, old, sample):
+        return sample if old is None else old + self.alpha * (sample - old)
+
+    def _penalty(self, st, now):
+        if not st.penalty:
+            return 0.0
+        return st.penalty * 0.5 ** ((now - st.penalty_ts) / FAILURE_DECAY)
+
+    # --- señales -------------------------------------------------------------------
+    def record_rtt(self, node_id, rtt):
+        if rtt is None or rtt < 0:
+            return
+        with self._lock:
+            st = self._get(node_id)
+            st.rtt = self._ewma(st.rtt, rtt)
+
+    def record_pong(self, node_id, sent_ts, now=None):
+        """
+        `sent_ts` es el `ts` (time.monotonic del coordinador) que el nodo devolvió en el PONG.
+        Retorna el RTT medido, o None si `sent_ts` no es válido.
+        """
+        try:
+            rtt = (now if now is not None else time.monotonic()) - float(sent_ts)
+        except (TypeError, ValueError):
+            return None
+        if not 0 <= rtt < 60:
+            return None
+        self.record_rtt(node_id, rtt)
+        return rtt
+
+    def set_suspect(self, node_id, suspect):
+        """Marca/desmarca el nodo como sospechoso (lo decide el detector de fallos)."""
+        with self._lock:
+            st = self._nodes.get(node_id)
+            if st is None:
+                if not suspect:
+                    return
+                st = self._get(node_id)
+            st.suspect = bool(suspect)
+
+    def begin(self, node_id):
+        """Marca el inicio de una petición al nodo. Retorna el instante para `end()`."""
+        with self._lock:
+            self._get(node_id).inflight += 1
+        return time.monotonic()
+
+    def end(self, node_id, started, nbytes=0, ok=True):
+        """Cierra una petición: actualiza throughput si tuvo éxito o penaliza el nodo si falló."""
+        now = time.monotonic()
+        with self._lock:
+            st = self._get(node_id)
+            st.inflight = max(0, st.inflight - 1)
+            st.requests += 1
+            if ok:
+                st.bytes += nbytes
+                # El tiempo de transferencia descuenta el RTT (solo cuenta el ancho de banda)
+                elapsed = max(now - started - (st.rtt or 0.0), 0.001)
+                if nbytes:
+                    st.throughput = self._ewma(st.throughput, nbytes / elapsed)
+            else:
+                st.failures += 1
+                st.penalty = self._penalty(st, now) + FAILURE_PENALTY
+                st.penalty_ts = now
+
+    # --- selección -----------------------------------------------------------------
+    def cost(self, node_id, size, now=None):
+        """Tiempo estimado (s) para leer `size` bytes del nodo con su carga actual."""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            st = self._nodes.get(node_id) or _NodeStats()
+            rtt = st.rtt if st.rtt is not None else DEFAULT_RTT
+            tput = st.throughput or DEFAULT_THROUGHPUT
+            cost = rtt + (st.inflight + 1) * size / tput + self._penalty(st, now)
+            return cost + SUSPECT_PENALTY if st.suspect else cost
+
+    def rank(self, sources, size):
+        """Ordena `sources` (tuplas cuyo primer elemento es el node_id) de menor a mayor coste."""
+        now = time.monotonic()
+        scored = [(self.cost(src[0], size, now) * (1 + random.uniform(-JITTER, JITTER)), i, src)
+                  for i, src in enumerate(sources)]
+        scored.sort()
+        return [src for _, _, src in scored]
+
+    def timeout_for(self, node_id, size, floor=2.0, ceiling=8.0):
+        """Timeout de una petición cuando quedan otras copias: 4 veces el coste esperado, acotado."""
+        return min(ceiling, max(floor, 4 * self.cost(node_id, size)))
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {nid: {'rtt_ms': round(st.rtt * 1000, 2) if st.rtt is not None else None,
+                          'throughput_mbps': round(st.throughput / 1048576, 2) if st.throughput else None,
+                          'inflight': st.inflight, 'requests': st.requests, 'failures': st.failures,
+                          'bytes': st.bytes, 'penalty_s': round(self._penalty(st, now), 3), 'suspect': st.suspect}
+                    for nid, st in self._nodes.items()}
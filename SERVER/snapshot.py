@@ -0,0 +1,191 @@
+"""
+Snapshots binarios de la metadata del coordinador (sin pickle).
+
+Formato de fichero (versionado):
+
+    cabecera:  MAGIC (8 bytes) | versión (u16) | tipo (u16)
+    secciones: etiqueta (4 bytes) | longitud (u64) | crc32 (u32) | datos
+    final:     sección 'END '
+
+Los enteros de la cabecera y de las secciones son little-endian. Cada sección
+lleva su CRC32: un snapshot truncado o corrupto se detecta al cargar (ValueError).
+
+Tabla de bloques (tipo KIND_BLOCKS):
+  - 'META': JSON con slot_size, nombres de estado, orden de bytes y tamaño de
+    los arrays, y por nodo: prefijo, nº de slots, nº de registros y de extents.
+  - 'FIDS': file_ids referenciados, separados por '\\0'.
+  - 'NODE' (una por nodo, en el orden de META): arrays contiguos de índices (u32),
+    estados (u8), tamaños (u64), archivo primario (i32) y extents libres
+    (inicios y finales, u32). Se cargan con array.frombytes, sin parsear.
+  - 'XTRA': JSON con los campos dispersos por nodo, alias y registros sueltos.
+
+Índice de archivos (tipo KIND_FILES):
+  - 'FILS': el dict de archivos en JSON compacto (una sola llamada a json.loads).
+
+Cargar un snapshot es una pasada por slot en uso, frente a parsear un JSON con
+un dict por bloque y reconstruir la tabla a partir de él.
+"""
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from block_table import BlockTable
+
+MAGIC = b'SADTFSNP'
+VERSION = 1
+KIND_BLOCKS = 1
+KIND_FILES = 2
+
+_HEADER = struct.Struct('<8sHH')
+_SECTION = struct.Struct('<4sQI')
+_ARRAYS = (('indices', 'I'), ('status', 'B'), ('sizes', 'Q'), ('primary', 'i'))
+
+
+def _section(tag, payload):
+    return _SECTION.pack(tag, len(payload), zlib.crc32(payload)) + payload
+
+
+def _json(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _write_atomic(path, chunks):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    try:
+        with open(tmp, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _read_sections(path, kind):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        raise ValueError(f"snapshot truncado: {path}")
+    magic, version, file_kind = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"no es un snapshot de SADTF: {path}")
+    if version != VERSION:
+        raise ValueError(f"versión de snapshot no soportada ({version}): {path}")
+    if file_kind != kind:
+        raise ValueError(f"tipo de snapshot inesperado ({file_kind}): {path}")
+    sections = []
+    view = memoryview(data)
+    pos = _HEADER.size
+    while True:
+        if pos + _SECTION.size > len(data):
+            raise ValueError(f"snapshot truncado: {path}")
+        tag, length, crc = _SECTION.unpack_from(data, pos)
+        pos += _SECTION.size
+        payload = view[pos:pos + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            raise ValueError(f"snapshot corrupto (sección {tag!r}): {path}")
+        pos += length
+        if tag == b'END ':
+            return sections
+        sections.append((tag, payload))
+
+
+# --- tabla de bloques -------------------------------------------------------------
+def save_blocks(path, table, table_size=None):
+    """Escribe la BlockTable en `path` (temporal + fsync + rename)."""
+    state = table.export_state()
+    meta = {
+        'slot_size': state['slot_size'],
+        'table_size': table_size if table_size is not None else table.total_slots(),
+        'status_names': state['status_names'],
+        'byteorder': sys.byteorder,
+        'itemsizes': {name: array(code).itemsize for name, code in _ARRAYS},
+        'nodes': [{'node': nid, 'prefix': n['prefix'], 'slots': n['slots'], 'unavailable': n['unavailable'],
+                   'count': len(n['indices']), 'extents': len(n['starts'])}
+                  for nid, n in state['nodes'].items()],
+    }
+    chunks = [_HEADER.pack(MAGIC, VERSION, KIND_BLOCKS), _section(b'META', _json(meta)),
+              _section(b'FIDS', '\0'.join(state['files']).encode('utf-8'))]
+    for n in state['nodes'].values():
+        payload = b''.join(n[name].tobytes() for name, _ in _ARRAYS) + n['starts'].tobytes() + n['ends'].tobytes()
+        chunks.append(_section(b'NODE', payload))
+    extra = {
+        # Por nodo: [posiciones, valores] (listas JSON, más rápidas de leer que un dict)
+        'extras': {nid: [list(n['extras']), list(n['extras'].values())]
+                   for nid, n in state['nodes'].items() if n['extras']},
+        'aliases': state['aliases'],
+        'loose': state['loose'],
+    }
+    chunks.append(_section(b'XTRA', _json(extra)))
+    chunks.append(_section(b'END ', b''))
+    _write_atomic(path, chunks)
+
+
+def load_blocks(path):
+    """Carga un snapshot de bloques. Retorna `{'blocks': BlockTable, 'table_size': n, 'nodes': resumen}`."""
+    sections = _read_sections(path, KIND_BLOCKS)
+    by_tag = {}
+    node_payloads = []
+    for tag, payload in sections:
+        if tag == b'NODE':
+            node_payloads.append(payload)
+        else:
+            by_tag[tag] = payload
+    meta = json.loads(bytes(by_tag[b'META']))
+    fids = bytes(by_tag.get(b'FIDS', b'')).decode('utf-8')
+    extra = json.loads(bytes(by_tag.get(b'XTRA', b'{}')))
+    swap = meta.get('byteorder', sys.byteorder) != sys.byteorder
+    sizes = meta.get('itemsizes', {})
+    if len(node_payloads) != len(meta['nodes']):
+        raise ValueError(f"snapshot inconsistente: {len(node_payloads)} secciones NODE para {len(meta['nodes'])} nodos")
+
+    def _take(payload, offset, code, count, name):
+        arr = array(code)
+        if sizes.get(name, arr.itemsize) != arr.itemsize:
+            raise ValueError(f"tamaño de '{name}' incompatible en el snapshot")
+        end = offset + count * arr.itemsize
+        arr.frombytes(payload[offset:end])
+        if swap:
+            arr.byteswap()
+        return arr, end
+
+    nodes = {}
+    for info, payload in zip(meta['nodes'], node_payloads):
+        data = {'prefix': info['prefix'], 'slots': info['slots'], 'unavailable': info.get('unavailable', False)}
+        offset = 0
+        for name, code in _ARRAYS:
+            data[name], offset = _take(payload, offset, code, info['count'], name)
+        data['starts'], offset = _take(payload, offset, 'I', info['extents'], 'indices')
+        data['ends'], offset = _take(payload, offset, 'I', info['extents'], 'indices')
+        positions, values = extra.get('extras', {}).get(info['node'], ([], []))
+        data['extras'] = dict(zip(positions, values))
+        nodes[info['node']] = data
+    table = BlockTable.from_state({
+        'slot_size': meta.get('slot_size', 1024 * 1024),
+        'status_names': meta.get('status_names'),
+        'files': fids.split('\0') if fids else [],
+        'aliases': extra.get('aliases', []),
+        'loose': extra.get('loose', {}),
+        'nodes': nodes,
+    })
+    return {'blocks': table, 'table_size': meta.get('table_size', table.total_slots()), 'nodes': table.node_summary()}
+
+
+# --- índice de archivos -----------------------------------------------------------
+def save_files(path, files_data):
+    chunks = [_HEADER.pack(MAGIC, VERSION, KIND_FILES),
+              _section(b'FILS', json.dumps(files_data.get('files', {}), separators=(',', ':'),
+                                           ensure_ascii=False).encode('utf-8')),
+              _section(b'END ', b'')]
+    _write_atomic(path, chunks)
+
+
+def load_files(path):
+    sections = dict(_read_sections(path, KIND_FILES))
+    return {'files': json.loads(bytes(sections.get(b'FILS', b'{}')))}
@@ -0,0 +1,96 @@
+"""
+StagingArea: ciclo de vida de los bloques en el área temporal del coordinador.
+
+Cada upload deja sus bloques en `temp/staging/<file_id>/` (un directorio por
+archivo: dos subidas con el mismo nombre ya no se pisan los `<base>.partNNN`).
+Esas copias locales hacen falta mientras algún nodo destino no haya confirmado
+(STORE_BLOCK_ACK) su copia; después son solo una caché de lectura.
+
+StagingArea lleva la cuenta de los bytes en staging por archivo y su orden de
+uso (LRU). El coordinador decide qué archivo está totalmente replicado; cuando
+el área pasa de `max_bytes`, expulsa primero los replicados usados hace más
+tiempo. Con `max_bytes = 0` se expulsa en cuanto todas las copias confirman.
+"""
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9._-]')
+
+
+class StagingArea:
+    def __init__(self, root, max_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max(0, int(max_bytes))
+        self._files = OrderedDict()     # file_id -> bytes en staging (orden = uso, el último el más reciente)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, file_id):
+        """Directorio de staging del archivo (no lo crea)."""
+        return os.path.join(self.root, _UNSAFE.sub('_', str(file_id)))
+
+    def create(self, file_id):
+        path = self.path_for(file_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def add(self, file_id, nbytes):
+        with self._lock:
+            self._bytes += nbytes - self._files.pop(file_id, 0)
+            self._files[file_id] = nbytes
+
+    def touch(self, file_id):
+        with self._lock:
+            if file_id in self._files:
+                self._files.move_to_end(file_id)
+
+    def forget(self, file_id):
+        """Deja de contar un archivo (borrado o expulsado). Retorna sus bytes."""
+        with self._lock:
+            nbytes = self._files.pop(file_id, 0)
+            self._bytes -= nbytes
+            return nbytes
+
+    def evicted(self, file_id):
+        nbytes = self.forget(file_id)
+        if nbytes:
+            with self._lock:
+                self.evicted_files += 1
+                self.evicted_bytes += nbytes
+        return nbytes
+
+    def reset(self):
+        with self._lock:
+            self._files.clear()
+            self._bytes = 0
+
+    def excess(self):
+        """Bytes por encima del tope (0 si está dentro)."""
+        with self._lock:
+            return max(0, self._bytes - self.max_bytes)
+
+    def lru(self):
+        """file_ids en staging, del usado hace más tiempo al más reciente."""
+        with self._lock:
+            return list(self._files)
+
+    def remove_dir(self, file_id):
+        """Borra el directorio de staging del archivo si existe (con lo que quede dentro)."""
+        shutil.rmtree(self.path_for(file_id), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'root': self.root,
+                'max_bytes': self.max_bytes,
+                'used_bytes': self._bytes,
+                'files': len(self._files),
+                'evicted_files': self.evicted_files,
+                'evicted_bytes': self.evicted_bytes,
+            }
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark de memoria de la tabla de bloques: bytes por slot con la
+representación clásica (un dict por slot, libres incluidos) frente a BlockTable
+(extents libres por nodo y registros solo para los slots en uso).
+
+Uso:
+  python bench_block_table.py                 # 1M slots en 4 nodos, la mitad ocupados
+  python bench_block_table.py --slots 2000000 --nodes 20 --used 0.1
+
+`--used` es la fracción de slots ocupados (con primary_for, size y
+stored_on_list), para medir también el coste de los campos dispersos. Con
+`--used 0` la tabla compacta está vacía y la comparación no dice nada útil.
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+script_dir = os.path.dirname(os.path.abspath(__file__))  # .../SERVER/tools
+server_dir = os.path.dirname(script_dir)  # .../SERVER
+sys.path.insert(0, server_dir)
+
+from block_table import BlockTable, format_block_id  # noqa: E402
+
+
+def build_legacy(nodes, per_node, used_every):
+    # Réplica de la estructura que creaba update_blocks_for_node antes de BlockTable
+    blocks = {}
+    for n in range(1, nodes + 1):
+        node_id = f"nodo{n}"
+        for i in range(1, per_node + 1):
+            bid = f"N{n}{str(i).zfill(3)}"
+            blocks[bid] = {'id': bid, 'node': node_id, 'index': i, 'status': 'free', 'primary_for': None}
+            if used_every and i % used_every == 0:
+                b = blocks[bid]
+                b['status'] = 'occupied'
+                b['primary_for'] = f"file_{i // 100}"
+                b['size'] = 1024 * 1024
+                b['stored_on_list'] = [node_id]
+    return blocks
+
+
+def build_compact(nodes, per_node, used_every):
+    table = BlockTable()
+    for n in range(1, nodes + 1):
+        node_id = f"nodo{n}"
+        table.ensure_node(node_id, f"N{n}")
+        table.resize_node(node_id, per_node)
+        if used_every:
+            for i in range(used_every, per_node + 1, used_every):
+                b = table[format_block_id(f"N{n}", i)]
+                b['status'] = 'occupied'
+                b['primary_for'] = f"file_{i // 100}"
+                b['size'] = 1024 * 1024
+                b['stored_on_list'] = [node_id]
+    return table
+
+
+def measure(label, builder, *args):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    obj = builder(*args)
+    elapsed = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    slots = obj.total_slots() if hasattr(obj, 'total_slots') else len(obj)
+    print(f"{label:<10} slots={slots:>10}  memoria={current / 1048576:9.1f} MB  "
+          f"bytes/slot={current / max(1, slots):7.1f}  pico={peak / 1048576:9.1f} MB  construcción={elapsed:6.2f}s")
+    del obj
+    gc.collect()
+    return current / max(1, slots)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Memoria por slot de la tabla de bloques')
+    parser.add_argument('--slots', type=int, default=1000000, help='slots totales')
+    parser.add_argument('--nodes', type=int, default=4, help='número de nodos')
+    parser.add_argument('--used', type=float, default=0.5, help='fracción de slots ocupados (0..1)')
+    args = parser.parse_args(argv)
+
+    per_node = max(1, args.slots // args.nodes)
+    used_every = int(round(1 / args.used)) if args.used > 0 else 0
+    occupancy = 1 / used_every if used_every else 0.0   # real: uno de cada `used_every` slots
+    print(f"{args.nodes} nodos x {per_node} slots, ocupados: {occupancy:.0%}")
+    before = measure('dict', build_legacy, args.nodes, per_node, used_every)
+    after = measure('BlockTable', build_compact, args.nodes, per_node, used_every)
+    print(f"Reducción: {before / max(after, 1e-9):.1f}x menos memoria por slot con {occupancy:.0%} ocupados")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
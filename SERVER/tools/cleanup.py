@@ -9,6 +9,8 @@ Uso:
 Acciones:
   - Reescribe `SERVER/info/nodes_data.json` con estructura mínima.
   - Reescribe `SERVER/info/blocks_data.json` con estructura mínima.
+  - Elimina la base SQLite de metadata (`SERVER/info/metadata.db`) si existe.
+  - Elimina los snapshots binarios (`SERVER/info/*.snap`) si existen.
   - Elimina todos los ficheros dentro de `SERVER/temp/`.
 
 Diseñado para usarse por el desarrollador localmente. Advertencia: esta acción es destructiva.
@@ -82,6 +84,20 @@ def main(argv=None):
     safe_write_json(files_file, {'files': {}})
     print(f'Reescrito: {files_file}')
 
+    # Eliminar la base SQLite (backend SADTF_METADATA_BACKEND=sqlite)
+    for suffix in ('', '-wal', '-shm'):
+        db_file = os.path.join(info_dir, 'metadata.db' + suffix)
+        if os.path.exists(db_file):
+            os.remove(db_file)
+            print(f'Eliminado: {db_file}')
+
+    # Eliminar los snapshots binarios (backend SADTF_METADATA_BACKEND=snapshot)
+    for name in ('blocks.snap', 'files.snap'):
+        snap_file = os.path.join(info_dir, name)
+        if os.path.exists(snap_file):
+            os.remove(snap_file)
+            print(f'Eliminado: {snap_file}')
+
     # Vaciar temp
     removed = remove_all_in_dir(temp_dir)
     print(f'Eliminados {removed} elementos en {temp_dir}')
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Migra la metadata del coordinador (nodos, bloques, archivos) entre backends.
+
+Uso:
+  python migrate_metadata.py                     # JSON (SERVER/info) -> SQLite (SERVER/info/metadata.db)
+  python migrate_metadata.py --to json           # SQLite -> JSON
+  python migrate_metadata.py --to snapshot       # JSON -> snapshots binarios (SERVER/info/*.snap)
+  python migrate_metadata.py --from sqlite --to snapshot
+  python migrate_metadata.py --db /ruta/meta.db  # otra ruta para la base SQLite
+  python migrate_metadata.py --yes               # sobrescribir el destino sin preguntar
+
+Tras migrar, arrancar el coordinador con SADTF_METADATA_BACKEND=<destino>.
+Los datos de origen no se modifican. Ejecutar con el coordinador detenido.
+"""
+import argparse
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.abspath(__file__))  # .../SERVER/tools
+server_dir = os.path.dirname(script_dir)  # .../SERVER
+sys.path.insert(0, server_dir)
+
+import log_manager as log  # noqa: E402
+import metadata_store  # noqa: E402
+
+
+def _counts(nodes, blocks, files):
+    # Solo cuentan los bloques en uso: la metadata antigua incluye un registro por slot libre
+    in_use = sum(1 for b in blocks.get('blocks', {}).values() if b.get('status') not in ('free', 'unavailable'))
+    return len(nodes), in_use, len(files.get('files', {}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Migra la metadata del coordinador entre backends')
+    parser.add_argument('--to', choices=metadata_store.BACKENDS, default=metadata_store.BACKEND_SQLITE,
+                        help='backend destino')
+    parser.add_argument('--from', dest='source', choices=metadata_store.BACKENDS,
+                        help='backend origen (por defecto json, o sqlite si el destino es json)')
+    parser.add_argument('--db', default=metadata_store.DEFAULT_DB_PATH, help='ruta de la base SQLite')
+    parser.add_argument('--info-dir', default=metadata_store.INFO_DIR, help='directorio de los JSON')
+    parser.add_argument('-y', '--yes', action='store_true', help='no pedir confirmación')
+    args = parser.parse_args(argv)
+
+    def _open(backend):
+        path = args.db if backend == metadata_store.BACKEND_SQLITE else args.info_dir
+        return metadata_store.open_store(backend, path)
+
+    source_name = args.source or (metadata_store.BACKEND_SQLITE if args.to == metadata_store.BACKEND_JSON
+                                  else metadata_store.BACKEND_JSON)
+    if source_name == args.to:
+        print('El origen y el destino son el mismo backend.')
+        return 1
+    source = _open(source_name)
+    nodes, blocks, files = source.load_nodes(), source.load_blocks(), source.load_files()
+    expected = _counts(nodes, blocks, files)
+    print(f"Origen ({source_name}): {expected[0]} nodos, {expected[1]} bloques en uso, {expected[2]} archivos")
+
+    dest = _open(args.to)
+    existing = _counts(dest.load_nodes(), dest.load_blocks(), dest.load_files())
+    if args.to == metadata_store.BACKEND_SNAPSHOT and not any(
+            os.path.exists(p) for p in (dest.blocks_snapshot, dest.files_snapshot)):
+        existing = (0, 0, 0)   # sin snapshots, lo que se lee son los JSON de origen
+    if any(existing) and not args.yes:
+        ans = input(f"El destino ({args.to}) ya contiene datos {existing}. ¿Sobrescribir? [yes/no]: ").strip().lower()
+        if ans not in ('y', 'yes'):
+            print('Abortado. No se realizaron cambios.')
+            return 1
+
+    dest.save_nodes(nodes)
+    dest.save_blocks(blocks)
+    dest.save_files(files)
+
+    # Verificar releyendo el destino
+    check = _open(args.to)
+    migrated = _counts(check.load_nodes(), check.load_blocks(), check.load_files())
+    log.stop()
+    if migrated != expected:
+        print(f"ERROR: el destino tiene {migrated} (nodos, bloques, archivos) tras migrar")
+        return 1
+    print(f"Migrado a {args.to}: {migrated[0]} nodos, {migrated[1]} bloques en uso, {migrated[2]} archivos")
+    if args.to != metadata_store.BACKEND_JSON:
+        print(f'Arranca el coordinador con SADTF_METADATA_BACKEND={args.to} para usarlo.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,293 @@
+"""
+upload_sessions: uploads reanudables y en paralelo por partes.
+
+Flujo:
+  1. create():   el cliente declara nombre y tamaño; recibe upload_id y block_size.
+  2. put_part(): sube cada parte (índice 1-based) en cualquier orden, en paralelo.
+                 Cada parte coincide con un bloque, así que no hay que re-dividir.
+  3. status():   consulta qué partes ya están recibidas (para reanudar).
+  4. commit():   comprueba que están todas y devuelve la metadata de bloques
+                 (mismo formato que split_file_to_blocks) para colocarlos y distribuirlos.
+
+Cada sesión vive en `<base_dir>/<upload_id>/` con un `session.json`; las partes
+recibidas se deducen de los ficheros presentes, así que una sesión sobrevive a un
+reinicio del coordinador. Las sesiones abandonadas se eliminan con gc().
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import chunker
+import log_manager as log
+
+SESSION_FILE = 'session.json'
+
+
+class UploadError(Exception):
+    """Error de sesión de upload con el código HTTP a devolver."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadSessionManager:
+    def __init__(self, base_dir, default_block_size=chunker.DEFAULT_BLOCK_SIZE, ttl=24 * 3600):
+        self.base_dir = base_dir
+        self.default_block_size = int(default_block_size)
+        self.ttl = ttl
+        self._sessions = {}          # upload_id -> dict
+        self._lock = threading.Lock()
+        os.makedirs(self.base_dir, exist_ok=True)
+        self._load_existing()
+
+    # --- persistencia ---------------------------------------------------------
+    def _dir(self, upload_id):
+        return os.path.join(self.base_dir, upload_id)
+
+    def _part_path(self, upload_id, index):
+        return os.path.join(self._dir(upload_id), f"part{index:06d}")
+
+    def _save_session(self, sess):
+        path = os.path.join(self._dir(sess['upload_id']), SESSION_FILE)
+        tmp = path + '.tmp'
+        data = {k: v for k, v in sess.items() if k != 'received'}
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _load_existing(self):
+        for upload_id in os.listdir(self.base_dir):
+            path = os.path.join(self._dir(upload_id), SESSION_FILE)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    sess = json.load(f)
+            except Exception:
+                continue
+            sess['received'] = set()
+            for i in range(1, sess.get('total_parts', 0) + 1):
+                if os.path.exists(self._part_path(upload_id, i)):
+                    sess['received'].add(i)
+            self._sessions[upload_id] = sess
+        if self._sessions:
+            log.info(f"[UPLOADS] Recuperadas {len(self._sessions)} sesiones de upload")
+
+    # --- API --------------------------------------------------------------------
+    def create(self, filename, size, block_size=None, uploader_ip=None):
+        filename = os.path.basename(filename or 'archivo')
+        try:
+            size = int(size)
+            block_size = int(block_size or self.default_block_size)
+        except (TypeError, ValueError):
+            raise UploadError('size y block_size deben ser enteros')
+        if size < 0 or block_size <= 0:
+            raise UploadError('size debe ser >= 0 y block_size > 0')
+        upload_id = uuid.uuid4().hex
+        now = time.time()
+        sess = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'size': size,
+            'block_size': block_size,
+            'total_parts': (size + block_size - 1) // block_size,
+            'uploader_ip': uploader_ip,
+            'created_at': now,
+            'updated_at': now,
+            'state': 'open',
+            'received': set(),
+        }
+        os.makedirs(self._dir(upload_id), exist_ok=True)
+        self._save_session(sess)
+        with self._lock:
+            self._sessions[upload_id] = sess
+        log.info(f"[UPLOADS] Sesión {upload_id} creada para '{filename}' ({size} bytes, {sess['total_parts']} partes)")
+        return self._public(sess)
+
+    def _get(self, upload_id):
+        sess = self._sessions.get(upload_id)
+        if not sess:
+            raise UploadError('upload no encontrado', status=404)
+        return sess
+
+    def _expected_size(self, sess, index):
+        if index < sess['total_parts']:
+            return sess['block_size']
+        return sess['size'] - (sess['total_parts'] - 1) * sess['block_size']
+
+    def put_part(self, upload_id, index, stream, length, sha256=None):
+        """
+        Escribe la parte `index` leyendo `length` bytes de `stream`. Es idempotente:
+        reenviar una parte ya recibida la sobrescribe. Si se pasa `sha256` se verifica.
+        """
+        with self._lock:
+            sess = self._get(upload_id)
+            if sess['state'] != 'open':
+                raise UploadError('el upload ya fue confirmado', status=409)
+        if not (1 <= index <= sess['total_parts']):
+            raise UploadError(f"índice de parte fuera de rango (1..{sess['total_parts']})")
+        expected = self._expected_size(sess, index)
+        if length != expected:
+            raise UploadError(f"tamaño de parte {index} incorrecto: {length} (esperado {expected})")
+
+        path = self._part_path(upload_id, index)
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        digest = hashlib.sha256()
+        remaining = length
+        try:
+            with open(tmp, 'wb') as f:
+                while remaining > 0:
+                    buf = stream.read(min(remaining, 256 * 1024))
+                    if not buf:
+                        raise UploadError('cuerpo incompleto', status=400)
+                    digest.update(buf)
+                    f.write(buf)
+                    remaining -= len(buf)
+            if sha256 and digest.hexdigest() != sha256.lower():
+                raise UploadError(f"checksum de la parte {index} no coincide", status=422)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        with self._lock:
+            sess['received'].add(index)
+            sess['updated_at'] = time.time()
+        return {'upload_id': upload_id, 'index': index, 'size': length, 'sha256': digest.hexdigest()}
+
+    def status(self, upload_id):
+        with self._lock:
+            return self._public(self._get(upload_id))
+
+    def commit(self, upload_id, dest_dir=None, block_prefix=None):
+        """
+        Cierra la sesión y devuelve la metadata de bloques (formato split_file_to_blocks).
+        Las partes se renombran como `<block_prefix>.partNNN` (por defecto `<base>`)
+        y se mueven a `dest_dir` (por defecto, el directorio de la sesión).
+        """
+        with self._lock:
+            sess = self._get(upload_id)
+            if sess['state'] != 'open':
+                raise UploadError('el upload ya fue confirmado', status=409)
+            missing = [i for i in range(1, sess['total_parts'] + 1) if i not in sess['received']]
+            if missing:
+                raise UploadError(f"faltan {len(missing)} partes", status=409)
+            sess['state'] = 'committing'
+
+        base = block_prefix or os.path.splitext(sess['filename'])[0]
+        dest_dir = dest_dir or self._dir(upload_id)
+        os.makedirs(dest_dir, exist_ok=True)
+        with self._lock:
+            sess['blocks_dir'] = dest_dir
+            sess['block_prefix'] = base
+        blocks = []
+        for i in range(1, sess['total_parts'] + 1):
+            src = self._part_path(upload_id, i)
+            block_name = f"{base}.part{i:03d}"
+            dest = os.path.join(dest_dir, block_name)
+            digest = hashlib.sha256()
+            with open(src, 'rb') as f:
+                for buf in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(buf)
+            os.replace(src, dest)
+            blocks.append({
+                'block_name': block_name,
+                'size': self._expected_size(sess, i),
+                'hash': digest.hexdigest(),
+                'path': dest,
+                'index': i
+            })
+        with self._lock:
+            sess['state'] = 'committed'
+            sess['updated_at'] = time.time()
+        self._save_session(sess)
+        return {
+            'original_filename': sess['filename'],
+            'total_blocks': len(blocks),
+            'total_size': sess['size'],
+            'chunking': chunker.normalize_config(chunker.MODE_FIXED, sess['block_size']),
+            'blocks': blocks
+        }
+
+    def reopen(self, upload_id):
+        """Devuelve una sesión a estado 'open' si la colocación tras commit falló."""
+        with self._lock:
+            sess = self._get(upload_id)
+            base = sess.pop('block_prefix', None) or os.path.splitext(sess['filename'])[0]
+            blocks_dir = sess.pop('blocks_dir', None) or self._dir(upload_id)
+            for i in range(1, sess['total_parts'] + 1):
+                named = os.path.join(blocks_dir, f"{base}.part{i:03d}")
+                if os.path.exists(named):
+                    os.replace(named, self._part_path(upload_id, i))
+            sess['state'] = 'open'
+        self._save_session(sess)
+
+    def finish(self, upload_id):
+        """
+        Tras colocar los bloques de un commit: borra el directorio de la sesión
+        (las partes ya se movieron a `dest_dir`). La sesión sigue en memoria, como
+        'committed', hasta que gc() la olvide.
+        """
+        with self._lock:
+            sess = self._sessions.get(upload_id)
+            if sess is None or sess['state'] != 'committed':
+                return
+            if sess.get('blocks_dir') == self._dir(upload_id):
+                # commit() sin dest_dir: los bloques viven aquí y los usa quien llamó
+                return
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    def abort(self, upload_id):
+        with self._lock:
+            sess = self._get(upload_id)
+            if sess['state'] == 'committed':
+                raise UploadError('el upload ya fue confirmado', status=409)
+            del self._sessions[upload_id]
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    def gc(self, now=None):
+        """Elimina sesiones abiertas sin actividad durante más de `ttl` segundos."""
+        now = now or time.time()
+        expired = []
+        committed = []
+        with self._lock:
+            for upload_id, sess in list(self._sessions.items()):
+                if now - sess['updated_at'] <= self.ttl:
+                    continue
+                # Confirmadas: sus bloques ya se colocaron; queda el session.json
+                # (y las partes si se confirmaron sin dest_dir)
+                (committed if sess['state'] == 'committed' else expired).append(upload_id)
+                del self._sessions[upload_id]
+        for upload_id in expired + committed:
+            shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+        if expired:
+            log.info(f"[UPLOADS] GC eliminó {len(expired)} sesiones abandonadas")
+        return len(expired)
+
+    def run_gc_loop(self, interval=600):
+        while True:
+            time.sleep(interval)
+            try:
+                self.gc()
+            except Exception as e:
+                log.error(f"[UPLOADS] Error en GC de sesiones: {e}")
+
+    @staticmethod
+    def _public(sess):
+        received = sorted(sess['received'])
+        missing = [i for i in range(1, sess['total_parts'] + 1) if i not in sess['received']]
+        return {
+            'upload_id': sess['upload_id'],
+            'filename': sess['filename'],
+            'size': sess['size'],
+            'block_size': sess['block_size'],
+            'total_parts': sess['total_parts'],
+            'state': sess['state'],
+            'received': received,
+            'missing': missing,
+            'created_at': sess['created_at'],
+            'updated_at': sess['updated_at'],
+        }